@@ -46,9 +46,21 @@ elif os.name == 'nt':
 else:
     raise AssertionError(f'Operating system "{os.name}" not supported.')
 
-from chevah_compat.posix_filesystem import FileAttributes
+from chevah_compat.posix_filesystem import (
+    FileAttributes,
+    FolderCursor,
+    FolderEvent,
+    FolderListing,
+    FolderWatch,
+    TreeUsage,
+)
 
 # Silence the linter
 FileAttributes
+FolderCursor
+FolderEvent
+FolderListing
+FolderWatch
+TreeUsage
 
 local_filesystem = LocalFilesystem(avatar=DefaultAvatar())
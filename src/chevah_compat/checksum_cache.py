@@ -0,0 +1,199 @@
+# Copyright (c) 2026 Adi Roiban.
+# See LICENSE for details.
+"""
+Cache for the checksums of the files, stored in extended attributes.
+"""
+
+import dbm
+import errno
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from zope.interface import implementer
+
+from chevah_compat.interfaces import IChecksumCache
+
+#: Errors for which the extended attributes are not supported by the
+#: filesystem.
+_UNSUPPORTED_ERRORS = frozenset(
+    code
+    for code in (
+        getattr(errno, 'ENOTSUP', None),
+        getattr(errno, 'EOPNOTSUPP', None),
+    )
+    if code is not None
+)
+
+
+def _get_stamp(stats):
+    """
+    Return the part of a stored value which identifies the content of
+    the file from `stats`.
+    """
+    return f'{stats.st_size}:{stats.st_mtime_ns}:{stats.st_ino}:'
+
+
+@implementer(IChecksumCache)
+class ChecksumCache:
+    """
+    See: IChecksumCache.
+
+    The value is stored as `size:mtime_ns:inode:digest:mac`, in the
+    `user.chevah.checksum.<algorithm>` extended attribute of the file.
+    The `mac` is a HMAC-SHA256 of the value, the device and the algorithm,
+    using `secret` as key, so that the values which were not stored by
+    this cache are ignored.
+    Without a `secret`, a random one is used, and the values stored by
+    other instances are computed again.
+    On filesystems without extended attributes, or on platforms without
+    `os.getxattr`, the value is stored in the `sidecar_path` database,
+    using the device and the inode of the file as key.
+    The values of the removed files are not removed from the database.
+
+    The attributes are accessed via the descriptor of the opened file, so
+    an unchanged file costs an `fstat` and a `getxattr`.
+
+    A file changed while keeping its size, modification time and inode
+    keeps its value, as for any other check based on these attributes.
+    """
+
+    #: Prefix for the name of the extended attributes.
+    #: The `user.chevah.` namespace can't be changed via the filesystem
+    #: API, but it can be changed by the OS accounts of the avatars, so
+    #: the values are authenticated.
+    attribute_prefix = 'user.chevah.checksum.'
+    #: Seconds since the last modification after which a digest is stored.
+    #: A file changed again in the same timestamp tick would keep the
+    #: same modification time.
+    min_age = 2
+
+    def __init__(self, sidecar_path=None, secret=None):
+        self.sidecar_path = sidecar_path
+        if secret is None:
+            secret = os.urandom(32)
+        self._secret = secret
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Devices for which the extended attributes are not supported.
+        self._unsupported = set()
+        self._sidecar = None
+        if sidecar_path is not None:
+            self._sidecar = dbm.open(sidecar_path, 'c')
+
+    def get(self, fd, algorithm, compute):
+        """
+        See: IChecksumCache.
+        """
+        stats = os.fstat(fd)
+        stamp = _get_stamp(stats)
+        value = self._load(fd, stats, algorithm)
+        if value is not None and value.startswith(stamp):
+            stored, _separator, mac = value.rpartition(':')
+            expected = self._sign(stats, algorithm, stored)
+            # The loaded value might have replaced non-ASCII characters.
+            if hmac.compare_digest(mac.encode('ascii', 'replace'), expected):
+                with self._lock:
+                    self.hits += 1
+                return stored[len(stamp) :]
+
+        with self._lock:
+            self.misses += 1
+        digest = compute()
+
+        # Only keep the digest when the file was not changed while read.
+        current = os.fstat(fd)
+        age = time.time_ns() - current.st_mtime_ns
+        if _get_stamp(current) == stamp and age >= self.min_age * 10**9:
+            stored = stamp + digest
+            mac = self._sign(stats, algorithm, stored)
+            self._save(fd, stats, algorithm, f'{stored}:{mac.decode()}')
+        return digest
+
+    def _sign(self, stats, algorithm, stored):
+        """
+        Return the hex HMAC, as bytes, of the `stored` value of `algorithm`
+        for the file from `stats`.
+        """
+        message = f'{stats.st_dev}:{algorithm}:{stored}'.encode(
+            'ascii', 'replace'
+        )
+        mac = hmac.new(self._secret, message, hashlib.sha256)
+        return mac.hexdigest().encode('ascii')
+
+    def close(self):
+        """
+        See: IChecksumCache.
+        """
+        with self._lock:
+            sidecar, self._sidecar = self._sidecar, None
+            if sidecar is not None:
+                sidecar.close()
+
+    def _useAttributes(self, stats):
+        """
+        Return True when the value can be stored as an extended attribute
+        of the file from `stats`.
+        """
+        return hasattr(os, 'getxattr') and stats.st_dev not in self._unsupported
+
+    def _load(self, fd, stats, algorithm):
+        """
+        Return the stored value for the opened file `fd`, or None.
+        """
+        if self._useAttributes(stats):
+            try:
+                value = os.getxattr(fd, self.attribute_prefix + algorithm)
+                return value.decode('ascii', 'replace')
+            except OSError as error:
+                if error.errno not in _UNSUPPORTED_ERRORS:
+                    # Not stored or not readable.
+                    return None
+                self._unsupported.add(stats.st_dev)
+
+        with self._lock:
+            if self._sidecar is None:
+                return None
+            try:
+                value = self._sidecar.get(self._getSidecarKey(stats, algorithm))
+            except OSError:
+                return None
+        if value is None:
+            return None
+        return value.decode('ascii', 'replace')
+
+    def _save(self, fd, stats, algorithm, value):
+        """
+        Store `value` for the opened file `fd`.
+
+        The value is not stored when the file can't be changed.
+        """
+        value = value.encode('ascii')
+        if self._useAttributes(stats):
+            try:
+                os.setxattr(fd, self.attribute_prefix + algorithm, value)
+            except OSError as error:
+                if error.errno not in _UNSUPPORTED_ERRORS:
+                    # No write permission, read-only or full filesystem.
+                    return
+                self._unsupported.add(stats.st_dev)
+            else:
+                return
+
+        with self._lock:
+            if self._sidecar is None:
+                return
+            try:
+                self._sidecar[self._getSidecarKey(stats, algorithm)] = value
+            except OSError:
+                return
+
+    @staticmethod
+    def _getSidecarKey(stats, algorithm):
+        """
+        Return the key of the file from `stats` in the sidecar database.
+        """
+        return f'{stats.st_dev}:{stats.st_ino}:{algorithm}'
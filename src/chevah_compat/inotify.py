@@ -0,0 +1,172 @@
+# Copyright (c) 2026 Adi Roiban.
+# See LICENSE for details.
+"""
+Minimal access to the Linux inotify API.
+
+See https://man7.org/linux/man-pages/man7/inotify.7.html
+"""
+
+import ctypes
+import errno
+import os
+import struct
+import sys
+
+#: Events which can be requested with `addWatch`.
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+#: Events sent by the kernel even when not requested.
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+#: Flags for `addWatch`.
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_MASK_ADD = 0x20000000
+
+#: Set in the mask of the events for a folder.
+IN_ISDIR = 0x40000000
+
+IN_MOVE = IN_MOVED_FROM | IN_MOVED_TO
+
+#: Flags for `inotify_init1`.
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+
+#: The fixed part of `struct inotify_event`: wd, mask, cookie and len.
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _get_libc():
+    """
+    Return the C library when it provides the inotify functions.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+_libc = _get_libc()
+
+
+def _check(result, path=None):
+    """
+    Return `result` or raise OSError when it signals an error.
+    """
+    if result >= 0:
+        return result
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code), path)
+
+
+class Inotify:
+    """
+    An inotify instance, reading the events in non-blocking mode.
+
+    Raise OSError with ENOSYS when inotify is not available.
+    """
+
+    #: Size used to read the queued events.
+    read_size = 64 * 1024
+
+    def __init__(self):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, 'inotify not available')
+        self._fd = _check(_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    @property
+    def closed(self):
+        """
+        True when the inotify descriptor was closed.
+        """
+        return self._fd is None
+
+    def fileno(self):
+        """
+        Return the inotify descriptor, to wait for events via select/poll.
+        """
+        return self._fd
+
+    def addWatch(self, path, mask):
+        """
+        Watch `path` for the `mask` events and return the watch descriptor.
+
+        The same descriptor is returned for an inode which is already
+        watched.
+        """
+        return _check(
+            _libc.inotify_add_watch(self._fd, os.fsencode(path), mask),
+            path,
+        )
+
+    def removeWatch(self, wd):
+        """
+        Stop the watch `wd`.
+
+        An IN_IGNORED event is queued for it.
+        """
+        _check(_libc.inotify_rm_watch(self._fd, wd))
+
+    def readEvents(self):
+        """
+        Return the list of the queued events, without waiting for them.
+
+        Each event is a tuple of (wd, mask, cookie, name), with `name` as
+        bytes, or None for events of the watched path itself.
+        """
+        result = []
+        while True:
+            try:
+                data = os.read(self._fd, self.read_size)
+            except BlockingIOError:
+                return result
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(
+                    data, offset
+                )
+                offset += _EVENT_HEADER.size
+                name = None
+                if length:
+                    name = data[offset : offset + length].rstrip(b'\0')
+                    offset += length
+                result.append((wd, mask, cookie, name))
+
+            if len(data) < self.read_size - _EVENT_HEADER.size - 256:
+                # All the queued events fit in the buffer.
+                return result
+
+    def close(self):
+        """
+        Close the inotify descriptor, removing all the watches.
+        """
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            os.close(fd)
@@ -400,6 +400,33 @@ class ILocalFilesystem(Interface):
     system_users = Attribute('Module for handling system users `IOSUsers`.')
     home_segments = Attribute('Segments for user home folder.')
     temp_segments = Attribute('Segments to temp folder.')
+    quota = Attribute(
+        'The `IQuotaTracker` updated when files are written, copied, renamed '
+        'or deleted, or None.'
+    )
+    metadata_cache = Attribute(
+        'The `IMetadataCache` used for the attributes, existence and content '
+        'of the paths, or None. The values of the paths changed via this '
+        'filesystem are removed from the cache.'
+    )
+    checksum_cache = Attribute(
+        'The `IChecksumCache` used for the checksums of the whole content '
+        'of the files, or None.'
+    )
+
+    def invalidateAvatarCache(avatar=None):
+        """
+        Forget the root path and the validated virtual folders cached for
+        the configuration of `avatar`, or for all avatars when `avatar` is
+        `None`.
+
+        The virtual folders are validated again by the next filesystem
+        created for that configuration.
+        The filesystems which were already created compile and validate
+        the virtual folders of their avatar again, so this should be
+        called after the virtual folders of an avatar are changed in
+        place.
+        """
 
     def getRealPathFromSegments(segments, include_virtual=True):
         """
@@ -435,6 +462,13 @@ class ILocalFilesystem(Interface):
         `path` is a ChevahPath and can be a relative path of the home folder.
         """
 
+    def getSegmentsMany(paths):
+        """
+        Return the list of segments for each ChevahPath from `paths`.
+
+        It has the same result as calling `getSegments` for each path.
+        """
+
     def isAbsolutePath(path):
         """
         Return True if path points to an absolute path.
@@ -465,6 +499,15 @@ class ILocalFilesystem(Interface):
         in order to not trigger errors due to permissions errors.
         """
 
+    def existsMany(segments_list, workers=None):
+        """
+        Return the list with the result of `exists` for each segments
+        from `segments_list`, or with the error.
+
+        The paths from different folders are checked in parallel by at
+        most `workers` threads.
+        """
+
     def createFolder(segments, recursive):
         """
         Create a folder at the path specified by segments.
@@ -488,9 +531,15 @@ class ILocalFilesystem(Interface):
         Delete the folder at `segments`.
         """
 
-    def rename(from_segments, to_segments):
+    def rename(from_segments, to_segments, progress=None):
         """
         Rename file or folder.
+
+        When `to_segments` is on another filesystem, the file or the
+        folder tree is copied with its attributes, written to disk and
+        then removed.
+        In this case, `progress` is called with the number of copied
+        bytes and the total number of bytes.
         """
 
     def openFile(segments, flags, mode):
@@ -505,19 +554,41 @@ class ILocalFilesystem(Interface):
         Return a file object for reading the file.
         """
 
-    def openFileForWriting(segments, mode='default'):
+    def openFileForWriting(
+        segments, mode='default', checksums=None, expected=None
+    ):
         """
         Return a file object for writing into the file.
 
         File is created if it does not exist.
         File is truncated if it exists.
+
+        When `checksums` has a list of algorithms, as for `getChecksum`,
+        the returned file has a `checksums` dictionary with the hex digest
+        of the content for each algorithm, after it is closed.
+
+        `expected` is a dictionary with the expected hex digest for some
+        algorithms. The content is then written to a new file, which
+        replaces the file on close only when it has the expected digests.
+        Otherwise, the new file is removed and a CompatError is raised on
+        close.
+        The new file gets the mode, owner and extended attributes of the
+        replaced file, when they can be set.
+        Links and files with multiple hard links are written in place, and
+        the written content is removed when not matching.
         """
 
-    def openFileForAppending(segments):
+    def openFileForAppending(
+        segments, mode='default', checksums=None, expected=None
+    ):
         """
         Return a file object for writing at the end a file.
 
         File is created if it does not exists.
+
+        `checksums` and `expected` are as for `openFileForWriting`, with
+        the digests for the whole content, including the existing one.
+        When not matching, the appended content is removed.
         """
 
     def getFileSize(segments):
@@ -530,9 +601,134 @@ class ILocalFilesystem(Interface):
         Return a list of files and folders contained by folder.
         """
 
-    def iterateFolderContent(segments):
+    def iterateFolderContent(
+        segments,
+        filter=None,  # noqa: A002
+        extended_attributes=None,
+    ):
         """
         Return an iterator with the IFileAttributes of each direct child.
+
+        When `filter` is not None, only the members matching it are
+        returned, and the excluded members are not stat-ed.
+        `filter` is one of:
+
+        * a glob pattern, using the `fnmatch` rules,
+        * a compiled regular expression, which should match the full name,
+        * a callable, called with the name of the member and True for
+          folders, which returns False for the excluded members.
+
+        When `extended_attributes` is a list of names, the attributes of
+        the real members have their `extended_attributes` read in the
+        same pass, as for `getExtendedAttributes`.
+        Links don't have the attributes of their target, and the members
+        for which the attributes can't be read have none.
+        """
+
+    def iterateFolderTree(segments, filter=None):  # noqa: A002
+        """
+        Return an iterator with a tuple of segments and IFileAttributes
+        for each member of the tree at `segments`.
+
+        The tree is walked depth first, without following links to
+        folders, and the folders which can't be listed are ignored.
+        Members removed while the tree is walked are not returned.
+
+        `filter` is as for `iterateFolderContent`, but it is matched against
+        the path relative to `segments`, using `/` as separator.
+        A `**` component of a glob pattern matches any number of folders.
+        """
+
+    def getTreeUsage(
+        segments,
+        one_filesystem=False,
+        progress=None,
+        workers=None,
+    ):
+        """
+        Return the `ITreeUsage` for the tree at `segments`.
+
+        The folders are scanned in parallel, using at most `workers`
+        threads.
+        Links are counted, but not followed, and files with multiple hard
+        links are counted once.
+        When `one_filesystem` is True, the folders from other filesystems
+        are ignored.
+
+        `progress` is called from the calling thread with the partial
+        usage, each time a folder was scanned.
+        """
+
+    def getChecksum(segments, algorithm='sha256', offset=0, length=None):
+        """
+        Return the hex digest of the content of the file at `segments`.
+
+        `algorithm` is `crc32` or any name supported by `hashlib`.
+        Only `length` bytes starting at `offset` are used, or the content
+        up to the end of the file when `length` is None or goes past the
+        end of the file.
+
+        The digest of the whole content is kept by `checksum_cache`, when
+        configured.
+        """
+
+    def getChecksumMany(segments_list, algorithm='sha256', workers=None):
+        """
+        Return the list with the hex digest of each file from
+        `segments_list`, computed in parallel by at most `workers`
+        threads.
+
+        For the files which can't be read, the list contains the error.
+        """
+
+    def executeMany(operations, workers=None):
+        """
+        Execute the list of `operations` and return the list with the
+        result of each operation, or with its error.
+
+        Each operation is a (name, segments) or a (name, segments,
+        arguments) tuple, executed as calling the `name` method with
+        `segments` and the `arguments` dictionary as keyword arguments.
+        The supported methods are `createFolder`, `deleteFile`,
+        `openFileForWriting`, `rename` and `setAttributes`.
+
+        Operations for different folders are executed in parallel by at
+        most `workers` threads.
+        An operation is executed after the previous operations for the
+        same path, for its parents or for its members.
+        The files are returned opened.
+        Raise AssertionError, before executing any operation, when an
+        operation or one of its arguments is not supported.
+        """
+
+    def getFolderListing(segments):
+        """
+        Return the `IFolderListing` with the attributes of each direct
+        child.
+
+        It has the same members as `iterateFolderContent`, but uses less
+        memory for folders with many members.
+        """
+
+    def listFolderPage(
+        segments,
+        sort_key='name',
+        reverse=False,
+        offset=0,
+        limit=None,
+        filter=None,  # noqa: A002
+    ):
+        """
+        Return a tuple with the number of members and the list with the
+        IFileAttributes of the members from the requested page.
+
+        The members are sorted by `sort_key`, which is one of `name`,
+        `size` or `modified`, and then by name.
+        The page starts at `offset` and has at most `limit` members, or all
+        the remaining members when `limit` is None.
+
+        `filter` is called with the name of the member and True for
+        folders, and the members for which it returns False are ignored.
         """
 
     def getStatus(segments):
@@ -557,6 +753,15 @@ class ILocalFilesystem(Interface):
         Return file not found when the link is broken.
         """
 
+    def getAttributesMany(segments_list, workers=None):
+        """
+        Return the list with the IFileAttributes of each segments from
+        `segments_list`, or with the error.
+
+        The paths from different folders are read in parallel by at most
+        `workers` threads.
+        """
+
     def setAttributes(segments, attributes):
         """
         Set `attributes` for segment.
@@ -568,6 +773,87 @@ class ILocalFilesystem(Interface):
          * mode -> s.st_mode
          * atime -> int(s.st_atime)
          * mtime -> int(s.st_mtime)
+         * atime_ns -> s.st_atime_ns
+         * mtime_ns -> s.st_mtime_ns
+
+        The uid and gid can be set separately, as can the access and
+        modification times.
+        The `*_ns` values are used instead of the values in seconds.
+        """
+
+    def setDescriptorAttributes(stream, attributes):
+        """
+        Set `attributes`, as for `setAttributes`, for the opened file
+        `stream` or file descriptor.
+
+        The buffered content of `stream` is written first, but any later
+        write changes the modification time.
+        Raise OSError with ENOTSUP when not supported by the OS.
+        """
+
+    def lockFile(stream, exclusive=True, offset=0, length=0, blocking=False):
+        """
+        Place an advisory lock on the `length` bytes from `offset` of the
+        opened file `stream` or file descriptor, or up to the end of the
+        file when `length` is 0.
+
+        The lock is shared by all the descriptors of the same opened
+        file, it conflicts with the locks of any other opened file, even
+        from the same process, and it is released when the file is
+        closed.
+        Exclusive locks need a file opened for writing, and shared locks
+        a file opened for reading.
+
+        When `blocking` is False, raise OSError with EAGAIN when the range
+        is locked by a conflicting lock. Otherwise, wait for it.
+        """
+
+    def unlockFile(stream, offset=0, length=0):
+        """
+        Release the lock placed by `lockFile` on the range.
+        """
+
+    def getFileLock(stream, exclusive=True, offset=0, length=0):
+        """
+        Return None when the `exclusive` or shared lock can be placed on
+        the range.
+
+        Otherwise, return the (exclusive, offset, length, pid) tuple for
+        one of the conflicting locks, where `pid` is None for the locks
+        which are not owned by a process.
+        Raise OSError with ENOTSUP when not supported by the OS.
+        """
+
+    def getExtendedAttributes(segments, names=None):
+        """
+        Return the dictionary with the bytes value of the `names` extended
+        attributes, or of all the attributes when `names` is None.
+
+        The names include the namespace, as in `user.origin`.
+        The attributes which are not set are not included.
+        The attributes from the `user.chevah.` namespace are used
+        internally and are never included.
+        Raise OSError with ENOTSUP when not supported by the OS.
+        """
+
+    def setExtendedAttributes(segments, attributes):
+        """
+        Set the extended attributes from the `attributes` dictionary of
+        names and values, with a single impersonation.
+
+        The values are bytes or text, stored as UTF-8.
+        A None value removes the attribute.
+        Raise OSError with EPERM for the attributes from the `user.chevah.`
+        namespace, before any attribute is changed.
+        Raise OSError with ENOTSUP when not supported by the OS.
+        """
+
+    def listExtendedAttributes(segments):
+        """
+        Return the list with the names of the extended attributes,
+        without the ones from the `user.chevah.` namespace.
+
+        Raise OSError with ENOTSUP when not supported by the OS.
         """
 
     def readLink(segments):
@@ -626,6 +912,214 @@ class ILocalFilesystem(Interface):
         copy will fail.
         """
 
+    def copyFolder(
+        source_segments,
+        destination_segments,
+        overwrite=False,
+        preserve=True,
+        progress=None,
+        workers=None,
+    ):
+        """
+        Copy the folder tree from `source_segments` to
+        `destination_segments`.
+
+        Files are copied in parallel by at most `workers` threads.
+        Links are copied as links.
+        When `preserve` is True, the owner, mode, times and extended
+        attributes of each member are copied, otherwise the members are
+        created with the default mode.
+
+        If `destination_segments` already exists and `overwrite` is not
+        `true`, copy will fail.
+        When `overwrite` is `true`, the existing folders are reused and
+        the other existing members are replaced.
+
+        `progress` is called with the number of copied bytes and the
+        total number of bytes.
+
+        Return the list of (segments, error) for the members which were
+        not copied, while the errors of the top folder are raised.
+        """
+
+    def openFolder(segments):
+        """
+        Return an `IFolderHandle` for the folder at `segments`.
+
+        The folder is opened once and all the operations done via the
+        handle are relative to it.
+        """
+
+    def openFolderCursor(segments, batch_size=100):
+        """
+        Return an `IFolderCursor` reading the members of the folder at
+        `segments` in batches of at most `batch_size` members.
+        """
+
+    def watchFolder(segments, recursive=False, callback=None):
+        """
+        Return an `IFolderWatch` reporting the changes of the members of
+        the folder at `segments`, or of all its descendants when
+        `recursive` is True.
+
+        When `callback` is not None, it is called from a separate thread
+        with each list of `IFolderEvent`.
+
+        Raise OSError with ENOSYS when not supported by the OS.
+        """
+
+
+class IFolderCursor(Interface):
+    """
+    A folder listing which is read in batches, over multiple calls.
+
+    The folder descriptor is not kept opened while the cursor is not used,
+    and it is opened again when the reading is resumed.
+    The descriptors of the idle cursors are closed each time a cursor
+    opens a folder. Applications which don't open cursors often can
+    also call `FolderCursor.reapIdleCursors` periodically.
+    """
+
+    segments = Attribute('Segments of the listed folder.')
+    path = Attribute('Real path of the listed folder.')
+    batch_size = Attribute('Maximum number of members returned by a read.')
+    position = Attribute('Number of members returned so far.')
+    closed = Attribute('True if the cursor was closed.')
+    exhausted = Attribute('True if all the members were returned.')
+    suspended = Attribute(
+        'True if the folder descriptor was closed before reading all the '
+        'members.'
+    )
+
+    def read():
+        """
+        Return the list with the IFileAttributes of the next members.
+
+        An empty list is returned when all the members were read.
+        """
+
+    def close():
+        """
+        Close the cursor.
+
+        It can be called multiple times.
+        """
+
+
+class IFolderEvent(Interface):
+    """
+    A change of a member from a watched folder.
+    """
+
+    kind = Attribute(
+        'One of `create`, `modify`, `close_write`, `move` or `delete`. '
+        '`overflow` is used when some changes were lost.'
+    )
+    segments = Attribute('Segments of the changed member.')
+    source_segments = Attribute(
+        'Segments from which the member was moved, or None.'
+    )
+    is_folder = Attribute('True if the member is a folder.')
+
+
+class IFolderWatch(Interface):
+    """
+    Reports the changes done to the members of a folder.
+
+    The changes are read in batches, in which the repeated changes of a
+    member are reported once.
+    A member moved from outside of the watched folder is reported as
+    created, and a member moved outside as deleted.
+    """
+
+    segments = Attribute('Segments of the watched folder.')
+    recursive = Attribute('True if the descendants are also watched.')
+    closed = Attribute('True if the watch was closed.')
+
+    def fileno():
+        """
+        Return the file descriptor which is readable when there are
+        changes to read.
+        """
+
+    def read(timeout=None):
+        """
+        Return the list of the `IFolderEvent` for the next changes.
+
+        Wait at most `timeout` seconds for the changes, or until changes
+        are available when `timeout` is None.
+        """
+
+    def close():
+        """
+        Stop watching the folder.
+
+        It can be called multiple times.
+        """
+
+
+class IFolderHandle(Interface):
+    """
+    An opened folder used for operations on its direct members.
+
+    Members are identified by their name and not by segments.
+    The operations are done relative to the opened folder, without
+    resolving the path of the folder for each call.
+
+    Virtual folders are not available via the handle.
+    """
+
+    segments = Attribute('Segments of the opened folder.')
+    path = Attribute('Real path of the opened folder.')
+    closed = Attribute('True if the handle was closed.')
+
+    def fileno():
+        """
+        Return the file descriptor of the opened folder.
+        """
+
+    def close():
+        """
+        Close the folder.
+
+        It can be called multiple times.
+        """
+
+    def stat(name, follow_symlinks=True):
+        """
+        Return the status structure for member `name`.
+        """
+
+    def open(name, flags, mode):
+        """
+        Return a file descriptor for member `name`.
+
+        `flags` and `mode` are used for os.open function.
+        """
+
+    def unlink(name):
+        """
+        Delete the file `name`.
+        """
+
+    def mkdir(name, mode):
+        """
+        Create the folder `name`.
+        """
+
+    def rename(name, new_name, destination=None):
+        """
+        Rename member `name` as `new_name`.
+
+        When `destination` is an `IFolderHandle` the member is moved
+        inside the `destination` folder.
+        """
+
+    def scandir():
+        """
+        Return an iterator with the IFileAttributes of each member.
+        """
+
 
 class IFileAttributes(Interface):
     """
@@ -651,3 +1145,244 @@ class IFileAttributes(Interface):
     node_id = Attribute('ID inside the filesystem.')
     owner = Attribute('Name of the owner of this path.')
     group = Attribute('Name of the group to which this path is associated.')
+    extended_attributes = Attribute(
+        'Dictionary with the requested extended attributes, or None when '
+        'they were not requested.'
+    )
+
+
+class IFolderListing(Interface):
+    """
+    Attributes for all the members of a folder, stored in columns.
+
+    Each column is an `array.array` with one value for each member.
+    Members are converted to `IFileAttributes` only when requested.
+    """
+
+    FILE = Attribute('Flag for members which are files.')
+    FOLDER = Attribute('Flag for members which are folders.')
+    LINK = Attribute('Flag for members which are symbolic links.')
+    VIRTUAL = Attribute('Flag for members which are virtual folders.')
+
+    path = Attribute('Real path of the listed folder.')
+    sizes = Attribute('Size in bytes.')
+    modified = Attribute('Timestamp at which content was last modified.')
+    modes = Attribute('Protection bits.')
+    hardlinks = Attribute('Number of hard links.')
+    uids = Attribute('User ID of the owner, or -1 when not known.')
+    gids = Attribute('Group ID, or -1 when not known.')
+    node_ids = Attribute('ID inside the filesystem.')
+    flags = Attribute('Combination of the FILE, FOLDER, LINK and VIRTUAL.')
+
+    def __len__():
+        """
+        Return the number of members.
+        """
+
+    def __getitem__(index):
+        """
+        Return the `IFileAttributes` for the member at `index`.
+        """
+
+    def __iter__():
+        """
+        Return an iterator with the `IFileAttributes` of each member.
+        """
+
+    def getName(index):
+        """
+        Return the name of the member at `index`.
+        """
+
+    def sort(key='name', reverse=False):
+        """
+        Return a new listing with the members sorted by `key`.
+
+        `key` is one of `name`, `size` or `modified`.
+        """
+
+    def filter(include=0, exclude=0):
+        """
+        Return a new listing with the members having all the `include`
+        flags and none of the `exclude` flags.
+        """
+
+    def count(include=0, exclude=0):
+        """
+        Return the number of members matching the flags, as for `filter`.
+        """
+
+    def getTotalSize(include=0, exclude=0):
+        """
+        Return the sum of the sizes for the members matching the flags,
+        as for `filter`.
+        """
+
+
+class ITreeUsage(Interface):
+    """
+    Usage statistics for a tree of files and folders.
+    """
+
+    files = Attribute('Number of files.')
+    folders = Attribute('Number of folders, without the top folder.')
+    links = Attribute('Number of symbolic links.')
+    size = Attribute('Sum of the file sizes, in bytes.')
+    allocated = Attribute('Disk space allocated to the files, in bytes.')
+    errors = Attribute(
+        'Number of folders or members which could not be scanned.'
+    )
+    extensions = Attribute(
+        'Dictionary with the lower case extension of the files as key and '
+        'a tuple with the number of files and their size as value.'
+    )
+
+    def addFile(name, size, allocated):
+        """
+        Add a file to the usage.
+        """
+
+    def update(other):
+        """
+        Add the usage from `other`.
+        """
+
+
+class IQuotaTracker(Interface):
+    """
+    Keeps the storage usage of the avatars without scanning their files
+    for each check.
+
+    The usage is updated by the filesystems for which `track` was called
+    and it is reconciled with the files from the avatar root folder.
+    """
+
+    path = Attribute('Path to the file in which the usage is stored.')
+
+    def track(filesystem):
+        """
+        Update the usage based on the changes done via `filesystem`.
+
+        The usage is reconciled when it is not already known.
+        Only the filesystems of avatars locked into their home folder can
+        be tracked, otherwise AssertionError is raised.
+        """
+
+    def getUsage(filesystem):
+        """
+        Return a tuple with the size and the number of files used by the
+        avatar of `filesystem`.
+        """
+
+    def check(filesystem, size, limit):
+        """
+        Raise a CompatError when adding `size` bytes to the usage of
+        `filesystem` is over `limit`.
+        """
+
+    def update(filesystem, size, files):
+        """
+        Add `size` bytes and `files` to the usage of `filesystem`.
+        """
+
+    def reconcile(filesystem):
+        """
+        Set the usage of `filesystem` based on its files.
+
+        A known usage is kept when not all the files could be scanned.
+        """
+
+    def flush():
+        """
+        Save the usage, when changed.
+        """
+
+    def start(interval):
+        """
+        Reconcile the usage of the tracked filesystems and save it, every
+        `interval` seconds, from a separate thread.
+        """
+
+    def stop():
+        """
+        Stop the thread started by `start` and save the usage.
+        """
+
+
+class IMetadataCache(Interface):
+    """
+    Keeps the attributes, existence and content of the paths until they
+    are changed.
+
+    The values are kept for each owner, as the result depends on the
+    permissions of the account used to get them.
+    """
+
+    max_entries = Attribute('Maximum number of values kept.')
+    max_watches = Attribute('Maximum number of watched folders.')
+    ttl = Attribute(
+        'Seconds for which the values are kept when the changes of the path '
+        'are not observed.'
+    )
+    hits = Attribute('Number of values returned from the cache.')
+    misses = Attribute('Number of values which were computed.')
+    hit_rate = Attribute('Ratio of the values returned from the cache.')
+
+    def get(kind, path, owner, compute, cacheable=None, observed_only=None):
+        """
+        Return the `kind` value of `path` for `owner`.
+
+        When not cached, it is the result of calling `compute`, which
+        is kept when `cacheable` is None or returns True for it.
+        The values for which `observed_only` returns True are kept only
+        when the changes of the path are observed, and not for `ttl`
+        seconds.
+        Errors raised by `compute` are not cached.
+        """
+
+    def invalidate(path=None, recursive=True):
+        """
+        Remove the values of `path` and its descendants, or all the values
+        when `path` is None.
+
+        When `recursive` is False, the values of the descendants are kept.
+        """
+
+    def close():
+        """
+        Remove all the values and release the used resources.
+        """
+
+
+class IChecksumCache(Interface):
+    """
+    Keeps the checksums of the files until their content is changed.
+
+    A checksum is valid while the size, the modification time and the
+    inode of the file are the same as when it was computed.
+    The stored checksums are authenticated, so that checksums stored by
+    other processes, like the shell of an avatar, are not used.
+    """
+
+    sidecar_path = Attribute(
+        'Path to the database used for the files without extended '
+        'attributes, or None.'
+    )
+    min_age = Attribute(
+        'Seconds since the last modification of the file after which its '
+        'checksum is kept.'
+    )
+    hits = Attribute('Number of checksums returned from the cache.')
+    misses = Attribute('Number of checksums which were computed.')
+
+    def get(fd, algorithm, compute):
+        """
+        Return the `algorithm` hex digest of the opened file `fd`.
+
+        When not cached, it is the result of calling `compute`.
+        """
+
+    def close():
+        """
+        Release the used resources.
+        """
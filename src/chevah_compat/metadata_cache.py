@@ -0,0 +1,473 @@
+# Copyright (c) 2026 Adi Roiban.
+# See LICENSE for details.
+"""
+Cache for the metadata of the files, invalidated by inotify events.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from zope.interface import implementer
+
+from chevah_compat.inotify import (
+    IN_ATTRIB,
+    IN_CREATE,
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_DONT_FOLLOW,
+    IN_EXCL_UNLINK,
+    IN_IGNORED,
+    IN_MODIFY,
+    IN_MOVE,
+    IN_MOVE_SELF,
+    IN_ONLYDIR,
+    IN_Q_OVERFLOW,
+    IN_UNMOUNT,
+    Inotify,
+)
+from chevah_compat.interfaces import IMetadataCache
+
+#: Events for which the cached values of a watched folder are removed.
+_WATCH_MASK = (
+    IN_ATTRIB
+    | IN_MODIFY
+    | IN_CREATE
+    | IN_DELETE
+    | IN_MOVE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+#: Events changing the members of a folder.
+_MEMBERS_MASK = IN_CREATE | IN_DELETE | IN_MOVE
+#: Events after which the watched path is no longer valid.
+_GONE_MASK = IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT | IN_IGNORED
+
+#: Filesystems for which the changes are not reported via inotify, as they
+#: can be done by other hosts or by a userspace process.
+UNRELIABLE_FILESYSTEMS = frozenset(
+    [
+        '9p',
+        'afs',
+        'ceph',
+        'cifs',
+        'fuse',
+        'fuseblk',
+        'gfs2',
+        'glusterfs',
+        'gpfs',
+        'lustre',
+        'ncpfs',
+        'nfs',
+        'nfs4',
+        'ocfs2',
+        'smb3',
+        'smbfs',
+        'sshfs',
+        'vboxsf',
+        'virtiofs',
+    ]
+)
+
+#: Path to the mount table of the current process.
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+
+#: Escaped characters from the mount points.
+_OCTAL_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+
+def _is_inside(path, folder):
+    """
+    Return True when `path` is `folder` or one of its descendants.
+    """
+    if folder == '/':
+        return True
+    return path == folder or path.startswith(folder + '/')
+
+
+def _get_ancestors(path):
+    """
+    Return the list of folders from the root down to `path`.
+    """
+    result = []
+    while True:
+        result.append(path)
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    result.reverse()
+    return result
+
+
+def _parse_mounts(content):
+    """
+    Return the list of (mount point, filesystem type) from the content of
+    a `mountinfo` file, with the longest mount points first.
+    """
+    result = []
+    for line in content.splitlines():
+        fields = line.split(' ')
+        try:
+            separator = fields.index('-', 6)
+            mount_point = _OCTAL_ESCAPE.sub(
+                lambda match: chr(int(match.group(1), 8)), fields[4]
+            )
+            result.append((mount_point, fields[separator + 1]))
+        except (ValueError, IndexError):
+            continue
+    result.sort(key=lambda mount: len(mount[0]), reverse=True)
+    return result
+
+
+@implementer(IMetadataCache)
+class MetadataCache:
+    """
+    See: IMetadataCache.
+
+    On Linux, the values of the paths from local filesystems are kept
+    until a change is reported by inotify for the path, or for any of
+    its parent folders.
+    A change of the access time is not reported, so the access time
+    of the cached attributes might be older.
+
+    The values from the other filesystems, or from all the filesystems
+    when inotify is not available, are kept for `ttl` seconds.
+    """
+
+    #: Seconds after which the mount table is read again.
+    mounts_interval = 5
+
+    def __init__(self, max_entries=10000, max_watches=1000, ttl=2):
+        self.max_entries = max_entries
+        self.max_watches = max_watches
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The key is (kind, path, owner) and the value a list of
+        # [value, watched folder or None, expiration time or None].
+        # While computed, the value is a unique marker.
+        self._entries = OrderedDict()
+        self._paths = {}
+        # Watched folders path to [wd, entries keys, watched members].
+        self._watches = OrderedDict()
+        self._wds = {}
+        self._mounts = []
+        self._mounts_content = None
+        self._mounts_time = None
+        try:
+            self._inotify = Inotify()
+        except OSError:
+            self._inotify = None
+        self._loadMounts()
+
+    @property
+    def hit_rate(self):
+        """
+        See: IMetadataCache.
+        """
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+        return self.hits / total
+
+    def get(
+        self, kind, path, owner, compute, cacheable=None, observed_only=None
+    ):
+        """
+        See: IMetadataCache.
+        """
+        key = (kind, path, owner)
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(key)
+            if entry is not None and type(entry[0]) is not _Computing:
+                expires = entry[2]
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._removeEntry(key)
+
+            self.misses += 1
+            folder = path if kind == 'content' else os.path.dirname(path)
+            if self._isWatched(folder):
+                watched = self._watch(folder)
+                if watched is None:
+                    # Changes can't be observed for this path.
+                    return compute()
+                expires = None
+            else:
+                watched = None
+                expires = time.monotonic() + self.ttl
+            marker = _Computing()
+            self._addEntry(key, [marker, watched, expires])
+
+        stored = False
+        try:
+            value = compute()
+            unobserved = expires is not None and observed_only is not None
+            if unobserved and observed_only(value):
+                return value
+            if cacheable is None or cacheable(value):
+                with self._lock:
+                    # Remove the marker when a change was reported.
+                    self._refresh()
+                    entry = self._entries.get(key)
+                    if entry is not None and entry[0] is marker:
+                        entry[0] = value
+                        stored = True
+            return value
+        finally:
+            if not stored:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None and entry[0] is marker:
+                        self._removeEntry(key)
+
+    def invalidate(self, path=None, recursive=True):
+        """
+        See: IMetadataCache.
+        """
+        with self._lock:
+            if path is None:
+                self._clear()
+                return
+
+            if not recursive:
+                self._removePath(path)
+                return
+
+            self._removeTree(path)
+            for key in [
+                key for key in self._entries if _is_inside(key[1], path)
+            ]:
+                self._removeEntry(key)
+
+    def close(self):
+        """
+        See: IMetadataCache.
+        """
+        with self._lock:
+            self._clear()
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+
+    def _isWatched(self, folder):
+        """
+        Return True when the changes of `folder` are reported by inotify.
+        """
+        if self._inotify is None or not folder.startswith('/'):
+            return False
+
+        for mount_point, filesystem in self._mounts:
+            if not _is_inside(folder, mount_point):
+                continue
+            name = filesystem.split('.', 1)[0]
+            return name not in UNRELIABLE_FILESYSTEMS
+        return False
+
+    def _watch(self, folder):
+        """
+        Watch `folder` and all its parents.
+
+        Return the watched folder or None when it can't be watched.
+        """
+        watches = self._watches
+        watch = watches.get(folder)
+        if watch is not None:
+            watches.move_to_end(folder)
+            return folder
+
+        parent = None
+        for ancestor in _get_ancestors(folder):
+            watch = watches.get(ancestor)
+            if watch is not None:
+                watches.move_to_end(ancestor)
+                parent = ancestor
+                continue
+
+            # The parents are watched first, to observe a change done
+            # while the watch is added.
+            # The parent is marked as used so that it is not removed to
+            # make room for the new watch.
+            if parent is not None:
+                watches[parent][2] += 1
+            self._evictWatches(self.max_watches - 1)
+            try:
+                wd = self._inotify.addWatch(ancestor, _WATCH_MASK)
+            except OSError:
+                # Not a folder, a link, not readable or over the limit.
+                wd = None
+            if wd is None or wd in self._wds:
+                # When already known, the same folder is available at
+                # another path.
+                if parent is not None:
+                    watches[parent][2] -= 1
+                return None
+            watches[ancestor] = [wd, set(), 0]
+            self._wds[wd] = ancestor
+            parent = ancestor
+        return folder
+
+    def _evictWatches(self, size):
+        """
+        Remove the least recently used watches for folders without
+        watched members, until there are at most `size` watches.
+        """
+        while len(self._watches) > size:
+            for folder, watch in self._watches.items():
+                if not watch[2]:
+                    break
+            else:
+                return
+            self._removeWatch(folder)
+
+    def _removeWatch(self, folder):
+        """
+        Stop watching `folder` and remove the values which depend on it.
+        """
+        wd, keys, _members = self._watches.pop(folder)
+        del self._wds[wd]
+        for key in list(keys):
+            self._removeEntry(key)
+
+        parent = os.path.dirname(folder)
+        watch = self._watches.get(parent)
+        if parent != folder and watch is not None:
+            watch[2] -= 1
+
+        try:
+            self._inotify.removeWatch(wd)
+        except OSError:
+            # Already removed by the kernel.
+            pass
+
+    def _addEntry(self, key, entry):
+        """
+        Add the `entry` for `key`, removing the least recently used
+        values when over the limit.
+        """
+        if key in self._entries:
+            self._removeEntry(key)
+        self._entries[key] = entry
+        self._paths.setdefault(key[1], set()).add(key)
+        if entry[1] is not None:
+            self._watches[entry[1]][1].add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._removeEntry(next(iter(self._entries)))
+
+    def _removeEntry(self, key):
+        """
+        Remove the value for `key`.
+        """
+        entry = self._entries.pop(key)
+        keys = self._paths[key[1]]
+        keys.discard(key)
+        if not keys:
+            del self._paths[key[1]]
+        watch = self._watches.get(entry[1])
+        if watch is not None:
+            watch[1].discard(key)
+
+    def _removePath(self, path):
+        """
+        Remove all the values of `path`.
+        """
+        for key in list(self._paths.get(path, ())):
+            self._removeEntry(key)
+
+    def _removeTree(self, path):
+        """
+        Remove the watches and the values of `path` and of its
+        descendants, without the values kept for `ttl`.
+        """
+        for folder in [
+            folder for folder in self._watches if _is_inside(folder, path)
+        ]:
+            self._removeWatch(folder)
+        self._removePath(path)
+
+    def _clear(self):
+        """
+        Remove all the values and the watches.
+        """
+        for folder in list(self._watches):
+            self._removeWatch(folder)
+        self._entries.clear()
+        self._paths.clear()
+
+    def _refresh(self):
+        """
+        Remove the values changed since the last call.
+        """
+        if time.monotonic() - self._mounts_time > self.mounts_interval:
+            self._loadMounts()
+
+        if self._inotify is None:
+            return
+
+        for wd, mask, _cookie, name in self._inotify.readEvents():
+            if mask & IN_Q_OVERFLOW:
+                # Some changes were lost.
+                self._clear()
+                continue
+
+            folder = self._wds.get(wd)
+            if folder is None:
+                # Already removed.
+                continue
+
+            if name is None:
+                if mask & _GONE_MASK:
+                    self._removeTree(folder)
+                else:
+                    self._removePath(folder)
+                continue
+
+            path = os.path.join(folder, os.fsdecode(name))
+            if mask & _MEMBERS_MASK:
+                # Also changes the modification time of the folder.
+                self._removePath(folder)
+            if path in self._watches:
+                # The values of the descendants are kept only while
+                # all their parents are watched.
+                self._removeTree(path)
+            else:
+                self._removePath(path)
+
+    def _loadMounts(self):
+        """
+        Read the mount table and remove all the values when it changed.
+        """
+        self._mounts_time = time.monotonic()
+        try:
+            with open(MOUNTINFO_PATH) as stream:
+                content = stream.read()
+        except OSError:
+            content = ''
+
+        if content == self._mounts_content:
+            return
+
+        if self._mounts_content is not None:
+            # A folder might be hidden by a new mount point.
+            self._clear()
+        self._mounts_content = content
+        self._mounts = _parse_mounts(content)
+
+
+class _Computing:
+    """
+    Marks a value which is computed.
+    """
+
+    __slots__ = ()
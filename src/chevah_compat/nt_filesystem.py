@@ -29,6 +29,7 @@ from chevah_compat.interfaces import ILocalFilesystem
 from chevah_compat.nt_capabilities import NTProcessCapabilities
 from chevah_compat.nt_users import NTDefaultAvatar, NTUsers
 from chevah_compat.posix_filesystem import (
+    FolderListing,
     PosixFilesystemBase,
     _win_getEncodedPath,
 )
@@ -69,6 +70,16 @@ FILE_STATUS_FLAGS = (
 ERROR_PATH_NOT_FOUND = 3
 #: The directory name is invalid.
 ERROR_DIRECTORY = 267
+#: The process cannot access the file because another process has locked
+#: a portion of the file.
+ERROR_LOCK_VIOLATION = 33
+#: The segment is already unlocked.
+ERROR_NOT_LOCKED = 158
+
+#: Flags for LockFileEx.
+#: https://learn.microsoft.com/en-us/windows/win32/api/fileapi/nf-fileapi-lockfileex
+LOCKFILE_FAIL_IMMEDIATELY = 0x01
+LOCKFILE_EXCLUSIVE_LOCK = 0x02
 
 
 @implementer(ILocalFilesystem)
@@ -329,7 +340,7 @@ class NTFilesystem(PosixFilesystemBase):
         path = six.text_type(path)
 
         target = self._getAbsolutePath(path.replace('/', '\\')).lower()
-        for virtual_segments, real_path in self._avatar.virtual_folders:
+        for virtual_segments, real_path in self._virtual_folders:
             real_path = real_path.replace('/', '\\').lower()
             virtual_root = self._getAbsolutePath(real_path)
             if not target.startswith(virtual_root):
@@ -532,6 +543,7 @@ class NTFilesystem(PosixFilesystemBase):
             except AdjustPrivilegeException as error:
                 message = force_unicode(error.message)
                 raise OSError(errno.EINVAL, message, link_path)
+        self._invalidateCache(link_segments)
 
     def getStatus(self, segments):
         """
@@ -623,29 +635,43 @@ class NTFilesystem(PosixFilesystemBase):
 
             return result
 
-    def setAttributes(self, segments, attributes):
+    def _setAttributesPath(self, segments, path_encoded, attributes):
         """
-        See `ILocalFilesystem`.
+        See `PosixFilesystemBase`.
         """
         with self._windowsToOSError(segments):
             if 'uid' in attributes or 'gid' in attributes:
                 raise OSError(errno.EPERM, 'Operation not supported')
 
-            return super().setAttributes(segments, attributes)
+            return super()._setAttributesPath(
+                segments, path_encoded, attributes
+            )
 
-    def iterateFolderContent(self, segments):
+    def iterateFolderContent(
+        self,
+        segments,
+        filter=None,  # noqa: A002
+        extended_attributes=None,
+    ):
         """
         See `ILocalFilesystem`.
         """
+        if extended_attributes is not None:
+            self._requireExtendedAttributes(segments)
+
         if not self._lock_in_home and segments in [[], ['.'], ['..']]:
             drives = [
                 self._getPlaceholderAttributes([drive])
                 for drive in self._getAllDrives()
             ]
-            return iter(drives)
+            return iter(
+                self._filterMembers(drives, self._compileFilter(filter))
+            )
 
         try:
-            return super().iterateFolderContent(segments)
+            return super().iterateFolderContent(
+                segments, filter, extended_attributes
+            )
         except OSError as error:
             if error.errno == ERROR_DIRECTORY:
                 # When we don't list a directory, we get a specific
@@ -661,6 +687,63 @@ class NTFilesystem(PosixFilesystemBase):
 
             raise
 
+    def getFolderListing(self, segments):
+        """
+        See `ILocalFilesystem`.
+
+        On Windows, scandir results need extra conversions, so the
+        listing is built from `iterateFolderContent`.
+        """
+        virtual_names = [m.name for m in self._getVirtualMembers(segments)]
+        result = FolderListing(self.getRealPathFromSegments(segments))
+        for attributes in self.iterateFolderContent(segments):
+            result.append(
+                attributes,
+                is_virtual=attributes.name in virtual_names,
+            )
+        return result
+
+    def listFolderPage(
+        self,
+        segments,
+        sort_key='name',
+        reverse=False,
+        offset=0,
+        limit=None,
+        filter=None,  # noqa: A002
+    ):
+        """
+        See `ILocalFilesystem`.
+
+        As for `getFolderListing`, the page is built from
+        `iterateFolderContent`.
+        """
+        return self._getFolderPage(
+            self.iterateFolderContent(segments),
+            sort_key,
+            reverse,
+            offset,
+            limit,
+            filter,
+        )
+
+    def _impersonateWorker(self):
+        """
+        See `PosixFilesystemBase`.
+
+        On Windows, the impersonation is done for each thread.
+        """
+        return self._impersonateUser()
+
+    def _iterateMembers(self, segments):
+        """
+        See `PosixFilesystemBase`.
+
+        As for `getFolderListing`, the members are from
+        `iterateFolderContent`.
+        """
+        return self.iterateFolderContent(segments)
+
     def getFolderContent(self, segments):
         """
         See `ILocalFilesystem`.
@@ -694,10 +777,12 @@ class NTFilesystem(PosixFilesystemBase):
                 result.append(drive)
         return result
 
-    def createFolder(self, segments, recursive=False):
-        """See `ILocalFilesystem`."""
+    def _createFolderPath(self, segments, path_encoded, recursive=False):
+        """
+        See `PosixFilesystemBase`.
+        """
         with self._windowsToOSError(segments):
-            return super().createFolder(segments, recursive)
+            return super()._createFolderPath(segments, path_encoded, recursive)
 
     def _getFileData(self, path):
         """
@@ -779,19 +864,20 @@ class NTFilesystem(PosixFilesystemBase):
         has_symlink_tag = data['tag'] == self.IO_REPARSE_TAG_SYMLINK
         return is_reparse_point and has_symlink_tag
 
-    def deleteFile(self, segments, ignore_errors=False):
+    def _deleteFilePath(self, segments, path_encoded, ignore_errors=False):
         """
-        See `ILocalFilesystem`.
+        See `PosixFilesystemBase`.
         """
         try:
             with self._windowsToOSError(segments):
-                return super().deleteFile(
+                return super()._deleteFilePath(
                     segments,
+                    path_encoded,
                     ignore_errors=ignore_errors,
                 )
         except OSError as error:
             # Windows return a bad error code for folders.
-            if self.isFolder(segments):
+            if os.path.isdir(path_encoded):
                 raise OSError(errno.EISDIR, 'Is a directory', error.filename)
             # When file is not found it uses EINVAL code but we want the
             # same code as in Unix.
@@ -799,6 +885,85 @@ class NTFilesystem(PosixFilesystemBase):
                 raise OSError(errno.ENOENT, 'Not found', error.filename)
             raise
 
+    def lockFile(
+        self, stream, exclusive=True, offset=0, length=0, blocking=False
+    ):
+        """
+        See `ILocalFilesystem`.
+
+        On Windows, the locks are mandatory and a range can only be
+        unlocked with the same offset and length used to lock it.
+        """
+        flags = 0
+        if exclusive:
+            flags |= LOCKFILE_EXCLUSIVE_LOCK
+        if not blocking:
+            flags |= LOCKFILE_FAIL_IMMEDIATELY
+
+        handle, overlapped, low, high = self._getLockArguments(
+            stream, offset, length
+        )
+        try:
+            win32file.LockFileEx(handle, flags, low, high, overlapped)
+        except pywintypes.error as error:
+            name = getattr(stream, 'name', None)
+            if error.winerror == ERROR_LOCK_VIOLATION:
+                raise OSError(errno.EAGAIN, 'File is locked', name)
+            raise OSError(error.winerror, error.strerror, name)
+
+    def unlockFile(self, stream, offset=0, length=0):
+        """
+        See `ILocalFilesystem`.
+        """
+        handle, overlapped, low, high = self._getLockArguments(
+            stream, offset, length
+        )
+        try:
+            win32file.UnlockFileEx(handle, low, high, overlapped)
+        except pywintypes.error as error:
+            if error.winerror == ERROR_NOT_LOCKED:
+                return
+            raise OSError(
+                error.winerror, error.strerror, getattr(stream, 'name', None)
+            )
+
+    def getFileLock(self, stream, exclusive=True, offset=0, length=0):
+        """
+        See `ILocalFilesystem`.
+
+        Windows has no support for querying the locks.
+        """
+        raise OSError(
+            errno.ENOTSUP,
+            'Operation not supported',
+            getattr(stream, 'name', None),
+        )
+
+    def _getLockArguments(self, stream, offset, length):
+        """
+        Return the handle, the OVERLAPPED structure with the offset and
+        the low and high parts of the length for LockFileEx.
+
+        A zero `length` locks the range up to the largest offset.
+        """
+        handle = msvcrt.get_osfhandle(self._getFileDescriptor(stream))
+        overlapped = pywintypes.OVERLAPPED()
+        overlapped.Offset = offset & 0xFFFFFFFF
+        overlapped.OffsetHigh = offset >> 32
+        if not length:
+            length = 0xFFFFFFFFFFFFFFFF - offset
+        return handle, overlapped, length & 0xFFFFFFFF, length >> 32
+
+    def openFolder(self, segments):
+        """
+        See `ILocalFilesystem`.
+
+        Windows has no support for operations relative to a folder
+        file descriptor.
+        """
+        path = self.getRealPathFromSegments(segments)
+        raise OSError(errno.ENOTSUP, 'Operation not supported', path)
+
     def _requireFolder(self, segments):
         """
         Raise an OSError when segments is not a folder.
@@ -816,15 +981,20 @@ class NTFilesystem(PosixFilesystemBase):
         """
         path = self.getRealPathFromSegments(segments, include_virtual=False)
         path_encoded = self.getEncodedPath(path)
+        usage = None
         try:
             with self._windowsToOSError(segments):
                 if self.isLink(segments):
                     recursive = False
+                usage = self._getQuotaFolderUsage(segments, recursive)
                 with self._impersonateUser():
                     if recursive:
-                        return self._rmtree(path_encoded)
-                    return os.rmdir(path_encoded)
+                        self._rmtree(path_encoded)
+                    else:
+                        os.rmdir(path_encoded)
         except OSError as error:
+            # Members might be deleted before an error.
+            self._invalidateCache(segments, recursive=True)
             # Sometimes windows return a generic EINVAL when path is not a
             # folder.
             # With Python3 we get ENOTDIR but with a different text
@@ -833,15 +1003,29 @@ class NTFilesystem(PosixFilesystemBase):
                 self._requireFolder(segments)
             raise
 
-    def rename(self, from_segments, to_segments):
+        self._invalidateCache(segments, recursive=True)
+        if usage is not None:
+            self._updateQuota(-usage.size, -usage.files)
+
+    def _renamePath(
+        self,
+        from_segments,
+        from_path_encoded,
+        to_segments,
+        to_path_encoded,
+        progress=None,
+    ):
         """
-        See `ILocalFilesystem`.
+        See `PosixFilesystemBase`.
         """
         with self._windowsToOSError(from_segments):
             try:
-                return super().rename(
+                return super()._renamePath(
                     from_segments,
+                    from_path_encoded,
                     to_segments,
+                    to_path_encoded,
+                    progress,
                 )
             except OSError as error:
                 # On Windows, rename fails if destination exists as it
@@ -850,10 +1034,13 @@ class NTFilesystem(PosixFilesystemBase):
                     # Not a file already exists error.
                     raise
                 # Try to remove the file, and then rename one more time.
-                self.deleteFile(to_segments)
-                return super().rename(
+                self._deleteFilePath(to_segments, to_path_encoded)
+                return super()._renamePath(
                     from_segments,
+                    from_path_encoded,
                     to_segments,
+                    to_path_encoded,
+                    progress,
                 )
 
     def setOwner(self, segments, owner):
@@ -5,16 +5,28 @@ Filesystem code used by all operating systems, including Windows as
 Windows has its layer of POSIX compatibility.
 """
 
+import copy
 import errno
+import fnmatch
+import hashlib
+import heapq
+import io
+import itertools
+import operator
 import os
-import posixpath
 import re
+import select
 import shutil
 import stat
 import struct
 import sys
+import threading
 import time
 import unicodedata
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 from datetime import date
 from os import scandir
@@ -26,11 +38,732 @@ from chevah_compat.exceptions import (
     CompatException,
 )
 from chevah_compat.helpers import NoOpContext, _
-from chevah_compat.interfaces import IFileAttributes
+from chevah_compat.inotify import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_EXCL_UNLINK,
+    IN_IGNORED,
+    IN_ISDIR,
+    IN_MODIFY,
+    IN_MOVE_SELF,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_ONLYDIR,
+    IN_Q_OVERFLOW,
+    Inotify,
+)
+from chevah_compat.interfaces import (
+    IFileAttributes,
+    IFolderCursor,
+    IFolderEvent,
+    IFolderHandle,
+    IFolderListing,
+    IFolderWatch,
+    ITreeUsage,
+)
 
 _DEFAULT_FOLDER_MODE = 0o777
 _DEFAULT_FILE_MODE = 0o600
 
+# Maximum number of avatar configurations for which the root path and the
+# validated virtual folders are kept.
+_AVATAR_CACHE_SIZE = 1024
+
+_IS_AIX = sys.platform.startswith('aix')
+
+# Whether the attributes can be set via a file descriptor.
+_DESCRIPTOR_ATTRIBUTES = (
+    getattr(os, 'chown', None) in os.supports_fd
+    and os.chmod in os.supports_fd
+    and os.utime in os.supports_fd
+)
+
+# Namespace of the extended attributes used internally, as by the checksum
+# cache, which are hidden from the avatar and can't be changed by it.
+_RESERVED_ATTRIBUTES = 'user.chevah.'
+
+# Size of the buffer used to compute the checksums.
+_CHECKSUM_BUFFER_SIZE = 1024 * 1024
+# The checksum buffer of each thread, reused between the calls.
+_checksum_buffers = threading.local()
+
+# Size of the blocks in which the files are copied.
+_COPY_BLOCK_SIZE = 8 * 1024 * 1024
+# Errors for which a copy function can't be used for the files.
+_COPY_FALLBACK_ERRORS = frozenset(
+    code
+    for code in (
+        errno.EXDEV,
+        errno.ENOSYS,
+        errno.EINVAL,
+        getattr(errno, 'ENOTSUP', None),
+        getattr(errno, 'EOPNOTSUPP', None),
+    )
+    if code is not None
+)
+# Seconds between the progress reports of a copy.
+_COPY_PROGRESS_INTERVAL = 0.5
+# Maximum number of files copied by a worker thread for a single task.
+# Small files are copied in batches, as a task costs more than the copy.
+_COPY_BATCH_FILES = 64
+
+# True when the members of a folder can be stat-ed relative to the folder
+# descriptor.
+_STAT_DIR_FD = os.stat in os.supports_dir_fd
+# Flags for opening a folder only to resolve the paths of its members.
+_OPEN_FOLDER_PATH = getattr(os, 'O_PATH', os.O_RDONLY) | getattr(
+    os, 'O_DIRECTORY', 0
+)
+# Maximum number of paths stat-ed by a worker thread for a single task.
+_STAT_BATCH_PATHS = 64
+
+# Names of the operations executed by `executeMany`, with the names of
+# their (required, optional) arguments.
+_BATCH_OPERATIONS = {
+    'createFolder': ((), ('recursive',)),
+    'deleteFile': ((), ('ignore_errors',)),
+    'openFileForWriting': ((), ('mode', 'checksums', 'expected')),
+    'rename': (('to_segments',), ('progress',)),
+    'setAttributes': (('attributes',), ()),
+}
+
+
+class _ListingEntry:
+    """
+    Name and status of a scandir entry, used to build a `FolderListing`
+    without creating `FileAttributes` for each member.
+    """
+
+    __slots__ = ('entry', 'is_link', 'name', 'stats')
+
+    def __init__(self, name, stats, is_link, entry):
+        self.name = name
+        self.stats = stats
+        self.is_link = is_link
+        self.entry = entry
+
+
+def _getQuotaStatusUsage(stats):
+    """
+    Return the (size, files) counted by the quota for `stats`.
+
+    Files with multiple hard links are only counted when the usage is
+    reconciled, as removing a link doesn't free the space.
+    Deleted files which are still opened are not counted.
+    """
+    if not stat.S_ISREG(stats.st_mode) or stats.st_nlink != 1:
+        return 0, 0
+    return stats.st_size, 1
+
+
+class _QuotaWriters:
+    """
+    Usage counted by the quota for the files which are opened for
+    writing, as the written content is only counted when closed.
+
+    The usage is kept by (device, inode) as a [size, files] list for each
+    writer, so that removing a file subtracts only the counted usage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._writers = {}
+
+    def add(self, key, counted):
+        """
+        Keep the `counted` usage of a new writer for the `key` file.
+        """
+        with self._lock:
+            self._writers.setdefault(key, []).append(counted)
+
+    def remove(self, key, counted):
+        """
+        Forget the `counted` usage of a closed writer.
+        """
+        with self._lock:
+            writers = self._writers[key]
+            for index, value in enumerate(writers):
+                if value is counted:
+                    del writers[index]
+                    break
+            if not writers:
+                del self._writers[key]
+
+    def get(self, key):
+        """
+        Return the (size, files) counted for the `key` file by its most
+        recent writer, or None when not opened for writing.
+        """
+        with self._lock:
+            writers = self._writers.get(key)
+            if not writers:
+                return None
+            return tuple(writers[-1])
+
+    def release(self, key):
+        """
+        Mark the usage of the writers of the removed `key` file as no
+        longer counted.
+        """
+        with self._lock:
+            for counted in self._writers.get(key, ()):
+                counted[:] = [0, 0]
+
+
+_quota_writers = _QuotaWriters()
+
+
+class _QuotaFileIO(io.FileIO):
+    """
+    File which calls `on_close` with the status of the file, just before
+    it is closed, or with None when the status can't be read.
+    """
+
+    def __init__(self, fd, mode, on_close):
+        super().__init__(fd, mode)
+        self._on_close = on_close
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        if self.closed or on_close is None:
+            return super().close()
+
+        try:
+            stats = os.fstat(self.fileno())
+        except OSError:
+            stats = None
+        super().close()
+        on_close(stats)
+        return None
+
+
+class _ChecksumFileIO(_QuotaFileIO):
+    """
+    File which updates the checksums with the written content.
+
+    When closed, the `checksums` are set to the hex digest of each
+    algorithm and `on_checked` is called with the list of (algorithm,
+    expected, digest) which are not matching the `expected` digests.
+    When not matching and `restore_size` is not None, the file is first
+    truncated to `restore_size`.
+    """
+
+    def __init__(
+        self,
+        fd,
+        mode,
+        on_close,
+        algorithms,
+        expected,
+        on_checked,
+        restore_size=None,
+    ):
+        super().__init__(fd, mode, on_close)
+        self._algorithms = algorithms
+        self._checksums = [_new_checksum(name) for name in algorithms]
+        self._expected = expected
+        self._on_checked = on_checked
+        self._restore_size = restore_size
+        self.checksums = None
+
+    def write(self, data):
+        written = super().write(data)
+        if written:
+            view = memoryview(data).cast('B')[:written]
+            for checksum in self._checksums:
+                checksum.update(view)
+        return written
+
+    def close(self):
+        if self.closed:
+            return super().close()
+
+        on_checked, self._on_checked = self._on_checked, None
+        self.checksums = {
+            algorithm: checksum.hexdigest()
+            for algorithm, checksum in zip(self._algorithms, self._checksums)
+        }
+        mismatched = [
+            (algorithm, wanted, self.checksums[algorithm])
+            for algorithm, wanted in self._expected.items()
+            if wanted.lower() != self.checksums[algorithm]
+        ]
+        try:
+            if mismatched and self._restore_size is not None:
+                os.ftruncate(self.fileno(), self._restore_size)
+        finally:
+            super().close()
+        if on_checked is not None:
+            on_checked(mismatched)
+        return None
+
+
+class ChecksumWriter(io.BufferedWriter):
+    """
+    Buffered file for writing, which has the hex digest of the written
+    content for each requested algorithm in `checksums`, after it is
+    closed.
+    """
+
+    @property
+    def checksums(self):
+        """
+        Dictionary with the hex digest for each algorithm, or None when
+        not closed.
+        """
+        return self.raw.checksums
+
+
+def _isReservedAttribute(name):
+    """
+    Return True when the extended attribute `name` is used internally.
+    """
+    return os.fsdecode(name).startswith(_RESERVED_ATTRIBUTES)
+
+
+def _getMode(stats):
+    """
+    Return the protection bits from `stats`.
+    """
+    mode = stats.st_mode
+    if _IS_AIX and stat.S_ISDIR(mode):
+        # On AIX mode contains an extra most significant bit
+        # which we don't use.
+        mode = mode & 0o077777
+    return mode
+
+
+# On Windows, the local separator is also handled.
+_HAS_BACKSLASH_SEPARATOR = os.path.sep == '\\'
+if _HAS_BACKSLASH_SEPARATOR:
+    _PATH_SEPARATORS = re.compile(r'[\\/]')
+else:
+    _PATH_SEPARATORS = re.compile('[/]')
+
+
+def _getNormalizedSegments(path):
+    """
+    Return the segments of ChevahPath `path` after resolving the `.` and
+    `..` parts.
+
+    It returns the same segments as splitting the result of
+    `posixpath.normpath`, but in a single pass.
+    """
+    is_absolute = path.startswith('/')
+    parts = []
+    for part in path.split('/'):
+        if part == '..':
+            if parts and parts[-1] != '..':
+                parts.pop()
+            elif not is_absolute:
+                parts.append(part)
+        elif part and part != '.':
+            parts.append(part)
+
+    if not parts:
+        return [] if is_absolute else ['.']
+
+    if _HAS_BACKSLASH_SEPARATOR:
+        # The `..` parts are resolved only for the forward slash.
+        parts = _PATH_SEPARATORS.split('/'.join(parts))
+
+    if not is_absolute:
+        parts[0] = parts[0].strip(':')
+
+    return [part for part in parts if part]
+
+
+class _CRC32:
+    """
+    CRC32 checksum with the same API as the `hashlib` objects.
+    """
+
+    __slots__ = ('_value',)
+
+    name = 'crc32'
+    digest_size = 4
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def digest(self):
+        return self._value.to_bytes(self.digest_size, 'big')
+
+    def hexdigest(self):
+        return f'{self._value:08x}'
+
+
+def _new_checksum(algorithm):
+    """
+    Return a new checksum object for `algorithm`.
+    """
+    if algorithm == _CRC32.name:
+        return _CRC32()
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise AssertionError(f'Unknown checksum algorithm: {algorithm}')
+
+
+def _get_time_ns(attributes, name):
+    """
+    Return the `name` time from `attributes` in nanoseconds, or None.
+
+    The `<name>_ns` integer value is used before the `<name>` seconds.
+    """
+    value = attributes.get(name + '_ns')
+    if value is not None:
+        return value
+    value = attributes.get(name)
+    if value is None:
+        return None
+    return int(value * 10**9)
+
+
+def _get_checksum_buffer():
+    """
+    Return the memoryview of the checksum buffer for the current thread.
+    """
+    view = getattr(_checksum_buffers, 'view', None)
+    if view is None:
+        view = memoryview(bytearray(_CHECKSUM_BUFFER_SIZE))
+        _checksum_buffers.view = view
+    return view
+
+
+def _copy_file_range(source_fd, destination_fd, count):
+    """
+    Copy the data inside the kernel, or on the server for network
+    filesystems, and return the number of copied bytes.
+    """
+    return os.copy_file_range(source_fd, destination_fd, count)
+
+
+def _sendfile(source_fd, destination_fd, count):
+    """
+    Copy the data inside the kernel and return the number of copied bytes.
+    """
+    return os.sendfile(destination_fd, source_fd, None, count)
+
+
+def _read_write(source_fd, destination_fd, count):
+    """
+    Copy the data via a buffer and return the number of copied bytes.
+    """
+    data = os.read(source_fd, count)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(destination_fd, view) :]
+    return len(data)
+
+
+# The functions used to copy the files, from the fastest one.
+_COPY_FUNCTIONS = tuple(
+    function
+    for function, available in (
+        (_copy_file_range, hasattr(os, 'copy_file_range')),
+        (_sendfile, sys.platform.startswith('linux')),
+        (_read_write, True),
+    )
+    if available
+)
+
+
+def _copy_descriptor(source_fd, destination_fd, size, update):
+    """
+    Copy the content of `source_fd` to `destination_fd`, starting from
+    their current offsets, and call `update` with the number of bytes
+    copied by each block.
+
+    `size` is the expected size of the content, used to detect a
+    function which can't copy the file.
+    """
+    copied = 0
+    functions = list(_COPY_FUNCTIONS)
+    while functions:
+        function = functions[0]
+        try:
+            count = function(source_fd, destination_fd, _COPY_BLOCK_SIZE)
+        except OSError as error:
+            if error.errno not in _COPY_FALLBACK_ERRORS or len(functions) == 1:
+                raise
+            # The file offsets are not changed, so the next function
+            # continues the copy.
+            functions.pop(0)
+            continue
+
+        if not count:
+            if copied < size and len(functions) > 1:
+                # Files of special filesystems are reported as empty.
+                functions.pop(0)
+                continue
+            return
+        copied += count
+        update(count)
+
+
+def _copy_attributes(source, destination):
+    """
+    Copy the owner, mode, times and extended attributes of `source` to
+    `destination`, without following links.
+
+    The owner is not changed when the account can't change it.
+    """
+    if hasattr(os, 'chown'):
+        stats = os.lstat(source)
+        try:
+            os.chown(
+                destination,
+                stats.st_uid,
+                stats.st_gid,
+                follow_symlinks=False,
+            )
+        except PermissionError:
+            pass
+    shutil.copystat(source, destination, follow_symlinks=False)
+
+
+def _list_copy_tree(source, errors=None):
+    """
+    Return the folders, the links and the (path, size) files of the
+    tree at `source`, with the paths relative to `source`.
+
+    The folders are listed before their members.
+    Raise OSError with ENOTSUP for members which are not regular files,
+    folders or links.
+
+    When `errors` is a list, the errors of the members are added to it
+    as (path, error) and the members are skipped.
+    """
+    folders = []
+    links = []
+    files = []
+    pending = [(source, '')]
+
+    def fail(relative, error):
+        if errors is None or not relative:
+            raise error
+        errors.append((relative, error))
+
+    while pending:
+        path, relative = pending.pop()
+        members = None
+        try:
+            stats = os.lstat(path)
+            if stat.S_ISDIR(stats.st_mode):
+                with scandir(path) as entries:
+                    members = [
+                        (entry.path, os.path.join(relative, entry.name))
+                        for entry in entries
+                    ]
+        except OSError as error:
+            fail(relative, error)
+            continue
+
+        if members is not None:
+            folders.append(relative)
+            pending.extend(members)
+        elif stat.S_ISLNK(stats.st_mode):
+            links.append(relative)
+        elif stat.S_ISREG(stats.st_mode):
+            files.append((relative, stats.st_size))
+        else:
+            fail(
+                relative,
+                OSError(errno.ENOTSUP, 'Special file not supported', path),
+            )
+    return folders, links, files
+
+
+def _batch_copy_files(files, is_skipped):
+    """
+    Return an iterator with the lists of (path, size) `files` copied by
+    a single task, without the files for which `is_skipped` is True.
+
+    A list has at most `_COPY_BATCH_FILES` files and the files after
+    the first one have less than `_COPY_BLOCK_SIZE` bytes in total.
+    """
+    batch = []
+    size = 0
+    for member in files:
+        if is_skipped(member[0]):
+            continue
+        if batch and (
+            len(batch) >= _COPY_BATCH_FILES
+            or size + member[1] > _COPY_BLOCK_SIZE
+        ):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(member)
+        size += member[1]
+    if batch:
+        yield batch
+
+
+def _iterate_parents(path):
+    """
+    Return an iterator with the parent folders of `path`, starting with
+    the direct parent.
+    """
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return
+        yield parent
+        path = parent
+
+
+class _OperationStages:
+    """
+    Splits a list of operations in stages, so that the operations of a
+    stage don't depend on each other, unless they are in the same group.
+
+    An operation depends on a previous operation from another group when
+    it has the same path, or when a path is a parent of the other one.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self._groups = None
+        # Path to group, and the parents of the paths in the last stage.
+        # As a path can't be a parent of another path from the stage,
+        # the parents have no parent or themselves in the paths.
+        self._paths = {}
+        self._parents = set()
+
+    def add(self, index, group, paths, call):
+        """
+        Add the operation at `index` with its `paths`, which is executed
+        by `call` after the previous operations of `group`.
+        """
+        paths = [os.path.normcase(path) for path in paths]
+        parents = self._getNewParents(group, paths)
+        if parents is None:
+            self._groups = {}
+            self._paths = {}
+            self._parents = set()
+            self.stages.append(self._groups)
+            parents = self._getNewParents(group, paths)
+
+        self._groups.setdefault(group, []).append((index, call))
+        for path in paths:
+            self._paths[path] = group
+        self._parents.update(parents)
+
+    def _getNewParents(self, group, paths):
+        """
+        Return the parents of `paths` which are not yet in the last
+        stage, or None when the operation for `paths` depends on an
+        operation from another group of the last stage.
+        """
+        if self._groups is None:
+            return None
+
+        result = []
+        for path in paths:
+            if self._paths.get(path, group) != group:
+                return None
+            if path in self._parents:
+                return None
+            for parent in _iterate_parents(path):
+                if parent in self._parents:
+                    # All the next parents are known.
+                    break
+                if parent in self._paths:
+                    return None
+                result.append(parent)
+        return result
+
+
+def _join_relative(path, relative):
+    """
+    Return the path of `relative` inside `path`.
+    """
+    if not relative:
+        return path
+    return os.path.join(path, relative)
+
+
+def _fsync_folder(path):
+    """
+    Write to disk the members of the folder at `path`.
+
+    Folders can't be opened on Windows, where this does nothing.
+    """
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _GlobFilter:
+    """
+    Filter for the path of a member relative to the listed folder.
+
+    The glob pattern uses `/` as separator and each component is matched
+    using the `fnmatch` rules, while a `**` component matches any number
+    of folders.
+    """
+
+    __slots__ = ('_components',)
+
+    def __init__(self, pattern, flags=0):
+        components = []
+        for component in pattern.split('/'):
+            if component != '**':
+                regex = re.compile(fnmatch.translate(component), flags)
+                components.append(regex.match)
+            elif not components or components[-1] is not None:
+                # `**` is stored as None, and consecutive ones are merged.
+                components.append(None)
+        self._components = components
+
+    def __call__(self, path, member):
+        return self.match(path.split('/'))
+
+    def match(self, parts, start=0):
+        """
+        Return True if the path `parts` are matching the components
+        starting with the one at `start`.
+        """
+        components = self._components
+        for index in range(start, len(components)):
+            component = components[index]
+            if component is None:
+                return any(
+                    self.match(parts[skip:], index + 1)
+                    for skip in range(len(parts) + 1)
+                )
+            if not parts or component(parts[0]) is None:
+                return False
+            parts = parts[1:]
+        return not parts
+
+    def canContain(self, parts):
+        """
+        Return True if the members of the folder with path `parts` can
+        match the pattern.
+        """
+        components = self._components
+        for index, part in enumerate(parts):
+            if index >= len(components):
+                return False
+            component = components[index]
+            if component is None:
+                return True
+            if component(part) is None:
+                return False
+        return len(parts) < len(components)
+
 
 class PosixFilesystemBase:
     """
@@ -48,6 +781,9 @@ class PosixFilesystemBase:
     OPEN_APPEND = os.O_APPEND
     OPEN_EXCLUSIVE = os.O_EXCL
     OPEN_TRUNCATE = os.O_TRUNC
+    # Not available on Windows.
+    OPEN_FOLDER = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+    OPEN_NO_FOLLOW = getattr(os, 'O_NOFOLLOW', 0)
 
     INTERNAL_ENCODING = 'utf-8'
 
@@ -59,10 +795,147 @@ class PosixFilesystemBase:
     #   desktop/aa365511(v=vs.85).aspx
     IO_REPARSE_TAG_SYMLINK = 0xA000000C
 
+    _home_segments_cache = None
+    # Flags used for the glob filters.
+    _glob_flags = 0
+    #: The IQuotaTracker updated by the changes done via this filesystem.
+    quota = None
+    #: The IMetadataCache used for the attributes, existence and content.
+    metadata_cache = None
+    #: The IChecksumCache used for the checksums of the whole files.
+    checksum_cache = None
+
+    # Shared by all the filesystems, see `_compileAvatar`.
+    _avatar_cache = OrderedDict()
+    _avatar_cache_lock = threading.Lock()
+    # Changed by `invalidateAvatarCache`, so that the filesystems compile
+    # their virtual folders again.
+    _avatar_cache_version = 0
+
     def __init__(self, avatar):
         self._avatar = avatar
-        self._root_path = self._getRootPath()
-        self._validateVirtualFolders()
+        self._setupPlatformStrategy()
+        self._updateVirtualFolders()
+
+    @property
+    def _virtual_folders(self):
+        """
+        The validated virtual folders of the avatar, compiled again when
+        the avatar has other virtual folders or after
+        `invalidateAvatarCache`.
+
+        This is used for each path, so the virtual folders are not
+        compared. Changes done in place are only used after
+        `invalidateAvatarCache`.
+        """
+        source, version, compiled = self._virtual_folders_state
+        if version != PosixFilesystemBase._avatar_cache_version or (
+            self._avatar and self._avatar.virtual_folders is not source
+        ):
+            compiled = self._updateVirtualFolders()
+        return compiled
+
+    def _updateVirtualFolders(self):
+        """
+        Compile the current virtual folders of the avatar and return them.
+        """
+        source = None
+        if self._avatar:
+            source = self._avatar.virtual_folders
+        version = PosixFilesystemBase._avatar_cache_version
+        self._root_path, compiled = self._compileAvatar()
+        self._virtual_folders_state = (source, version, compiled)
+        return compiled
+
+    @classmethod
+    def _getAvatarCacheKey(cls, avatar):
+        """
+        Return the key under which the configuration of `avatar` is cached.
+        """
+        return (
+            cls,
+            avatar.home_folder_path,
+            avatar.root_folder_path,
+            avatar.lock_in_home_folder,
+            tuple(
+                (tuple(virtual_segments), real_path)
+                for virtual_segments, real_path in avatar.virtual_folders
+            ),
+        )
+
+    def _compileAvatar(self):
+        """
+        Return a tuple with the root path and the virtual folders of the
+        avatar.
+
+        The virtual folders are validated only for the first filesystem
+        created for an avatar configuration, and only a valid configuration
+        is cached.
+        It is called again when the virtual folders of the avatar are
+        changed.
+        """
+        if not self._avatar or not self._avatar.virtual_folders:
+            # Nothing to validate.
+            return self._getRootPath(), ()
+
+        key = self._getAvatarCacheKey(self._avatar)
+        cache = self._avatar_cache
+        with self._avatar_cache_lock:
+            compiled = cache.get(key)
+            if compiled is not None:
+                cache.move_to_end(key)
+                return compiled
+
+        root_path = self._getRootPath()
+        virtual_folders = tuple(
+            (list(virtual_segments), real_path)
+            for virtual_segments, real_path in self._avatar.virtual_folders
+        )
+        self._validateVirtualFolders(root_path, virtual_folders)
+
+        compiled = (root_path, virtual_folders)
+        with self._avatar_cache_lock:
+            cache[key] = compiled
+            while len(cache) > _AVATAR_CACHE_SIZE:
+                cache.popitem(last=False)
+        return compiled
+
+    @classmethod
+    def invalidateAvatarCache(cls, avatar=None):
+        """
+        See `ILocalFilesystem`.
+        """
+        with cls._avatar_cache_lock:
+            PosixFilesystemBase._avatar_cache_version += 1
+            if avatar is None:
+                cls._avatar_cache.clear()
+                return
+            cls._avatar_cache.pop(cls._getAvatarCacheKey(avatar), None)
+
+    def _setupPlatformStrategy(self):
+        """
+        Select once the implementations which depend on the operating
+        system, so that the hot paths don't check it on each call.
+        """
+        # This is done to allow lazy initialization of this module.
+        from chevah_compat import process_capabilities
+
+        os_name = process_capabilities.os_name
+
+        if os_name == 'osx':
+            self._decodeFilename = self._decodeNormalizedFilename
+
+        if os_name in ['windows', 'osx']:
+            self._areEqual = self._areEqualCaseInsensitive
+            self._glob_flags = re.IGNORECASE
+        else:
+            # On Linux and Unix we do strict case.
+            self._areEqual = operator.eq
+
+        if os_name == 'windows':
+            self._onDeleteFileError = self._onDeleteFileErrorWindows
+        elif os_name != 'linux':
+            self._onDeleteFileError = self._onDeleteFileErrorUnix
 
     @property
     def avatar(self):
@@ -98,14 +971,7 @@ class PosixFilesystemBase:
         """
         Recursive split of a path.
         """
-        if os.path.sep == '\\':
-            # We are on Windows.
-            # Also handle Unix separators and escape the regex.
-            separators = r'[\\/]'
-        else:
-            separators = '[/]'
-
-        segments = re.split(separators, path)
+        segments = _PATH_SEPARATORS.split(path)
 
         if len(segments) > 0:
             segments[0] = segments[0].strip(':')
@@ -125,7 +991,29 @@ class PosixFilesystemBase:
     @property
     def home_segments(self):
         """See `ILocalFilesystem`."""
+        return self._getHomeSegments()[:]
+
+    def _getHomeSegments(self):
+        """
+        Return the home segments, parsed again only when the home or the
+        root folder of the avatar was changed.
+
+        The returned list is shared, so it should not be modified.
+        """
+        if not self._avatar:
+            return self._parseHomeSegments()
+
+        key = (self._avatar.home_folder_path, self._avatar.root_folder_path)
+        cached = self._home_segments_cache
+        if cached is None or cached[0] != key:
+            cached = (key, self._parseHomeSegments())
+            self._home_segments_cache = cached
+        return cached[1]
 
+    def _parseHomeSegments(self):
+        """
+        Return the segments for the home folder of the avatar.
+        """
         if not self._avatar:
             return self._pathSplitRecursive(str(os.path.expanduser('~')))
 
@@ -155,8 +1043,7 @@ class PosixFilesystemBase:
         if segments == []:
             return '/'
 
-        normalized_path = posixpath.normpath('/'.join(segments))
-        return '/' + '/'.join(self._pathSplitRecursive(normalized_path))
+        return '/' + '/'.join(_getNormalizedSegments('/'.join(segments)))
 
     def getSegments(self, path):
         """
@@ -173,18 +1060,44 @@ class PosixFilesystemBase:
 
         if not path.startswith('/'):
             # Resolve relative path.
-            home_path = '/' + '/'.join(self.home_segments) + '/'
-            path = home_path + path
+            path = '/'.join(['', *self._getHomeSegments(), path])
 
-        normalize_path = posixpath.normpath(path)
-        return self._pathSplitRecursive(normalize_path)
+        return _getNormalizedSegments(path)
 
-    @property
-    def temp_segments(self):
-        """See `ILocalFilesystem`."""
-        if self.avatar.lock_in_home_folder:
-            temporary_folder = os.path.join(
-                self.avatar.home_folder_path,
+    def getSegmentsMany(self, paths):
+        """
+        See `ILocalFilesystem`.
+        """
+        home_segments = None
+        home_path = None
+        result = []
+        for path in paths:
+            if path is None or path == '' or path == '.':
+                if home_segments is None:
+                    home_segments = self._getHomeSegments()
+                result.append(home_segments[:])
+                continue
+
+            if not isinstance(path, str):
+                path = path.decode(self.INTERNAL_ENCODING)
+
+            if not path.startswith('/'):
+                # Resolve relative path.
+                if home_path is None:
+                    if home_segments is None:
+                        home_segments = self._getHomeSegments()
+                    home_path = '/'.join(['', *home_segments, ''])
+                path = home_path + path
+
+            result.append(_getNormalizedSegments(path))
+        return result
+
+    @property
+    def temp_segments(self):
+        """See `ILocalFilesystem`."""
+        if self.avatar.lock_in_home_folder:
+            temporary_folder = os.path.join(
+                self.avatar.home_folder_path,
                 '__chevah_test_temp__',
             )
         else:
@@ -201,32 +1114,39 @@ class PosixFilesystemBase:
     def _areEqual(self, first, second):
         """
         Return true if first and second segments are for the same path.
+
+        Replaced at init with the variant for the current OS.
+        """
+        return first == second
+
+    def _areEqualCaseInsensitive(self, first, second):
+        """
+        Return true if first and second segments are for the same path,
+        ignoring the case.
+
+        On Windows and OSX paths are case insensitive.
         """
         if first == second:
             return True
 
-        from chevah_compat import process_capabilities
-
-        if process_capabilities.os_name not in ['windows', 'osx']:
-            # On Linux and Unix we do strict case.
+        if len(first) != len(second):
             return False
 
-        # On Windows paths are case insensitive, so we compare based on
-        # lowercase.
-        # But first try with the same case, in case we have strange
-        first = [s.lower() for s in first]
-        second = [s.lower() for s in second]
-        return first == second
+        for first_segment, second_segment in zip(first, second):
+            if first_segment.lower() != second_segment.lower():
+                return False
+        return True
 
-    def _validateVirtualFolders(self):
+    def _validateVirtualFolders(self, root_path, virtual_folders):
         """
-        Check that virtual folders don't overlap with existing real folders.
+        Check that virtual folders don't overlap with existing real folders
+        from `root_path`.
         """
-        for virtual_segments, real_path in self._avatar.virtual_folders:
+        for virtual_segments, _real_path in virtual_folders:
             target_segments = virtual_segments[:]
             # Check for the virtual segments, but also for any ancestor.
             while target_segments:
-                inside_path = os.path.join(self._root_path, *target_segments)
+                inside_path = os.path.join(root_path, *target_segments)
                 encoded_path = self.getEncodedPath(inside_path)
                 if not os.path.lexists(encoded_path):
                     target_segments.pop()
@@ -247,8 +1167,11 @@ class PosixFilesystemBase:
         Raise CompatError when `include_virtual` is False and the segments
         are for a virtual path (root or part of it).
         """
+        if not self._virtual_folders:
+            return None
+
         segments_length = len(segments)
-        for virtual_segments, real_path in self._avatar.virtual_folders:
+        for virtual_segments, real_path in self._virtual_folders:
             if segments_length < len(virtual_segments):
                 # Not the virtual folder of a descended of it.
                 if not include_virtual and self._areEqual(
@@ -299,14 +1222,14 @@ class PosixFilesystemBase:
 
         Return False when they are a descendant of a virtual folder.
         """
-        if not segments:
+        if not segments or not self._virtual_folders:
             return False
 
         partial_virtual = False
         segments_length = len(segments)
 
         # Part of virtual paths, virtually exists.
-        for virtual_segments, real_path in self._avatar.virtual_folders:
+        for virtual_segments, real_path in self._virtual_folders:
             # Any segment which does start the same way as a virtual path is
             # normal path
             if not self._areEqual(segments[0:1], virtual_segments[0:1]):
@@ -389,7 +1312,15 @@ class PosixFilesystemBase:
 
     def exists(self, segments):
         """See `ILocalFilesystem`."""
+        # A missing path might be created via another path.
+        return self._getCached(
+            'exists', segments, self._exists, observed_only=operator.not_
+        )
 
+    def _exists(self, segments):
+        """
+        Return True when `segments` exists, without using the cache.
+        """
         try:
             if self._isVirtualPath(segments):
                 return True
@@ -405,14 +1336,52 @@ class PosixFilesystemBase:
         with self._impersonateUser():
             return os.path.lexists(path_encoded)
 
+    def existsMany(self, segments_list, workers=None):
+        """
+        See `ILocalFilesystem`.
+
+        See `getAttributesMany` for how the paths are checked.
+        """
+        if not _STAT_DIR_FD:
+            return self._callMany(self.exists, segments_list)
+
+        # A broken virtual path does not exits.
+        result = self._getStatusMany(
+            segments_list, False, workers, broken_virtual=False
+        )
+        for index, value in enumerate(result):
+            if value is None:
+                # Virtual path.
+                result[index] = True
+            elif isinstance(value, OSError):
+                result[index] = False
+            elif isinstance(value, tuple):
+                result[index] = True
+        return result
+
     def createFolder(self, segments, recursive=False):
         """See `ILocalFilesystem`."""
         path = self.getRealPathFromSegments(segments, include_virtual=False)
         path_encoded = self.getEncodedPath(path)
         with self._impersonateUser():
-            if recursive:
-                return os.makedirs(path_encoded, _DEFAULT_FOLDER_MODE)
-            return os.mkdir(path_encoded, _DEFAULT_FOLDER_MODE)
+            return self._createFolderPath(segments, path_encoded, recursive)
+
+    def _createFolderPath(self, segments, path_encoded, recursive=False):
+        """
+        Create the folder at the low level `path_encoded` for `segments`.
+
+        It should be called with the avatar already impersonated.
+        """
+        if not recursive:
+            result = os.mkdir(path_encoded, _DEFAULT_FOLDER_MODE)
+            self._invalidateCache(segments)
+            return result
+
+        result = os.makedirs(path_encoded, _DEFAULT_FOLDER_MODE)
+        # Any of the parent folders might be created.
+        for depth in range(1, len(segments) + 1):
+            self._invalidateCache(segments[:depth])
+        return result
 
     def deleteFolder(self, segments, recursive=True):
         """
@@ -459,36 +1428,68 @@ class PosixFilesystemBase:
         path = self.getRealPathFromSegments(segments, include_virtual=False)
         path_encoded = self.getEncodedPath(path)
         with self._impersonateUser():
+            return self._deleteFilePath(segments, path_encoded, ignore_errors)
+
+    def _deleteFilePath(self, segments, path_encoded, ignore_errors=False):
+        """
+        Delete the file at the low level `path_encoded` for `segments`.
+
+        It should be called with the avatar already impersonated.
+        """
+        size, files, key = self._getQuotaRemovedUsage(path_encoded)
+        try:
             try:
-                try:
-                    return os.unlink(path_encoded)
-                except OSError as error:
-                    # This is done to allow lazy initialization of this module.
-                    from chevah_compat import process_capabilities
-
-                    # On Unix (AIX, Solaris) when segments is a folder,
-                    # we get EPERM, so we force a EISDIR.
-                    # For now, Unix is everything else, other than Linux.
-                    if process_capabilities.os_name != 'linux':
-                        self._requireFile(segments)
-
-                    # On Windows we might get an permissions error when
-                    # file is ready-only.
-                    if (
-                        process_capabilities.os_name == 'windows'
-                        and error.errno == errno.EACCES
-                    ):
-                        os.chmod(path_encoded, stat.S_IWRITE)
-                        return os.unlink(path_encoded)
+                result = os.unlink(path_encoded)
+            except OSError as error:
+                result = self._onDeleteFileError(error, segments, path_encoded)
+        except Exception:
+            if ignore_errors:
+                return None
+            raise
+        self._invalidateCache(segments)
+        _quota_writers.release(key)
+        self._updateQuota(-size, -files)
+        return result
 
-                    raise
-            except Exception:
-                if ignore_errors:
-                    return None
-                raise
+    def _onDeleteFileError(self, error, segments, path):
+        """
+        Called when unlink failed for `path`.
 
-    def rename(self, from_segments, to_segments):
-        """See `ILocalFilesystem`."""
+        On Linux the error is already the right one.
+        """
+        raise error
+
+    def _onDeleteFileErrorUnix(self, error, segments, path):
+        """
+        On Unix (AIX, Solaris) when segments is a folder,
+        we get EPERM, so we force a EISDIR.
+
+        For now, Unix is everything else, other than Linux.
+        """
+        self._requireFile(segments)
+        raise error
+
+    def _onDeleteFileErrorWindows(self, error, segments, path):
+        """
+        On Windows we might get an permissions error when
+        file is ready-only.
+        """
+        self._requireFile(segments)
+
+        if error.errno == errno.EACCES:
+            os.chmod(path, stat.S_IWRITE)
+            return os.unlink(path)
+
+        raise error
+
+    def rename(self, from_segments, to_segments, progress=None):
+        """
+        See `ILocalFilesystem`.
+
+        For a destination on another filesystem, the source is copied in
+        parallel using the fastest copy function supported by the OS,
+        and then removed.
+        """
         from_path = self.getRealPathFromSegments(
             from_segments,
             include_virtual=False,
@@ -501,7 +1502,326 @@ class PosixFilesystemBase:
         from_path_encoded = self.getEncodedPath(from_path)
         to_path_encoded = self.getEncodedPath(to_path)
         with self._impersonateUser():
-            return os.rename(from_path_encoded, to_path_encoded)
+            return self._renamePath(
+                from_segments,
+                from_path_encoded,
+                to_segments,
+                to_path_encoded,
+                progress,
+            )
+
+    def _renamePath(
+        self,
+        from_segments,
+        from_path_encoded,
+        to_segments,
+        to_path_encoded,
+        progress=None,
+    ):
+        """
+        Rename the low level `from_path_encoded` for `from_segments` to
+        `to_path_encoded` for `to_segments`.
+
+        It should be called with the avatar already impersonated.
+        """
+        size, files, key = self._getQuotaRemovedUsage(
+            to_path_encoded, source=from_path_encoded
+        )
+        try:
+            result = os.rename(from_path_encoded, to_path_encoded)
+        except OSError as error:
+            if error.errno != errno.EXDEV:
+                raise
+            result = self._moveAcrossDevices(
+                from_path_encoded, to_path_encoded, progress
+            )
+        self._invalidateCache(from_segments, recursive=True)
+        self._invalidateCache(to_segments, recursive=True)
+        # The replaced file is no longer used.
+        _quota_writers.release(key)
+        self._updateQuota(-size, -files)
+        return result
+
+    def _moveAcrossDevices(self, source, destination, progress):
+        """
+        Move `source` to `destination` from another filesystem.
+
+        The tree is copied next to `destination` and then renamed, so
+        that `destination` is replaced as for a rename.
+        The source is removed only after the copy is written to disk.
+        It should be called with the avatar already impersonated.
+        """
+        folder, name = os.path.split(destination)
+        temporary = os.path.join(
+            folder, f'.{name}.{os.urandom(4).hex()}.chevah-move'
+        )
+        try:
+            self._copyTree(
+                source,
+                temporary,
+                progress=progress,
+                workers=None,
+                worker_context=self._impersonateWorker,
+            )
+            os.rename(temporary, destination)
+        except BaseException:
+            if os.path.isdir(temporary) and not os.path.islink(temporary):
+                shutil.rmtree(temporary, ignore_errors=True)
+            elif os.path.lexists(temporary):
+                os.unlink(temporary)
+            raise
+        _fsync_folder(folder)
+
+        if os.path.isdir(source) and not os.path.islink(source):
+            self._rmtree(source)
+        else:
+            os.unlink(source)
+
+    def _copyTree(
+        self,
+        source,
+        destination,
+        progress,
+        workers,
+        worker_context,
+        overwrite=False,
+        preserve=True,
+        sync=True,
+        errors=None,
+    ):
+        """
+        Copy the file, link or folder tree from `source` to the
+        `destination` path, with the attributes of each member.
+
+        The files are copied in parallel by at most `workers` threads,
+        each running inside the context returned by `worker_context`.
+        When not None, `progress` is called from the calling thread with
+        the number of copied bytes and the total number of bytes.
+
+        When `overwrite` is True, the existing folders are reused and the
+        other existing members are replaced.
+        When `preserve` is False, the members are created with the
+        default mode and the attributes are not copied.
+        When `sync` is True, each file is written to disk.
+        When `errors` is a list, the errors of the members are added to it
+        as (relative path, error) and the copy continues without them.
+        The errors of the top member are always raised.
+
+        It should be called with the avatar already impersonated.
+        """
+        if workers is None:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+        folders, links, files = _list_copy_tree(source, errors)
+        total = sum(size for _ignored, size in files)
+        copied = [0]
+        lock = threading.Lock()
+        # Folders which were not created, and their members are skipped.
+        failed = set()
+
+        def update(count):
+            with lock:
+                copied[0] += count
+
+        def record(relative, error):
+            if errors is None or not relative:
+                raise error
+            errors.append((relative, error))
+
+        def is_skipped(relative):
+            return bool(relative) and os.path.dirname(relative) in failed
+
+        for relative in folders:
+            if is_skipped(relative):
+                failed.add(relative)
+                continue
+            try:
+                self._makeTreeFolder(
+                    _join_relative(destination, relative), overwrite, preserve
+                )
+            except OSError as error:
+                failed.add(relative)
+                record(relative, error)
+
+        for relative in links:
+            if is_skipped(relative):
+                continue
+            try:
+                self._copyTreeLink(
+                    _join_relative(source, relative),
+                    _join_relative(destination, relative),
+                    overwrite,
+                    preserve,
+                )
+            except OSError as error:
+                record(relative, error)
+
+        def collect(futures):
+            for future in futures:
+                del running[future]
+                for relative, error in future.result():
+                    record(relative, error)
+
+        def wait_running(limit):
+            while len(running) > limit:
+                done, _ignored = wait(
+                    running,
+                    timeout=_COPY_PROGRESS_INTERVAL,
+                    return_when=FIRST_COMPLETED,
+                )
+                collect(done)
+                if progress:
+                    progress(copied[0], total)
+
+        # At most twice the number of workers are queued, so that the
+        # copy is stopped soon after an error.
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            try:
+                for batch in _batch_copy_files(files, is_skipped):
+                    wait_running(workers * 2 - 1)
+                    future = executor.submit(
+                        self._copyTreeFiles,
+                        source,
+                        destination,
+                        batch,
+                        update,
+                        worker_context,
+                        overwrite,
+                        preserve,
+                        sync,
+                        errors is not None,
+                    )
+                    running[future] = batch
+                wait_running(0)
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+
+        if not preserve:
+            return
+
+        # The members are changed while copied, so the times of the
+        # folders are set from the deepest one.
+        for relative in reversed(folders):
+            if relative in failed:
+                continue
+            try:
+                _copy_attributes(
+                    _join_relative(source, relative),
+                    _join_relative(destination, relative),
+                )
+            except OSError as error:
+                record(relative, error)
+
+    @staticmethod
+    def _makeTreeFolder(path, overwrite, preserve):
+        """
+        Create the folder at `path` for a copied tree.
+
+        When `preserve` is True, the folder is only accessible by the
+        current account until its attributes are copied.
+        """
+        mode = 0o700 if preserve else _DEFAULT_FOLDER_MODE
+        try:
+            os.mkdir(path, mode)
+        except FileExistsError:
+            if not overwrite or os.path.islink(path) or not os.path.isdir(path):
+                raise
+
+    @staticmethod
+    def _removeTreeMember(path, overwrite):
+        """
+        Remove the existing file or link at `path` which is replaced by
+        a copied member.
+
+        Existing folders are not removed.
+        """
+        if not overwrite:
+            return
+        try:
+            stats = os.lstat(path)
+        except FileNotFoundError:
+            return
+        if stat.S_ISDIR(stats.st_mode):
+            raise OSError(errno.EISDIR, 'Is a directory', path)
+        os.unlink(path)
+
+    def _copyTreeLink(self, source, destination, overwrite, preserve):
+        """
+        Create at `destination` a link with the same target as the link
+        at `source`.
+        """
+        target = os.readlink(source)
+        self._removeTreeMember(destination, overwrite)
+        os.symlink(target, destination)
+        if preserve:
+            _copy_attributes(source, destination)
+
+    def _copyTreeFiles(
+        self,
+        source,
+        destination,
+        batch,
+        update,
+        worker_context,
+        overwrite,
+        preserve,
+        sync,
+        skip_errors,
+    ):
+        """
+        Copy the (relative path, size) files from `batch` inside the
+        context returned by `worker_context`.
+
+        When `skip_errors` is True, the other files are copied after an
+        error and the list of (relative path, error) is returned.
+        The errors of the top member are always raised.
+        """
+        errors = []
+        with worker_context():
+            for relative, size in batch:
+                try:
+                    self._copyTreeFile(
+                        _join_relative(source, relative),
+                        _join_relative(destination, relative),
+                        size,
+                        update,
+                        overwrite,
+                        preserve,
+                        sync,
+                    )
+                except OSError as error:
+                    if not skip_errors or not relative:
+                        raise
+                    errors.append((relative, error))
+        return errors
+
+    def _copyTreeFile(
+        self, source, destination, size, update, overwrite, preserve, sync
+    ):
+        """
+        Copy the file at `source` to the `destination` path, with its
+        attributes, and write it to disk when `sync` is True.
+        """
+        source_fd = os.open(source, self.OPEN_READ_ONLY)
+        try:
+            self._removeTreeMember(destination, overwrite)
+            destination_fd = os.open(
+                destination,
+                self.OPEN_WRITE_ONLY | self.OPEN_CREATE | self.OPEN_EXCLUSIVE,
+                _DEFAULT_FILE_MODE,
+            )
+            try:
+                _copy_descriptor(source_fd, destination_fd, size, update)
+                if preserve:
+                    _copy_attributes(source, destination)
+                if sync:
+                    os.fsync(destination_fd)
+            finally:
+                os.close(destination_fd)
+        finally:
+            os.close(source_fd)
 
     @contextmanager
     def _convertToOSError(self, path):
@@ -523,92 +1843,518 @@ class PosixFilesystemBase:
         if self.isFolder(segments):
             raise OSError(errno.EISDIR, f'Is a directory: {path}', path)
 
-    def openFile(self, segments, flags, mode):
-        """See `ILocalFilesystem`."""
+    def _osOpen(self, path, flags, mode=0o777):
+        """
+        Return the file descriptor for the low level `path`.
+
+        It should be called with the avatar already impersonated.
+        """
+        return os.open(path, flags, mode)
+
+    def _openFile(self, segments, flags, mode=0o777):
+        """
+        Return the file descriptor for file at `segments`.
+
+        Raise OSError with EISDIR when `segments` is a folder.
+        The folder is detected based on the result of the open call, without
+        doing a separate status call before opening the file.
+        """
         path = self.getRealPathFromSegments(segments, include_virtual=False)
         path_encoded = self.getEncodedPath(path)
 
-        self._requireFile(segments)
-        with self._convertToOSError(path), self._impersonateUser():
-            return os.open(path_encoded, flags, mode)
+        try:
+            with self._convertToOSError(path), self._impersonateUser():
+                fd = self._osOpen(path_encoded, flags, mode)
+        except OSError as error:
+            if error.errno == errno.EISDIR:
+                raise OSError(errno.EISDIR, f'Is a directory: {path}', path)
+            if error.errno in (errno.EACCES, errno.EPERM):
+                # Some systems, like Windows, fail with a permission error
+                # when opening a folder.
+                self._requireFile(segments)
+            raise
+
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            # A folder can't be opened for writing, so we already got
+            # an EISDIR error.
+            return fd
+
+        # A folder can be opened for reading, so check what we got.
+        try:
+            is_folder = stat.S_ISDIR(os.fstat(fd).st_mode)
+        except Exception:
+            os.close(fd)
+            raise
 
-    def openFileForReading(self, segments):
+        if is_folder:
+            os.close(fd)
+            raise OSError(errno.EISDIR, f'Is a directory: {path}', path)
+
+        return fd
+
+    def openFile(self, segments, flags, mode):
         """See `ILocalFilesystem`."""
-        path = self.getRealPathFromSegments(segments, include_virtual=False)
-        path_encoded = self.getEncodedPath(path)
+        return self._openFile(segments, flags, mode)
 
-        self._requireFile(segments)
-        with self._convertToOSError(path), self._impersonateUser():
-            fd = os.open(path_encoded, self.OPEN_READ_ONLY)
-            return os.fdopen(fd, 'rb')
+    def openFileForReading(self, segments):
+        """See `ILocalFilesystem`."""
+        fd = self._openFile(segments, self.OPEN_READ_ONLY)
+        return os.fdopen(fd, 'rb')
 
-    def openFileForWriting(self, segments, mode=_DEFAULT_FILE_MODE):
+    def openFileForWriting(
+        self,
+        segments,
+        mode=_DEFAULT_FILE_MODE,
+        checksums=None,
+        expected=None,
+    ):
         """
         See `ILocalFilesystem`.
 
         For security reasons, the file is only opened with read/write for
         owner.
         """
-        path = self.getRealPathFromSegments(segments, include_virtual=False)
-        path_encoded = self.getEncodedPath(path)
+        algorithms = self._getWriterAlgorithms(checksums, expected)
+        if expected:
+            path = self.getRealPathFromSegments(segments, include_virtual=False)
+            path_encoded = self.getEncodedPath(path)
+            with self._convertToOSError(path), self._impersonateUser():
+                return self._openVerifiedWriter(
+                    segments, path_encoded, mode, algorithms, expected
+                )
 
-        self._requireFile(segments)
-        with self._convertToOSError(path), self._impersonateUser():
-            fd = os.open(
+        previous = self._getQuotaWriterUsage(segments)
+        fd = self._openFile(
+            segments,
+            (self.OPEN_WRITE_ONLY | self.OPEN_CREATE | self.OPEN_TRUNCATE),
+            mode,
+        )
+        return self._openWriter(
+            fd, 'wb', previous, segments, algorithms, expected
+        )
+
+    def _openFileForWritingPath(
+        self,
+        segments,
+        path_encoded,
+        mode=_DEFAULT_FILE_MODE,
+        checksums=None,
+        expected=None,
+    ):
+        """
+        Return the file object for writing into the file at the low level
+        `path_encoded` for `segments`.
+
+        It should be called with the avatar already impersonated.
+        """
+        algorithms = self._getWriterAlgorithms(checksums, expected)
+        if expected:
+            return self._openVerifiedWriter(
+                segments, path_encoded, mode, algorithms, expected
+            )
+
+        previous = None
+        if self.quota is not None:
+            previous = self._getQuotaUsage(path_encoded)
+        try:
+            fd = self._osOpen(
                 path_encoded,
-                (self.OPEN_WRITE_ONLY | self.OPEN_CREATE | self.OPEN_TRUNCATE),
+                self.OPEN_WRITE_ONLY | self.OPEN_CREATE | self.OPEN_TRUNCATE,
                 mode,
             )
-            return os.fdopen(fd, 'wb')
-
-    def openFileForAppending(self, segments, mode=_DEFAULT_FILE_MODE):
-        """See `ILocalFilesystem`."""
-
-        def fail_on_read():
-            raise AssertionError(
-                'File opened for appending. Read is not allowed.',
+        except IsADirectoryError:
+            raise OSError(
+                errno.EISDIR, f'Is a directory: {path_encoded}', path_encoded
             )
+        return self._openWriter(
+            fd, 'wb', previous, segments, algorithms, expected
+        )
 
-        path = self.getRealPathFromSegments(segments, include_virtual=False)
-        path_encoded = self.getEncodedPath(path)
+    def _openVerifiedWriter(
+        self, segments, path_encoded, mode, algorithms, expected
+    ):
+        """
+        Return the file object for writing into the file at the low level
+        `path_encoded` for `segments`, which is only replaced when the
+        content has the `expected` digests.
+
+        The content is written to a new file from the same folder, which
+        is renamed over `path_encoded` when closed, or removed when the
+        digests are not matching.
+        The new file gets the mode, owner and extended attributes of the
+        existing file.
+        Links and files with multiple hard links are not replaced, as
+        this would change the file of the other names. Their content is
+        written in place and removed when the digests are not matching.
+        It should be called with the avatar already impersonated.
+        """
+        try:
+            existing = self._osOpen(
+                path_encoded, self.OPEN_WRITE_ONLY | self.OPEN_NO_FOLLOW
+            )
+        except FileNotFoundError:
+            existing = None
+        except OSError as error:
+            if error.errno == errno.EISDIR:
+                raise OSError(
+                    errno.EISDIR,
+                    f'Is a directory: {path_encoded}',
+                    path_encoded,
+                )
+            if error.errno not in (errno.ELOOP, errno.EMLINK):
+                raise
+            # A link.
+            return self._openInPlaceWriter(
+                segments, path_encoded, mode, algorithms, expected
+            )
 
-        self._requireFile(segments)
-        with self._convertToOSError(path), self._impersonateUser():
-            fd = os.open(
-                path_encoded,
-                (self.OPEN_APPEND | self.OPEN_CREATE | self.OPEN_WRITE_ONLY),
+        folder, name = os.path.split(path_encoded)
+        temporary_name = f'.{name}.{os.urandom(4).hex()}.chevah-write'
+        temporary = os.path.join(folder, temporary_name)
+        try:
+            if existing is not None:
+                stats = os.fstat(existing)
+                if stats.st_nlink > 1 or not stat.S_ISREG(stats.st_mode):
+                    return self._openInPlaceWriter(
+                        segments, path_encoded, mode, algorithms, expected
+                    )
+            fd = self._osOpen(
+                temporary,
+                self.OPEN_WRITE_ONLY | self.OPEN_CREATE | self.OPEN_EXCLUSIVE,
                 mode,
             )
-            return os.fdopen(fd, 'ab')
+            if existing is not None:
+                try:
+                    self._copyFileMetadata(existing, stats, fd)
+                except Exception:
+                    os.close(fd)
+                    os.unlink(temporary)
+                    raise
+        finally:
+            if existing is not None:
+                os.close(existing)
+
+        previous = None
+        if self.quota is not None:
+            previous = (0, 0)
+        return self._openWriter(
+            fd,
+            'wb',
+            previous,
+            segments[:-1] + [temporary_name],
+            algorithms,
+            expected,
+            target=(segments, path_encoded, temporary),
+        )
 
-    def getFileSize(self, segments):
-        """See `ILocalFilesystem`."""
-        if self._isVirtualPath(segments):
-            # Virtual path are non-existent in real filesystem but we return
-            # a value instead of file not found.
-            return 0
+    def _openInPlaceWriter(
+        self, segments, path_encoded, mode, algorithms, expected
+    ):
+        """
+        Return the file object for writing the `expected` content
+        directly into the file at the low level `path_encoded`.
 
-        path = self.getRealPathFromSegments(segments)
-        path_encoded = self.getEncodedPath(path)
-        with self._impersonateUser():
-            return os.path.getsize(path_encoded)
+        It should be called with the avatar already impersonated.
+        """
+        previous = None
+        if self.quota is not None:
+            previous = self._getQuotaUsage(path_encoded)
+        fd = self._osOpen(
+            path_encoded,
+            self.OPEN_WRITE_ONLY | self.OPEN_CREATE | self.OPEN_TRUNCATE,
+            mode,
+        )
+        return self._openWriter(
+            fd, 'wb', previous, segments, algorithms, expected
+        )
 
-    def _getVirtualMembers(self, segments):
+    @staticmethod
+    def _copyFileMetadata(source, stats, destination):
         """
-        Return a list with virtual folders which are children of `segments`.
+        Copy the mode, owner and extended attributes of the `source` file
+        descriptor, with `stats`, to the `destination` file descriptor.
+
+        The owner and the attributes which can't be set by the current
+        account are not copied.
+        The internal extended attributes are not copied, as they are
+        for the content of `source`.
         """
-        result = []
-        segments_length = len(segments)
-        for virtual_segments, real_path in self._avatar.virtual_folders:
-            if segments_length >= len(virtual_segments):
-                # Not something that might look like the parent of a
-                # virtual folder.
-                continue
+        if not hasattr(os, 'fchown'):
+            # Windows has no owner and only the read-only mode.
+            return
 
-            if not self._areEqual(virtual_segments[:segments_length], segments):
+        os.fchmod(destination, stat.S_IMODE(stats.st_mode))
+        try:
+            os.fchown(destination, stats.st_uid, stats.st_gid)
+        except PermissionError:
+            pass
+
+        if not hasattr(os, 'listxattr'):
+            return
+        try:
+            names = os.listxattr(source)
+        except OSError:
+            # Not supported by the filesystem.
+            return
+        for name in names:
+            if _isReservedAttribute(name):
+                continue
+            try:
+                os.setxattr(destination, name, os.getxattr(source, name))
+            except OSError:
                 continue
 
-            child_segments = virtual_segments[segments_length:]
+    def openFileForAppending(
+        self,
+        segments,
+        mode=_DEFAULT_FILE_MODE,
+        checksums=None,
+        expected=None,
+    ):
+        """See `ILocalFilesystem`."""
+        algorithms = self._getWriterAlgorithms(checksums, expected)
+        previous = self._getQuotaWriterUsage(segments)
+        fd = self._openFile(
+            segments,
+            (self.OPEN_APPEND | self.OPEN_CREATE | self.OPEN_WRITE_ONLY),
+            mode,
+        )
+        return self._openWriter(
+            fd, 'ab', previous, segments, algorithms, expected
+        )
+
+    @staticmethod
+    def _getWriterAlgorithms(checksums, expected):
+        """
+        Return the list of checksum algorithms for a writer, including
+        the ones with an `expected` digest.
+        """
+        algorithms = list(checksums or ())
+        for algorithm in expected or ():
+            if algorithm not in algorithms:
+                algorithms.append(algorithm)
+        for algorithm in algorithms:
+            # Fail before opening the file.
+            _new_checksum(algorithm)
+        return algorithms
+
+    def _openWriter(
+        self, fd, mode, previous, segments, algorithms, expected, target=None
+    ):
+        """
+        Return the file object for writing to `fd`, opened for `segments`.
+
+        When the quota is tracked, the usage is updated when the file is
+        closed, based on the `previous` usage of the file, or on none
+        when the file was removed via the filesystem in the meantime.
+
+        When `algorithms` are requested, the checksums are updated with
+        the written content, starting with the existing content when
+        appending.
+        When the content doesn't have the `expected` digests, the appended
+        content is removed, keeping the existing one.
+        With a (segments, path, temporary path) `target`, `fd` is for the
+        temporary file, which is renamed over the target path only when
+        the digests are matching.
+        """
+        # The file might be created or truncated.
+        self._invalidateCache(segments)
+        on_close = None
+        if previous is not None:
+            key = None
+            counted = list(previous)
+            try:
+                stats = os.fstat(fd)
+            except OSError:
+                # The usage is fixed by the next reconcile.
+                pass
+            else:
+                key = (stats.st_dev, stats.st_ino)
+                _quota_writers.add(key, counted)
+
+        if previous is not None or self.metadata_cache is not None:
+
+            def on_close(stats):
+                self._invalidateCache(segments)
+                if previous is None:
+                    return
+                if key is not None:
+                    _quota_writers.remove(key, counted)
+                if stats is None:
+                    return
+                size, files = _getQuotaStatusUsage(stats)
+                self._updateQuota(size - counted[0], files - counted[1])
+
+        if not algorithms:
+            if on_close is None:
+                return os.fdopen(fd, mode)
+            return io.BufferedWriter(_QuotaFileIO(fd, mode, on_close))
+
+        def on_checked(mismatched):
+            if target is None:
+                if not mismatched:
+                    return
+                if mode == 'ab':
+                    result = 'The appended content was removed.'
+                else:
+                    result = 'The written content was removed.'
+            else:
+                target_segments, target_path, temporary = target
+                with self._impersonateUser():
+                    if not mismatched:
+                        self._renamePath(
+                            segments, temporary, target_segments, target_path
+                        )
+                        return
+                    self._deleteFilePath(segments, temporary)
+                result = 'The file was not changed.'
+
+            details = ', '.join(
+                f'{algorithm} expected {wanted} got {digest}'
+                for algorithm, wanted, digest in mismatched
+            )
+            name = '/'.join(segments if target is None else target[0])
+            raise CompatError(
+                1020,
+                _(f'Checksum mismatch for "{name}": {details}. {result}'),
+            )
+
+        size = None
+        if mode == 'ab':
+            try:
+                size = os.fstat(fd).st_size
+            except Exception:
+                os.close(fd)
+                raise
+        elif target is None:
+            # Written in place.
+            size = 0
+        raw = _ChecksumFileIO(
+            fd,
+            mode,
+            on_close,
+            algorithms,
+            expected or {},
+            on_checked,
+            restore_size=size,
+        )
+        try:
+            if size:
+                with self.openFileForReading(segments) as stream:
+                    self._readChecksums(raw._checksums, stream, 0, size)
+        except Exception:
+            raw._on_checked = None
+            raw.close()
+            raise
+        return ChecksumWriter(raw)
+
+    def _getQuotaWriterUsage(self, segments):
+        """
+        Return the usage of the file at `segments` before it is opened
+        for writing, or None when the quota is not tracked.
+        """
+        if self.quota is None:
+            return None
+        path = self.getRealPathFromSegments(segments, include_virtual=False)
+        path_encoded = self.getEncodedPath(path)
+        with self._impersonateUser():
+            return self._getQuotaUsage(path_encoded)
+
+    def _getQuotaUsage(self, path_encoded, source=None):
+        """
+        Return the (size, files) counted by the quota for the file at
+        `path_encoded`.
+
+        It returns (0, 0) when the quota is not tracked or when the path
+        is the same file as `source`.
+        It should be called with the avatar already impersonated.
+        """
+        if self.quota is None:
+            return 0, 0
+        try:
+            stats = os.lstat(path_encoded)
+            if source is not None and os.path.samestat(stats, os.lstat(source)):
+                return 0, 0
+        except OSError:
+            return 0, 0
+        return _getQuotaStatusUsage(stats)
+
+    def _getQuotaRemovedUsage(self, path_encoded, source=None):
+        """
+        Return the (size, files, key) counted by the quota for the file at
+        `path_encoded` which is removed, where `key` identifies the file
+        for `_quota_writers`.
+
+        For a file which is opened for writing, only the usage counted
+        before it was opened is returned.
+        It should be called with the avatar already impersonated.
+        """
+        if self.quota is None:
+            return 0, 0, None
+        try:
+            stats = os.lstat(path_encoded)
+            if source is not None and os.path.samestat(stats, os.lstat(source)):
+                return 0, 0, None
+        except OSError:
+            return 0, 0, None
+        key = (stats.st_dev, stats.st_ino)
+        counted = _quota_writers.get(key)
+        if counted is None:
+            counted = _getQuotaStatusUsage(stats)
+        return counted[0], counted[1], key
+
+    def _getQuotaFolderUsage(self, segments, recursive):
+        """
+        Return the usage of the folder at `segments` before it is
+        deleted, or None when there is nothing to update.
+        """
+        if self.quota is None or not recursive:
+            return None
+        try:
+            return self.getTreeUsage(segments)
+        except OSError:
+            # The delete will fail with the same error.
+            return None
+
+    def _updateQuota(self, size, files):
+        """
+        Add `size` and `files` to the tracked quota usage.
+        """
+        if self.quota is None or not (size or files):
+            return
+        self.quota.update(self, size, files)
+
+    def getFileSize(self, segments):
+        """See `ILocalFilesystem`."""
+        if self._isVirtualPath(segments):
+            # Virtual path are non-existent in real filesystem but we return
+            # a value instead of file not found.
+            return 0
+
+        path = self.getRealPathFromSegments(segments)
+        path_encoded = self.getEncodedPath(path)
+        with self._impersonateUser():
+            return os.path.getsize(path_encoded)
+
+    def _getVirtualMembers(self, segments):
+        """
+        Return a list with virtual folders which are children of `segments`.
+        """
+        if not self._virtual_folders:
+            return []
+
+        result = []
+        segments_length = len(segments)
+        for virtual_segments, real_path in self._virtual_folders:
+            if segments_length >= len(virtual_segments):
+                # Not something that might look like the parent of a
+                # virtual folder.
+                continue
+
+            if not self._areEqual(virtual_segments[:segments_length], segments):
+                continue
+
+            child_segments = virtual_segments[segments_length:]
 
             result.append(child_segments[0])
 
@@ -621,6 +2367,15 @@ class PosixFilesystemBase:
         """
         See `ILocalFilesystem`.
         """
+        return list(
+            self._getCached('content', segments, self._getFolderContent)
+        )
+
+    def _getFolderContent(self, segments):
+        """
+        Return the names from the `segments` folder, without using the
+        cache.
+        """
         result = [m.name for m in self._getVirtualMembers(segments)]
         if segments and result:
             # We only support mixing virtual folder names with real names
@@ -645,423 +2400,2299 @@ class PosixFilesystemBase:
 
         return result
 
-    def iterateFolderContent(self, segments):
+    def iterateFolderContent(
+        self,
+        segments,
+        filter=None,  # noqa: A002
+        extended_attributes=None,
+    ):
         """
         See `ILocalFilesystem`.
         """
-        path = self.getRealPathFromSegments(segments)
-        path_encoded = self.getEncodedPath(path)
+        convert = self._dirEntryToFileAttributes
+        if extended_attributes is not None:
+            self._requireExtendedAttributes(segments)
+            names = list(extended_attributes)
+
+            def convert(entry):
+                result = self._dirEntryToFileAttributes(entry)
+                result.extended_attributes = self._getEntryExtendedAttributes(
+                    entry, names
+                )
+                return result
 
-        virtual_members = self._getVirtualMembers(segments)
-        if segments and virtual_members:
-            # We only support mixing virtual folder names with real names
-            # for the root folder.
-            # For all the other paths, we ignore the real folders if they
-            # overlay a virtual path.
-            return iter(virtual_members)
+        return self._iterateFolder(
+            segments, convert, self._compileFilter(filter)
+        )
 
-        # We start with possible virtual folders as they should shadow the
-        # real folders.
-        firsts = virtual_members
+    def _getEntryExtendedAttributes(self, entry, names):
+        """
+        Return the `names` extended attributes of the scandir `entry`.
+
+        The attributes of a link are not the ones of its target, and
+        members which can't be read have no attributes, so that they
+        don't stop the listing.
+        """
         try:
             with self._impersonateUser():
-                folder_iterator = scandir(path_encoded)
+                return self._getExtendedAttributes(
+                    entry.path, names, follow_symlinks=False
+                )
+        except OSError:
+            return {}
 
-            # On Windows we need to iterate over the first element to get the
-            # errors.
-            # Otherwise just by opening the directory, we don't get any errors.
-            # This is why we try to extract the first element, and yield it
-            # later.
-            try:
-                first_member = next(folder_iterator)
-            except StopIteration:
-                # The folder is empty so just return an iterator with possible
-                # virtual members.
-                return iter(virtual_members)
+    def iterateFolderTree(self, segments, filter=None):  # noqa: A002
+        """
+        See `ILocalFilesystem`.
+        """
+        members = self._iterateMembers(segments)
+        return self._iterateTree(segments, members, self._compileFilter(filter))
 
-            real_first_attributes = self._dirEntryToFileAttributes(first_member)
-            first_names = [m.name for m in firsts]
-            if real_first_attributes.name not in first_names:
-                firsts.append(real_first_attributes)
+    def _iterateTree(self, segments, members, match):
+        """
+        Yield the segments and the `FileAttributes` of the members from the
+        tree at `segments`, with `members` being the direct members.
 
-        except Exception:
-            # We fail to list the actual folder.
-            if not virtual_members:
-                # Since there are no virtual folder, we just raise the error.
-                raise
+        The tree is walked depth first, without following links to folders.
+        Folders which can't be listed are ignored, as are the folders
+        which can't contain members matching a glob filter and the
+        members removed while the tree is walked.
+        """
+        can_contain = None
+        if isinstance(match, _GlobFilter):
+            can_contain = match.canContain
+
+        stack = [([], members)]
+        while stack:
+            relative, members = stack[-1]
+            member = next(members, None)
+            if member is None:
+                stack.pop()
+                continue
 
-            # We have virtual folders.
-            # No direct listing.
-            folder_iterator = iter([])
+            child = relative + [self._getMemberName(member)]
+            if match is None or match('/'.join(child), member):
+                try:
+                    attributes = self._getMemberAttributes(member)
+                except OSError as error:
+                    if error.errno != errno.ENOENT:
+                        raise
+                    continue
+                yield segments + child, attributes
 
-        return self._iterateScandir(set(firsts), folder_iterator)
+            if not self._isFolderMember(member):
+                continue
+            if can_contain is not None and not can_contain(child):
+                continue
+            try:
+                stack.append((child, self._iterateMembers(segments + child)))
+            except OSError:
+                continue
 
-    def _iterateScandir(self, firsts, folder_iterator):
+    def _compileFilter(self, filter):  # noqa: A002
         """
-        This generator wrapper needs to be delegated to this method as
-        otherwise we get a GeneratorExit error.
+        Return the callable telling if a member matches `filter`, or None
+        when all the members are included.
 
-        `firsts` is a list of FileAttributes.
-        `folder_iterators` is the iterator resulted from scandir.
+        The callable is called with the path of the member relative to
+        the listed folder, and the scandir entry or the `FileAttributes`
+        of the member.
         """
-        first_names = []
-        for member in firsts:
-            first_names.append(member.name)
-            yield member
+        if filter is None:
+            return None
 
-        for entry in folder_iterator:
-            attributes = self._dirEntryToFileAttributes(entry)
-            if attributes.name in first_names:
-                # Make sure we don't add duplicate from previous
-                # virtual folders.
-                continue
-            yield attributes
+        if isinstance(filter, str):
+            return _GlobFilter(filter, self._glob_flags)
+
+        if isinstance(filter, re.Pattern):
+            fullmatch = filter.fullmatch
+            return lambda path, member: fullmatch(path) is not None
+
+        return lambda path, member: filter(path, self._isFolderMember(member))
 
-    def _dirEntryToFileAttributes(self, entry):
+    def _isFolderMember(self, member):
         """
-        Convert the result from scandir to FileAttributes.
+        Return True if the scandir entry or the `FileAttributes` `member`
+        is a folder, without following links.
+
+        For scandir entries, the type from the folder listing is used,
+        so in most cases no stat call is done.
         """
-        name = self._decodeFilename(entry.name)
-        path = self._decodeFilename(entry.path)
+        if isinstance(member, FileAttributes):
+            return member.is_folder and not member.is_link
+        return member.is_dir(follow_symlinks=False)
 
-        with self._impersonateUser():
-            stats = entry.stat(follow_symlinks=False)
-            is_link = entry.is_symlink()
+    def _getMemberName(self, member):
+        """
+        Return the name of the scandir entry or `FileAttributes` `member`.
+        """
+        if isinstance(member, FileAttributes):
+            return member.name
+        return self._decodeFilename(member.name)
 
-        mode = stats.st_mode
-        is_directory = bool(stat.S_ISDIR(mode))
-        if is_directory and sys.platform.startswith('aix'):
-            # On AIX mode contains an extra most significant bit
-            # which we don't use.
-            mode = mode & 0o077777
-
-        # We use the INODE from stats, as on Windows getting INODE from
-        # scandir result is slow.
-        inode = stats.st_ino
-
-        modified = stats.st_mtime
-        if os.name == 'nt':
-            # On Windows, scandir gets float precision while
-            # getAttributes only integer.
-            modified = int(modified)
-            # On Windows, path might have long names for local drives.
-            # For compat, we keep the simple format as the end user format.
-            if path.startswith('\\\\?\\') and path[5] == ':':
-                path = path[4:]
-
-        hardlinks = stats.st_nlink
-        if not hardlinks and os.name == 'nt':
-            # I don't know why on Windows we don't get any number
-            # or hardlinks with scandir.
-            hardlinks = 1
+    @staticmethod
+    def _filterMembers(members, match):
+        """
+        Return the list of `FileAttributes` from `members` which are
+        matching the result of `_compileFilter`.
+        """
+        if match is None:
+            return members
+        return [member for member in members if match(member.name, member)]
 
-        return FileAttributes(
-            name=name,
-            path=path,
-            size=stats.st_size,
-            is_file=bool(stat.S_ISREG(mode)),
-            is_folder=is_directory,
-            is_link=is_link,
-            modified=modified,
-            mode=mode,
-            hardlinks=hardlinks,
-            uid=stats.st_uid,
-            gid=stats.st_gid,
-            node_id=inode,
-        )
+    def getTreeUsage(
+        self,
+        segments,
+        one_filesystem=False,
+        progress=None,
+        workers=None,
+    ):
+        """
+        See `ILocalFilesystem`.
 
-    def _decodeFilename(self, name):
+        The avatar is impersonated once, in the calling thread, for the
+        whole scan.
+        On Unix, the impersonation applies to the whole process, so the
+        worker threads don't impersonate again.
         """
-        Return the Unicode representation of file from `name`.
+        path = self.getRealPathFromSegments(segments)
+        path_encoded = self.getEncodedPath(path)
+        with self._convertToOSError(path), self._impersonateUser():
+            return self._scanTree(
+                path_encoded,
+                segments,
+                one_filesystem,
+                progress,
+                workers,
+                self._impersonateWorker,
+            )
 
-        `name` is in the encoded format stored on the filesystem.
+    def _scanTree(
+        self,
+        path_encoded,
+        segments,
+        one_filesystem,
+        progress,
+        workers,
+        worker_context,
+    ):
         """
-        # This is done to allow lazy initialization of process_capabilities.
-        from chevah_compat import process_capabilities
+        Return the `TreeUsage` for the tree at `segments`.
 
-        if not isinstance(name, str):
-            name = name.decode(self.INTERNAL_ENCODING)
+        Each worker thread scans the folders inside the context returned
+        by calling `worker_context`.
+        """
+        result = TreeUsage()
+        # Identifiers of the files with multiple hard links.
+        seen = set()
+        device = None
+        if one_filesystem:
+            device = os.stat(path_encoded).st_dev
+
+        # The top folder is scanned here, so that its errors are raised.
+        scan = self._scanTreeFolder(path_encoded, segments, device)
+        children = self._mergeTreeFolder(result, seen, scan)
+        if progress:
+            progress(result)
+
+        def submit(folder):
+            return executor.submit(
+                self._scanTreeWorker, folder, device, worker_context
+            )
 
-        # OSX HFS+ store file as Unicode, but in normalized format.
-        # On OSX we might also read files from other filesystems, not only
-        # HFS+, but we are lucky here as normalize will not raise errors
-        # if input is already normalized.
-        if process_capabilities.os_name == 'osx':
-            name = unicodedata.normalize('NFC', name)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {submit(child) for child in children}
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    children = self._mergeTreeFolder(
+                        result, seen, future.result()
+                    )
+                    running.update(submit(child) for child in children)
+                if progress:
+                    progress(result)
 
-        return name
+        return result
 
-    def getAttributes(self, segments):
+    def getChecksum(self, segments, algorithm='sha256', offset=0, length=None):
         """
         See `ILocalFilesystem`.
+
+        The content is read in large blocks, for which `hashlib` and
+        `zlib` release the GIL.
         """
-        if self._isVirtualPath(segments):
-            return self._getPlaceholderAttributes(segments)
+        if offset < 0 or (length is not None and length < 0):
+            raise AssertionError(f'Invalid range: {offset} {length}')
+        checksum = _new_checksum(algorithm)
+        stream = self.openFileForReading(segments)
+        if offset or length is not None:
+            return self._updateChecksum(checksum, stream, offset, length)
+        return self._getFileChecksum(algorithm, stream)
+
+    def getChecksumMany(self, segments_list, algorithm='sha256', workers=None):
+        """
+        See `ILocalFilesystem`.
 
-        stats = self.getStatus(segments)
-        mode = stats.st_mode
-        is_directory = bool(stat.S_ISDIR(mode))
-        if is_directory and sys.platform.startswith('aix'):
-            # On AIX mode contains an extra most significant bit
-            # which we don't use.
-            mode = mode & 0o077777
+        The files are opened in the calling thread, so that the avatar is
+        impersonated only there, and they are read by the worker threads.
+        At most twice the number of workers are opened at the same time.
+        """
+        _new_checksum(algorithm)
+        if workers is None:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+        result = [None] * len(segments_list)
+
+        def collect(futures):
+            for future in futures:
+                index = running.pop(future)
+                try:
+                    result[index] = future.result()
+                except OSError as error:
+                    result[index] = error
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            for index, segments in enumerate(segments_list):
+                if len(running) >= workers * 2:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    collect(done)
+                try:
+                    stream = self.openFileForReading(segments)
+                except (OSError, CompatError) as error:
+                    result[index] = error
+                    continue
+                future = executor.submit(
+                    self._getFileChecksum, algorithm, stream
+                )
+                running[future] = index
+            collect(list(running))
 
-        try:
-            name = segments[-1]
-        except Exception:
-            name = None
-        path = self.getRealPathFromSegments(segments)
+        return result
 
-        return FileAttributes(
-            name=name,
-            path=path,
-            size=stats.st_size,
-            is_file=bool(stat.S_ISREG(mode)),
-            is_folder=is_directory,
-            is_link=self.isLink(segments),
-            modified=stats.st_mtime,
-            mode=mode,
-            hardlinks=stats.st_nlink,
-            uid=stats.st_uid,
-            gid=stats.st_gid,
-            node_id=stats.st_ino,
-        )
+    def _getFileChecksum(self, algorithm, stream):
+        """
+        Return the `algorithm` hex digest of the whole content of `stream`,
+        from the checksum cache when configured.
 
-    def _getPlaceholderAttributes(self, segments):
+        The stream is closed.
         """
-        Return the attributes which can be used for the case when a real
-        attribute don't exists for `segments`.
+        cache = self.checksum_cache
+        if cache is None:
+            return self._updateChecksum(
+                _new_checksum(algorithm), stream, 0, None
+            )
+
+        def compute():
+            checksum = _new_checksum(algorithm)
+            self._readChecksums([checksum], stream, 0, None)
+            return checksum.hexdigest()
+
+        with stream:
+            return cache.get(stream.fileno(), algorithm, compute)
+
+    @classmethod
+    def _updateChecksum(cls, checksum, stream, offset, length):
         """
-        modified = time.mktime((date.today().year, 1, 1, 0, 0, 0, 0, 0, -1))
-        return FileAttributes(
-            name=segments[-1],
-            path=self.getRealPathFromSegments(segments),
-            size=0,
-            is_file=False,
-            is_folder=True,
-            is_link=False,
-            modified=modified,
-            mode=0o40555,
-            hardlinks=1,
-            uid=1,
-            gid=1,
-            node_id=None,
-        )
+        Update `checksum` with the `length` bytes from `offset` of
+        `stream` and return the hex digest.
 
-    def _getPlaceholderStatus(self):
+        The stream is closed.
         """
-        Return a placeholder status result.
+        with stream:
+            cls._readChecksums([checksum], stream, offset, length)
+        return checksum.hexdigest()
+
+    @staticmethod
+    def _readChecksums(checksums, stream, offset, length):
         """
-        modified = time.mktime((date.today().year, 1, 1, 0, 0, 0, 0, 0, -1))
+        Update each of `checksums` with the `length` bytes from `offset`
+        of `stream`.
+        """
+        view = _get_checksum_buffer()
+        remaining = length
+        if offset:
+            stream.seek(offset)
+        while remaining is None or remaining > 0:
+            size = len(view)
+            if remaining is not None:
+                size = min(size, remaining)
+            read = stream.readinto(view[:size])
+            if not read:
+                break
+            for checksum in checksums:
+                checksum.update(view[:read])
+            if remaining is not None:
+                remaining -= read
+
+    def executeMany(self, operations, workers=None):
+        """
+        See `ILocalFilesystem`.
 
-        return os.stat_result([0o40555, 0, 0, 0, 1, 1, 0, 1, modified, 0])
+        The paths of all the operations are resolved before executing
+        the first operation.
+        The operations are grouped by the parent folder of their path,
+        and the groups are executed in parallel by the worker threads.
+        An operation is executed only after the previous operations
+        having one of its paths, or a parent of its paths, are done.
+
+        The avatar is impersonated once, in the calling thread, for the
+        whole list.
+        On Windows, each worker thread impersonates once.
+        """
+        if workers is None:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+        result = [None] * len(operations)
+        stages = _OperationStages()
+        for index, operation in enumerate(operations):
+            try:
+                group, paths, call = self._prepareOperation(*operation)
+            except (OSError, CompatError) as error:
+                result[index] = error
+                continue
+            stages.add(index, group, paths, call)
 
-    def setAttributes(self, segments, attributes):
-        """See `ILocalFilesystem`."""
-        path = self.getRealPathFromSegments(segments, include_virtual=False)
-        path_encoded = self.getEncodedPath(path)
         with self._impersonateUser():
-            if 'uid' in attributes and 'gid' in attributes:
-                os.chown(path_encoded, attributes['uid'], attributes['gid'])
-            if 'mode' in attributes:
-                os.chmod(path_encoded, attributes['mode'])
-            if 'atime' in attributes and 'mtime' in attributes:
-                os.utime(
-                    path_encoded,
-                    (attributes['atime'], attributes['mtime']),
-                )
+            if len(stages.stages) == 1 and len(stages.stages[0]) == 1:
+                # Nothing to do in parallel.
+                for group in stages.stages[0].values():
+                    self._executeGroup(group, result, NoOpContext)
+                return result
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for stage in stages.stages:
+                    futures = [
+                        executor.submit(
+                            self._executeGroup,
+                            group,
+                            result,
+                            self._impersonateWorker,
+                        )
+                        for group in stage.values()
+                    ]
+                    for future in futures:
+                        future.result()
+        return result
 
-    def touch(self, segments):
+    def _prepareOperation(self, name, segments, arguments=None):
         """
-        See: ILocalFilesystem.
+        Return the (group, paths, call) for an operation of `executeMany`.
+
+        `call` executes the operation while the avatar is impersonated.
         """
+        if name not in _BATCH_OPERATIONS:
+            raise AssertionError(f'Operation not supported: {name}')
+        arguments = arguments or {}
+        required, optional = _BATCH_OPERATIONS[name]
+        for argument in required:
+            if argument not in arguments:
+                raise AssertionError(f'Missing {name} argument: {argument}')
+        for argument in arguments:
+            if argument not in required and argument not in optional:
+                raise AssertionError(f'Unknown {name} argument: {argument}')
         path = self.getRealPathFromSegments(segments, include_virtual=False)
         path_encoded = self.getEncodedPath(path)
-        with self._impersonateUser():
-            with open(path_encoded, 'a'):
-                os.utime(path_encoded, None)
+        group = os.path.normcase(os.path.dirname(path_encoded))
+
+        if name == 'rename':
+            arguments = arguments.copy()
+            to_segments = arguments.pop('to_segments')
+            to_path = self.getRealPathFromSegments(
+                to_segments,
+                include_virtual=False,
+            )
+            to_path_encoded = self.getEncodedPath(to_path)
+
+            def call():
+                return self._renamePath(
+                    segments,
+                    path_encoded,
+                    to_segments,
+                    to_path_encoded,
+                    **arguments,
+                )
+
+            return group, [path_encoded, to_path_encoded], call
+
+        # Executed by the method for the low level path.
+        method = getattr(self, f'_{name}Path')
+
+        def call():
+            return method(segments, path_encoded, **arguments)
+
+        return group, [path_encoded], call
+
+    @staticmethod
+    def _executeGroup(group, result, worker_context):
+        """
+        Execute in order the (index, call) operations of `group` inside
+        the context returned by `worker_context`, and store the value
+        or the error of each operation in `result`.
+
+        Any error is stored, so that the files opened by the other
+        operations are returned to be closed.
+        """
+        with worker_context():
+            for index, call in group:
+                try:
+                    result[index] = call()
+                except Exception as error:
+                    result[index] = error
+
+    def _impersonateWorker(self):
+        """
+        Return the impersonation context for a worker thread started
+        while the avatar is impersonated.
+
+        On Unix, the impersonation is already active for all the threads.
+        """
+        return NoOpContext()
+
+    def _scanTreeWorker(self, folder, device, worker_context):
+        """
+        Scan the `folder` from the tree, as a (path, segments) tuple, in a
+        worker thread.
+
+        A folder which can't be listed is counted as an error.
+        """
+        path_encoded, segments = folder
+        with worker_context():
+            try:
+                return self._scanTreeFolder(path_encoded, segments, device)
+            except OSError:
+                usage = TreeUsage()
+                usage.errors = 1
+                return usage, [], []
+
+    def _scanTreeFolder(self, path_encoded, segments, device):
+        """
+        Return the usage of the direct files of a folder, the files with
+        multiple hard links and the child folders.
+
+        The files with multiple hard links are not included in the usage,
+        but returned as (key, name, size, allocated) tuples, so that they
+        are counted only once.
+        Child folders are returned as (path, segments) tuples.
+        When `device` is not None, the folders from other devices are
+        ignored.
+        Members removed while the folder is scanned are ignored and the
+        members which can't be read are counted as errors.
+        """
+        usage = TreeUsage()
+        linked = []
+        children = []
+
+        virtual_members = self._getVirtualMembers(segments)
+        virtual_names = [member.name for member in virtual_members]
+        for name in virtual_names:
+            child_segments = segments + [name]
+            child_path = self.getEncodedPath(
+                self.getRealPathFromSegments(child_segments)
+            )
+            children.append((child_path, child_segments))
+            usage.folders += 1
+
+        if segments and virtual_members:
+            # As for the listing, the real members are overlaid.
+            return usage, linked, children
+
+        with scandir(path_encoded) as folder_iterator:
+            for entry in folder_iterator:
+                name = self._decodeFilename(entry.name)
+                if name in virtual_names:
+                    continue
+
+                if entry.is_symlink():
+                    usage.links += 1
+                    continue
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if (
+                            device is not None
+                            and entry.stat(follow_symlinks=False).st_dev
+                            != device
+                        ):
+                            continue
+                        children.append((entry.path, segments + [name]))
+                        usage.folders += 1
+                        continue
+
+                    stats = entry.stat(follow_symlinks=False)
+                except OSError as error:
+                    # The usage of the other members is kept.
+                    if error.errno != errno.ENOENT:
+                        usage.errors += 1
+                    continue
+
+                size = stats.st_size
+                # st_blocks is not available on Windows.
+                blocks = getattr(stats, 'st_blocks', None)
+                allocated = size if blocks is None else blocks * 512
+                if stats.st_nlink > 1:
+                    key = (stats.st_dev, stats.st_ino)
+                    linked.append((key, name, size, allocated))
+                else:
+                    usage.addFile(name, size, allocated)
+
+        return usage, linked, children
+
+    @staticmethod
+    def _mergeTreeFolder(result, seen, scan):
+        """
+        Merge the `scan` of a folder into `result` and return its child
+        folders.
+        """
+        usage, linked, children = scan
+        result.update(usage)
+        for key, name, size, allocated in linked:
+            if key in seen:
+                continue
+            seen.add(key)
+            result.addFile(name, size, allocated)
+        return children
+
+    def getFolderListing(self, segments):
+        """
+        See `ILocalFilesystem`.
+        """
+        result = FolderListing(self.getRealPathFromSegments(segments))
+        for member in self._iterateFolder(segments, self._dirEntryToStatus):
+            if isinstance(member, FileAttributes):
+                result.append(member, is_virtual=True)
+            else:
+                result.appendStatus(member.name, member.stats, member.is_link)
+        return result
+
+    def listFolderPage(
+        self,
+        segments,
+        sort_key='name',
+        reverse=False,
+        offset=0,
+        limit=None,
+        filter=None,  # noqa: A002
+    ):
+        """
+        See `ILocalFilesystem`.
+        """
+        members = self._iterateFolder(segments, self._dirEntryToStatus)
+        return self._getFolderPage(
+            members, sort_key, reverse, offset, limit, filter
+        )
+
+    def _getFolderPage(
+        self,
+        members,
+        sort_key,
+        reverse,
+        offset,
+        limit,
+        filter,  # noqa: A002
+    ):
+        """
+        Return the total and the page from `members`, which are
+        `FileAttributes` or the result of `_dirEntryToStatus`.
+
+        Only `offset + limit` members are kept while iterating and
+        `FileAttributes` are created only for the page.
+        """
+        if sort_key not in ('name', 'size', 'modified'):
+            raise AssertionError(f'Unknown sort key "{sort_key}".')
+
+        total = 0
+
+        def keyed_members():
+            """
+            Yield the members matching the filter, together with their
+            sort key.
+            """
+            nonlocal total
+            for member in members:
+                if isinstance(member, FileAttributes):
+                    size = member.size
+                    modified = member.modified
+                    is_folder = member.is_folder
+                else:
+                    size = member.stats.st_size
+                    modified = member.stats.st_mtime
+                    is_folder = stat.S_ISDIR(member.stats.st_mode)
+
+                if filter is not None and not filter(member.name, is_folder):
+                    continue
+                total += 1
+
+                # Names are unique, so they are used to have the same
+                # order between pages for members with the same value.
+                if sort_key == 'name':
+                    key = (member.name,)
+                elif sort_key == 'size':
+                    key = (size, member.name)
+                else:
+                    key = (modified, member.name)
+                yield key, member
+
+        candidates = keyed_members()
+        get_key = operator.itemgetter(0)
+        if limit is None:
+            window = sorted(candidates, key=get_key, reverse=reverse)
+        elif reverse:
+            window = heapq.nlargest(offset + limit, candidates, get_key)
+        else:
+            window = heapq.nsmallest(offset + limit, candidates, get_key)
+
+        # For an empty window the candidates are not consumed, but we
+        # still need the total.
+        for _candidate in candidates:
+            pass
+
+        page = []
+        for _key, member in window[offset:]:
+            if not isinstance(member, FileAttributes):
+                member = self._dirEntryToFileAttributes(member.entry)
+            page.append(member)
+        return total, page
+
+    def _iterateFolder(self, segments, convert, match=None):
+        """
+        Return an iterator with the members of the folder at `segments`.
+
+        Virtual members are `FileAttributes`, while real members are the
+        result of calling `convert` with the scandir entry.
+        The result of `convert` should have a `name` attribute.
+
+        When `match` is not None, it is called with the name and the
+        scandir entry or the `FileAttributes` of each member, and only the
+        matching members are included.
+        This is done before `convert`, so no stat call is done for the
+        excluded entries.
+        """
+        path = self.getRealPathFromSegments(segments)
+        path_encoded = self.getEncodedPath(path)
+
+        virtual_members = self._getVirtualMembers(segments)
+        if segments and virtual_members:
+            # We only support mixing virtual folder names with real names
+            # for the root folder.
+            # For all the other paths, we ignore the real folders if they
+            # overlay a virtual path.
+            return iter(self._filterMembers(virtual_members, match))
+
+        # Entries read while checking for errors, which are yielded
+        # before the rest of the scandir entries.
+        pending = []
+        try:
+            with self._impersonateUser():
+                folder_iterator = scandir(path_encoded)
+
+            # On Windows we need to iterate over the first element to get the
+            # errors.
+            # Otherwise just by opening the directory, we don't get any errors.
+            # This is why we try to extract the first element, and yield it
+            # later.
+            try:
+                pending.append(next(folder_iterator))
+            except StopIteration:
+                # The folder is empty so just return an iterator with possible
+                # virtual members.
+                folder_iterator.close()
+                return iter(self._filterMembers(virtual_members, match))
+
+        except Exception:
+            # We fail to list the actual folder.
+            if not virtual_members:
+                # Since there are no virtual folder, we just raise the error.
+                raise
+
+            # We have virtual folders.
+            # No direct listing.
+            folder_iterator = iter([])
+
+        # We start with possible virtual folders as they should shadow the
+        # real folders.
+        # Virtual members can overlap, so duplicates are removed while
+        # keeping the listing order stable.
+        firsts = list(dict.fromkeys(virtual_members))
+        return self._iterateScandir(
+            firsts, pending, folder_iterator, convert, match
+        )
+
+    def _iterateScandir(self, firsts, pending, folder_iterator, convert, match):
+        """
+        This generator wrapper needs to be delegated to this method as
+        otherwise we get a GeneratorExit error.
+
+        `firsts` is a list of members which are yielded first.
+        `pending` is a list of scandir entries yielded before the ones
+        from `folder_iterator`, which is the iterator resulted from scandir.
+        `convert` is called for each scandir entry matching `match`.
+        """
+        try:
+            first_names = []
+            for member in firsts:
+                first_names.append(member.name)
+                if match is None or match(member.name, member):
+                    yield member
+
+            for entry in itertools.chain(pending, folder_iterator):
+                if match is not None and not match(
+                    self._decodeFilename(entry.name), entry
+                ):
+                    continue
+                attributes = convert(entry)
+                if attributes.name in first_names:
+                    # Make sure we don't add duplicate from previous
+                    # virtual folders.
+                    continue
+                yield attributes
+        finally:
+            # Release the folder descriptor as soon as the iteration is
+            # stopped, without waiting for the garbage collector.
+            close = getattr(folder_iterator, 'close', None)
+            if close is not None:
+                close()
+
+    def _dirEntryToFileAttributes(self, entry, path=None):
+        """
+        Convert the result from scandir to FileAttributes.
+
+        `path` is used when the entry was produced by listing a folder
+        file descriptor, as in this case the entry has no full path.
+        """
+        name = self._decodeFilename(entry.name)
+        if path is None:
+            path = self._decodeFilename(entry.path)
+
+        with self._impersonateUser():
+            stats = entry.stat(follow_symlinks=False)
+            is_link = entry.is_symlink()
+
+        if os.name != 'nt':
+            return FileAttributes.fromStatus(name, path, stats, is_link)
+
+        # On Windows, path might have long names for local drives.
+        # For compat, we keep the simple format as the end user format.
+        if path.startswith('\\\\?\\') and path[5] == ':':
+            path = path[4:]
+
+        result = FileAttributes.fromStatus(name, path, stats, is_link)
+        # On Windows, scandir gets float precision while
+        # getAttributes only integer.
+        result.modified = int(result.modified)
+        if not result.hardlinks:
+            # I don't know why on Windows we don't get any number
+            # or hardlinks with scandir.
+            result.hardlinks = 1
+        return result
+
+    def _dirEntryToStatus(self, entry):
+        """
+        Return the name and the status for the result from scandir.
+        """
+        with self._impersonateUser():
+            stats = entry.stat(follow_symlinks=False)
+            is_link = entry.is_symlink()
+        return _ListingEntry(
+            self._decodeFilename(entry.name), stats, is_link, entry
+        )
+
+    def _decodeFilename(self, name):
+        """
+        Return the Unicode representation of file from `name`.
+
+        `name` is in the encoded format stored on the filesystem.
+        """
+        if not isinstance(name, str):
+            name = name.decode(self.INTERNAL_ENCODING)
+        return name
+
+    def _decodeNormalizedFilename(self, name):
+        """
+        Return the Unicode representation of file from `name`,
+        in the NFC normalized form.
+
+        OSX HFS+ store file as Unicode, but in normalized format.
+        On OSX we might also read files from other filesystems, not only
+        HFS+, but we are lucky here as normalize will not raise errors
+        if input is already normalized.
+        """
+        if not isinstance(name, str):
+            name = name.decode(self.INTERNAL_ENCODING)
+        return unicodedata.normalize('NFC', name)
+
+    def getAttributes(self, segments):
+        """
+        See `ILocalFilesystem`.
+        """
+        # The target of a link can be changed via another path.
+        result = self._getCached(
+            'attributes',
+            segments,
+            self._getAttributes,
+            cacheable=lambda attributes: not attributes.is_link,
+        )
+        if self.metadata_cache is None:
+            return result
+        # The cached instance is shared with the other callers.
+        return copy.copy(result)
+
+    def _getAttributes(self, segments):
+        """
+        Return the attributes of `segments`, without using the cache.
+        """
+        if self._isVirtualPath(segments):
+            return self._getPlaceholderAttributes(segments)
+
+        stats = self.getStatus(segments)
+
+        try:
+            name = segments[-1]
+        except Exception:
+            name = None
+        path = self.getRealPathFromSegments(segments)
+
+        return FileAttributes.fromStatus(
+            name, path, stats, is_link=self.isLink(segments)
+        )
+
+    def getAttributesMany(self, segments_list, workers=None):
+        """
+        See `ILocalFilesystem`.
+
+        The paths are grouped by their parent folder.
+        Each folder is opened once and its members are stat-ed relative
+        to it, in parallel for different folders.
+        A single `lstat` is done for members which are not links.
+        The avatar is impersonated once, in the calling thread.
+
+        The metadata cache is not used.
+        """
+        if not _STAT_DIR_FD:
+            return self._callMany(self.getAttributes, segments_list)
+
+        result = self._getStatusMany(segments_list, True, workers)
+        for index, value in enumerate(result):
+            segments = segments_list[index]
+            if value is None:
+                result[index] = self._getPlaceholderAttributes(segments)
+            elif isinstance(value, tuple):
+                stats, is_link, path = value
+                result[index] = FileAttributes.fromStatus(
+                    segments[-1] if segments else None,
+                    path,
+                    stats,
+                    is_link=is_link,
+                )
+        return result
+
+    @staticmethod
+    def _callMany(method, segments_list):
+        """
+        Return the list with the result of `method` for each segments
+        from `segments_list`, or with its error.
+        """
+        result = []
+        for segments in segments_list:
+            try:
+                result.append(method(segments))
+            except (OSError, CompatError) as error:
+                result.append(error)
+        return result
+
+    def _getStatusMany(
+        self, segments_list, follow_symlinks, workers, broken_virtual=None
+    ):
+        """
+        Return the list with the (stats, is_link, path) of each segments
+        from `segments_list`, with None for virtual paths, or with the
+        error.
+
+        When `follow_symlinks` is False, only the status of the links is
+        read.
+        When `broken_virtual` is not None, it is used instead of the error
+        for broken virtual paths.
+        """
+        if workers is None:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+        result = [None] * len(segments_list)
+        groups = {}
+        for index, segments in enumerate(segments_list):
+            try:
+                if self._isVirtualPath(segments):
+                    continue
+            except CompatError as error:
+                result[index] = error
+                if broken_virtual is not None:
+                    result[index] = broken_virtual
+                continue
+            try:
+                path = self.getRealPathFromSegments(segments)
+            except CompatError as error:
+                result[index] = error
+                continue
+            path_encoded = self.getEncodedPath(path)
+            folder, name = os.path.split(path_encoded)
+            groups.setdefault(folder, []).append(
+                (index, name or '.', path_encoded)
+            )
+
+        # Small folders are stat-ed together by a task.
+        tasks = [[]]
+        size = 0
+        for folder, members in groups.items():
+            if size and size + len(members) > _STAT_BATCH_PATHS:
+                tasks.append([])
+                size = 0
+            tasks[-1].append((folder, members))
+            size += len(members)
+
+        with self._impersonateUser():
+            if len(tasks) == 1:
+                self._getFoldersStatus(
+                    tasks[0], follow_symlinks, result, NoOpContext
+                )
+                return result
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        self._getFoldersStatus,
+                        task,
+                        follow_symlinks,
+                        result,
+                        self._impersonateWorker,
+                    )
+                    for task in tasks
+                ]
+                for future in futures:
+                    future.result()
+        return result
+
+    def _getFoldersStatus(self, task, follow_symlinks, result, worker_context):
+        """
+        Store in `result` the status of the (index, name, path) members of
+        each (folder, members) from `task`, inside the context returned
+        by `worker_context`.
+
+        When the folder can't be opened, the members are stat-ed by path,
+        to get the same errors as for a single path.
+        """
+        with worker_context():
+            for folder, members in task:
+                try:
+                    fd = self._osOpen(folder, _OPEN_FOLDER_PATH)
+                except OSError:
+                    fd = None
+                try:
+                    for index, name, path in members:
+                        target = path if fd is None else name
+                        try:
+                            stats = os.stat(
+                                target, dir_fd=fd, follow_symlinks=False
+                            )
+                            is_link = stat.S_ISLNK(stats.st_mode)
+                            if is_link and follow_symlinks:
+                                stats = os.stat(target, dir_fd=fd)
+                        except OSError as error:
+                            result[index] = OSError(
+                                error.errno, error.strerror, path
+                            )
+                            continue
+                        result[index] = (stats, is_link, path)
+                finally:
+                    if fd is not None:
+                        os.close(fd)
+
+    def _getCached(
+        self, kind, segments, compute, cacheable=None, observed_only=None
+    ):
+        """
+        Return the `kind` value of `segments` from the metadata cache,
+        or the result of `compute(segments)`.
+
+        The virtual paths are not cached, as the values depend on the
+        avatar configuration and not only on the real path.
+        """
+        cache = self.metadata_cache
+        if cache is None:
+            return compute(segments)
+
+        try:
+            if self._isVirtualPath(segments) or self._getVirtualMembers(
+                segments
+            ):
+                return compute(segments)
+            path = self.getRealPathFromSegments(segments)
+        except CompatError:
+            return compute(segments)
+
+        # Without impersonation, all the values are for the process account.
+        owner = None
+        if self._avatar and self._avatar.use_impersonation:
+            owner = self._avatar.name
+        return cache.get(
+            kind,
+            path,
+            owner,
+            lambda: compute(segments),
+            cacheable=cacheable,
+            observed_only=observed_only,
+        )
+
+    def _invalidateCache(self, segments, recursive=False):
+        """
+        Remove the cached values of `segments` and of its parent folder,
+        after the path was changed via this filesystem.
+
+        When `recursive` is True, the values of its descendants are also
+        removed.
+        """
+        cache = self.metadata_cache
+        if cache is None:
+            return
+        try:
+            path = self.getRealPathFromSegments(segments)
+        except CompatError:
+            return
+        cache.invalidate(path, recursive=recursive)
+        cache.invalidate(os.path.dirname(path), recursive=False)
+
+    def _getPlaceholderAttributes(self, segments):
+        """
+        Return the attributes which can be used for the case when a real
+        attribute don't exists for `segments`.
+        """
+        modified = time.mktime((date.today().year, 1, 1, 0, 0, 0, 0, 0, -1))
+        return FileAttributes(
+            name=segments[-1],
+            path=self.getRealPathFromSegments(segments),
+            size=0,
+            is_file=False,
+            is_folder=True,
+            is_link=False,
+            modified=modified,
+            mode=0o40555,
+            hardlinks=1,
+            uid=1,
+            gid=1,
+            node_id=None,
+        )
+
+    def _getPlaceholderStatus(self):
+        """
+        Return a placeholder status result.
+        """
+        modified = time.mktime((date.today().year, 1, 1, 0, 0, 0, 0, 0, -1))
+
+        return os.stat_result([0o40555, 0, 0, 0, 1, 1, 0, 1, modified, 0])
+
+    def setAttributes(self, segments, attributes):
+        """
+        See `ILocalFilesystem`.
+
+        The attributes are set by path, as opening the path might have
+        side effects for devices.
+        Use `setDescriptorAttributes` for an already opened file.
+        """
+        path = self.getRealPathFromSegments(segments, include_virtual=False)
+        path_encoded = self.getEncodedPath(path)
+        with self._impersonateUser():
+            self._setAttributesPath(segments, path_encoded, attributes)
+
+    def _setAttributesPath(self, segments, path_encoded, attributes):
+        """
+        Set the `attributes` of the low level `path_encoded` for
+        `segments`.
+
+        It should be called with the avatar already impersonated.
+        """
+        try:
+            self._setAttributes(path_encoded, attributes)
+        finally:
+            # Some attributes might be changed before an error.
+            self._invalidateCache(segments)
+
+    def setDescriptorAttributes(self, stream, attributes):
+        """
+        See `ILocalFilesystem`.
+        """
+        if not _DESCRIPTOR_ATTRIBUTES:
+            raise OSError(
+                errno.ENOTSUP,
+                'Operation not supported',
+                getattr(stream, 'name', None),
+            )
+
+        if not isinstance(stream, int):
+            # The buffered content would change the modification time
+            # when written later.
+            stream.flush()
+
+        with self._impersonateUser():
+            self._setAttributes(self._getFileDescriptor(stream), attributes)
+
+    @staticmethod
+    def _setAttributes(target, attributes):
+        """
+        Set the `attributes` for the path or the file descriptor `target`.
+        """
+        uid = attributes.get('uid', -1)
+        gid = attributes.get('gid', -1)
+        if uid != -1 or gid != -1:
+            os.chown(target, uid, gid)
+
+        if 'mode' in attributes:
+            os.chmod(target, attributes['mode'])
+
+        atime_ns = _get_time_ns(attributes, 'atime')
+        mtime_ns = _get_time_ns(attributes, 'mtime')
+        if atime_ns is None and mtime_ns is None:
+            return
+        if atime_ns is None or mtime_ns is None:
+            stats = os.stat(target)
+            if atime_ns is None:
+                atime_ns = stats.st_atime_ns
+            if mtime_ns is None:
+                mtime_ns = stats.st_mtime_ns
+        os.utime(target, ns=(atime_ns, mtime_ns))
+
+    def lockFile(
+        self, stream, exclusive=True, offset=0, length=0, blocking=False
+    ):
+        """
+        See `ILocalFilesystem`.
+        """
+        raise NotImplementedError('lockFile')
+
+    def unlockFile(self, stream, offset=0, length=0):
+        """
+        See `ILocalFilesystem`.
+        """
+        raise NotImplementedError('unlockFile')
+
+    def getFileLock(self, stream, exclusive=True, offset=0, length=0):
+        """
+        See `ILocalFilesystem`.
+        """
+        raise NotImplementedError('getFileLock')
+
+    @staticmethod
+    def _getFileDescriptor(stream):
+        """
+        Return the file descriptor of `stream`, which can already be a
+        file descriptor.
+        """
+        if isinstance(stream, int):
+            return stream
+        return stream.fileno()
+
+    def getExtendedAttributes(self, segments, names=None):
+        """
+        See `ILocalFilesystem`.
+        """
+        self._requireExtendedAttributes(segments)
+        if self._isVirtualPath(segments):
+            return {}
+
+        path = self.getRealPathFromSegments(segments)
+        path_encoded = self.getEncodedPath(path)
+        with self._impersonateUser():
+            if names is None:
+                names = os.listxattr(path_encoded)
+            return self._getExtendedAttributes(path_encoded, names)
+
+    def setExtendedAttributes(self, segments, attributes):
+        """
+        See `ILocalFilesystem`.
+        """
+        self._requireExtendedAttributes(segments)
+        path = self.getRealPathFromSegments(segments, include_virtual=False)
+        path_encoded = self.getEncodedPath(path)
+        for name in attributes:
+            if _isReservedAttribute(name):
+                raise OSError(
+                    errno.EPERM,
+                    f'Reserved extended attribute: {os.fsdecode(name)}',
+                    path_encoded,
+                )
+        with self._impersonateUser():
+            for name, value in attributes.items():
+                if value is not None:
+                    if isinstance(value, str):
+                        value = value.encode('utf-8')
+                    os.setxattr(path_encoded, name, value)
+                    continue
+                try:
+                    os.removexattr(path_encoded, name)
+                except OSError as error:
+                    if error.errno != errno.ENODATA:
+                        raise
+
+    def listExtendedAttributes(self, segments):
+        """
+        See `ILocalFilesystem`.
+        """
+        self._requireExtendedAttributes(segments)
+        if self._isVirtualPath(segments):
+            return []
+
+        path = self.getRealPathFromSegments(segments)
+        path_encoded = self.getEncodedPath(path)
+        with self._impersonateUser():
+            names = os.listxattr(path_encoded)
+        return [name for name in names if not _isReservedAttribute(name)]
+
+    def _requireExtendedAttributes(self, segments):
+        """
+        Raise an OSError when the extended attributes are not supported
+        by the OS.
+        """
+        if hasattr(os, 'getxattr'):
+            return
+        path = self.getRealPathFromSegments(segments)
+        raise OSError(errno.ENOTSUP, 'Operation not supported', path)
+
+    @staticmethod
+    def _getExtendedAttributes(path, names, follow_symlinks=True):
+        """
+        Return the dictionary with the values of the `names` extended
+        attributes of `path`, without the attributes which are not set
+        and without the reserved attributes.
+        """
+        result = {}
+        for name in names:
+            if _isReservedAttribute(name):
+                continue
+            try:
+                result[name] = os.getxattr(
+                    path, name, follow_symlinks=follow_symlinks
+                )
+            except OSError as error:
+                if error.errno != errno.ENODATA:
+                    raise
+        return result
+
+    def touch(self, segments):
+        """
+        See: ILocalFilesystem.
+        """
+        path = self.getRealPathFromSegments(segments, include_virtual=False)
+        path_encoded = self.getEncodedPath(path)
+        with self._impersonateUser():
+            with open(path_encoded, 'a'):
+                os.utime(path_encoded, None)
+        self._invalidateCache(segments)
+
+    def copyFile(self, source_segments, destination_segments, overwrite=False):
+        """
+        See: ILocalFilesystem.
+        """
+        if self.isFolder(destination_segments):
+            destination_segments = destination_segments[:]
+            destination_segments.append(source_segments[-1])
+
+        destination_path = self.getRealPathFromSegments(
+            destination_segments,
+            include_virtual=False,
+        )
+        destination_path_encoded = self.getEncodedPath(destination_path)
+
+        if not overwrite and self.exists(destination_segments):
+            raise OSError(
+                errno.EEXIST,
+                'Destination exists',
+                destination_path_encoded,
+            )
+
+        source_path = self.getRealPathFromSegments(
+            source_segments,
+            include_virtual=False,
+        )
+        source_path_encoded = self.getEncodedPath(source_path)
+
+        with self._impersonateUser():
+            replaced = self._getQuotaUsage(destination_path_encoded)
+            shutil.copyfile(source_path_encoded, destination_path_encoded)
+            size, files = self._getQuotaUsage(destination_path_encoded)
+        self._invalidateCache(destination_segments)
+        self._updateQuota(size - replaced[0], files - replaced[1])
+
+    def copyFolder(
+        self,
+        source_segments,
+        destination_segments,
+        overwrite=False,
+        preserve=True,
+        progress=None,
+        workers=None,
+    ):
+        """
+        See: ILocalFilesystem.
+
+        The tree is listed and the folders and links are created from the
+        calling thread, while the files are copied in parallel using the
+        fastest copy function supported by the OS.
+        The attributes of the folders are copied at the end, from the
+        deepest one.
+        """
+        source_path = self.getRealPathFromSegments(
+            source_segments,
+            include_virtual=False,
+        )
+        source_path_encoded = self.getEncodedPath(source_path)
+        destination_path = self.getRealPathFromSegments(
+            destination_segments,
+            include_virtual=False,
+        )
+        destination_path_encoded = self.getEncodedPath(destination_path)
+
+        # An existing destination is kept when the copy fails, so only the
+        # difference is added to the usage.
+        replaced = self._getQuotaFolderUsage(destination_segments, True)
+        errors = []
+        try:
+            with self._convertToOSError(source_path), self._impersonateUser():
+                if not stat.S_ISDIR(os.lstat(source_path_encoded).st_mode):
+                    raise OSError(
+                        errno.ENOTDIR,
+                        'Not a directory',
+                        source_path_encoded,
+                    )
+                self._copyTree(
+                    source_path_encoded,
+                    destination_path_encoded,
+                    progress=progress,
+                    workers=workers,
+                    worker_context=self._impersonateWorker,
+                    overwrite=overwrite,
+                    preserve=preserve,
+                    sync=False,
+                    errors=errors,
+                )
+        finally:
+            # Members might be copied before an error.
+            self._invalidateCache(destination_segments, recursive=True)
+            self._updateCopyQuota(destination_segments, replaced)
+
+        return [
+            (destination_segments + relative.split(os.sep), error)
+            for relative, error in errors
+        ]
+
+    def _updateCopyQuota(self, segments, replaced):
+        """
+        Update the quota usage with the difference between the usage of
+        the folder at `segments` after a copy and the `replaced` usage.
+        """
+        if self.quota is None:
+            return
+        usage = self._getQuotaFolderUsage(segments, True)
+        if usage is None:
+            return
+        size = usage.size
+        files = usage.files
+        if replaced is not None:
+            size -= replaced.size
+            files -= replaced.files
+        self._updateQuota(size, files)
+
+    def openFolder(self, segments):
+        """
+        See: ILocalFilesystem.
+        """
+        path = self.getRealPathFromSegments(segments)
+        path_encoded = self.getEncodedPath(path)
+
+        # Virtual members can't be modified via the handle.
+        virtual_names = [m.name for m in self._getVirtualMembers(segments)]
+
+        with self._convertToOSError(path), self._impersonateUser():
+            fd = self._osOpen(path_encoded, self.OPEN_FOLDER)
+        return FolderHandle(
+            filesystem=self,
+            segments=segments,
+            path=path,
+            fd=fd,
+            virtual_names=virtual_names,
+        )
+
+    def openFolderCursor(self, segments, batch_size=100):
+        """
+        See: ILocalFilesystem.
+        """
+        return FolderCursor(self, segments, batch_size)
+
+    def watchFolder(self, segments, recursive=False, callback=None):
+        """
+        See: ILocalFilesystem.
+        """
+        watch = FolderWatch(self, segments, recursive)
+        if callback is not None:
+            watch.start(callback)
+        return watch
+
+    def _iterateMembers(self, segments):
+        """
+        Return the iterator with the members of the folder at `segments`,
+        as used by `FolderCursor` and `iterateFolderTree`.
+
+        Real members are kept as scandir entries, so that skipping them
+        doesn't require a stat call.
+        """
+        return self._iterateFolder(segments, self._keepDirEntry)
+
+    def _keepDirEntry(self, entry):
+        """
+        Conversion for `_iterateFolder` which keeps the scandir entry.
+        """
+        return entry
+
+    def _getMemberAttributes(self, member):
+        """
+        Return the `FileAttributes` for a member returned by
+        `_iterateMembers`.
+        """
+        if isinstance(member, FileAttributes):
+            return member
+        return self._dirEntryToFileAttributes(member)
+
+    def setGroup(self, segments, group, permissions=None):
+        """Informational method for not using setGroup."""
+        raise AssertionError('Use addGroup for setting a group.')
+
+    def raiseFailedToAddGroup(self, group, path, message=''):
+        """
+        Helper for raising the exception from a single place.
+        """
+        raise CompatError(
+            1017,
+            _(f'Failed to add group "{group}" for "{path}". {message}'),
+        )
+
+    def raiseFailedToSetOwner(self, owner, path, message=''):
+        """
+        Helper for raising the exception from a single place.
+        """
+        raise CompatError(
+            1016,
+            _(
+                f'Failed to set owner to "{owner}" for "{path}". {message}',
+            ),
+        )
+
+    def _checkChildPath(self, root, child):
+        """
+        Check that child path is inside root path.
+        """
+        child_strip = self.getAbsoluteRealPath(child)
+        root_strip = self.getAbsoluteRealPath(root)
+
+        if child_strip == root_strip:
+            return
+
+        # Make sure /root/path-other is not accepted for /root/path.
+        if not child_strip.startswith(root_strip.rstrip(os.sep) + os.sep):
+            raise CompatError(
+                1018,
+                f'Path "{child}" is outside of locked folder "{root}"',
+            )
+
+    def _parseReparseData(self, raw_reparse_data):
+        """
+        Parse reparse buffer.
 
-    def copyFile(self, source_segments, destination_segments, overwrite=False):
+        Return a dict in format:
+        {
+            'tag': TAG,
+            'length': LENGTH,
+            'data': actual_payload_as_byte_string,
+            ...
+            'optional_struct_member_1': VALUE_FOR_STRUCT_MEMBER,
+            ...
+            }
+
+        When reparse data contains an unknown tag, it will parse the tag
+        and length headers and put everything else in data.
         """
-        See: ILocalFilesystem.
+        # Size of our types.
+        SIZE_ULONG = 4  # sizeof(ULONG)
+        SIZE_USHORT = 2  # sizeof(USHORT)
+        HEADER_SIZE = 20
+
+        # buffer structure:
+        #
+        # typedef struct _REPARSE_DATA_BUFFER {
+        #     ULONG  ReparseTag;
+        #     USHORT ReparseDataLength;
+        #     USHORT Reserved;
+        #     union {
+        #         struct {
+        #             USHORT SubstituteNameOffset;
+        #             USHORT SubstituteNameLength;
+        #             USHORT PrintNameOffset;
+        #             USHORT PrintNameLength;
+        #             ULONG Flags;
+        #             WCHAR PathBuffer[1];
+        #         } SymbolicLinkReparseBuffer;
+        #         struct {
+        #             USHORT SubstituteNameOffset;
+        #             USHORT SubstituteNameLength;
+        #             USHORT PrintNameOffset;
+        #             USHORT PrintNameLength;
+        #             WCHAR PathBuffer[1];
+        #         } MountPointReparseBuffer;
+        #         struct {
+        #             UCHAR  DataBuffer[1];
+        #         } GenericReparseBuffer;
+        #     } DUMMYUNIONNAME;
+        # } REPARSE_DATA_BUFFER, *PREPARSE_DATA_BUFFER;
+
+        # Supported formats for reparse data.
+        # For now only SymbolicLinkReparseBuffer is supported.
+        formats = {
+            # http://msdn.microsoft.com/en-us/library/cc232006.aspx
+            self.IO_REPARSE_TAG_SYMLINK: [
+                ('substitute_name_offset', SIZE_USHORT),
+                ('substitute_name_length', SIZE_USHORT),
+                ('print_name_offset', SIZE_USHORT),
+                ('print_name_length', SIZE_USHORT),
+                ('flags', SIZE_ULONG),
+            ],
+        }
+
+        if len(raw_reparse_data) < HEADER_SIZE:
+            raise CompatException('Reparse buffer to small.')
+
+        result = {}
+        # Parse header.
+        result['tag'] = struct.unpack('<L', raw_reparse_data[:4])[0]
+        result['length'] = struct.unpack('<H', raw_reparse_data[4:6])[0]
+        # Reserved header member is ignored.
+        tail = raw_reparse_data[8:]
+
+        try:
+            structure = formats[result['tag']]
+        except KeyError:
+            structure = []
+
+        for member_name, member_size in structure:
+            member_data = tail[:member_size]
+            tail = tail[member_size:]
+
+            if member_size == SIZE_USHORT:
+                result[member_name] = struct.unpack('<H', member_data)[0]
+            else:
+                result[member_name] = struct.unpack('<L', member_data)[0]
+
+        # Remaining tail is set as data.
+        result['data'] = tail
+        return result
+
+    def _parseSymbolicLinkReparse(self, symbolic_link_data):
         """
-        if self.isFolder(destination_segments):
-            destination_segments = destination_segments[:]
-            destination_segments.append(source_segments[-1])
+        Return a diction with 'name' and 'target' for `symbolic_link_data` as
+        Unicode strings.
+        """
+        result = {'name': None, 'target': None}
 
-        destination_path = self.getRealPathFromSegments(
-            destination_segments,
-            include_virtual=False,
+        offset = symbolic_link_data['print_name_offset']
+        ending = offset + symbolic_link_data['print_name_length']
+        result['name'] = symbolic_link_data['data'][offset:ending].decode(
+            'utf-16',
         )
-        destination_path_encoded = self.getEncodedPath(destination_path)
 
-        if not overwrite and self.exists(destination_segments):
-            raise OSError(
-                errno.EEXIST,
-                'Destination exists',
-                destination_path_encoded,
+        offset = symbolic_link_data['substitute_name_offset']
+        ending = offset + symbolic_link_data['substitute_name_length']
+        target_path = symbolic_link_data['data'][offset:ending].decode('utf-16')
+
+        # Have no idea why we get this marker, but we convert it to
+        # long UNC.
+        if target_path.startswith('\\??\\'):
+            target_path = '\\\\?' + target_path[3:]
+        result['target'] = target_path
+
+        return result
+
+
+@implementer(IFolderHandle)
+class FolderHandle:
+    """
+    See: IFolderHandle.
+
+    All the calls are done using the `dir_fd` argument, so the folder path
+    is no longer resolved by the OS and we don't care if the folder is
+    moved while the handle is opened.
+    """
+
+    def __init__(self, filesystem, segments, path, fd, virtual_names=()):
+        self._filesystem = filesystem
+        self._fd = fd
+        self._virtual_names = virtual_names
+        self.segments = segments
+        self.path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}:{id(self)}:{self.path}'
+
+    @property
+    def closed(self):
+        """
+        See: IFolderHandle.
+        """
+        return self._fd is None
+
+    def fileno(self):
+        """
+        See: IFolderHandle.
+        """
+        if self._fd is None:
+            raise OSError(errno.EBADF, 'Folder handle is closed.', self.path)
+        return self._fd
+
+    def close(self):
+        """
+        See: IFolderHandle.
+        """
+        if self._fd is None:
+            return
+        fd = self._fd
+        self._fd = None
+        os.close(fd)
+
+    def _checkName(self, name, modify=False):
+        """
+        Raise an OSError when `name` is not the name of a direct member.
+
+        When `modify` is True, it also raises a CompatError when `name`
+        is a virtual member.
+        """
+        if (
+            not name
+            or name in ('.', '..')
+            or '/' in name
+            or os.sep in name
+            or '\0' in name
+        ):
+            raise OSError(errno.EINVAL, 'Invalid member name.', name)
+
+        if modify and any(
+            self._filesystem._areEqual([name], [virtual_name])
+            for virtual_name in self._virtual_names
+        ):
+            raise CompatError(1007, 'Modifying a virtual path is not allowed.')
+
+    @contextmanager
+    def _call(self, *names):
+        """
+        Run the OS call as the avatar, relative to the opened folder.
+
+        It converts the errors to have the full path as the filename.
+        """
+        fd = self.fileno()
+        try:
+            with self._filesystem._impersonateUser():
+                yield fd
+        except OSError as error:
+            filename = self.path
+            if names:
+                filename = os.path.join(self.path, names[0])
+            raise OSError(error.errno, error.strerror, filename)
+
+    def stat(self, name, follow_symlinks=True):
+        """
+        See: IFolderHandle.
+        """
+        self._checkName(name)
+        with self._call(name) as fd:
+            return os.stat(name, dir_fd=fd, follow_symlinks=follow_symlinks)
+
+    def open(self, name, flags, mode=_DEFAULT_FILE_MODE):
+        """
+        See: IFolderHandle.
+        """
+        self._checkName(name, modify=True)
+        with self._call(name) as fd:
+            return os.open(name, flags, mode, dir_fd=fd)
+
+    def unlink(self, name):
+        """
+        See: IFolderHandle.
+        """
+        self._checkName(name, modify=True)
+        with self._call(name) as fd:
+            return os.unlink(name, dir_fd=fd)
+
+    def mkdir(self, name, mode=_DEFAULT_FOLDER_MODE):
+        """
+        See: IFolderHandle.
+        """
+        self._checkName(name, modify=True)
+        with self._call(name) as fd:
+            return os.mkdir(name, mode, dir_fd=fd)
+
+    def rename(self, name, new_name, destination=None):
+        """
+        See: IFolderHandle.
+        """
+        if destination is None:
+            destination = self
+        self._checkName(name, modify=True)
+        destination._checkName(new_name, modify=True)
+        destination_fd = destination.fileno()
+        with self._call(name) as fd:
+            return os.rename(
+                name,
+                new_name,
+                src_dir_fd=fd,
+                dst_dir_fd=destination_fd,
             )
 
-        source_path = self.getRealPathFromSegments(
-            source_segments,
-            include_virtual=False,
+    def scandir(self):
+        """
+        See: IFolderHandle.
+        """
+        with self._call() as fd:
+            folder_iterator = scandir(fd)
+        return self._iterateScandir(folder_iterator)
+
+    def _iterateScandir(self, folder_iterator):
+        """
+        Convert the scandir entries, closing the iterator at the end.
+        """
+        with folder_iterator:
+            for entry in folder_iterator:
+                yield self._filesystem._dirEntryToFileAttributes(
+                    entry,
+                    path=os.path.join(self.path, entry.name),
+                )
+
+
+@implementer(IFolderCursor)
+class FolderCursor:
+    """
+    See: IFolderCursor.
+
+    The folder iterator is closed when the cursor is not used for
+    `idle_timeout` seconds or when more than `max_open` cursors have an
+    opened iterator.
+    The idle iterators are closed each time a folder is opened by a
+    cursor, or when `reapIdleCursors` is called.
+    Cursors which are being read count toward `max_open`, but their
+    iterator is not closed, so opening a folder waits while all the
+    opened cursors are being read.
+    The next `read` opens the folder again and skips the members which
+    were already returned, so members added or removed in the meantime
+    might be skipped or returned twice, as for a re-opened directory
+    stream.
+    """
+
+    #: Seconds after which an unused cursor can have its iterator closed.
+    idle_timeout = 30
+    #: Maximum number of cursors with an opened folder iterator.
+    max_open = 256
+
+    # Cursors with an opened iterator, from the least recently used one.
+    _opened = OrderedDict()
+    _opened_lock = threading.Lock()
+    # Notified when an iterator is closed or a read is done.
+    _opened_changed = threading.Condition(_opened_lock)
+
+    def __init__(self, filesystem, segments, batch_size=100):
+        if batch_size < 1:
+            raise AssertionError(f'Invalid batch size: {batch_size}')
+        self._filesystem = filesystem
+        self._members = None
+        self._last_used = 0
+        self._reading = False
+        self.segments = segments
+        self.path = filesystem.getRealPathFromSegments(segments)
+        self.batch_size = batch_size
+        self.position = 0
+        self.closed = False
+        self.exhausted = False
+        # The folder is opened right away so that errors are raised here.
+        with self._opened_lock:
+            self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}:{id(self)}:{self.path}'
+
+    @property
+    def suspended(self):
+        """
+        See: IFolderCursor.
+        """
+        return self._members is None and not (self.closed or self.exhausted)
+
+    def read(self):
+        """
+        See: IFolderCursor.
+        """
+        if self.closed:
+            raise OSError(errno.EBADF, 'Folder cursor is closed.', self.path)
+
+        if self.exhausted:
+            return []
+
+        with self._opened_lock:
+            skip = 0
+            if self._members is None:
+                self._open()
+                skip = self.position
+            # While reading, the iterator is not closed by other threads.
+            self._reading = True
+            members = self._members
+
+        batch = []
+        try:
+            # Skipped members are not converted, so this is cheap.
+            for _member in itertools.islice(members, skip):
+                pass
+            for member in members:
+                batch.append(self._filesystem._getMemberAttributes(member))
+                if len(batch) == self.batch_size:
+                    break
+        except Exception:
+            # The next read will start again from the current position.
+            self._doneReading(suspend=True)
+            raise
+
+        self.position += len(batch)
+        if len(batch) < self.batch_size:
+            self.exhausted = True
+        self._doneReading(suspend=self.exhausted)
+        return batch
+
+    def close(self):
+        """
+        See: IFolderCursor.
+        """
+        self.closed = True
+        self._suspend()
+
+    @classmethod
+    def reapIdleCursors(cls):
+        """
+        Close the iterator of the cursors which were not used for their
+        `idle_timeout`.
+
+        Return the number of closed iterators.
+        """
+        with cls._opened_lock:
+            idle = cls._getIdle(time.monotonic())
+            for cursor in idle:
+                cursor._detach()
+        return len(idle)
+
+    @classmethod
+    def _getIdle(cls, now):
+        """
+        Return the cursors from the registry which are idle at `now`.
+
+        Called with the registry lock held.
+        """
+        return [
+            cursor
+            for cursor in cls._opened
+            if not cursor._reading
+            and now - cursor._last_used >= cursor.idle_timeout
+        ]
+
+    def _open(self):
+        """
+        Open the folder iterator and add the cursor to the registry as
+        the most recently used one.
+
+        The idle iterators are closed first, and then the least recently
+        used ones which are not being read, while there is no free slot.
+        Called with the registry lock held, so that concurrent opens
+        can't go over `max_open`.
+        """
+        for cursor in self._getIdle(time.monotonic()):
+            cursor._detach()
+        while self._opened and len(self._opened) >= self.max_open:
+            for cursor in self._opened:
+                if not cursor._reading:
+                    cursor._detach()
+                    break
+            else:
+                # All the opened cursors are being read.
+                self._opened_changed.wait()
+
+        self._members = self._filesystem._iterateMembers(self.segments)
+        self._last_used = time.monotonic()
+        self._opened[self] = None
+
+    def _doneReading(self, suspend):
+        """
+        Mark the end of a read, closing the iterator when `suspend` is
+        True, or marking the cursor as the most recently used one.
+        """
+        with self._opened_lock:
+            self._reading = False
+            if suspend:
+                self._detach()
+            elif self in self._opened:
+                self._last_used = time.monotonic()
+                self._opened.move_to_end(self)
+            self._opened_changed.notify()
+
+    def _suspend(self):
+        """
+        Close the folder iterator.
+        """
+        with self._opened_lock:
+            self._detach()
+
+    def _detach(self):
+        """
+        Close the iterator and remove the cursor from the registry.
+
+        Called with the registry lock held.
+        """
+        self._opened.pop(self, None)
+        self._opened_changed.notify()
+        members, self._members = self._members, None
+        close = getattr(members, 'close', None)
+        if close is not None:
+            close()
+
+
+@implementer(IFolderEvent)
+class FolderEvent:
+    """
+    See: IFolderEvent.
+    """
+
+    __slots__ = ('is_folder', 'kind', 'segments', 'source_segments')
+
+    def __init__(self, kind, segments, is_folder, source_segments=None):
+        self.kind = kind
+        self.segments = segments
+        self.is_folder = is_folder
+        self.source_segments = source_segments
+
+    def __eq__(self, other):
+        if not isinstance(other, FolderEvent):
+            return NotImplemented
+        return (
+            self.kind == other.kind
+            and self.segments == other.segments
+            and self.is_folder == other.is_folder
+            and self.source_segments == other.source_segments
         )
-        source_path_encoded = self.getEncodedPath(source_path)
 
-        with self._impersonateUser():
-            shutil.copyfile(source_path_encoded, destination_path_encoded)
+    def __repr__(self):
+        source = ''
+        if self.source_segments is not None:
+            source = f'{self.source_segments} -> '
+        return f'{self.__class__.__name__}:{self.kind}:{source}{self.segments}'
 
-    def setGroup(self, segments, group, permissions=None):
-        """Informational method for not using setGroup."""
-        raise AssertionError('Use addGroup for setting a group.')
 
-    def raiseFailedToAddGroup(self, group, path, message=''):
+@implementer(IFolderWatch)
+class FolderWatch:
+    """
+    See: IFolderWatch.
+
+    The changes are reported by inotify, for the folders watched based on
+    their segments, so changes from virtual folders are reported with
+    the virtual segments.
+    Folders created in a recursive watch are listed right after they are
+    watched, and their members are reported as created, so members
+    created in the meantime might be reported twice.
+    Links to folders are not followed.
+    """
+
+    #: Seconds between the checks for a stopped callback thread.
+    stop_interval = 0.5
+
+    # Changes reported by the watched folders.
+    _mask = (
+        IN_CREATE
+        | IN_MODIFY
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+        | IN_ONLYDIR
+        | IN_EXCL_UNLINK
+    )
+
+    def __init__(self, filesystem, segments, recursive=False):
+        self._filesystem = filesystem
+        self._inotify = Inotify()
+        self._wds = {}
+        self._thread = None
+        self._stopped = threading.Event()
+        self.segments = segments
+        self.recursive = recursive
+        try:
+            self._root_wd = self._addWatch(segments)
+            if recursive:
+                for child_segments, _attributes in filesystem.iterateFolderTree(
+                    segments, filter=lambda path, is_folder: is_folder
+                ):
+                    self._addChildWatch(child_segments)
+        except Exception:
+            self._inotify.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def __iter__(self):
+        """
+        Yield the `FolderEvent` for the changes, until closed.
+        """
+        while not self.closed:
+            yield from self.read(timeout=self.stop_interval)
+
+    @property
+    def closed(self):
         """
-        Helper for raising the exception from a single place.
+        See: IFolderWatch.
         """
-        raise CompatError(
-            1017,
-            _(f'Failed to add group "{group}" for "{path}". {message}'),
-        )
+        return self._inotify.closed
 
-    def raiseFailedToSetOwner(self, owner, path, message=''):
+    def fileno(self):
         """
-        Helper for raising the exception from a single place.
+        See: IFolderWatch.
         """
-        raise CompatError(
-            1016,
-            _(
-                f'Failed to set owner to "{owner}" for "{path}". {message}',
-            ),
+        return self._inotify.fileno()
+
+    def read(self, timeout=None):
+        """
+        See: IFolderWatch.
+        """
+        if self.closed:
+            return []
+        readable, _, _ = select.select([self.fileno()], [], [], timeout)
+        if not readable or self.closed:
+            return []
+        return self._coalesce(self._getEvents(self._inotify.readEvents()))
+
+    def start(self, callback):
+        """
+        Call `callback` with the list of events, from a separate thread,
+        until closed.
+
+        Without a callback, `close` should be called from the thread
+        reading the changes.
+        """
+        if self._thread is not None:
+            raise AssertionError('Folder watch already started.')
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(callback,),
+            name='chevah-compat-watch',
+            daemon=True,
         )
+        self._thread.start()
 
-    def _checkChildPath(self, root, child):
+    def close(self):
         """
-        Check that child path is inside root path.
+        See: IFolderWatch.
         """
-        child_strip = self.getAbsoluteRealPath(child)
-        root_strip = self.getAbsoluteRealPath(root)
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            # Wait for the thread to stop reading the changes.
+            thread.join()
+        self._inotify.close()
+
+    def _run(self, callback):
+        """
+        Deliver the events to `callback`, until closed.
+        """
+        while not self._stopped.is_set():
+            events = self.read(timeout=self.stop_interval)
+            if events:
+                callback(events)
 
-        if not child_strip.startswith(root_strip):
-            raise CompatError(
-                1018,
-                f'Path "{child}" is outside of locked folder "{root}"',
-            )
+    def _addWatch(self, segments):
+        """
+        Watch the folder at `segments` and return the watch descriptor.
 
-    def _parseReparseData(self, raw_reparse_data):
+        Return None for the parts of a virtual path, as they can't be
+        changed.
         """
-        Parse reparse buffer.
+        filesystem = self._filesystem
+        if segments and filesystem._getVirtualMembers(segments):
+            return None
+        path = filesystem.getRealPathFromSegments(segments)
+        path_encoded = filesystem.getEncodedPath(path)
+        with filesystem._impersonateUser():
+            wd = self._inotify.addWatch(path_encoded, self._mask)
+        self._wds[wd] = segments
+        return wd
+
+    def _addChildWatch(self, segments):
+        """
+        Watch the folder at `segments`, from the watched tree.
 
-        Return a dict in format:
-        {
-            'tag': TAG,
-            'length': LENGTH,
-            'data': actual_payload_as_byte_string,
-            ...
-            'optional_struct_member_1': VALUE_FOR_STRUCT_MEMBER,
-            ...
-            }
+        Folders which were removed or which can't be read are ignored,
+        but an error is raised when over the limit of watches.
+        """
+        try:
+            self._addWatch(segments)
+        except OSError as error:
+            if error.errno == errno.ENOSPC:
+                raise
 
-        When reparse data contains an unknown tag, it will parse the tag
-        and length headers and put everything else in data.
+    def _watchTree(self, segments):
         """
-        # Size of our types.
-        SIZE_ULONG = 4  # sizeof(ULONG)
-        SIZE_USHORT = 2  # sizeof(USHORT)
-        HEADER_SIZE = 20
+        Watch the new folder at `segments` and its descendants, and return
+        the events for their members.
+        """
+        result = []
+        try:
+            self._addChildWatch(segments)
+            for (
+                child_segments,
+                attributes,
+            ) in self._filesystem.iterateFolderTree(segments):
+                is_folder = attributes.is_folder and not attributes.is_link
+                result.append(FolderEvent('create', child_segments, is_folder))
+                if is_folder:
+                    self._addChildWatch(child_segments)
+        except OSError as error:
+            if error.errno == errno.ENOSPC:
+                result.append(FolderEvent('overflow', self.segments, True))
+        return result
 
-        # buffer structure:
-        #
-        # typedef struct _REPARSE_DATA_BUFFER {
-        #     ULONG  ReparseTag;
-        #     USHORT ReparseDataLength;
-        #     USHORT Reserved;
-        #     union {
-        #         struct {
-        #             USHORT SubstituteNameOffset;
-        #             USHORT SubstituteNameLength;
-        #             USHORT PrintNameOffset;
-        #             USHORT PrintNameLength;
-        #             ULONG Flags;
-        #             WCHAR PathBuffer[1];
-        #         } SymbolicLinkReparseBuffer;
-        #         struct {
-        #             USHORT SubstituteNameOffset;
-        #             USHORT SubstituteNameLength;
-        #             USHORT PrintNameOffset;
-        #             USHORT PrintNameLength;
-        #             WCHAR PathBuffer[1];
-        #         } MountPointReparseBuffer;
-        #         struct {
-        #             UCHAR  DataBuffer[1];
-        #         } GenericReparseBuffer;
-        #     } DUMMYUNIONNAME;
-        # } REPARSE_DATA_BUFFER, *PREPARSE_DATA_BUFFER;
+    def _unwatchTree(self, segments):
+        """
+        Stop watching the folder at `segments` and its descendants.
+        """
+        size = len(segments)
+        for wd, watched in list(self._wds.items()):
+            if watched[:size] != segments:
+                continue
+            del self._wds[wd]
+            try:
+                self._inotify.removeWatch(wd)
+            except OSError:
+                # Already removed by the kernel.
+                pass
 
-        # Supported formats for reparse data.
-        # For now only SymbolicLinkReparseBuffer is supported.
-        formats = {
-            # http://msdn.microsoft.com/en-us/library/cc232006.aspx
-            self.IO_REPARSE_TAG_SYMLINK: [
-                ('substitute_name_offset', SIZE_USHORT),
-                ('substitute_name_length', SIZE_USHORT),
-                ('print_name_offset', SIZE_USHORT),
-                ('print_name_length', SIZE_USHORT),
-                ('flags', SIZE_ULONG),
-            ],
-        }
+    def _moveTree(self, source, destination):
+        """
+        Update the segments of the watched folders from `source` after
+        being moved to `destination`.
+        """
+        size = len(source)
+        for wd, watched in self._wds.items():
+            if watched[:size] == source:
+                self._wds[wd] = destination + watched[size:]
 
-        if len(raw_reparse_data) < HEADER_SIZE:
-            raise CompatException('Reparse buffer to small.')
+    def _getEvents(self, raw_events):
+        """
+        Return the list of `FolderEvent` for the inotify `raw_events`.
+        """
+        result = []
+        moves = {}
+        for wd, mask, cookie, name in raw_events:
+            if mask & IN_Q_OVERFLOW:
+                result.append(FolderEvent('overflow', self.segments, True))
+                continue
 
-        result = {}
-        # Parse header.
-        result['tag'] = struct.unpack('<L', raw_reparse_data[:4])[0]
-        result['length'] = struct.unpack('<H', raw_reparse_data[4:6])[0]
-        # Reserved header member is ignored.
-        tail = raw_reparse_data[8:]
+            parent = self._wds.get(wd)
+            if parent is None:
+                continue
 
-        try:
-            structure = formats[result['tag']]
-        except KeyError:
-            structure = []
+            if name is None:
+                if mask & IN_IGNORED:
+                    del self._wds[wd]
+                elif wd == self._root_wd and mask & (
+                    IN_MOVE_SELF | IN_DELETE_SELF
+                ):
+                    # Changes are no longer done to the watched segments.
+                    result.append(FolderEvent('delete', self.segments, True))
+                    self._unwatchTree(self.segments)
+                continue
 
-        for member_name, member_size in structure:
-            member_data = tail[:member_size]
-            tail = tail[member_size:]
+            segments = parent + [self._filesystem._decodeFilename(name)]
+            is_folder = bool(mask & IN_ISDIR)
+            if mask & IN_MOVED_FROM:
+                # Reported as deleted, unless moved inside the watched
+                # folders.
+                event = FolderEvent('delete', segments, is_folder)
+                moves[cookie] = event
+                result.append(event)
+                continue
 
-            if member_size == SIZE_USHORT:
-                result[member_name] = struct.unpack('<H', member_data)[0]
-            else:
-                result[member_name] = struct.unpack('<L', member_data)[0]
+            if mask & IN_MOVED_TO:
+                event = moves.pop(cookie, None)
+                if event is None:
+                    result.append(FolderEvent('create', segments, is_folder))
+                    if is_folder and self.recursive:
+                        result.extend(self._watchTree(segments))
+                    continue
+                event.kind = 'move'
+                event.source_segments = event.segments
+                event.segments = segments
+                if is_folder:
+                    self._moveTree(event.source_segments, segments)
+                continue
 
-        # Remaining tail is set as data.
-        result['data'] = tail
+            if mask & IN_CREATE:
+                result.append(FolderEvent('create', segments, is_folder))
+                if is_folder and self.recursive:
+                    result.extend(self._watchTree(segments))
+            elif mask & IN_MODIFY:
+                result.append(FolderEvent('modify', segments, is_folder))
+            elif mask & IN_CLOSE_WRITE:
+                result.append(FolderEvent('close_write', segments, is_folder))
+            elif mask & IN_DELETE:
+                result.append(FolderEvent('delete', segments, is_folder))
+
+        for event in moves.values():
+            if event.is_folder:
+                self._unwatchTree(event.segments)
         return result
 
-    def _parseSymbolicLinkReparse(self, symbolic_link_data):
+    @staticmethod
+    def _coalesce(events):
         """
-        Return a diction with 'name' and 'target' for `symbolic_link_data` as
-        Unicode strings.
-        """
-        result = {'name': None, 'target': None}
-
-        offset = symbolic_link_data['print_name_offset']
-        ending = offset + symbolic_link_data['print_name_length']
-        result['name'] = symbolic_link_data['data'][offset:ending].decode(
-            'utf-16',
-        )
-
-        offset = symbolic_link_data['substitute_name_offset']
-        ending = offset + symbolic_link_data['substitute_name_length']
-        target_path = symbolic_link_data['data'][offset:ending].decode('utf-16')
-
-        # Have no idea why we get this marker, but we convert it to
-        # long UNC.
-        if target_path.startswith('\\??\\'):
-            target_path = '\\\\?' + target_path[3:]
-        result['target'] = target_path
+        Return the `events` without the repeated changes of a member.
 
+        A member is modified as part of being created, so modifications
+        right after being created are not reported.
+        """
+        result = []
+        reported = {}
+        for event in events:
+            if event.source_segments is not None:
+                reported.pop(tuple(event.source_segments), None)
+            kinds = reported.setdefault(tuple(event.segments), set())
+            if event.kind in kinds:
+                continue
+            if event.kind == 'modify' and 'create' in kinds:
+                continue
+            if event.kind in ('create', 'delete', 'move'):
+                # A different file is now at this path.
+                kinds.clear()
+            kinds.add(event.kind)
+            result.append(event)
         return result
 
 
@@ -1069,8 +4700,31 @@ class PosixFilesystemBase:
 class FileAttributes:
     """
     See: IFileAttributes.
+
+    With `cache_hash`, the hash is computed only once, so the attributes
+    should not be changed after the instance was hashed.
     """
 
+    __slots__ = (
+        '_cache_hash',
+        '_hash',
+        'extended_attributes',
+        'gid',
+        'group',
+        'hardlinks',
+        'is_file',
+        'is_folder',
+        'is_link',
+        'mode',
+        'modified',
+        'name',
+        'node_id',
+        'owner',
+        'path',
+        'size',
+        'uid',
+    )
+
     def __init__(
         self,
         name,
@@ -1087,6 +4741,8 @@ class FileAttributes:
         owner=None,
         group=None,
         node_id=None,
+        cache_hash=False,
+        extended_attributes=None,
     ):
         self.name = name
         self.path = path
@@ -1103,9 +4759,46 @@ class FileAttributes:
         self.node_id = node_id
         self.owner = owner
         self.group = group
+        self.extended_attributes = extended_attributes
+
+        self._cache_hash = cache_hash
+        self._hash = None
+
+    @classmethod
+    def fromStatus(cls, name, path, stats, is_link=None, cache_hash=False):
+        """
+        Return the attributes for the `os.stat_result` `stats`.
+
+        When `is_link` is None, it is read from `stats`, so `stats` should
+        be the result of `lstat`.
+        """
+        mode = _getMode(stats)
+        is_folder = stat.S_ISDIR(mode)
+
+        if is_link is None:
+            is_link = stat.S_ISLNK(mode)
+
+        return cls(
+            name=name,
+            path=path,
+            size=stats.st_size,
+            is_file=stat.S_ISREG(mode),
+            is_folder=is_folder,
+            is_link=is_link,
+            modified=stats.st_mtime,
+            mode=mode,
+            hardlinks=stats.st_nlink,
+            uid=stats.st_uid,
+            gid=stats.st_gid,
+            node_id=stats.st_ino,
+            cache_hash=cache_hash,
+        )
 
     def __hash__(self):
-        return hash(
+        if self._hash is not None:
+            return self._hash
+
+        result = hash(
             (
                 self.name,
                 self.path,
@@ -1123,18 +4816,343 @@ class FileAttributes:
                 self.group,
             ),
         )
+        if self._cache_hash:
+            self._hash = result
+        return result
 
     def __eq__(self, other):
+        if self is other:
+            return True
+
+        # Start with the attributes which are most likely to differ.
         return (
             isinstance(other, self.__class__)
-            and self.__dict__ == other.__dict__
+            and self.path == other.path
+            and self.name == other.name
+            and self.size == other.size
+            and self.modified == other.modified
+            and self.node_id == other.node_id
+            and self.mode == other.mode
+            and self.is_folder == other.is_folder
+            and self.is_file == other.is_file
+            and self.is_link == other.is_link
+            and self.hardlinks == other.hardlinks
+            and self.uid == other.uid
+            and self.gid == other.gid
+            and self.owner == other.owner
+            and self.group == other.group
         )
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __repr__(self):
-        return f'{self.__class__}:{id(self)}:{self.__dict__}'
+        # Same format as when the attributes were stored in `__dict__`.
+        values = {
+            'name': self.name,
+            'path': self.path,
+            'size': self.size,
+            'is_folder': self.is_folder,
+            'is_file': self.is_file,
+            'is_link': self.is_link,
+            'modified': self.modified,
+            'mode': self.mode,
+            'hardlinks': self.hardlinks,
+            'uid': self.uid,
+            'gid': self.gid,
+            'node_id': self.node_id,
+            'owner': self.owner,
+            'group': self.group,
+        }
+        return f'{self.__class__}:{id(self)}:{values}'
+
+
+@implementer(IFolderListing)
+class FolderListing:
+    """
+    See: IFolderListing.
+
+    The names are stored as UTF-8 in a single buffer, with the offset
+    of each name in a separate column.
+    The owner and group names are not stored.
+    """
+
+    FILE = 1
+    FOLDER = 2
+    LINK = 4
+    VIRTUAL = 8
+    # Set when the member has no node_id.
+    _NO_NODE_ID = 16
+
+    _COLUMNS = (
+        ('sizes', 'q'),
+        ('modified', 'd'),
+        ('modes', 'L'),
+        ('hardlinks', 'L'),
+        ('uids', 'q'),
+        ('gids', 'q'),
+        ('node_ids', 'Q'),
+        ('flags', 'B'),
+    )
+    _SORT_COLUMNS = {'size': 'sizes', 'modified': 'modified'}
+
+    def __init__(self, path):
+        self.path = path
+        for column, typecode in self._COLUMNS:
+            setattr(self, column, array(typecode))
+        self._names = bytearray()
+        self._name_offsets = array('Q', [0])
+        # Paths for the members which are not direct children of `path`,
+        # as for virtual folders.
+        self._paths = {}
+
+    def appendStatus(self, name, stats, is_link):
+        """
+        Add a member with the `os.stat_result` from `stats`.
+        """
+        mode = _getMode(stats)
+        flags = 0
+        if stat.S_ISREG(mode):
+            flags |= self.FILE
+        if stat.S_ISDIR(mode):
+            flags |= self.FOLDER
+        if is_link:
+            flags |= self.LINK
+
+        self.sizes.append(stats.st_size)
+        self.modified.append(stats.st_mtime)
+        self.modes.append(mode)
+        self.hardlinks.append(stats.st_nlink)
+        self.uids.append(stats.st_uid)
+        self.gids.append(stats.st_gid)
+        self.node_ids.append(stats.st_ino)
+        self.flags.append(flags)
+        self._appendName(name)
+
+    def append(self, attributes, is_virtual=False):
+        """
+        Add a member from its `IFileAttributes`.
+        """
+        flags = 0
+        if attributes.is_file:
+            flags |= self.FILE
+        if attributes.is_folder:
+            flags |= self.FOLDER
+        if attributes.is_link:
+            flags |= self.LINK
+        if is_virtual:
+            flags |= self.VIRTUAL
+
+        node_id = attributes.node_id
+        if node_id is None:
+            flags |= self._NO_NODE_ID
+            node_id = 0
+
+        self.sizes.append(attributes.size)
+        self.modified.append(attributes.modified)
+        self.modes.append(attributes.mode)
+        self.hardlinks.append(attributes.hardlinks)
+        self.uids.append(-1 if attributes.uid is None else attributes.uid)
+        self.gids.append(-1 if attributes.gid is None else attributes.gid)
+        self.node_ids.append(node_id)
+        self.flags.append(flags)
+        self._appendName(attributes.name)
+
+        if attributes.path != os.path.join(self.path, attributes.name):
+            self._paths[attributes.name] = attributes.path
+
+    def _appendName(self, name):
+        """
+        Add `name` to the names buffer.
+        """
+        # Keep any surrogate, so that all names can be decoded back.
+        self._names += name.encode('utf-8', 'surrogatepass')
+        self._name_offsets.append(len(self._names))
+
+    def __len__(self):
+        return len(self.flags)
+
+    def getName(self, index):
+        """
+        See: IFolderListing.
+        """
+        start = self._name_offsets[index]
+        end = self._name_offsets[index + 1]
+        return self._names[start:end].decode('utf-8', 'surrogatepass')
+
+    def __getitem__(self, index):
+        """
+        See: IFolderListing.
+        """
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('Folder listing index out of range.')
+
+        name = self.getName(index)
+        flags = self.flags[index]
+        path = self._paths.get(name)
+        if path is None:
+            path = os.path.join(self.path, name)
+
+        uid = self.uids[index]
+        gid = self.gids[index]
+        node_id = self.node_ids[index]
+        return FileAttributes(
+            name=name,
+            path=path,
+            size=self.sizes[index],
+            is_file=bool(flags & self.FILE),
+            is_folder=bool(flags & self.FOLDER),
+            is_link=bool(flags & self.LINK),
+            modified=self.modified[index],
+            mode=self.modes[index],
+            hardlinks=self.hardlinks[index],
+            uid=None if uid == -1 else uid,
+            gid=None if gid == -1 else gid,
+            node_id=None if flags & self._NO_NODE_ID else node_id,
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return f'{self.__class__}:{id(self)}:{self.path}:{len(self)}'
+
+    def sort(self, key='name', reverse=False):
+        """
+        See: IFolderListing.
+        """
+        if key == 'name':
+            get_key = self.getName
+        elif key in self._SORT_COLUMNS:
+            get_key = getattr(self, self._SORT_COLUMNS[key]).__getitem__
+        else:
+            raise AssertionError(f'Unknown sort key "{key}".')
+
+        return self._take(
+            sorted(range(len(self)), key=get_key, reverse=reverse)
+        )
+
+    def _getIndexes(self, include, exclude):
+        """
+        Return the indexes of the members having all the `include` flags
+        and none of the `exclude` flags.
+        """
+        return [
+            index
+            for index, flags in enumerate(self.flags)
+            if flags & include == include and not flags & exclude
+        ]
+
+    def filter(self, include=0, exclude=0):
+        """
+        See: IFolderListing.
+        """
+        return self._take(self._getIndexes(include, exclude))
+
+    def count(self, include=0, exclude=0):
+        """
+        See: IFolderListing.
+        """
+        if not include and not exclude:
+            return len(self)
+        return len(self._getIndexes(include, exclude))
+
+    def getTotalSize(self, include=0, exclude=0):
+        """
+        See: IFolderListing.
+        """
+        if not include and not exclude:
+            return sum(self.sizes)
+
+        return sum(
+            size
+            for size, flags in zip(self.sizes, self.flags)
+            if flags & include == include and not flags & exclude
+        )
+
+    def _take(self, indexes):
+        """
+        Return a new listing with the members at `indexes`, in that order.
+        """
+        result = self.__class__(self.path)
+        for column, typecode in self._COLUMNS:
+            values = getattr(self, column)
+            setattr(
+                result, column, array(typecode, [values[i] for i in indexes])
+            )
+
+        names = self._names
+        offsets = self._name_offsets
+        for index in indexes:
+            result._names += names[offsets[index] : offsets[index + 1]]
+            result._name_offsets.append(len(result._names))
+
+        result._paths = self._paths
+        return result
+
+
+@implementer(ITreeUsage)
+class TreeUsage:
+    """
+    See: ITreeUsage.
+    """
+
+    __slots__ = (
+        'allocated',
+        'errors',
+        'extensions',
+        'files',
+        'folders',
+        'links',
+        'size',
+    )
+
+    def __init__(self):
+        self.files = 0
+        self.folders = 0
+        self.links = 0
+        self.size = 0
+        self.allocated = 0
+        self.errors = 0
+        self.extensions = {}
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}('
+            f'files={self.files}, folders={self.folders}, '
+            f'links={self.links}, size={self.size}, '
+            f'allocated={self.allocated}, errors={self.errors})'
+        )
+
+    def addFile(self, name, size, allocated):
+        """
+        See: ITreeUsage.
+        """
+        self.files += 1
+        self.size += size
+        self.allocated += allocated
+        extension = os.path.splitext(name)[1].lower()
+        files, total = self.extensions.get(extension, (0, 0))
+        self.extensions[extension] = (files + 1, total + size)
+
+    def update(self, other):
+        """
+        See: ITreeUsage.
+        """
+        self.files += other.files
+        self.folders += other.folders
+        self.links += other.links
+        self.size += other.size
+        self.allocated += other.allocated
+        self.errors += other.errors
+        extensions = self.extensions
+        for extension, (files, size) in other.extensions.items():
+            current_files, current_size = extensions.get(extension, (0, 0))
+            extensions[extension] = (current_files + files, current_size + size)
 
 
 def _win_getEncodedPath(path):
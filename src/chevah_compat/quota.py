@@ -0,0 +1,262 @@
+# Copyright (c) 2026 Adi Roiban.
+# See LICENSE for details.
+"""
+Storage usage accounting for the avatars of a local filesystem.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from zope.interface import implementer
+
+from chevah_compat.exceptions import CompatError
+from chevah_compat.helpers import NoOpContext, _
+from chevah_compat.interfaces import IQuotaTracker
+
+_log = logging.getLogger(__name__)
+
+
+@implementer(IQuotaTracker)
+class QuotaTracker:
+    """
+    See: IQuotaTracker.
+
+    The usage is kept for each avatar root path and it is stored as a
+    JSON file, which is replaced atomically.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Held for the whole write of the store, so that the snapshots
+        # are saved in the order in which they were taken.
+        self._write_lock = threading.Lock()
+        self._usage = {}
+        self._filesystems = {}
+        self._dirty = False
+        self._stopped = threading.Event()
+        self._thread = None
+        self._load()
+
+    def track(self, filesystem):
+        """
+        See: IQuotaTracker.
+
+        The root folder of an avatar which is not locked into its home
+        folder can be the whole disk, so it is not tracked.
+        """
+        avatar = filesystem.avatar
+        if avatar is None or not avatar.lock_in_home_folder:
+            raise AssertionError(
+                'Only avatars locked into the home folder can be tracked.'
+            )
+        key = self._getKey(filesystem)
+        filesystem.quota = self
+        with self._lock:
+            self._filesystems[key] = filesystem
+            is_known = key in self._usage
+        if not is_known:
+            self.reconcile(filesystem)
+
+    def getUsage(self, filesystem):
+        """
+        See: IQuotaTracker.
+        """
+        with self._lock:
+            size, files, _reconciled = self._usage.get(
+                self._getKey(filesystem), (0, 0, 0)
+            )
+        return size, files
+
+    def check(self, filesystem, size, limit):
+        """
+        See: IQuotaTracker.
+        """
+        used, _files = self.getUsage(filesystem)
+        if used + size <= limit:
+            return
+        raise CompatError(
+            1019,
+            _(
+                f'Quota exceeded for "{self._getKey(filesystem)}". '
+                f'{used} bytes used, {size} requested and the limit is '
+                f'{limit}.'
+            ),
+        )
+
+    def update(self, filesystem, size, files):
+        """
+        See: IQuotaTracker.
+        """
+        key = self._getKey(filesystem)
+        with self._lock:
+            used, count, reconciled = self._usage.get(key, (0, 0, 0))
+            self._usage[key] = (used + size, count + files, reconciled)
+            self._dirty = True
+
+    def reconcile(self, filesystem):
+        """
+        See: IQuotaTracker.
+
+        The avatar is not impersonated, as on Unix the impersonation
+        changes the account of the whole process.
+        For the same reason, a scan from a separate thread which overlaps
+        the impersonation done by another thread runs with the account of
+        that avatar, and it might not be able to read all the folders.
+        When the scan has errors, a known usage is kept, as the scan might
+        not include all the files.
+        Changes done while the tree is scanned might not be included,
+        and they are fixed by the next reconcile.
+        """
+        path = filesystem.getRealPathFromSegments([])
+        usage = filesystem._scanTree(
+            filesystem.getEncodedPath(path),
+            [],
+            one_filesystem=False,
+            progress=None,
+            workers=None,
+            worker_context=NoOpContext,
+        )
+        key = self._getKey(filesystem)
+        with self._lock:
+            if usage.errors:
+                if key in self._usage:
+                    return
+                # Better than no usage, but reconciled again on next run.
+                self._usage[key] = (usage.size, usage.files, 0)
+            else:
+                self._usage[key] = (usage.size, usage.files, int(time.time()))
+            self._dirty = True
+
+    def reconcileAll(self):
+        """
+        Reconcile the usage for all the tracked filesystems and save it.
+
+        Errors for a filesystem are logged and they don't stop the
+        reconcile of the others.
+        """
+        with self._lock:
+            filesystems = list(self._filesystems.items())
+        for key, filesystem in filesystems:
+            try:
+                self.reconcile(filesystem)
+            except Exception:
+                _log.exception('Failed to reconcile the quota for "%s".', key)
+        self.flush()
+
+    def flush(self):
+        """
+        See: IQuotaTracker.
+        """
+        with self._write_lock:
+            self._flush()
+
+    def _flush(self):
+        """
+        Write the usage to the store, while holding the write lock.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            content = json.dumps(
+                {
+                    'version': 1,
+                    'usage': {
+                        key: {'size': size, 'files': files, 'reconciled': date}
+                        for key, (size, files, date) in self._usage.items()
+                    },
+                }
+            )
+            self._dirty = False
+
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, temporary_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as stream:
+                stream.write(content)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(temporary_path, self.path)
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            os.unlink(temporary_path)
+            raise
+
+    def start(self, interval):
+        """
+        See: IQuotaTracker.
+        """
+        if self._thread is not None:
+            raise AssertionError('Quota tracker already started.')
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(interval,),
+            name='chevah-compat-quota',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        See: IQuotaTracker.
+        """
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join()
+        self.flush()
+
+    def _run(self, interval):
+        """
+        Reconcile and save the usage every `interval` seconds, until
+        stopped.
+
+        The errors are logged, so that they don't stop the thread.
+        """
+        while not self._stopped.wait(interval):
+            try:
+                self.reconcileAll()
+            except Exception:
+                # Keep reconciling, as the error might be temporary.
+                _log.exception('Failed to save the quota usage.')
+
+    def _load(self):
+        """
+        Load the usage from the store, if it exists.
+
+        A store which can't be parsed is ignored, so that the usage is
+        reconciled when the filesystems are tracked.
+        """
+        try:
+            with open(self.path) as stream:
+                content = json.load(stream)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # Partially written or corrupted.
+            return
+
+        usage = {}
+        try:
+            for key, value in content['usage'].items():
+                usage[key] = (
+                    int(value['size']),
+                    int(value['files']),
+                    int(value['reconciled']),
+                )
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return
+        self._usage = usage
+
+    @staticmethod
+    def _getKey(filesystem):
+        """
+        Return the key under which the usage of `filesystem` is kept.
+        """
+        return filesystem.getRealPathFromSegments([])
@@ -0,0 +1,172 @@
+# Copyright (c) 2026 Adi Roiban.
+# See LICENSE for details.
+"""
+Tests for the checksum cache.
+"""
+
+import hashlib
+import hmac
+import os
+import time
+
+from chevah_compat.checksum_cache import ChecksumCache
+from chevah_compat.interfaces import IChecksumCache
+from chevah_compat.testing import CompatTestCase, conditionals
+
+
+class TestChecksumCache(CompatTestCase):
+    """
+    Tests for ChecksumCache.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.folder, _ = self.tempFolder()
+        self.secret = b'test-secret'
+        self.sut = ChecksumCache(secret=self.secret)
+        self.addCleanup(self.sut.close)
+        self.calls = 0
+
+    def makeFile(self, content, age=60):
+        """
+        Create a file with `content`, modified `age` seconds ago, and
+        return its descriptor.
+        """
+        path = os.path.join(self.folder, 'file')
+        with open(path, 'wb') as stream:
+            stream.write(content)
+        modified = time.time_ns() - age * 10**9
+        os.utime(path, ns=(modified, modified))
+        fd = os.open(path, os.O_RDONLY)
+        self.addCleanup(os.close, fd)
+        return fd
+
+    def compute(self):
+        """
+        Return a new digest for each call.
+        """
+        self.calls += 1
+        return f'digest-{self.calls}'
+
+    def test_init(self):
+        """
+        No sidecar is used by default.
+        """
+        self.assertProvides(IChecksumCache, self.sut)
+        self.assertIsNone(self.sut.sidecar_path)
+        self.assertEqual(0, self.sut.hits)
+        self.assertEqual(0, self.sut.misses)
+
+    @conditionals.onOSName('linux')
+    def test_get(self):
+        """
+        The digest is stored in an extended attribute of the file, for
+        each algorithm.
+        """
+        fd = self.makeFile(b'123')
+        stats = os.fstat(fd)
+
+        self.assertEqual('digest-1', self.sut.get(fd, 'md5', self.compute))
+        self.assertEqual('digest-1', self.sut.get(fd, 'md5', self.compute))
+        self.assertEqual('digest-2', self.sut.get(fd, 'crc32', self.compute))
+
+        stored = f'3:{stats.st_mtime_ns}:{stats.st_ino}:digest-1'
+        mac = hmac.new(
+            self.secret,
+            f'{stats.st_dev}:md5:{stored}'.encode(),
+            hashlib.sha256,
+        ).hexdigest()
+        self.assertEqual(
+            f'{stored}:{mac}'.encode(),
+            os.getxattr(fd, 'user.chevah.checksum.md5'),
+        )
+        self.assertEqual(1, self.sut.hits)
+        self.assertEqual(2, self.sut.misses)
+
+    @conditionals.onOSName('linux')
+    def test_get_forged(self):
+        """
+        Values which were not stored with the same secret are ignored and
+        replaced.
+        """
+        fd = self.makeFile(b'123')
+        stats = os.fstat(fd)
+        name = 'user.chevah.checksum.md5'
+        stored = f'3:{stats.st_mtime_ns}:{stats.st_ino}:forged'
+        os.setxattr(fd, name, stored.encode())
+
+        self.assertEqual('digest-1', self.sut.get(fd, 'md5', self.compute))
+
+        os.setxattr(fd, name, f'{stored}:{"0" * 64}'.encode())
+
+        self.assertEqual('digest-2', self.sut.get(fd, 'md5', self.compute))
+        self.assertEqual('digest-2', self.sut.get(fd, 'md5', self.compute))
+
+        other = ChecksumCache()
+        self.addCleanup(other.close)
+        self.assertEqual('digest-3', other.get(fd, 'md5', self.compute))
+        self.assertEqual(0, other.hits)
+
+    @conditionals.onOSName('linux')
+    def test_get_changed(self):
+        """
+        The digest is computed again when the file is changed.
+        """
+        fd = self.makeFile(b'123')
+        self.sut.get(fd, 'md5', self.compute)
+        os.utime(fd, ns=(0, 0))
+
+        self.assertEqual('digest-2', self.sut.get(fd, 'md5', self.compute))
+        self.assertEqual('digest-2', self.sut.get(fd, 'md5', self.compute))
+
+        with open(os.path.join(self.folder, 'file'), 'ab') as stream:
+            stream.write(b'4')
+        os.utime(fd, ns=(0, 0))
+
+        self.assertEqual('digest-3', self.sut.get(fd, 'md5', self.compute))
+
+    def test_get_recent(self):
+        """
+        The digest is not stored for files modified in the last `min_age`
+        seconds.
+        """
+        fd = self.makeFile(b'123', age=0)
+
+        self.sut.get(fd, 'md5', self.compute)
+
+        self.assertEqual('digest-2', self.sut.get(fd, 'md5', self.compute))
+        self.assertEqual(0, self.sut.hits)
+
+    def test_get_sidecar(self):
+        """
+        Without extended attributes, the digest is stored in the sidecar
+        database, which is kept between instances with the same secret.
+        """
+        sidecar_path = os.path.join(self.folder, 'checksums')
+        sut = ChecksumCache(sidecar_path=sidecar_path, secret=self.secret)
+        fd = self.makeFile(b'123')
+        stats = os.fstat(fd)
+        sut._unsupported.add(stats.st_dev)
+
+        self.assertEqual('digest-1', sut.get(fd, 'md5', self.compute))
+        sut.close()
+
+        sut = ChecksumCache(sidecar_path=sidecar_path, secret=self.secret)
+        self.addCleanup(sut.close)
+        sut._unsupported.add(stats.st_dev)
+        self.assertEqual('digest-1', sut.get(fd, 'md5', self.compute))
+        self.assertEqual(1, sut.hits)
+        if hasattr(os, 'getxattr'):
+            self.assertNotIn('user.chevah.checksum.md5', os.listxattr(fd))
+
+    def test_get_unsupported(self):
+        """
+        Without extended attributes and without a sidecar, the digest is
+        always computed.
+        """
+        fd = self.makeFile(b'123')
+        self.sut._unsupported.add(os.fstat(fd).st_dev)
+
+        self.sut.get(fd, 'md5', self.compute)
+
+        self.assertEqual('digest-2', self.sut.get(fd, 'md5', self.compute))
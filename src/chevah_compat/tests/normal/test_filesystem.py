@@ -5,22 +5,51 @@ Tests for portable filesystem access.
 """
 
 import errno
+import hashlib
 import os
+import re
 import stat
 import subprocess
 import sys
 import tempfile
+import threading
 import time
+import zlib
+from contextlib import contextmanager
 from datetime import date
 
 from nose.plugins.attrib import attr
 
-from chevah_compat import DefaultAvatar, FileAttributes, LocalFilesystem
+from chevah_compat import (
+    DefaultAvatar,
+    FileAttributes,
+    FolderCursor,
+    FolderEvent,
+    FolderListing,
+    FolderWatch,
+    LocalFilesystem,
+    TreeUsage,
+)
 from chevah_compat.avatar import FilesystemApplicationAvatar
+from chevah_compat.checksum_cache import ChecksumCache
 from chevah_compat.exceptions import CompatError
 from chevah_compat.helpers import force_unicode
-from chevah_compat.interfaces import IFileAttributes, ILocalFilesystem
-from chevah_compat.posix_filesystem import _win_getEncodedPath
+from chevah_compat.interfaces import (
+    IFileAttributes,
+    IFolderCursor,
+    IFolderEvent,
+    IFolderHandle,
+    IFolderListing,
+    IFolderWatch,
+    ILocalFilesystem,
+    ITreeUsage,
+)
+from chevah_compat.metadata_cache import MetadataCache
+from chevah_compat.posix_filesystem import (
+    PosixFilesystemBase,
+    _OperationStages,
+    _win_getEncodedPath,
+)
 from chevah_compat.testing import CompatTestCase, conditionals, mk
 
 start_of_year = time.mktime((date.today().year, 1, 1, 0, 0, 0, 0, 0, -1))
@@ -158,6 +187,28 @@ class FilesystemTestMixin(FilesystemTestingHelpers):
         path = self.filesystem.getPath(['a', '..', 'b', '..', 'c'])
         self.assertEqual('/c', path)
 
+    def test_getSegmentsMany(self):
+        """
+        It returns the segments for each path, in the same order.
+        """
+        paths = [
+            '/a/../b',
+            'c/./d',
+            '',
+            None,
+            '..',
+            '/',
+            b'/bytes',
+        ]
+
+        result = self.filesystem.getSegmentsMany(paths)
+
+        self.assertEqual(
+            [self.filesystem.getSegments(path) for path in paths],
+            result,
+        )
+        self.assertEqual([], self.filesystem.getSegmentsMany([]))
+
 
 class DefaultFilesystemTestCase(CompatTestCase, FilesystemTestMixin):
     """
@@ -208,6 +259,64 @@ class TestLocalFilesystem(DefaultFilesystemTestCase):
         segments = self.filesystem.temp_segments
         self.assertTrue(self.filesystem.isFolder(segments))
 
+    def test_areEqual(self):
+        """
+        Segments are compared based on the case sensitivity of the
+        current OS.
+        """
+        self.assertTrue(self.filesystem._areEqual(['a', 'B'], ['a', 'B']))
+        self.assertFalse(self.filesystem._areEqual(['a', 'B'], ['a']))
+        self.assertFalse(self.filesystem._areEqual(['a', 'B'], ['a', 'c']))
+
+        result = self.filesystem._areEqual(['a', 'B'], ['A', 'b'])
+
+        if self.os_name in ['windows', 'osx']:
+            self.assertTrue(result)
+        else:
+            self.assertFalse(result)
+
+    def test_areEqualCaseInsensitive(self):
+        """
+        Segments are equal when they differ only by case.
+        """
+        are_equal = self.filesystem._areEqualCaseInsensitive
+
+        self.assertTrue(are_equal(['a', 'B'], ['A', 'b']))
+        self.assertTrue(are_equal([], []))
+        self.assertFalse(are_equal(['a', 'B'], ['A']))
+        self.assertFalse(are_equal(['a', 'B'], ['A', 'c']))
+
+    def test_decodeFilename(self):
+        """
+        The filename is returned as Unicode and on OSX it is also
+        normalized.
+        """
+        decomposed = 'a\N{COMBINING ACUTE ACCENT}'
+
+        result = self.filesystem._decodeFilename(decomposed.encode('utf-8'))
+
+        if self.os_name == 'osx':
+            self.assertEqual('\N{LATIN SMALL LETTER A WITH ACUTE}', result)
+        else:
+            self.assertEqual(decomposed, result)
+
+    def test_decodeNormalizedFilename(self):
+        """
+        The filename is returned as Unicode in the NFC form.
+        """
+        decomposed = 'a\N{COMBINING ACUTE ACCENT}'
+        composed = '\N{LATIN SMALL LETTER A WITH ACUTE}'
+
+        self.assertEqual(
+            composed,
+            self.filesystem._decodeNormalizedFilename(
+                decomposed.encode('utf-8')
+            ),
+        )
+        self.assertEqual(
+            composed, self.filesystem._decodeNormalizedFilename(composed)
+        )
+
     @conditionals.onOSFamily('nt')
     def test_temp_segments_location_nt(self):
         """
@@ -948,6 +1057,86 @@ class TestLocalFilesystem(DefaultFilesystemTestCase):
         else:
             self.assertEqual('/', attributes.path)
 
+    def test_getAttributesMany(self):
+        """
+        The attributes are returned in the order of the paths, with the
+        errors for the paths which can't be read.
+        """
+        segments = self.folderInTemp()
+        mk.fs.createFile(segments + ['a'], content='1')
+        mk.fs.createFolder(segments + ['sub'])
+        mk.fs.createFile(segments + ['sub', 'b'], content='12')
+        segments_list = [
+            segments + ['sub', 'b'],
+            segments + ['a'],
+            segments + ['missing'],
+            [],
+            segments + ['sub'],
+            segments + ['missing', 'child'],
+            segments + ['a', 'child'],
+        ]
+
+        # Each folder is read by a separate task.
+        with self.patch('chevah_compat.posix_filesystem._STAT_BATCH_PATHS', 1):
+            result = self.filesystem.getAttributesMany(segments_list, workers=2)
+
+        for index in (0, 1, 3, 4):
+            self.assertEqual(
+                self.filesystem.getAttributes(segments_list[index]),
+                result[index],
+            )
+        self.assertEqual(2, result[0].size)
+        self.assertEqual(errno.ENOENT, result[2].errno)
+        self.assertEqual(
+            self.filesystem.getRealPathFromSegments(segments + ['missing']),
+            result[2].filename,
+        )
+        self.assertEqual(errno.ENOENT, result[5].errno)
+        self.assertEqual(errno.ENOTDIR, result[6].errno)
+
+    @conditionals.onOSFamily('posix')
+    def test_getAttributesMany_link(self):
+        """
+        The attributes of the links are for their targets, while the
+        broken links don't exist.
+        """
+        path, segments = self.tempFolder()
+        mk.fs.createFile(segments + ['a'], content='123')
+        os.symlink('a', os.path.join(path, 'link'))
+        os.symlink('missing', os.path.join(path, 'broken'))
+        segments_list = [segments + ['link'], segments + ['broken']]
+
+        result = self.filesystem.getAttributesMany(segments_list)
+
+        self.assertEqual(
+            self.filesystem.getAttributes(segments + ['link']), result[0]
+        )
+        self.assertTrue(result[0].is_link)
+        self.assertEqual(3, result[0].size)
+        self.assertEqual(errno.ENOENT, result[1].errno)
+        self.assertEqual(
+            [True, True], self.filesystem.existsMany(segments_list)
+        )
+
+    def test_existsMany(self):
+        """
+        The existence of each path is returned in the order of the paths.
+        """
+        segments = self.folderInTemp()
+        mk.fs.createFile(segments + ['a'])
+
+        result = self.filesystem.existsMany(
+            [
+                segments + ['missing'],
+                segments + ['a'],
+                segments,
+                segments + ['a', 'child'],
+            ],
+            workers=2,
+        )
+
+        self.assertEqual([False, True, True, False], result)
+
     @conditionals.onCapability('symbolic_link', True)
     def test_getAttributes_link_file(self):
         """
@@ -1255,746 +1444,1921 @@ class TestLocalFilesystem(DefaultFilesystemTestCase):
         self.assertTrue(link_attributes.is_link)
         self.assertAlmostEqual(self.now(), link_attributes.modified, delta=5)
 
-    @attr('slow')
-    def test_iterateFolderContent_big(self):
+    def test_getFolderListing_not_found(self):
         """
-        It will not block on listing folders with many members.
-
-        On some systems, this test takes more than 1 minute.
+        Raise OSError when trying to list a non existent path.
         """
-        self._iterateFolderContent_big()
+        segments = ['c', mk.string(), mk.string()]
 
-    def _iterateFolderContent_big(self):
-        """
-        Main code for running the test
-        """
-        if self.os_name == 'aix':
-            count = 3000
-            base_timeout = 0.02
-        elif self.os_name == 'osx':
-            # On GitHub the OSX can be a bit slow.
-            count = 32000
-            base_timeout = 0.3
-        elif self.os_name in ['hpux', 'freebsd', 'openbsd']:
-            # Some OS/FS does not allow more than 32765 members in a folder
-            # and the slave is generally slow.
-            count = 32000
-            base_timeout = 0.15
-        elif self.cpu_type in ['sparc', 'arm64']:
-            count = 5000
-            base_timeout = 0.1
-        else:
-            count = 40000
-            base_timeout = 0.1
+        with self.assertRaises(OSError) as context:
+            self.filesystem.getFolderListing(segments)
 
-        if self.os_name == 'windows':
-            # On windows, some iteration operation might be very slow.
-            bias = 0.7
-        else:
-            bias = 0
+        self.assertEqual(errno.ENOENT, context.exception.errno)
 
+    def test_getFolderListing(self):
+        """
+        It has the same members as iterateFolderContent.
+        """
         base_segments = self.folderInTemp()
+        file_name = mk.makeFilename(prefix='file-')
+        folder_name = mk.makeFilename(prefix='folder-')
+        mk.fs.createFile(base_segments + [file_name], content='123456789')
+        mk.fs.createFolder(base_segments + [folder_name])
 
-        for i in range(count):
-            mk.fs.createFolder(base_segments + [f'some-member-{i}'])
-            if i % 1000 == 0:
-                # This is slow, so keep the CI informed that we are doing
-                # stuff.
-                sys.stdout.write('+')
-                sys.stdout.flush()
-
-        # Show progress.
-        sys.stdout.write('-SLOW-')
-        sys.stdout.flush()
+        result = self.filesystem.getFolderListing(base_segments)
 
-        # We check that doing a direct listing will take a long time.
-        with self.assertRaises(AssertionError):
-            with self.assertExecutionTime(base_timeout):
-                result = self.filesystem.getFolderContent(base_segments)
-        self.assertEqual(count, len(result))
+        self.assertProvides(IFolderListing, result)
+        self.assertEqual(2, len(result))
+        self.assertItemsEqual(
+            list(self.filesystem.iterateFolderContent(base_segments)),
+            list(result),
+        )
+        self.assertEqual(9, result.getTotalSize(include=result.FILE))
+        self.assertEqual(1, result.count(include=result.FILE))
+        self.assertEqual(1, result.count(include=result.FOLDER))
 
-        # Show progress.
-        sys.stdout.write('-FAST-')
-        sys.stdout.flush()
+    @conditionals.onCapability('symbolic_link', True)
+    def test_getFolderListing_link(self):
+        """
+        Links are flagged and are not followed.
+        """
+        base_segments = self.folderInTemp()
+        link_name = mk.makeFilename(prefix='link-')
+        mk.fs.makeLink(
+            target_segments=['z', 'no-such', 'target'],
+            link_segments=base_segments + [link_name],
+        )
 
-        # Getting the iterator will not take long.
-        with self.assertExecutionTime(base_timeout + bias):
-            iterator = self.filesystem.iterateFolderContent(base_segments)
+        result = self.filesystem.getFolderListing(base_segments)
 
-        # Iterating at any step will not take long.
-        result = []
-        result.append(next(iterator))
-        try:
-            i = 0
-            while True:
-                with self.assertExecutionTime(base_timeout + bias):
-                    result.append(next(iterator))
-                i += 1
-                if i % 1000 == 0:
-                    # This is slow, so keep the CI informed that we are doing
-                    # stuff.
-                    sys.stdout.write('+')
-                    sys.stdout.flush()
-        except StopIteration:
-            """
-            We are at the end. All good.
-            """
-        self.assertEqual(count, len(result))
+        self.assertEqual(1, len(result))
+        self.assertEqual(result.LINK, result.flags[0])
+        self.assertItemsEqual(
+            list(self.filesystem.iterateFolderContent(base_segments)),
+            list(result),
+        )
 
-    def test_openFile_folder(self):
+    def makePageMembers(self):
         """
-        Raise OSError when trying to open a folder as file.
-        """
-        self.test_segments = mk.fs.createFolderInTemp()
-        path = mk.fs.getRealPathFromSegments(self.test_segments)
+        Create a folder with members of different sizes and modified times.
 
-        with self.assertRaises(OSError) as context:
-            self.filesystem.openFile(self.test_segments, os.O_RDONLY, 0o777)
+        Return the segments of the folder.
+        """
+        base_segments = self.folderInTemp()
+        for name, size, modified in [
+            ('b-file', 5, 1000),
+            ('a-file', 1, 3000),
+            ('d-file', 5, 2000),
+            ('c-file', 3, 4000),
+        ]:
+            mk.fs.createFile(base_segments + [name], content='x' * size)
+            path = mk.fs.getRealPathFromSegments(base_segments + [name])
+            os.utime(path, (modified, modified))
+        mk.fs.createFolder(base_segments + ['e-folder'])
+        return base_segments
+
+    def test_listFolderPage(self):
+        """
+        It returns the members from the page, sorted by name.
+        """
+        base_segments = self.makePageMembers()
+
+        total, page = self.filesystem.listFolderPage(
+            base_segments, offset=1, limit=2
+        )
 
-        self.assertEqual(errno.EISDIR, context.exception.errno)
-        expected = '[Errno 21] Is a directory: ' + path
-        self.assertStartsWith(expected, force_unicode(context.exception))
+        self.assertEqual(5, total)
+        self.assertEqual(['b-file', 'c-file'], [m.name for m in page])
+        self.assertEqual(
+            self.filesystem.getAttributes(base_segments + ['b-file']),
+            page[0],
+        )
 
-    def test_openFileForReading_folder(self):
+    def test_listFolderPage_modified_reverse(self):
         """
-        Raise OSError when trying to open a folder as file for reading.
+        Members can be sorted by modified time in reverse order.
         """
-        self.test_segments = mk.fs.createFolderInTemp()
-        path = mk.fs.getRealPathFromSegments(self.test_segments)
+        base_segments = self.makePageMembers()
 
-        with self.assertRaises(OSError) as context:
-            self.filesystem.openFileForReading(self.test_segments)
+        total, page = self.filesystem.listFolderPage(
+            base_segments,
+            sort_key='modified',
+            reverse=True,
+            offset=1,
+            limit=3,
+            filter=lambda name, is_folder: not is_folder,
+        )
 
-        self.assertEqual(errno.EISDIR, context.exception.errno)
-        details = '[Errno 21] Is a directory: ' + path
-        self.assertStartsWith(details, force_unicode(context.exception))
+        self.assertEqual(4, total)
+        self.assertEqual(['a-file', 'd-file', 'b-file'], [m.name for m in page])
 
-    def test_openFileForWriting_folder(self):
+    def test_listFolderPage_size(self):
         """
-        Raise OSError when trying to open a folder as file for writing.
+        Members with the same size are sorted by name, and without a limit
+        all the remaining members are returned.
         """
-        self.test_segments = mk.fs.createFolderInTemp()
-        path = mk.fs.getRealPathFromSegments(self.test_segments)
+        base_segments = self.makePageMembers()
 
-        with self.assertRaises(OSError) as context:
-            self.filesystem.openFileForWriting(self.test_segments)
+        total, page = self.filesystem.listFolderPage(
+            base_segments,
+            sort_key='size',
+            offset=2,
+            filter=lambda name, is_folder: name.endswith('-file'),
+        )
 
-        self.assertEqual(errno.EISDIR, context.exception.errno)
-        self.assertEqual(path, context.exception.filename)
-        details = '[Errno 21] Is a directory: ' + path
-        self.assertStartsWith(details, force_unicode(context.exception))
+        self.assertEqual(4, total)
+        self.assertEqual(['b-file', 'd-file'], [m.name for m in page])
 
-    def test_openFileForAppending_folder(self):
+    def test_listFolderPage_empty_page(self):
         """
-        Raise OSError when trying to open a folder as file for appending.
+        The total is returned even when the page is empty.
         """
-        self.test_segments = mk.fs.createFolderInTemp()
-        path = mk.fs.getRealPathFromSegments(self.test_segments)
+        base_segments = self.makePageMembers()
 
-        with self.assertRaises(OSError) as context:
-            self.filesystem.openFileForAppending(self.test_segments)
+        result = self.filesystem.listFolderPage(base_segments, limit=0)
 
-        self.assertEqual(errno.EISDIR, context.exception.errno)
-        self.assertEqual(path, context.exception.filename)
-        details = '[Errno 21] Is a directory: ' + path
-        self.assertStartsWith(details, str(context.exception))
+        self.assertEqual((5, []), result)
 
-    def test_touch_no_parent(self):
+        result = self.filesystem.listFolderPage(
+            base_segments, offset=10, limit=2
+        )
+
+        self.assertEqual((5, []), result)
+
+    def test_listFolderPage_unknown_key(self):
         """
-        Raise an error when path does not exists and can not be created.
+        It fails for unknown sort keys.
         """
-        segments = ['c', 'no-such', 'path']
-        path = mk.fs.getRealPathFromSegments(segments)
+        with self.assertRaises(AssertionError):
+            self.filesystem.listFolderPage(
+                self.filesystem.temp_segments, sort_key='mode'
+            )
 
-        with self.assertRaises(IOError) as context:
-            self.filesystem.touch(segments)
+    def makeTreeMembers(self):
+        """
+        Create a tree of files and folders and return its segments.
+        """
+        base_segments = self.folderInTemp()
+        mk.fs.createFile(base_segments + ['a.csv'])
+        mk.fs.createFile(base_segments + ['b.txt'])
+        mk.fs.createFolder(base_segments + ['c.csv'])
+        mk.fs.createFile(base_segments + ['c.csv', 'd.csv'])
+        mk.fs.createFolder(base_segments + ['c.csv', 'e'])
+        mk.fs.createFile(base_segments + ['c.csv', 'e', 'f.csv'])
+        return base_segments
+
+    def test_iterateFolderContent_filter_glob(self):
+        """
+        With a glob filter, only the matching members are returned and the
+        other members are not converted.
+        """
+        base_segments = self.makeTreeMembers()
+
+        with self.patchObject(
+            self.filesystem,
+            '_dirEntryToFileAttributes',
+            wraps=self.filesystem._dirEntryToFileAttributes,
+        ) as convert:
+            result = list(
+                self.filesystem.iterateFolderContent(base_segments, '*.csv')
+            )
 
-        self.assertEqual(errno.ENOENT, context.exception.errno)
-        details = '[Errno 2] No such file or directory: ' + path
-        self.assertEqual(details, force_unicode(context.exception))
+        self.assertEqual(2, convert.call_count)
+        self.assertItemsEqual(['a.csv', 'c.csv'], [m.name for m in result])
+        self.assertEqual(
+            self.filesystem.getAttributes(base_segments + ['c.csv']),
+            next(m for m in result if m.name == 'c.csv'),
+        )
 
-    def test_touch_dont_exists(self):
+    def test_iterateFolderContent_filter_regex_and_callable(self):
         """
-        A file is created if it does not exists.
+        The filter can be a regular expression matching the full name or
+        a callable called with the name and the folder flag.
         """
-        _, self.test_segments = mk.fs.makePathInTemp()
-        self.assertFalse(mk.fs.exists(self.test_segments))
+        base_segments = self.makeTreeMembers()
 
-        self.filesystem.touch(self.test_segments)
+        result = self.filesystem.iterateFolderContent(
+            base_segments, re.compile(r'[ab]\.')
+        )
 
-        self.assertTrue(mk.fs.exists(self.test_segments))
+        self.assertEqual([], list(result))
 
-    def test_touch_already_exists(self):
-        """
-        The modified time is updated path already exists.
-        """
-        self.test_segments = mk.fs.createFileInTemp()
-        now = time.time()
-        mk.fs.setAttributes(
-            self.test_segments,
-            {'atime': now - 10, 'mtime': now - 10},
+        result = self.filesystem.iterateFolderContent(
+            base_segments, re.compile(r'[ab]\..*')
         )
 
-        self.filesystem.touch(self.test_segments)
+        self.assertItemsEqual(['a.csv', 'b.txt'], [m.name for m in result])
 
-        self.assertTrue(mk.fs.exists(self.test_segments))
-        attributes = mk.fs.getAttributes(self.test_segments)
-        self.assertAlmostEqual(now, attributes.modified, delta=1.5)
+        result = self.filesystem.iterateFolderContent(
+            base_segments, lambda name, is_folder: not is_folder
+        )
 
-    def test_copyFile_destination_no_parent(self):
+        self.assertItemsEqual(['a.csv', 'b.txt'], [m.name for m in result])
+
+    def test_iterateFolderContent_filter_not_found(self):
         """
-        Raises an exception when destination does not exists, and it can not
-        be created
+        The errors for the listed folder are raised as without a filter.
         """
-        self.test_segments = mk.fs.createFileInTemp(content=mk.string())
-        destination_segments = ['c', 'no-parent', 'path']
-        path = mk.fs.getRealPathFromSegments(destination_segments)
+        _, segments = self.tempPath()
 
-        with self.assertRaises(IOError) as context:
-            self.filesystem.copyFile(self.test_segments, destination_segments)
+        with self.assertRaises(OSError) as context:
+            self.filesystem.iterateFolderContent(segments, '*')
 
         self.assertEqual(errno.ENOENT, context.exception.errno)
-        details = '[Errno 2] No such file or directory: ' + path
-        self.assertEqual(details, force_unicode(context.exception))
 
-    def test_copyFile_file_destination_exists_no_overwrite(self):
+    def test_iterateFolderTree(self):
         """
-        Raise an error when destination exists and it was not instructed to
-        overwrite existing files.
+        Without a filter, all the members of the tree are returned with
+        their segments, the parent folder before its members.
         """
-        source_segments = ['ignore', 'source']
-        path, segments = self.tempFile(win_encoded=True)
+        base_segments = self.makeTreeMembers()
 
-        with self.assertRaises(OSError) as context:
-            self.filesystem.copyFile(source_segments, segments)
+        result = list(self.filesystem.iterateFolderTree(base_segments))
 
-        self.assertEqual(errno.EEXIST, context.exception.errno)
-        details = '[Errno 17] Destination exists: ' + path
-        self.assertEqual(details, force_unicode(context.exception))
+        paths = [
+            '/'.join(segments[len(base_segments) :]) for segments, _ in result
+        ]
+        self.assertItemsEqual(
+            [
+                'a.csv',
+                'b.txt',
+                'c.csv',
+                'c.csv/d.csv',
+                'c.csv/e',
+                'c.csv/e/f.csv',
+            ],
+            paths,
+        )
+        self.assertLess(paths.index('c.csv'), paths.index('c.csv/e'))
+        self.assertLess(paths.index('c.csv/e'), paths.index('c.csv/e/f.csv'))
+        for segments, attributes in result:
+            self.assertEqual(
+                self.filesystem.getAttributes(segments), attributes
+            )
 
-    def test_copyFile_file_destination_exists_overwrite(self):
+    def test_iterateFolderTree_removed(self):
         """
-        Copy file without errors when overwrite was asked.
+        Members removed while the tree is walked are skipped, and the
+        other members are still returned.
         """
-        content = mk.string()
-        self.test_segments = mk.fs.createFileInTemp(content=content)
-        destination_segments = mk.fs.createFileInTemp()
+        base_segments = self.makeTreeMembers()
+        get_attributes = self.filesystem._getMemberAttributes
 
-        self.filesystem.copyFile(
-            self.test_segments,
-            destination_segments,
-            overwrite=True,
-        )
+        def remove_and_get(member):
+            segments = base_segments + [member.name]
+            if member.name == 'b.txt':
+                mk.fs.deleteFile(segments)
+            if member.name == 'c.csv':
+                mk.fs.deleteFolder(segments, recursive=True)
+            return get_attributes(member)
 
-        destination_content = mk.fs.getFileContent(destination_segments)
-        self.assertEqual(content, destination_content)
-        mk.fs.deleteFile(destination_segments)
+        with self.patchObject(
+            self.filesystem, '_getMemberAttributes', side_effect=remove_and_get
+        ):
+            result = list(self.filesystem.iterateFolderTree(base_segments))
 
-    def test_copyFile_folder_destination_exists_no_overwrite(self):
+        self.assertItemsEqual(
+            [base_segments + ['a.csv']], [segments for segments, _ in result]
+        )
+
+    def test_iterateFolderTree_glob(self):
         """
-        Raise an error when destination exists in destination folder
-        and it was not instructed to overwrite existing files.
+        The glob filter is matched against the relative path, and `**`
+        matches any number of folders.
         """
-        self.test_segments = mk.fs.createFileInTemp()
-        destination_segments = self.test_segments[:-1]
-        path = mk.fs.getRealPathFromSegments(
-            destination_segments + self.test_segments[-1:],
-        )
-        source_segments = ['bla', self.test_segments[-1]]
-        if self.os_name == 'windows':
-            path = mk.fs.getEncodedPath(path)
+        base_segments = self.makeTreeMembers()
 
-        with self.assertRaises(OSError) as context:
-            self.filesystem.copyFile(source_segments, destination_segments)
+        def get_paths(pattern):
+            return [
+                '/'.join(segments[len(base_segments) :])
+                for segments, _ in self.filesystem.iterateFolderTree(
+                    base_segments, pattern
+                )
+            ]
 
-        self.assertEqual(errno.EEXIST, context.exception.errno)
-        details = '[Errno 17] Destination exists: ' + path
-        self.assertEqual(details, force_unicode(context.exception))
+        self.assertItemsEqual(['a.csv', 'c.csv'], get_paths('*.csv'))
+        self.assertItemsEqual(['c.csv/d.csv'], get_paths('*/*.csv'))
+        self.assertItemsEqual(
+            ['a.csv', 'c.csv', 'c.csv/d.csv', 'c.csv/e/f.csv'],
+            get_paths('**/*.csv'),
+        )
+        self.assertItemsEqual(['c.csv/e/f.csv'], get_paths('c.csv/**/f.csv'))
 
-    def test_copyFile_folder_destination_exists_overwrite(self):
+    def test_iterateFolderTree_glob_prune(self):
         """
-        Replace file when destination exists in destination folder
-        and it was instructed to overwrite existing files.
+        Folders which can't contain matching members are not listed.
         """
-        content = mk.string()
-        self.test_segments = mk.fs.createFileInTemp(content=content)
-        destination_segments = mk.fs.createFolderInTemp()
-        destination_file_segments = destination_segments[:]
-        destination_file_segments.append(self.test_segments[-1])
-        mk.fs.touch(destination_file_segments)
+        base_segments = self.makeTreeMembers()
 
-        self.filesystem.copyFile(
-            self.test_segments,
-            destination_segments,
-            overwrite=True,
-        )
+        with self.patchObject(
+            self.filesystem,
+            '_iterateMembers',
+            wraps=self.filesystem._iterateMembers,
+        ) as iterate:
+            result = list(
+                self.filesystem.iterateFolderTree(base_segments, '*.csv')
+            )
 
-        destination_content = mk.fs.getFileContent(destination_file_segments)
-        self.assertEqual(content, destination_content)
-        mk.fs.deleteFolder(destination_segments, recursive=True)
+        self.assertEqual(2, len(result))
+        iterate.assert_called_once_with(base_segments)
 
-    def test_copyFile_file_destination_no_exists(self):
+    def test_iterateFolderTree_link(self):
         """
-        Copy file in destination when destination does not exists, but
-        can be created.
+        Links to folders are returned, but not followed.
         """
-        content = mk.string()
-        _, destination_segments = mk.fs.makePathInTemp()
-        source_segments = mk.fs.createFileInTemp(content=content)
+        base_segments = self.makeTreeMembers()
+        self.makeLink(base_segments + ['c.csv'])
 
-        self.filesystem.copyFile(source_segments, destination_segments)
+        result = self.filesystem.iterateFolderTree(base_segments, '**/d.csv')
 
-        self.assertTrue(self.filesystem.exists(destination_segments))
-        destination_content = mk.fs.getFileContent(destination_segments)
-        self.assertEqual(content, destination_content)
-        # Clean new files.
-        self.filesystem.deleteFile(source_segments)
-        self.filesystem.deleteFile(destination_segments)
+        self.assertEqual(
+            [base_segments + ['c.csv', 'd.csv']],
+            [segments for segments, _ in result],
+        )
 
-    def test_copyFile_folder_destination_no_exists(self):
+    def test_getTreeUsage_not_found(self):
         """
-        When destination is a folder the file will be copied using the same
-        filename as the source, if the folder does not already contain
-        a member with the same name.
+        The errors for the top folder are raised.
         """
-        content = mk.string()
-        source_segments = mk.fs.createFileInTemp(content=content)
-        self.test_segments = mk.fs.createFolderInTemp()
-        destination_segments = self.test_segments[:]
-        destination_segments.append(source_segments[-1])
+        _, segments = self.tempPath()
 
-        self.filesystem.copyFile(source_segments, self.test_segments)
+        with self.assertRaises(OSError) as context:
+            self.filesystem.getTreeUsage(segments)
 
-        self.assertTrue(self.filesystem.exists(destination_segments))
-        destination_content = mk.fs.getFileContent(destination_segments)
-        self.assertEqual(content, destination_content)
-        self.filesystem.deleteFile(source_segments)
+        self.assertEqual(errno.ENOENT, context.exception.errno)
 
-    def test_makeFolder(self):
+    def test_getTreeUsage(self):
         """
-        Check makeFolder.
+        The usage is aggregated for all the files from the tree, and
+        links are not followed.
         """
-        folder_name = mk.makeFilename(length=10)
-        self.test_segments = mk.fs.temp_segments[:]
-        self.test_segments.append(folder_name)
+        base_segments = self.folderInTemp()
+        mk.fs.createFile(base_segments + ['a.CSV'], content='1' * 10)
+        mk.fs.createFolder(base_segments + ['sub'])
+        mk.fs.createFile(base_segments + ['sub', 'b.csv'], content='1' * 20)
+        mk.fs.createFolder(base_segments + ['sub', 'deep'])
+        mk.fs.createFile(base_segments + ['sub', 'deep', 'c'], content='123')
+        self.makeLink(base_segments + ['sub'])
+        allocated = 0
+        for segments in [['a.CSV'], ['sub', 'b.csv'], ['sub', 'deep', 'c']]:
+            path = mk.fs.getRealPathFromSegments(base_segments + segments)
+            stats = os.lstat(path)
+            allocated += getattr(stats, 'st_blocks', stats.st_size / 512) * 512
+        calls = []
+
+        result = self.filesystem.getTreeUsage(
+            base_segments, progress=calls.append, workers=2
+        )
 
-        self.filesystem.createFolder(self.test_segments)
+        self.assertProvides(ITreeUsage, result)
+        self.assertEqual(3, result.files)
+        self.assertEqual(2, result.folders)
+        self.assertEqual(1, result.links)
+        self.assertEqual(33, result.size)
+        self.assertEqual(allocated, result.allocated)
+        self.assertEqual(0, result.errors)
+        self.assertEqual({'.csv': (2, 30), '': (1, 3)}, result.extensions)
+        # Progress is reported for each folder, with the partial usage.
+        self.assertEqual(3, len(calls))
+        self.assertIs(result, calls[-1])
+
+        result = self.filesystem.getTreeUsage(
+            base_segments + ['sub'], one_filesystem=True
+        )
 
-        self.assertTrue(self.filesystem.isFolder(self.test_segments))
+        self.assertEqual(2, result.files)
+        self.assertEqual(1, result.folders)
+        self.assertEqual(23, result.size)
 
-    def test_rename_file(self):
+    def test_getTreeUsage_error(self):
         """
-        System test for file renaming.
+        Folders which can't be scanned are counted as errors.
         """
-        _, initial_segments = mk.fs.makePathInTemp()
-        _, self.test_segments = mk.fs.makePathInTemp()
-        self.assertFalse(self.filesystem.exists(initial_segments))
-        self.assertFalse(self.filesystem.exists(self.test_segments))
-        self.filesystem.touch(initial_segments)
+        base_segments = self.folderInTemp()
+        mk.fs.createFile(base_segments + ['a'], content='12')
+        mk.fs.createFolder(base_segments + ['sub'])
+        mk.fs.createFile(base_segments + ['sub', 'b'], content='123')
+        scan = self.filesystem._scanTreeFolder
 
-        self.filesystem.rename(initial_segments, self.test_segments)
+        def scan_top_folder(path, segments, device):
+            if segments != base_segments:
+                raise OSError(errno.EACCES, 'Permission denied.', path)
+            return scan(path, segments, device)
 
-        self.assertFalse(self.filesystem.exists(initial_segments))
-        self.assertTrue(self.filesystem.exists(self.test_segments))
+        with self.patchObject(
+            self.filesystem, '_scanTreeFolder', side_effect=scan_top_folder
+        ):
+            result = self.filesystem.getTreeUsage(base_segments)
 
-    def test_rename_file_overwrite_destination(self):
+        self.assertEqual(1, result.files)
+        self.assertEqual(1, result.folders)
+        self.assertEqual(2, result.size)
+        self.assertEqual(1, result.errors)
+
+    def test_getTreeUsage_member_error(self):
         """
-        It will overwrite existing file.
+        Members which can't be read are counted as errors and the
+        members removed during the scan are ignored, while the usage of
+        the other members from the folder is kept.
         """
-        _, source_segments = self.tempFile(prefix='src-', cleanup=False)
-        _, destination_segments = self.tempFile(prefix='dst-')
-        self.assertTrue(self.filesystem.exists(source_segments))
-        self.assertTrue(self.filesystem.exists(destination_segments))
-
-        self.filesystem.rename(source_segments, destination_segments)
-
-        self.assertFalse(self.filesystem.exists(source_segments))
-        self.assertTrue(self.filesystem.exists(destination_segments))
+        base_segments = self.folderInTemp()
+        mk.fs.createFile(base_segments + ['a'], content='12')
+        mk.fs.createFile(base_segments + ['gone'], content='123')
+        mk.fs.createFile(base_segments + ['locked'], content='1234')
+        mk.fs.createFolder(base_segments + ['sub'])
+        mk.fs.createFile(base_segments + ['sub', 'b'], content='1')
+        failures = {'gone': errno.ENOENT, 'locked': errno.EACCES}
+
+        class FailingEntry:
+            def __init__(self, entry):
+                self._entry = entry
+
+            def __getattr__(self, name):
+                return getattr(self._entry, name)
+
+            def stat(self, follow_symlinks=True):
+                code = failures.get(os.fsdecode(self._entry.name))
+                if code is not None:
+                    raise OSError(code, os.strerror(code), self._entry.path)
+                return self._entry.stat(follow_symlinks=follow_symlinks)
+
+        @contextmanager
+        def failing_scandir(path):
+            with os.scandir(path) as entries:
+                yield (FailingEntry(entry) for entry in entries)
+
+        with self.patch(
+            'chevah_compat.posix_filesystem.scandir', failing_scandir
+        ):
+            result = self.filesystem.getTreeUsage(base_segments)
+
+        self.assertEqual(2, result.files)
+        self.assertEqual(1, result.folders)
+        self.assertEqual(3, result.size)
+        self.assertEqual(1, result.errors)
 
-    def test_rename_folder(self):
+    @conditionals.onOSFamily('posix')
+    def test_getTreeUsage_hard_links(self):
         """
-        System test for folder renaming.
+        Files with multiple hard links are counted once.
         """
-        _, initial_segments = mk.fs.makePathInTemp()
-        _, self.test_segments = mk.fs.makePathInTemp()
-        self.assertFalse(self.filesystem.exists(initial_segments))
-        self.assertFalse(self.filesystem.exists(self.test_segments))
-        self.filesystem.createFolder(initial_segments)
+        base_segments = self.folderInTemp()
+        mk.fs.createFolder(base_segments + ['sub'])
+        mk.fs.createFile(base_segments + ['a'], content='1' * 10)
+        mk.fs.createFile(base_segments + ['b'], content='1' * 5)
+        os.link(
+            mk.fs.getRealPathFromSegments(base_segments + ['a']),
+            mk.fs.getRealPathFromSegments(base_segments + ['sub', 'a-link']),
+        )
 
-        self.filesystem.rename(initial_segments, self.test_segments)
+        result = self.filesystem.getTreeUsage(base_segments)
 
-        self.assertFalse(self.filesystem.exists(initial_segments))
-        self.assertTrue(self.filesystem.exists(self.test_segments))
+        self.assertEqual(2, result.files)
+        self.assertEqual(15, result.size)
 
-    def test_exists_false(self):
+    def test_getChecksum(self):
         """
-        exists will return `False` if file or folder does not exists.
+        The digest of the whole content or of a range is returned.
         """
-        segments = self.filesystem.temp_segments[:]
-        segments.append(mk.makeFilename())
+        # Larger than the buffer, so that it is read in multiple blocks.
+        content = b'1234567890' * 250000
+        _, segments = self.tempFile(content=content)
 
-        self.assertFalse(self.filesystem.exists(segments))
+        self.assertEqual(
+            hashlib.sha256(content).hexdigest(),
+            self.filesystem.getChecksum(segments),
+        )
+        self.assertEqual(
+            hashlib.md5(content[1500000:1500010]).hexdigest(),
+            self.filesystem.getChecksum(segments, 'md5', 1500000, 10),
+        )
+        self.assertEqual(
+            f'{zlib.crc32(content[2:3]):08x}',
+            self.filesystem.getChecksum(segments, 'crc32', offset=2, length=1),
+        )
+        self.assertEqual(
+            f'{zlib.crc32(content[-5:]):08x}',
+            self.filesystem.getChecksum(segments, 'crc32', offset=2499995),
+        )
+        self.assertEqual(
+            hashlib.sha1(b'').hexdigest(),
+            self.filesystem.getChecksum(segments, 'sha1', offset=3000000),
+        )
 
-    def test_exists_file_true(self):
+    def test_getChecksum_error(self):
         """
-        exists will return `True` if file exists.
+        An error is raised for unknown algorithms, invalid ranges and
+        files which can't be read.
         """
-        self.test_segments = self.filesystem.temp_segments[:]
-        self.test_segments.append(mk.makeFilename(suffix='low'))
-        with self.filesystem.openFileForWriting(self.test_segments) as new_file:
-            new_file.write(mk.getUniqueString().encode('utf8'))
+        segments = self.folderInTemp()
 
-        self.assertTrue(self.filesystem.exists(self.test_segments))
+        with self.assertRaises(AssertionError):
+            self.filesystem.getChecksum(segments, 'no-such-algorithm')
+        with self.assertRaises(AssertionError):
+            self.filesystem.getChecksum(segments, offset=-1)
 
-        segments_case = self.test_segments[:]
-        segments_case[-1] = (
-            segments_case[-1][:-3] + segments_case[-1][-3:].upper()
-        )
-        if self.os_name in ['windows', 'osx']:
-            # On Windows, the operations are case insensitive.
-            self.assertTrue(self.filesystem.exists(segments_case))
-        else:
-            self.assertFalse(self.filesystem.exists(segments_case))
+        with self.assertRaises(OSError) as context:
+            self.filesystem.getChecksum(segments + ['missing'])
 
-    def test_exists_folder_true(self):
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+
+    def test_getChecksumMany(self):
         """
-        exists will return `True` if folder exists.
+        The digests are returned in the order of the files, with the
+        errors for the files which can't be read.
         """
-        self.test_segments = self.filesystem.temp_segments[:]
-        self.test_segments.append(mk.makeFilename())
-        self.filesystem.createFolder(self.test_segments)
+        segments = self.folderInTemp()
+        paths = []
+        expected = []
+        for index in range(10):
+            content = str(index).encode('ascii') * (index + 1)
+            mk.fs.createFile(segments + [f'file-{index}'], content=content)
+            paths.append(segments + [f'file-{index}'])
+            expected.append(hashlib.md5(content).hexdigest())
+        paths.insert(3, segments + ['missing'])
 
-        self.assertTrue(self.filesystem.exists(self.test_segments))
+        result = self.filesystem.getChecksumMany(paths, 'md5', workers=2)
 
-    def test_getFileSize(self):
+        self.assertIsInstance(result.pop(3), OSError)
+        self.assertEqual(expected, result)
+
+    def test_executeMany(self):
         """
-        Check retrieving the size for a file.
+        The operations are executed in order for the same folder, and
+        the result or the error of each operation is returned.
         """
-        test_size = 1345
-        self.test_segments = mk.fs.createFileInTemp(length=test_size)
+        segments = self.folderInTemp()
 
-        size = self.filesystem.getFileSize(self.test_segments)
+        result = self.filesystem.executeMany(
+            [
+                ('createFolder', segments + ['a']),
+                ('openFileForWriting', segments + ['a', 'f']),
+                ('createFolder', segments + ['b', 'c'], {'recursive': True}),
+                ('deleteFile', segments + ['missing']),
+                (
+                    'setAttributes',
+                    segments + ['a'],
+                    {'attributes': {'atime': 1, 'mtime': 2}},
+                ),
+                ('rename', segments + ['b'], {'to_segments': segments + ['d']}),
+                ('deleteFile', segments + ['d', 'c']),
+            ],
+            workers=2,
+        )
 
-        self.assertEqual(test_size, size)
+        with result[1] as stream:
+            stream.write(b'content')
+        self.assertEqual(None, result[0])
+        self.assertEqual(None, result[2])
+        self.assertEqual(errno.ENOENT, result[3].errno)
+        self.assertEqual(None, result[4])
+        self.assertEqual(None, result[5])
+        self.assertEqual(errno.EISDIR, result[6].errno)
+        self.assertEqual(
+            ['a', 'd'], sorted(self.filesystem.getFolderContent(segments))
+        )
+        self.assertEqual('content', mk.fs.getFileContent(segments + ['a', 'f']))
+        self.assertEqual(
+            2, self.filesystem.getAttributes(segments + ['a']).modified
+        )
+        self.assertTrue(self.filesystem.isFolder(segments + ['d', 'c']))
 
-    def test_getFileSize_empty_file(self):
+    def test_executeMany_unknown(self):
         """
-        Check getting file size for an empty file.
+        Nothing is executed when an operation is not supported.
         """
-        test_size = 0
-        self.test_segments = mk.fs.createFileInTemp(length=0)
+        segments = self.folderInTemp()
 
-        size = self.filesystem.getFileSize(self.test_segments)
+        with self.assertRaises(AssertionError) as context:
+            self.filesystem.executeMany(
+                [
+                    ('createFolder', segments + ['a']),
+                    ('chmod', segments + ['a']),
+                ]
+            )
 
-        self.assertEqual(test_size, size)
+        self.assertEqual(
+            'Operation not supported: chmod', context.exception.args[0]
+        )
+        self.assertEqual([], self.filesystem.getFolderContent(segments))
 
-    def test_openFileForReading_parent_not_found(self):
+    def test_executeMany_arguments(self):
         """
-        Raise OSError when trying to open a file that doesn't exist for reading,
-        since the parent directory doesn't exists.
+        Nothing is executed when the arguments of an operation are not
+        valid.
         """
-        segments = ['c', 'no', 'such', 'file.txt']
-        path = self.filesystem.getRealPathFromSegments(segments)
+        segments = self.folderInTemp()
 
-        with self.assertRaises(OSError) as context:
-            self.filesystem.openFileForReading(segments)
+        with self.assertRaises(AssertionError) as context:
+            self.filesystem.executeMany(
+                [
+                    ('createFolder', segments + ['a']),
+                    ('createFolder', segments + ['b'], {'bad': True}),
+                ]
+            )
 
-        details = '[Errno 2] No such file or directory: ' + path
-        self.assertStartsWith(details, force_unicode(context.exception))
-        self.assertEqual(errno.ENOENT, context.exception.errno)
+        self.assertEqual(
+            'Unknown createFolder argument: bad', context.exception.args[0]
+        )
 
-    def test_openFileForReading_file_not_found(self):
+        with self.assertRaises(AssertionError) as context:
+            self.filesystem.executeMany(
+                [('rename', segments + ['a'], {'progress': None})]
+            )
+
+        self.assertEqual(
+            'Missing rename argument: to_segments', context.exception.args[0]
+        )
+        self.assertEqual([], self.filesystem.getFolderContent(segments))
+
+    def test_executeMany_error(self):
         """
-        Raise OSError when trying to open a file that doesn't exist for reading,
-        even when the parent directory exists.
+        The errors raised by an operation are returned as its result, so
+        that the files opened by the other operations can be closed.
         """
-        segments = ['c', 'no-such-file-in-root-drive.txt']
-        path = self.filesystem.getRealPathFromSegments(segments)
+        segments = self.folderInTemp()
 
-        with self.assertRaises(OSError) as context:
-            self.filesystem.openFileForReading(segments)
+        result = self.filesystem.executeMany(
+            [
+                ('openFileForWriting', segments + ['a']),
+                ('openFileForWriting', segments + ['b'], {'checksums': ['x']}),
+            ]
+        )
 
-        details = '[Errno 2] No such file or directory: ' + path
-        self.assertStartsWith(details, force_unicode(context.exception))
-        self.assertEqual(errno.ENOENT, context.exception.errno)
+        result[0].close()
+        self.assertIsInstance(AssertionError, result[1])
+        self.assertEqual(['a'], self.filesystem.getFolderContent(segments))
 
-    def test_openFileForReading_already_opened(self):
+    def test_OperationStages(self):
         """
-        The same file can be opened for reading multiple times.
-        Each handler has a separate cursor.
+        Operations depending on operations from other groups are in
+        a new stage.
         """
-        segments = self.fileInTemp(content='something-\N{SUN}')
-        file_1 = None
-        file_2 = None
-        try:
-            file_1 = self.filesystem.openFileForReading(segments)
-            file_2 = self.filesystem.openFileForReading(segments)
-
-            content = file_1.read(11)
-            self.assertEqual(b'something-\xe2', content)
+        sut = _OperationStages()
 
-            content = file_2.read(12)
-            self.assertEqual(b'something-\xe2\x98', content)
+        sut.add(0, 'root', ['/root/a'], 'create-a')
+        sut.add(1, 'root', ['/root/b'], 'create-b')
+        sut.add(2, '/root/a', ['/root/a/1'], 'write-a-1')
+        sut.add(3, '/root/b', ['/root/b/1'], 'write-b-1')
+        sut.add(4, '/root/a', ['/root/a/2'], 'write-a-2')
+        sut.add(5, '/root', ['/root/b', '/root/c'], 'rename-b')
+        sut.add(6, '/other', ['/other/1', '/root/c/1'], 'rename-other')
 
-        finally:
-            file_1.close()
-            file_2.close()
+        self.assertEqual(
+            [
+                {'root': [(0, 'create-a'), (1, 'create-b')]},
+                {
+                    '/root/a': [(2, 'write-a-1'), (4, 'write-a-2')],
+                    '/root/b': [(3, 'write-b-1')],
+                },
+                {'/root': [(5, 'rename-b')]},
+                {'/other': [(6, 'rename-other')]},
+            ],
+            sut.stages,
+        )
 
-    def test_openFileForReading_already_opened_for_write(self):
+    @conditionals.onOSName('linux')
+    def test_extendedAttributes(self):
         """
-        It can read a file that is currently open for writing.
+        Multiple extended attributes are set in one call, and they can be
+        read and removed.
         """
-        segments = self.fileInTemp(content='something-\N{SUN}')
-        file_read = None
-        file_write = None
-        try:
-            file_write = self.filesystem.openFileForWriting(segments)
-            file_write.write(b'some-new-content')
-            file_write.flush()
+        _, segments = self.tempFile()
 
-            # We open the file while write is still ongoing (not closed).
-            file_read = self.filesystem.openFileForReading(segments)
+        self.filesystem.setExtendedAttributes(
+            segments,
+            {'user.origin': b'192.0.2.1', 'user.transfer': 'id-\N{SUN}'},
+        )
 
-            content = file_read.read(100)
-            self.assertEqual(b'some-new-content', content)
+        self.assertEqual(
+            {
+                'user.origin': b'192.0.2.1',
+                'user.transfer': 'id-\N{SUN}'.encode('utf-8'),
+            },
+            self.filesystem.getExtendedAttributes(segments),
+        )
+        self.assertEqual(
+            {'user.origin': b'192.0.2.1'},
+            self.filesystem.getExtendedAttributes(
+                segments, ['user.origin', 'user.missing']
+            ),
+        )
 
-        finally:
-            file_read.close()
-            file_write.close()
+        self.filesystem.setExtendedAttributes(
+            segments, {'user.origin': None, 'user.missing': None}
+        )
 
-    def test_openFileForReading_unicode(self):
+        self.assertEqual(
+            ['user.transfer'],
+            self.filesystem.listExtendedAttributes(segments),
+        )
+
+    @conditionals.onOSName('linux')
+    def test_extendedAttributes_error(self):
         """
-        Check reading in Unicode.
+        An error is raised for paths which don't exist.
         """
-        content = mk.getUniqueString()
-        self.test_segments = mk.fs.createFileInTemp(content=content)
-        a_file = None
-        try:
-            a_file = self.filesystem.openFileForReading(self.test_segments)
+        segments = self.folderInTemp() + ['missing']
 
-            self.assertEqual(content, a_file.read().decode('utf-8'))
-        finally:
-            a_file.close()
+        with self.assertRaises(OSError) as context:
+            self.filesystem.getExtendedAttributes(segments)
+        self.assertEqual(errno.ENOENT, context.exception.errno)
 
-    def test_openFileForReading_empty(self):
+        with self.assertRaises(OSError) as context:
+            self.filesystem.setExtendedAttributes(segments, {'user.a': b'1'})
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+
+    @conditionals.onOSName('linux')
+    def test_iterateFolderContent_extended_attributes(self):
         """
-        An empty file can be opened for reading.
+        The requested extended attributes are read together with the
+        attributes of the members.
         """
-        self.test_segments = mk.fs.createFileInTemp(length=0)
-        a_file = None
-        try:
-            a_file = self.filesystem.openFileForReading(self.test_segments)
+        segments = self.folderInTemp()
+        mk.fs.createFile(segments + ['a'])
+        mk.fs.createFile(segments + ['b'])
+        self.filesystem.setExtendedAttributes(
+            segments + ['a'], {'user.origin': b'1', 'user.other': b'2'}
+        )
 
-            self.assertEqual(b'', a_file.read())
-        finally:
-            a_file.close()
+        result = {
+            member.name: member.extended_attributes
+            for member in self.filesystem.iterateFolderContent(
+                segments, extended_attributes=['user.origin']
+            )
+        }
 
-    def test_openFileForReading_no_write(self):
+        self.assertEqual({'a': {'user.origin': b'1'}, 'b': {}}, result)
+        result = list(self.filesystem.iterateFolderContent(segments))
+        self.assertIsNone(result[0].extended_attributes)
+
+    @conditionals.onOSName('linux')
+    def test_getChecksum_cache(self):
         """
-        A file opened only for reading will not be able to write into.
+        The digests of the whole files are kept by the checksum cache.
         """
-        self.test_segments = mk.fs.createFileInTemp(length=0)
-        a_file = None
-        try:
-            a_file = self.filesystem.openFileForReading(self.test_segments)
+        sut = LocalFilesystem(avatar=DefaultAvatar())
+        sut.checksum_cache = ChecksumCache()
+        self.addCleanup(sut.checksum_cache.close)
+        content = b'1234567890'
+        path, segments = self.tempFile(content=content)
+        os.utime(path, (0, 0))
 
-            with self.assertRaises(IOError):
-                a_file.write('something')
-        finally:
-            a_file.close()
+        self.assertEqual(
+            hashlib.md5(content).hexdigest(), sut.getChecksum(segments, 'md5')
+        )
+        self.assertEqual(
+            [hashlib.md5(content).hexdigest()],
+            sut.getChecksumMany([segments], 'md5'),
+        )
+        self.assertEqual(
+            hashlib.md5(content[2:]).hexdigest(),
+            sut.getChecksum(segments, 'md5', offset=2),
+        )
 
-    def test_openFileForReading_no_delete_lock(self):
+        self.assertEqual(1, sut.checksum_cache.hits)
+        self.assertEqual(1, sut.checksum_cache.misses)
+
+    @conditionals.onOSName('linux')
+    def test_getChecksum_cache_reserved(self):
         """
-        A file opened only for reading will not be locked for delete
-        operations.
+        The digests kept by the checksum cache can't be read or forged
+        via the extended attributes of the files.
         """
-        _, segments = mk.fs.makePathInTemp()
-        mk.fs.writeFileContent(segments=segments, content='something-\N{SUN}')
-        a_file = None
-        try:
-            a_file = self.filesystem.openFileForReading(segments)
+        sut = LocalFilesystem(avatar=DefaultAvatar())
+        sut.checksum_cache = ChecksumCache()
+        self.addCleanup(sut.checksum_cache.close)
+        content = b'1234567890'
+        path, segments = self.tempFile(content=content)
+        os.utime(path, (0, 0))
+        stats = os.stat(path)
+        name = 'user.chevah.checksum.md5'
+        forged = f'10:{stats.st_mtime_ns}:{stats.st_ino}:{"0" * 32}'
 
-            self.filesystem.deleteFile(segments)
+        with self.assertRaises(OSError) as context:
+            sut.setExtendedAttributes(
+                segments, {'user.origin': b'1', name: forged}
+            )
 
-            content = a_file.read(100)
-            self.assertEqual(b'something-\xe2\x98\x89', content)
-        finally:
-            a_file.close()
+        self.assertEqual(errno.EPERM, context.exception.errno)
+        self.assertEqual({}, sut.getExtendedAttributes(segments))
+        self.assertEqual(
+            hashlib.md5(content).hexdigest(), sut.getChecksum(segments, 'md5')
+        )
+        self.assertIn(os.listxattr(path), name)
+        self.assertEqual([], sut.listExtendedAttributes(segments))
+        self.assertEqual({}, sut.getExtendedAttributes(segments, [name]))
 
-    def test_openFile_read_no_delete_lock(self):
+    @conditionals.onOSName('linux')
+    def test_metadata_cache(self):
         """
-        A file opened only for reading will not be locked for delete
-        operations.
-
-        The file is opened in binary mode.
+        The attributes, existence and content are cached until changed.
         """
-        content = 'first-line\nmore-lines\r\nsomething-\N{SUN}'
-        _, segments = mk.fs.makePathInTemp()
-        mk.fs.writeFileContent(segments=segments, content=content)
-        fd = None
-        try:
-            fd = self.filesystem.openFile(
-                segments,
-                flags=self.filesystem.OPEN_READ_ONLY,
-                mode=0,
-            )
-
-            self.filesystem.deleteFile(segments)
-            self.assertFalse(self.filesystem.exists(segments))
+        sut = LocalFilesystem(avatar=DefaultAvatar())
+        sut.metadata_cache = MetadataCache()
+        self.addCleanup(sut.metadata_cache.close)
+        base_segments = self.folderInTemp()
+        file_segments = base_segments + ['a']
 
-            result = os.read(fd, 100)
-            self.assertEqual(content.encode('utf-8'), result)
-        finally:
-            if fd:
-                os.close(fd)
+        self.assertFalse(sut.exists(file_segments))
+        self.assertEqual([], sut.getFolderContent(base_segments))
 
-    @conditionals.onOSFamily('nt')
-    def test_fdRead_os_error(self):
-        """
-        This is a low-level Windows test.
+        sut.createFolder(file_segments)
 
-        Under normal update, this function should never fail as we have some
-        higher API guards.
+        self.assertTrue(sut.exists(file_segments))
+        self.assertTrue(sut.isFolder(file_segments))
+        self.assertEqual(['a'], sut.getFolderContent(base_segments))
 
-        This test is here to make sure that if it fails, it raises a generic
-        OSError.
-        """
-        with self.assertRaises(OSError):
-            self.filesystem._fdRead('no/such/path')
+        sut.deleteFolder(file_segments)
+        mk.fs.createFile(file_segments, content=b'123')
 
-    def test_openFile_write_only(self):
-        """
-        A file opened only for write will not allow reading.
+        self.assertTrue(sut.isFile(file_segments))
+        self.assertEqual(3, sut.getAttributes(file_segments).size)
+        self.assertEqual(3, sut.getAttributes(file_segments).size)
+        self.assertTrue(sut.exists(file_segments))
+        content = sut.getFolderContent(base_segments)
+        content.append('changed')
+        self.assertEqual(['a'], sut.getFolderContent(base_segments))
 
-        Initial content is reset.
+        self.assertEqual(3, sut.metadata_cache.hits)
+        self.assertEqual(8, sut.metadata_cache.misses)
 
-        The file is written in binary mode.
+    def test_metadata_cache_changed(self):
         """
-        content = 'first-line\nmore-lines\r\nsomething-\N{SUN}'
-        segments = self.fileInTemp(content='initial-value')
-        fd = None
-        try:
-            fd = self.filesystem.openFile(
-                segments,
-                flags=self.filesystem.OPEN_WRITE_ONLY,
-                mode=0,
-            )
+        The values of the paths changed via the filesystem are removed
+        from the cache, even when the other changes are not observed.
+        The cached attributes are not shared with the callers.
+        """
+        sut = LocalFilesystem(avatar=DefaultAvatar())
+        sut.metadata_cache = MetadataCache(ttl=3600)
+        self.addCleanup(sut.metadata_cache.close)
+        sut.metadata_cache.mounts_interval = 3600
+        sut.metadata_cache._mounts = [('/', 'nfs4')]
+        base_segments = self.folderInTemp()
+        file_segments = base_segments + ['a']
+        other_segments = base_segments + ['b']
 
-            os.write(fd, content.encode('utf-8'))
+        self.assertFalse(sut.exists(file_segments))
+        self.assertEqual([], sut.getFolderContent(base_segments))
+        with sut.openFileForWriting(file_segments) as stream:
+            stream.write(b'12')
 
-            # File can't be read.
-            self.assertRaises(OSError, os.read, fd, 1)
+        self.assertTrue(sut.exists(file_segments))
+        self.assertEqual(['a'], sut.getFolderContent(base_segments))
+        attributes = sut.getAttributes(file_segments)
+        attributes.size = 5
+        self.assertEqual(2, sut.getAttributes(file_segments).size)
 
-        finally:
-            if fd:
-                os.close(fd)
+        with sut.openFileForAppending(file_segments) as stream:
+            stream.write(b'3')
 
-        # Just check the result after close.
-        self.assertEqual(content, mk.fs.getFileContent(segments))
+        self.assertEqual(3, sut.getAttributes(file_segments).size)
 
-    def test_openFile_read_and_write(self):
-        """
-        A file opened for read and write will not have the
-        content reset or truncated.
+        sut.setAttributes(file_segments, {'mtime': 1000})
 
-        The file is locked for delete.
+        self.assertEqual(1000, sut.getAttributes(file_segments).modified)
 
-        The file is written in binary mode.
-        """
-        content = 'first-line\nmore-lines\r\nsomething-\N{SUN}'
-        segments = self.fileInTemp(content=content)
-        fd = None
-        try:
-            fd = self.filesystem.openFile(
-                segments,
-                flags=self.filesystem.OPEN_READ_WRITE,
-                mode=0,
-            )
+        sut.rename(file_segments, other_segments)
 
-            # File can be read, and pointer is at start
-            result = os.read(fd, 15)
-            self.assertEqual(b'first-line\nmore', result)
+        self.assertFalse(sut.exists(file_segments))
+        self.assertEqual(['b'], sut.getFolderContent(base_segments))
 
-            # File can be written
-            os.write(fd, b'UPDATE')
+        sut.copyFile(other_segments, file_segments)
+        sut.deleteFile(other_segments)
 
-            # On Windows, the file is locked for deletion, due to write access.
-            if self.os_family == 'nt':
-                self.assertRaises(OSError, self.filesystem.deleteFile, segments)
+        self.assertEqual(['a'], sut.getFolderContent(base_segments))
+        self.assertFalse(sut.exists(other_segments))
 
-        finally:
-            if fd:
-                os.close(fd)
+        sut.createFolder(other_segments)
+        sut.copyFolder(other_segments, base_segments + ['c'])
 
-        # The write is in the middle of the file.
-        # All the previous content is kept, with the exception of the
-        # updated part.
+        self.assertTrue(sut.isFolder(base_segments + ['c']))
         self.assertEqual(
-            'first-line\nmoreUPDATE\r\nsomething-\N{SUN}',
-            mk.fs.getFileContent(segments),
+            ['a', 'b', 'c'], sorted(sut.getFolderContent(base_segments))
         )
 
-    def test_openFileForWriting_ascii(self):
-        """
-        Check opening a file for writing in plain/ascii/str mode.
-
-        It will create the file if it doesn't exists with owner only
-        permisisons.
-        """
-        content = b'some ascii text'
-        _, segments = self.tempPathCleanup()
-        self.assertFalse(mk.fs.exists(segments))
-
-        sut = self.filesystem.openFileForWriting(segments)
-        sut.write(content)
-        sut.close()
-
-        result = self.filesystem.getAttributes(segments)
-        self.assertEqual(result.mode | 0o600, result.mode)
+        sut.deleteFolder(other_segments)
 
-        a_file = self.filesystem.openFileForReading(segments)
-        test_content = a_file.read()
-        a_file.close()
-        self.assertEqual(test_content, content)
+        self.assertFalse(sut.exists(other_segments))
+        self.assertEqual(
+            ['a', 'c'], sorted(sut.getFolderContent(base_segments))
+        )
 
-    def test_openFileForWriting_mode(self):
+    @conditionals.onCapability('symbolic_link', True)
+    def test_metadata_cache_link(self):
         """
-        You can specify the file permissions for the newly created file.
+        The attributes of a link are not cached, as the target can be
+        changed via other paths.
         """
-        _, segments = self.tempPathCleanup()
+        sut = LocalFilesystem(avatar=DefaultAvatar())
+        sut.metadata_cache = MetadataCache()
+        self.addCleanup(sut.metadata_cache.close)
+        base_segments = self.folderInTemp()
+        mk.fs.createFile(base_segments + ['target'], content=b'1')
+        link_segments = self.makeLink(base_segments + ['target'])
 
-        sut = self.filesystem.openFileForWriting(segments, mode=0o642)
-        self.addCleanup(sut.close)
-        sut.write(b'some data')
+        sut.getAttributes(link_segments)
+        result = sut.getAttributes(link_segments)
 
-        if self.os_family == 'posix':
-            result = self.filesystem.getAttributes(segments)
-            # The umask will overwrite the requested attributes.
-            self.assertEqual(0o640, result.mode & 0o640)
+        self.assertTrue(result.is_link)
+        self.assertEqual(0, sut.metadata_cache.hits)
 
-    def test_openFileForWriting_no_read(self):
-        """
-        When a file is opened for writing, we can not read from it.
+    @attr('slow')
+    def test_iterateFolderContent_big(self):
         """
-        self.test_segments = mk.fs.createFileInTemp(length=0)
-        a_file = None
-        try:
-            a_file = self.filesystem.openFileForWriting(self.test_segments)
-
-            # We should not be able to read.
-            with self.assertRaises(IOError):
-                a_file.read()
+        It will not block on listing folders with many members.
 
-        finally:
-            a_file.close()
+        On some systems, this test takes more than 1 minute.
+        """
+        self._iterateFolderContent_big()
 
-    def test_openFileForWriting_truncate(self):
+    def _iterateFolderContent_big(self):
         """
-        When a file is opened for writing, the previous file is truncated
-        to 0 length and we write as a fresh file.
+        Main code for running the test
         """
-        content = mk.getUniqueString(100)
-        new_content = mk.getUniqueString(50)
+        if self.os_name == 'aix':
+            count = 3000
+            base_timeout = 0.02
+        elif self.os_name == 'osx':
+            # On GitHub the OSX can be a bit slow.
+            count = 32000
+            base_timeout = 0.3
+        elif self.os_name in ['hpux', 'freebsd', 'openbsd']:
+            # Some OS/FS does not allow more than 32765 members in a folder
+            # and the slave is generally slow.
+            count = 32000
+            base_timeout = 0.15
+        elif self.cpu_type in ['sparc', 'arm64']:
+            count = 5000
+            base_timeout = 0.1
+        else:
+            count = 40000
+            base_timeout = 0.1
+
+        if self.os_name == 'windows':
+            # On windows, some iteration operation might be very slow.
+            bias = 0.7
+        else:
+            bias = 0
+
+        base_segments = self.folderInTemp()
+
+        for i in range(count):
+            mk.fs.createFolder(base_segments + [f'some-member-{i}'])
+            if i % 1000 == 0:
+                # This is slow, so keep the CI informed that we are doing
+                # stuff.
+                sys.stdout.write('+')
+                sys.stdout.flush()
+
+        # Show progress.
+        sys.stdout.write('-SLOW-')
+        sys.stdout.flush()
+
+        # We check that doing a direct listing will take a long time.
+        with self.assertRaises(AssertionError):
+            with self.assertExecutionTime(base_timeout):
+                result = self.filesystem.getFolderContent(base_segments)
+        self.assertEqual(count, len(result))
+
+        # Show progress.
+        sys.stdout.write('-FAST-')
+        sys.stdout.flush()
+
+        # Getting the iterator will not take long.
+        with self.assertExecutionTime(base_timeout + bias):
+            iterator = self.filesystem.iterateFolderContent(base_segments)
+
+        # Iterating at any step will not take long.
+        result = []
+        result.append(next(iterator))
+        try:
+            i = 0
+            while True:
+                with self.assertExecutionTime(base_timeout + bias):
+                    result.append(next(iterator))
+                i += 1
+                if i % 1000 == 0:
+                    # This is slow, so keep the CI informed that we are doing
+                    # stuff.
+                    sys.stdout.write('+')
+                    sys.stdout.flush()
+        except StopIteration:
+            """
+            We are at the end. All good.
+            """
+        self.assertEqual(count, len(result))
+
+    def test_openFile_folder(self):
+        """
+        Raise OSError when trying to open a folder as file.
+        """
+        self.test_segments = mk.fs.createFolderInTemp()
+        path = mk.fs.getRealPathFromSegments(self.test_segments)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFile(self.test_segments, os.O_RDONLY, 0o777)
+
+        self.assertEqual(errno.EISDIR, context.exception.errno)
+        expected = '[Errno 21] Is a directory: ' + path
+        self.assertStartsWith(expected, force_unicode(context.exception))
+
+    def test_openFileForReading_folder(self):
+        """
+        Raise OSError when trying to open a folder as file for reading.
+        """
+        self.test_segments = mk.fs.createFolderInTemp()
+        path = mk.fs.getRealPathFromSegments(self.test_segments)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFileForReading(self.test_segments)
+
+        self.assertEqual(errno.EISDIR, context.exception.errno)
+        details = '[Errno 21] Is a directory: ' + path
+        self.assertStartsWith(details, force_unicode(context.exception))
+
+    def test_openFileForWriting_folder(self):
+        """
+        Raise OSError when trying to open a folder as file for writing.
+        """
+        self.test_segments = mk.fs.createFolderInTemp()
+        path = mk.fs.getRealPathFromSegments(self.test_segments)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFileForWriting(self.test_segments)
+
+        self.assertEqual(errno.EISDIR, context.exception.errno)
+        self.assertEqual(path, context.exception.filename)
+        details = '[Errno 21] Is a directory: ' + path
+        self.assertStartsWith(details, force_unicode(context.exception))
+
+    def test_openFileForAppending_folder(self):
+        """
+        Raise OSError when trying to open a folder as file for appending.
+        """
+        self.test_segments = mk.fs.createFolderInTemp()
+        path = mk.fs.getRealPathFromSegments(self.test_segments)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFileForAppending(self.test_segments)
+
+        self.assertEqual(errno.EISDIR, context.exception.errno)
+        self.assertEqual(path, context.exception.filename)
+        details = '[Errno 21] Is a directory: ' + path
+        self.assertStartsWith(details, str(context.exception))
+
+    def test_touch_no_parent(self):
+        """
+        Raise an error when path does not exists and can not be created.
+        """
+        segments = ['c', 'no-such', 'path']
+        path = mk.fs.getRealPathFromSegments(segments)
+
+        with self.assertRaises(IOError) as context:
+            self.filesystem.touch(segments)
+
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+        details = '[Errno 2] No such file or directory: ' + path
+        self.assertEqual(details, force_unicode(context.exception))
+
+    def test_touch_dont_exists(self):
+        """
+        A file is created if it does not exists.
+        """
+        _, self.test_segments = mk.fs.makePathInTemp()
+        self.assertFalse(mk.fs.exists(self.test_segments))
+
+        self.filesystem.touch(self.test_segments)
+
+        self.assertTrue(mk.fs.exists(self.test_segments))
+
+    def test_touch_already_exists(self):
+        """
+        The modified time is updated path already exists.
+        """
+        self.test_segments = mk.fs.createFileInTemp()
+        now = time.time()
+        mk.fs.setAttributes(
+            self.test_segments,
+            {'atime': now - 10, 'mtime': now - 10},
+        )
+
+        self.filesystem.touch(self.test_segments)
+
+        self.assertTrue(mk.fs.exists(self.test_segments))
+        attributes = mk.fs.getAttributes(self.test_segments)
+        self.assertAlmostEqual(now, attributes.modified, delta=1.5)
+
+    def test_copyFile_destination_no_parent(self):
+        """
+        Raises an exception when destination does not exists, and it can not
+        be created
+        """
+        self.test_segments = mk.fs.createFileInTemp(content=mk.string())
+        destination_segments = ['c', 'no-parent', 'path']
+        path = mk.fs.getRealPathFromSegments(destination_segments)
+
+        with self.assertRaises(IOError) as context:
+            self.filesystem.copyFile(self.test_segments, destination_segments)
+
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+        details = '[Errno 2] No such file or directory: ' + path
+        self.assertEqual(details, force_unicode(context.exception))
+
+    def test_copyFile_file_destination_exists_no_overwrite(self):
+        """
+        Raise an error when destination exists and it was not instructed to
+        overwrite existing files.
+        """
+        source_segments = ['ignore', 'source']
+        path, segments = self.tempFile(win_encoded=True)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.copyFile(source_segments, segments)
+
+        self.assertEqual(errno.EEXIST, context.exception.errno)
+        details = '[Errno 17] Destination exists: ' + path
+        self.assertEqual(details, force_unicode(context.exception))
+
+    def test_copyFile_file_destination_exists_overwrite(self):
+        """
+        Copy file without errors when overwrite was asked.
+        """
+        content = mk.string()
+        self.test_segments = mk.fs.createFileInTemp(content=content)
+        destination_segments = mk.fs.createFileInTemp()
+
+        self.filesystem.copyFile(
+            self.test_segments,
+            destination_segments,
+            overwrite=True,
+        )
+
+        destination_content = mk.fs.getFileContent(destination_segments)
+        self.assertEqual(content, destination_content)
+        mk.fs.deleteFile(destination_segments)
+
+    def test_copyFile_folder_destination_exists_no_overwrite(self):
+        """
+        Raise an error when destination exists in destination folder
+        and it was not instructed to overwrite existing files.
+        """
+        self.test_segments = mk.fs.createFileInTemp()
+        destination_segments = self.test_segments[:-1]
+        path = mk.fs.getRealPathFromSegments(
+            destination_segments + self.test_segments[-1:],
+        )
+        source_segments = ['bla', self.test_segments[-1]]
+        if self.os_name == 'windows':
+            path = mk.fs.getEncodedPath(path)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.copyFile(source_segments, destination_segments)
+
+        self.assertEqual(errno.EEXIST, context.exception.errno)
+        details = '[Errno 17] Destination exists: ' + path
+        self.assertEqual(details, force_unicode(context.exception))
+
+    def test_copyFile_folder_destination_exists_overwrite(self):
+        """
+        Replace file when destination exists in destination folder
+        and it was instructed to overwrite existing files.
+        """
+        content = mk.string()
+        self.test_segments = mk.fs.createFileInTemp(content=content)
+        destination_segments = mk.fs.createFolderInTemp()
+        destination_file_segments = destination_segments[:]
+        destination_file_segments.append(self.test_segments[-1])
+        mk.fs.touch(destination_file_segments)
+
+        self.filesystem.copyFile(
+            self.test_segments,
+            destination_segments,
+            overwrite=True,
+        )
+
+        destination_content = mk.fs.getFileContent(destination_file_segments)
+        self.assertEqual(content, destination_content)
+        mk.fs.deleteFolder(destination_segments, recursive=True)
+
+    def test_copyFile_file_destination_no_exists(self):
+        """
+        Copy file in destination when destination does not exists, but
+        can be created.
+        """
+        content = mk.string()
+        _, destination_segments = mk.fs.makePathInTemp()
+        source_segments = mk.fs.createFileInTemp(content=content)
+
+        self.filesystem.copyFile(source_segments, destination_segments)
+
+        self.assertTrue(self.filesystem.exists(destination_segments))
+        destination_content = mk.fs.getFileContent(destination_segments)
+        self.assertEqual(content, destination_content)
+        # Clean new files.
+        self.filesystem.deleteFile(source_segments)
+        self.filesystem.deleteFile(destination_segments)
+
+    def test_copyFile_folder_destination_no_exists(self):
+        """
+        When destination is a folder the file will be copied using the same
+        filename as the source, if the folder does not already contain
+        a member with the same name.
+        """
+        content = mk.string()
+        source_segments = mk.fs.createFileInTemp(content=content)
+        self.test_segments = mk.fs.createFolderInTemp()
+        destination_segments = self.test_segments[:]
+        destination_segments.append(source_segments[-1])
+
+        self.filesystem.copyFile(source_segments, self.test_segments)
+
+        self.assertTrue(self.filesystem.exists(destination_segments))
+        destination_content = mk.fs.getFileContent(destination_segments)
+        self.assertEqual(content, destination_content)
+        self.filesystem.deleteFile(source_segments)
+
+    @conditionals.onOSFamily('posix')
+    def test_copyFolder(self):
+        """
+        The folder tree is copied with the attributes of the members,
+        including the links, which are not followed.
+        """
+        source_path, source_segments = self.tempFolder()
+        mk.fs.createFolder(source_segments + ['sub'])
+        mk.fs.createFile(source_segments + ['a'], content='a-content')
+        mk.fs.createFile(source_segments + ['sub', 'b'], content='b')
+        os.symlink('../a', os.path.join(source_path, 'sub', 'link'))
+        os.chmod(os.path.join(source_path, 'sub'), 0o750)
+        os.chmod(os.path.join(source_path, 'a'), 0o640)
+        destination_path, destination_segments = self.tempPathCleanup()
+        calls = []
+
+        result = self.filesystem.copyFolder(
+            source_segments,
+            destination_segments,
+            progress=lambda *args: calls.append(args),
+        )
+
+        self.assertEqual([], result)
+        self.assertEqual((10, 10), calls[-1])
+        self.assertEqual(['a', 'sub'], sorted(os.listdir(source_path)))
+        self.assertEqual(['a', 'sub'], sorted(os.listdir(destination_path)))
+        link_path = os.path.join(destination_path, 'sub', 'link')
+        self.assertEqual('../a', os.readlink(link_path))
+        with open(link_path) as stream:
+            self.assertEqual('a-content', stream.read())
+        self.assertEqual(
+            0o750,
+            stat.S_IMODE(
+                os.stat(os.path.join(destination_path, 'sub')).st_mode
+            ),
+        )
+        self.assertEqual(
+            0o640,
+            stat.S_IMODE(os.stat(os.path.join(destination_path, 'a')).st_mode),
+        )
+
+    @conditionals.onOSFamily('posix')
+    def test_copyFolder_no_preserve(self):
+        """
+        When not preserving the attributes, the members are created with
+        the default mode.
+        """
+        source_path, source_segments = self.tempFolder()
+        mk.fs.createFolder(source_segments + ['sub'])
+        mk.fs.createFile(source_segments + ['sub', 'a'], content='a')
+        os.chmod(os.path.join(source_path, 'sub'), 0o750)
+        os.chmod(os.path.join(source_path, 'sub', 'a'), 0o644)
+        destination_path, destination_segments = self.tempPathCleanup()
+
+        result = self.filesystem.copyFolder(
+            source_segments, destination_segments, preserve=False
+        )
+
+        self.assertEqual([], result)
+        self.assertEqual(
+            0o600,
+            stat.S_IMODE(
+                os.stat(os.path.join(destination_path, 'sub', 'a')).st_mode
+            ),
+        )
+        self.assertNotEqual(
+            0o750,
+            stat.S_IMODE(
+                os.stat(os.path.join(destination_path, 'sub')).st_mode
+            ),
+        )
+
+    def test_copyFolder_destination_exists(self):
+        """
+        The copy fails when the destination exists and `overwrite` is not
+        True, otherwise the existing members are replaced and the other
+        ones are kept.
+        """
+        source_segments = self.folderInTemp()
+        mk.fs.createFile(source_segments + ['a'], content='new')
+        destination_segments = self.folderInTemp()
+        mk.fs.createFile(destination_segments + ['a'], content='old')
+        mk.fs.createFile(destination_segments + ['b'], content='b')
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.copyFolder(source_segments, destination_segments)
+
+        self.assertEqual(errno.EEXIST, context.exception.errno)
+
+        result = self.filesystem.copyFolder(
+            source_segments, destination_segments, overwrite=True
+        )
+
+        self.assertEqual([], result)
+        self.assertEqual(
+            'new', mk.fs.getFileContent(destination_segments + ['a'])
+        )
+        self.assertEqual(
+            'b', mk.fs.getFileContent(destination_segments + ['b'])
+        )
+
+    def test_copyFolder_errors(self):
+        """
+        The members which can't be copied are returned with their error,
+        while the other members are copied.
+        """
+        source_segments = self.folderInTemp()
+        mk.fs.createFile(source_segments + ['a'], content='a')
+        mk.fs.createFolder(source_segments + ['sub'])
+        mk.fs.createFile(source_segments + ['sub', 'b'], content='b')
+        destination_segments = self.folderInTemp()
+        mk.fs.createFolder(destination_segments + ['a'])
+        mk.fs.createFile(destination_segments + ['sub'])
+
+        result = self.filesystem.copyFolder(
+            source_segments, destination_segments, overwrite=True
+        )
+
+        self.assertEqual(
+            [destination_segments + ['sub'], destination_segments + ['a']],
+            [segments for segments, _ignored in result],
+        )
+        self.assertEqual(
+            [errno.EEXIST, errno.EISDIR],
+            [error.errno for _ignored, error in result],
+        )
+        self.assertEqual(
+            ['a', 'sub'],
+            sorted(self.filesystem.getFolderContent(destination_segments)),
+        )
+        self.assertTrue(self.filesystem.isFile(destination_segments + ['sub']))
+
+    def test_copyFolder_not_folder(self):
+        """
+        The copy fails when the source is not a folder.
+        """
+        source_segments = self.fileInTemp()
+        destination_segments = self.folderInTemp()
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.copyFolder(
+                source_segments, destination_segments + ['copy']
+            )
+
+        self.assertEqual(errno.ENOTDIR, context.exception.errno)
+        self.assertEqual(
+            [], self.filesystem.getFolderContent(destination_segments)
+        )
+
+    def test_makeFolder(self):
+        """
+        Check makeFolder.
+        """
+        folder_name = mk.makeFilename(length=10)
+        self.test_segments = mk.fs.temp_segments[:]
+        self.test_segments.append(folder_name)
+
+        self.filesystem.createFolder(self.test_segments)
+
+        self.assertTrue(self.filesystem.isFolder(self.test_segments))
+
+    def test_rename_file(self):
+        """
+        System test for file renaming.
+        """
+        _, initial_segments = mk.fs.makePathInTemp()
+        _, self.test_segments = mk.fs.makePathInTemp()
+        self.assertFalse(self.filesystem.exists(initial_segments))
+        self.assertFalse(self.filesystem.exists(self.test_segments))
+        self.filesystem.touch(initial_segments)
+
+        self.filesystem.rename(initial_segments, self.test_segments)
+
+        self.assertFalse(self.filesystem.exists(initial_segments))
+        self.assertTrue(self.filesystem.exists(self.test_segments))
+
+    def test_rename_file_overwrite_destination(self):
+        """
+        It will overwrite existing file.
+        """
+        _, source_segments = self.tempFile(prefix='src-', cleanup=False)
+        _, destination_segments = self.tempFile(prefix='dst-')
+        self.assertTrue(self.filesystem.exists(source_segments))
+        self.assertTrue(self.filesystem.exists(destination_segments))
+
+        self.filesystem.rename(source_segments, destination_segments)
+
+        self.assertFalse(self.filesystem.exists(source_segments))
+        self.assertTrue(self.filesystem.exists(destination_segments))
+
+    def test_rename_folder(self):
+        """
+        System test for folder renaming.
+        """
+        _, initial_segments = mk.fs.makePathInTemp()
+        _, self.test_segments = mk.fs.makePathInTemp()
+        self.assertFalse(self.filesystem.exists(initial_segments))
+        self.assertFalse(self.filesystem.exists(self.test_segments))
+        self.filesystem.createFolder(initial_segments)
+
+        self.filesystem.rename(initial_segments, self.test_segments)
+
+        self.assertFalse(self.filesystem.exists(initial_segments))
+        self.assertTrue(self.filesystem.exists(self.test_segments))
+
+    def patchRenameAcrossDevices(self):
+        """
+        Return a context in which the renames from the filesystem fail as
+        for a destination on another filesystem.
+        """
+        rename = os.rename
+
+        def cross_device_rename(source, destination):
+            if '.chevah-move' in str(source):
+                return rename(source, destination)
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        return self.patchObject(os, 'rename', side_effect=cross_device_rename)
+
+    @conditionals.onOSFamily('posix')
+    def test_rename_other_device_file(self):
+        """
+        A file is moved to another filesystem with its attributes, even
+        when the fastest copy function is not supported.
+        """
+        content = b'1234567890' * 1000000
+        path, segments = self.tempFile(content=content, cleanup=False)
+        os.chmod(path, 0o640)
+        os.utime(path, ns=(1000000001, 2000000002))
+        destination_path, destination_segments = self.tempPathCleanup()
+        progress = []
+
+        with self.patchRenameAcrossDevices():
+            with self.patchObject(
+                os,
+                'copy_file_range',
+                side_effect=OSError(errno.EXDEV, 'Not supported'),
+                create=True,
+            ):
+                self.filesystem.rename(
+                    segments,
+                    destination_segments,
+                    progress=lambda *args: progress.append(args),
+                )
+
+        self.assertFalse(os.path.exists(path))
+        with open(destination_path, 'rb') as stream:
+            self.assertEqual(content, stream.read())
+        result = os.stat(destination_path)
+        self.assertEqual(0o640, stat.S_IMODE(result.st_mode))
+        self.assertEqual(2000000002, result.st_mtime_ns)
+        self.assertEqual((len(content), len(content)), progress[-1])
+
+    @conditionals.onOSFamily('posix')
+    def test_rename_other_device_folder(self):
+        """
+        A folder tree is moved to another filesystem, including the
+        links, which are not followed.
+        """
+        source_path, source_segments = self.tempPath()
+        mk.fs.createFolder(source_segments)
+        mk.fs.createFolder(source_segments + ['sub'])
+        mk.fs.createFile(source_segments + ['a'], content='a-content')
+        mk.fs.createFile(source_segments + ['sub', 'b'], content='b')
+        os.symlink('../a', os.path.join(source_path, 'sub', 'link'))
+        os.chmod(os.path.join(source_path, 'sub'), 0o750)
+        destination_path, destination_segments = self.tempPathCleanup()
+
+        with self.patchRenameAcrossDevices():
+            self.filesystem.rename(source_segments, destination_segments)
+
+        self.assertFalse(os.path.exists(source_path))
+        self.assertEqual(['a', 'sub'], sorted(os.listdir(destination_path)))
+        link_path = os.path.join(destination_path, 'sub', 'link')
+        self.assertEqual('../a', os.readlink(link_path))
+        with open(link_path) as stream:
+            self.assertEqual('a-content', stream.read())
+        self.assertEqual(
+            0o750,
+            stat.S_IMODE(
+                os.stat(os.path.join(destination_path, 'sub')).st_mode
+            ),
+        )
+
+    @conditionals.onOSFamily('posix')
+    def test_rename_other_device_error(self):
+        """
+        The source is kept and the partial copy is removed when the
+        destination can't be replaced.
+        """
+        source_segments = self.folderInTemp()
+        mk.fs.createFile(source_segments + ['a'])
+        destination_segments = self.folderInTemp()
+        mk.fs.createFile(destination_segments + ['b'])
+
+        with self.patchRenameAcrossDevices():
+            with self.assertRaises(OSError) as context:
+                self.filesystem.rename(source_segments, destination_segments)
+
+        self.assertEqual(errno.ENOTEMPTY, context.exception.errno)
+        self.assertTrue(self.filesystem.exists(source_segments + ['a']))
+        self.assertEqual(
+            ['b'], self.filesystem.getFolderContent(destination_segments)
+        )
+        parent = self.filesystem.getRealPathFromSegments(
+            destination_segments[:-1]
+        )
+        self.assertEqual(
+            [],
+            [name for name in os.listdir(parent) if 'chevah-move' in name],
+        )
+
+    def test_exists_false(self):
+        """
+        exists will return `False` if file or folder does not exists.
+        """
+        segments = self.filesystem.temp_segments[:]
+        segments.append(mk.makeFilename())
+
+        self.assertFalse(self.filesystem.exists(segments))
+
+    def test_exists_file_true(self):
+        """
+        exists will return `True` if file exists.
+        """
+        self.test_segments = self.filesystem.temp_segments[:]
+        self.test_segments.append(mk.makeFilename(suffix='low'))
+        with self.filesystem.openFileForWriting(self.test_segments) as new_file:
+            new_file.write(mk.getUniqueString().encode('utf8'))
+
+        self.assertTrue(self.filesystem.exists(self.test_segments))
+
+        segments_case = self.test_segments[:]
+        segments_case[-1] = (
+            segments_case[-1][:-3] + segments_case[-1][-3:].upper()
+        )
+        if self.os_name in ['windows', 'osx']:
+            # On Windows, the operations are case insensitive.
+            self.assertTrue(self.filesystem.exists(segments_case))
+        else:
+            self.assertFalse(self.filesystem.exists(segments_case))
+
+    def test_exists_folder_true(self):
+        """
+        exists will return `True` if folder exists.
+        """
+        self.test_segments = self.filesystem.temp_segments[:]
+        self.test_segments.append(mk.makeFilename())
+        self.filesystem.createFolder(self.test_segments)
+
+        self.assertTrue(self.filesystem.exists(self.test_segments))
+
+    def test_getFileSize(self):
+        """
+        Check retrieving the size for a file.
+        """
+        test_size = 1345
+        self.test_segments = mk.fs.createFileInTemp(length=test_size)
+
+        size = self.filesystem.getFileSize(self.test_segments)
+
+        self.assertEqual(test_size, size)
+
+    def test_getFileSize_empty_file(self):
+        """
+        Check getting file size for an empty file.
+        """
+        test_size = 0
+        self.test_segments = mk.fs.createFileInTemp(length=0)
+
+        size = self.filesystem.getFileSize(self.test_segments)
+
+        self.assertEqual(test_size, size)
+
+    def test_openFileForReading_parent_not_found(self):
+        """
+        Raise OSError when trying to open a file that doesn't exist for reading,
+        since the parent directory doesn't exists.
+        """
+        segments = ['c', 'no', 'such', 'file.txt']
+        path = self.filesystem.getRealPathFromSegments(segments)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFileForReading(segments)
+
+        details = '[Errno 2] No such file or directory: ' + path
+        self.assertStartsWith(details, force_unicode(context.exception))
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+
+    def test_openFileForReading_file_not_found(self):
+        """
+        Raise OSError when trying to open a file that doesn't exist for reading,
+        even when the parent directory exists.
+        """
+        segments = ['c', 'no-such-file-in-root-drive.txt']
+        path = self.filesystem.getRealPathFromSegments(segments)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFileForReading(segments)
+
+        details = '[Errno 2] No such file or directory: ' + path
+        self.assertStartsWith(details, force_unicode(context.exception))
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+
+    def test_openFileForReading_already_opened(self):
+        """
+        The same file can be opened for reading multiple times.
+        Each handler has a separate cursor.
+        """
+        segments = self.fileInTemp(content='something-\N{SUN}')
+        file_1 = None
+        file_2 = None
+        try:
+            file_1 = self.filesystem.openFileForReading(segments)
+            file_2 = self.filesystem.openFileForReading(segments)
+
+            content = file_1.read(11)
+            self.assertEqual(b'something-\xe2', content)
+
+            content = file_2.read(12)
+            self.assertEqual(b'something-\xe2\x98', content)
+
+        finally:
+            file_1.close()
+            file_2.close()
+
+    def test_openFileForReading_already_opened_for_write(self):
+        """
+        It can read a file that is currently open for writing.
+        """
+        segments = self.fileInTemp(content='something-\N{SUN}')
+        file_read = None
+        file_write = None
+        try:
+            file_write = self.filesystem.openFileForWriting(segments)
+            file_write.write(b'some-new-content')
+            file_write.flush()
+
+            # We open the file while write is still ongoing (not closed).
+            file_read = self.filesystem.openFileForReading(segments)
+
+            content = file_read.read(100)
+            self.assertEqual(b'some-new-content', content)
+
+        finally:
+            file_read.close()
+            file_write.close()
+
+    def test_openFileForReading_unicode(self):
+        """
+        Check reading in Unicode.
+        """
+        content = mk.getUniqueString()
+        self.test_segments = mk.fs.createFileInTemp(content=content)
+        a_file = None
+        try:
+            a_file = self.filesystem.openFileForReading(self.test_segments)
+
+            self.assertEqual(content, a_file.read().decode('utf-8'))
+        finally:
+            a_file.close()
+
+    def test_openFileForReading_empty(self):
+        """
+        An empty file can be opened for reading.
+        """
+        self.test_segments = mk.fs.createFileInTemp(length=0)
+        a_file = None
+        try:
+            a_file = self.filesystem.openFileForReading(self.test_segments)
+
+            self.assertEqual(b'', a_file.read())
+        finally:
+            a_file.close()
+
+    def test_openFileForReading_no_write(self):
+        """
+        A file opened only for reading will not be able to write into.
+        """
+        self.test_segments = mk.fs.createFileInTemp(length=0)
+        a_file = None
+        try:
+            a_file = self.filesystem.openFileForReading(self.test_segments)
+
+            with self.assertRaises(IOError):
+                a_file.write('something')
+        finally:
+            a_file.close()
+
+    def test_openFileForReading_no_delete_lock(self):
+        """
+        A file opened only for reading will not be locked for delete
+        operations.
+        """
+        _, segments = mk.fs.makePathInTemp()
+        mk.fs.writeFileContent(segments=segments, content='something-\N{SUN}')
+        a_file = None
+        try:
+            a_file = self.filesystem.openFileForReading(segments)
+
+            self.filesystem.deleteFile(segments)
+
+            content = a_file.read(100)
+            self.assertEqual(b'something-\xe2\x98\x89', content)
+        finally:
+            a_file.close()
+
+    def test_openFile_read_no_delete_lock(self):
+        """
+        A file opened only for reading will not be locked for delete
+        operations.
+
+        The file is opened in binary mode.
+        """
+        content = 'first-line\nmore-lines\r\nsomething-\N{SUN}'
+        _, segments = mk.fs.makePathInTemp()
+        mk.fs.writeFileContent(segments=segments, content=content)
+        fd = None
+        try:
+            fd = self.filesystem.openFile(
+                segments,
+                flags=self.filesystem.OPEN_READ_ONLY,
+                mode=0,
+            )
+
+            self.filesystem.deleteFile(segments)
+            self.assertFalse(self.filesystem.exists(segments))
+
+            result = os.read(fd, 100)
+            self.assertEqual(content.encode('utf-8'), result)
+        finally:
+            if fd:
+                os.close(fd)
+
+    @conditionals.onOSFamily('nt')
+    def test_fdRead_os_error(self):
+        """
+        This is a low-level Windows test.
+
+        Under normal update, this function should never fail as we have some
+        higher API guards.
+
+        This test is here to make sure that if it fails, it raises a generic
+        OSError.
+        """
+        with self.assertRaises(OSError):
+            self.filesystem._fdRead('no/such/path')
+
+    def test_openFile_write_only(self):
+        """
+        A file opened only for write will not allow reading.
+
+        Initial content is reset.
+
+        The file is written in binary mode.
+        """
+        content = 'first-line\nmore-lines\r\nsomething-\N{SUN}'
+        segments = self.fileInTemp(content='initial-value')
+        fd = None
+        try:
+            fd = self.filesystem.openFile(
+                segments,
+                flags=self.filesystem.OPEN_WRITE_ONLY,
+                mode=0,
+            )
+
+            os.write(fd, content.encode('utf-8'))
+
+            # File can't be read.
+            self.assertRaises(OSError, os.read, fd, 1)
+
+        finally:
+            if fd:
+                os.close(fd)
+
+        # Just check the result after close.
+        self.assertEqual(content, mk.fs.getFileContent(segments))
+
+    def test_openFile_read_and_write(self):
+        """
+        A file opened for read and write will not have the
+        content reset or truncated.
+
+        The file is locked for delete.
+
+        The file is written in binary mode.
+        """
+        content = 'first-line\nmore-lines\r\nsomething-\N{SUN}'
+        segments = self.fileInTemp(content=content)
+        fd = None
+        try:
+            fd = self.filesystem.openFile(
+                segments,
+                flags=self.filesystem.OPEN_READ_WRITE,
+                mode=0,
+            )
+
+            # File can be read, and pointer is at start
+            result = os.read(fd, 15)
+            self.assertEqual(b'first-line\nmore', result)
+
+            # File can be written
+            os.write(fd, b'UPDATE')
+
+            # On Windows, the file is locked for deletion, due to write access.
+            if self.os_family == 'nt':
+                self.assertRaises(OSError, self.filesystem.deleteFile, segments)
+
+        finally:
+            if fd:
+                os.close(fd)
+
+        # The write is in the middle of the file.
+        # All the previous content is kept, with the exception of the
+        # updated part.
+        self.assertEqual(
+            'first-line\nmoreUPDATE\r\nsomething-\N{SUN}',
+            mk.fs.getFileContent(segments),
+        )
+
+    def test_openFileForWriting_ascii(self):
+        """
+        Check opening a file for writing in plain/ascii/str mode.
+
+        It will create the file if it doesn't exists with owner only
+        permisisons.
+        """
+        content = b'some ascii text'
+        _, segments = self.tempPathCleanup()
+        self.assertFalse(mk.fs.exists(segments))
+
+        sut = self.filesystem.openFileForWriting(segments)
+        sut.write(content)
+        sut.close()
+
+        result = self.filesystem.getAttributes(segments)
+        self.assertEqual(result.mode | 0o600, result.mode)
+
+        a_file = self.filesystem.openFileForReading(segments)
+        test_content = a_file.read()
+        a_file.close()
+        self.assertEqual(test_content, content)
+
+    def test_openFileForWriting_mode(self):
+        """
+        You can specify the file permissions for the newly created file.
+        """
+        _, segments = self.tempPathCleanup()
+
+        sut = self.filesystem.openFileForWriting(segments, mode=0o642)
+        self.addCleanup(sut.close)
+        sut.write(b'some data')
+
+        if self.os_family == 'posix':
+            result = self.filesystem.getAttributes(segments)
+            # The umask will overwrite the requested attributes.
+            self.assertEqual(0o640, result.mode & 0o640)
+
+    def test_openFileForWriting_no_read(self):
+        """
+        When a file is opened for writing, we can not read from it.
+        """
+        self.test_segments = mk.fs.createFileInTemp(length=0)
+        a_file = None
+        try:
+            a_file = self.filesystem.openFileForWriting(self.test_segments)
+
+            # We should not be able to read.
+            with self.assertRaises(IOError):
+                a_file.read()
+
+        finally:
+            a_file.close()
+
+    def test_openFileForWriting_truncate(self):
+        """
+        When a file is opened for writing, the previous file is truncated
+        to 0 length and we write as a fresh file.
+        """
+        content = mk.getUniqueString(100)
+        new_content = mk.getUniqueString(50)
         # Create initial content.
         self.test_segments = mk.fs.createFileInTemp(content=content)
         if self.os_family == 'posix':
@@ -2003,467 +3367,1407 @@ class TestLocalFilesystem(DefaultFilesystemTestCase):
                 {'mode': 0o666},
             )
 
-        # Write new content into file.
-        test_file = self.filesystem.openFileForWriting(self.test_segments)
-        test_file.write(new_content.encode('utf-8'))
-        test_file.close()
+        # Write new content into file.
+        test_file = self.filesystem.openFileForWriting(self.test_segments)
+        test_file.write(new_content.encode('utf-8'))
+        test_file.close()
+
+        file_content = mk.fs.getFileContent(self.test_segments)
+        self.assertEqual(new_content, file_content)
+
+        if self.os_family == 'posix':
+            # It will not overwrite the permissions for existing files.
+            result = self.filesystem.getAttributes(self.test_segments)
+            self.assertEqual(0o666, result.mode & 0o666)
+
+    def test_openFileForAppending(self):
+        """
+        System test for openFileForAppending.
+        """
+        content = mk.getUniqueString()
+        new_content = mk.getUniqueString()
+        self.test_segments = mk.fs.createFileInTemp(content=content)
+
+        if self.os_family == 'posix':
+            result = self.filesystem.setAttributes(
+                self.test_segments,
+                {'mode': 0o666},
+            )
+
+        a_file = None
+        try:
+            a_file = self.filesystem.openFileForAppending(self.test_segments)
+
+            a_file.write(new_content.encode('utf-8'))
+            a_file.close()
+
+            a_file = self.filesystem.openFileForReading(self.test_segments)
+            new_test_content = a_file.read().decode('utf-8')
+            self.assertEqual(new_test_content, content + new_content)
+        finally:
+            a_file.close()
+
+        if self.os_family == 'posix':
+            # It will not overwrite the permissions for existing files.
+            result = self.filesystem.getAttributes(self.test_segments)
+            self.assertEqual(0o666, result.mode & 0o666)
+
+    def test_openFileForAppending_mode(self):
+        """
+        You can specify the file permissions used to create a new file
+        if doesn't exists.
+        """
+        _, segments = self.tempPathCleanup()
+
+        sut = self.filesystem.openFileForAppending(segments, mode=0o642)
+        sut.write(b'some data')
+        sut.close()
+
+        a_file = self.filesystem.openFileForReading(segments)
+        new_test_content = a_file.read()
+        self.assertEqual(b'some data', new_test_content)
+
+        if self.os_family == 'posix':
+            result = self.filesystem.getAttributes(segments)
+            # The umask will overwrite the requested attributes.
+            self.assertEqual(0o640, result.mode & 0o640)
+
+    def test_openFileForWriting_checksums(self):
+        """
+        The digests of the written content are available after the file
+        is closed.
+        """
+        _, segments = self.tempPathCleanup()
+
+        with self.filesystem.openFileForWriting(
+            segments, checksums=['md5', 'crc32']
+        ) as stream:
+            stream.write(b'some ')
+            stream.write(b'data' * 100000)
+            self.assertIsNone(stream.checksums)
+
+        content = b'some ' + b'data' * 100000
+        self.assertEqual(
+            {
+                'md5': hashlib.md5(content).hexdigest(),
+                'crc32': f'{zlib.crc32(content):08x}',
+            },
+            stream.checksums,
+        )
+
+        with self.assertRaises(AssertionError):
+            self.filesystem.openFileForWriting(segments, checksums=['bad'])
+
+    def test_openFileForWriting_expected(self):
+        """
+        The file is replaced when the content has the expected digest, and
+        it is not changed when not.
+        """
+        base_segments = self.folderInTemp()
+        segments = base_segments + ['upload']
+        expected = {'sha256': hashlib.sha256(b'good').hexdigest().upper()}
+
+        with self.filesystem.openFileForWriting(
+            segments, expected=expected
+        ) as stream:
+            stream.write(b'good')
+
+        self.assertEqual(expected['sha256'].lower(), stream.checksums['sha256'])
+        self.assertTrue(self.filesystem.exists(segments))
+
+        with self.assertRaises(CompatError) as context:
+            with self.filesystem.openFileForWriting(
+                segments, expected=expected
+            ) as stream:
+                stream.write(b'bad')
+
+        self.assertEqual(1020, context.exception.event_id)
+        self.assertContains('sha256 expected', context.exception.message)
+        self.assertContains('upload', context.exception.message)
+        self.assertEqual(b'good', mk.fs.getFileContent(segments, utf8=False))
+        self.assertEqual(
+            ['upload'], self.filesystem.getFolderContent(base_segments)
+        )
+
+    @conditionals.onOSName('linux')
+    def test_openFileForWriting_expected_metadata(self):
+        """
+        The replaced file keeps the mode and the extended attributes of
+        the existing file, but not the internal attributes.
+        """
+        path, segments = self.tempFile(content=b'old')
+        os.chmod(path, 0o640)
+        os.setxattr(path, 'user.origin', b'192.0.2.1')
+        os.setxattr(path, 'user.chevah.sha256', b'old-digest')
+        expected = {'md5': hashlib.md5(b'new').hexdigest()}
+
+        with self.filesystem.openFileForWriting(
+            segments, expected=expected
+        ) as stream:
+            stream.write(b'new')
+
+        self.assertEqual(b'new', mk.fs.getFileContent(segments, utf8=False))
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(path).st_mode))
+        self.assertEqual(['user.origin'], os.listxattr(path))
+
+    def test_openFileForWriting_expected_folder(self):
+        """
+        Raise OSError when the expected content is written to a folder.
+        """
+        segments = self.folderInTemp()
+        path = mk.fs.getRealPathFromSegments(segments)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFileForWriting(
+                segments, expected={'md5': '0' * 32}
+            )
+
+        self.assertEqual(errno.EISDIR, context.exception.errno)
+        self.assertEqual(path, context.exception.filename)
+        self.assertEqual(
+            [],
+            [
+                name
+                for name in self.filesystem.getFolderContent(segments[:-1])
+                if name.endswith('.chevah-write')
+            ],
+        )
+
+    @conditionals.onOSFamily('posix')
+    def test_openFileForWriting_expected_hard_link(self):
+        """
+        Files with multiple hard links are written in place, so that all
+        the names have the new content, and the written content is
+        removed when the digest is not matching.
+        """
+        base_segments = self.folderInTemp()
+        segments = base_segments + ['upload']
+        mk.fs.createFile(segments, content=b'old')
+        other_path = mk.fs.getRealPathFromSegments(base_segments + ['other'])
+        os.link(mk.fs.getRealPathFromSegments(segments), other_path)
+        expected = {'md5': hashlib.md5(b'new').hexdigest()}
+
+        with self.filesystem.openFileForWriting(
+            segments, expected=expected
+        ) as stream:
+            stream.write(b'new')
+
+        with open(other_path, 'rb') as stream:
+            self.assertEqual(b'new', stream.read())
+
+        with self.assertRaises(CompatError) as context:
+            with self.filesystem.openFileForWriting(
+                segments, expected=expected
+            ) as stream:
+                stream.write(b'bad')
+
+        self.assertContains(
+            'The written content was removed.', context.exception.message
+        )
+        with open(other_path, 'rb') as stream:
+            self.assertEqual(b'', stream.read())
+        self.assertItemsEqual(
+            ['other', 'upload'], self.filesystem.getFolderContent(base_segments)
+        )
+
+    def test_openFileForAppending_expected(self):
+        """
+        The appended content is removed when the whole content doesn't
+        have the expected digest, keeping the existing content.
+        """
+        _, segments = self.tempFile(content=b'first')
+        expected = {'md5': hashlib.md5(b'first-second').hexdigest()}
+
+        with self.assertRaises(CompatError) as context:
+            with self.filesystem.openFileForAppending(
+                segments, expected=expected
+            ) as stream:
+                stream.write(b'-other')
+
+        self.assertEqual(1020, context.exception.event_id)
+        self.assertEqual(b'first', mk.fs.getFileContent(segments, utf8=False))
+
+        with self.filesystem.openFileForAppending(
+            segments, expected=expected
+        ) as stream:
+            stream.write(b'-second')
+
+        self.assertEqual(
+            b'first-second', mk.fs.getFileContent(segments, utf8=False)
+        )
+
+    def test_openFileForAppending_checksums(self):
+        """
+        The digests are for the whole file, including the content which
+        existed before appending.
+        """
+        _, segments = self.tempFile(content=b'first')
+
+        with self.filesystem.openFileForAppending(
+            segments, checksums=['sha1']
+        ) as stream:
+            stream.write(b'-second')
+
+        self.assertEqual(
+            {'sha1': hashlib.sha1(b'first-second').hexdigest()},
+            stream.checksums,
+        )
+
+    def test_openFileForReading_ascii(self):
+        """
+        Check opening file for reading in ascii mode.
+        """
+        content = 'ceva nou'
+        content_str = b'ceva nou'
+        self.test_segments = mk.fs.createFileInTemp(content=content)
+        a_file = None
+        try:
+            a_file = self.filesystem.openFileForReading(self.test_segments)
+
+            self.assertEqual(content_str, a_file.read())
+        finally:
+            a_file.close()
+
+    def test_setAttributes_owner_and_group(self):
+        """
+        It will raise OSError when trying to set ownership as normal user.
+        """
+        _, segments = self.tempFile()
+
+        if self.os_name == 'hpux':
+            # On HP-UX you can change the ownership of a file which is owned
+            # by you.
+            # But you can't reset it later, as it no longer belongs to you.
+            self.filesystem.setAttributes(segments, {'uid': 2, 'gid': 4})
+
+        error = self.assertRaises(
+            OSError,
+            self.filesystem.setAttributes,
+            segments,
+            {'uid': 1, 'gid': 1},
+        )
+
+        self.assertEqual(errno.EPERM, error.errno)
+
+    def test_setAttributes_time(self):
+        """
+        It will set the time of the file.
+        """
+        _, segments = self.tempFile()
+        initial = self.filesystem.getAttributes(segments)
+
+        self.filesystem.setAttributes(segments, {'atime': 1, 'mtime': 2})
+
+        after = self.filesystem.getAttributes(segments)
+
+        self.assertNotEqual(initial.modified, after.modified)
+        self.assertEqual(2, after.modified)
+
+    @conditionals.onOSFamily('posix')
+    def test_setAttributes_time_ns(self):
+        """
+        The times are set with nanoseconds precision, and each of them
+        can be set alone.
+        """
+        _, segments = self.tempFile()
+
+        self.filesystem.setAttributes(
+            segments, {'atime_ns': 1000000001, 'mtime_ns': 2000000002}
+        )
+        self.filesystem.setAttributes(segments, {'mtime': 3})
+
+        result = self.filesystem.getStatus(segments)
+        self.assertEqual(1000000001, result.st_atime_ns)
+        self.assertEqual(3000000000, result.st_mtime_ns)
+
+    @conditionals.onOSFamily('posix')
+    def test_setAttributes_not_readable(self):
+        """
+        The attributes are set for files which can't be opened for
+        reading.
+        """
+        _, segments = self.tempFile()
+        self.filesystem.setAttributes(segments, {'mode': 0o200})
+
+        self.filesystem.setAttributes(segments, {'mode': 0o600, 'mtime': 2})
+
+        result = self.filesystem.getStatus(segments)
+        self.assertEqual(0o600, stat.S_IMODE(result.st_mode))
+        self.assertEqual(2, result.st_mtime)
+
+    @conditionals.onOSFamily('posix')
+    def test_setAttributes_not_opened(self):
+        """
+        The attributes are set by path, without opening the file.
+        """
+        _, segments = self.tempFile()
+
+        with self.patchObject(self.filesystem, '_osOpen') as mock_open:
+            self.filesystem.setAttributes(segments, {'mode': 0o640})
+
+        self.assertFalse(mock_open.called)
+        result = self.filesystem.getStatus(segments)
+        self.assertEqual(0o640, stat.S_IMODE(result.st_mode))
+
+    @conditionals.onOSFamily('posix')
+    def test_setDescriptorAttributes(self):
+        """
+        The attributes are set for a file which is still opened, after
+        writing the buffered content.
+        """
+        _, segments = self.tempFile()
+
+        with self.filesystem.openFileForWriting(segments) as stream:
+            stream.write(b'data')
+            self.filesystem.setDescriptorAttributes(
+                stream, {'mode': 0o640, 'mtime_ns': 2000000002}
+            )
+
+        result = self.filesystem.getStatus(segments)
+        self.assertEqual(4, result.st_size)
+        self.assertEqual(0o640, stat.S_IMODE(result.st_mode))
+        self.assertEqual(2000000002, result.st_mtime_ns)
+
+    def openForLock(self, segments):
+        """
+        Return a new file opened for reading and writing, closed at the
+        end of the test.
+        """
+        fd = self.filesystem.openFile(segments, os.O_RDWR, 0o600)
+        self.addCleanup(os.close, fd)
+        return fd
+
+    @conditionals.onOSName('linux')
+    def test_lockFile(self):
+        """
+        Exclusive locks conflict with the locks on the same range from
+        other opened files, until unlocked.
+        """
+        _, segments = self.tempFile()
+        first = self.openForLock(segments)
+        second = self.openForLock(segments)
+
+        self.filesystem.lockFile(first, offset=0, length=10)
+        self.filesystem.lockFile(second, offset=10, length=10)
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.lockFile(second, offset=5, length=1)
+        self.assertEqual(errno.EAGAIN, context.exception.errno)
+        self.assertEqual(
+            (True, 0, 10, None),
+            self.filesystem.getFileLock(second, False, offset=5, length=1),
+        )
+
+        self.filesystem.unlockFile(first, offset=0, length=10)
+
+        self.assertIsNone(self.filesystem.getFileLock(second, length=10))
+        self.filesystem.lockFile(second, offset=5, length=1)
+
+    @conditionals.onOSName('linux')
+    def test_lockFile_shared(self):
+        """
+        Shared locks only conflict with exclusive locks, and they are
+        released when the file is closed.
+        """
+        _, segments = self.tempFile()
+        first = self.filesystem.openFileForReading(segments)
+        second = self.openForLock(segments)
+
+        self.filesystem.lockFile(first, exclusive=False)
+        self.filesystem.lockFile(second, exclusive=False)
+
+        self.assertIsNone(self.filesystem.getFileLock(second, False))
+        self.assertEqual(
+            (False, 0, 0, None), self.filesystem.getFileLock(second)
+        )
+        with self.assertRaises(OSError):
+            self.filesystem.lockFile(second, exclusive=True)
+
+        first.close()
+
+        self.filesystem.lockFile(second, exclusive=True)
+
+    @conditionals.onOSName('linux')
+    def test_lockFile_blocking(self):
+        """
+        A blocking lock waits for the conflicting lock to be released.
+        """
+        _, segments = self.tempFile()
+        first = self.openForLock(segments)
+        second = self.openForLock(segments)
+        self.filesystem.lockFile(first)
+        timer = threading.Timer(0.1, self.filesystem.unlockFile, (first,))
+        timer.start()
+        self.addCleanup(timer.join)
+
+        self.filesystem.lockFile(second, blocking=True)
+
+        self.assertEqual((True, 0, 0, None), self.filesystem.getFileLock(first))
+
+
+class LocalFilesystemNTMixin:
+    """
+    Shared tests for Windows path handling in an unlocked filesystem.
+    """
+
+    def test_temp_segments(self):
+        """
+        The temporary segments are the default Windows OS segments
+        """
+        result = self.filesystem.temp_segments
+
+        # We assume that all tests run from drive C
+        # and were we check that the temp segments are for an absolute path.
+        self.assertEqual('C', result[0])
+
+    def test_rename_file_read_only(self):
+        """
+        On Windows, it will rename the file even if it has the read only
+        attribute.
+        """
+        _, initial_segments = mk.fs.makePathInTemp()
+        _, self.test_segments = mk.fs.makePathInTemp()
+        self.assertFalse(self.filesystem.exists(initial_segments))
+        self.assertFalse(self.filesystem.exists(self.test_segments))
+        self.filesystem.touch(initial_segments)
+        path = self.filesystem.getRealPathFromSegments(initial_segments)
+        os.chmod(self.filesystem.getEncodedPath(path), stat.S_IREAD)
+
+        self.filesystem.rename(initial_segments, self.test_segments)
+
+        self.assertFalse(self.filesystem.exists(initial_segments))
+        self.assertTrue(self.filesystem.exists(self.test_segments))
+
+    def test_getStatus_already_opened(self):
+        """
+        It will get status for file even if it's opened for writing.
+        """
+        self.test_segments = mk.fs.createFileInTemp()
+        handle = self.filesystem.openFileForWriting(self.test_segments)
+        handle.write(mk.ascii().encode('ascii'))
+        handle.flush()
+        self.addCleanup(lambda: handle.close())
+
+        status = self.filesystem.getStatus(self.test_segments)
+
+        self.assertTrue(stat.S_ISREG(status.st_mode))
+        self.assertFalse(stat.S_ISDIR(status.st_mode))
+        self.assertFalse(stat.S_ISLNK(status.st_mode))
+        self.assertNotEqual(0, status.st_ino)
+
+    def test_checkChildPath_nt(self):
+        """
+        See: test_checkChildPath_unix
+        """
+        self.filesystem._checkChildPath('c:\\root\\path', 'c:\\root\\path')
+        self.filesystem._checkChildPath('c:\\root\\path\\', 'c:\\root\\path')
+        self.filesystem._checkChildPath('c:\\root\\path', 'c:\\root\\path\\')
+        self.filesystem._checkChildPath(
+            'c:\\root\\path',
+            'c:\\root\\path\\..\\path',
+        )
+
+        with self.assertRaises(CompatError):
+            self.filesystem._checkChildPath('c:\\root\\path', 'c:\\')
+
+        with self.assertRaises(CompatError):
+            self.filesystem._checkChildPath(
+                'c:\\root\\path',
+                'c:\\root\\path\\..',
+            )
+
+    def test_getFileData(self):
+        """
+        Return a dict with file data.
+        """
+        content = mk.string()
+        path, segments = self.tempFile(content=content.encode('utf-8'))
+        name = segments[-1]
+
+        result = self.filesystem._getFileData(path)
+
+        self.assertEqual(len(content.encode('utf-8')), result['size'])
+        self.assertEqual(name, result['name'])
+        self.assertEqual(0, result['tag'])
+
+    @conditionals.onCapability('symbolic_link', True)
+    def test_makeLink_bad_root_target(self):
+        """
+        For unlocked accounts, will not create a valid link to a target
+        which does not have a valid drive letter.
+
+        This is a API inconsistency in Windows where CreateSymbolicLink will
+        consider bad:\\path as a relative path named `bad:` and not 'bad:'
+        as drive letter.
+        """
+        with self.assertRaises(OSError):
+            target_segments = ['bad', 'no-such', 'target']
+            _, test_segments = mk.fs.makePathInTemp()
+            self.filesystem.makeLink(
+                target_segments=target_segments,
+                link_segments=test_segments,
+            )
+
+    def test_deleteFolder_recursive_read_only_members(self):
+        """
+        On Windows, it will also delete the folders, even if it contains
+        files with read only attributes.
+        """
+        segments, child_name = self.createFolderWithChild()
+        # Create and make sure we have a read only child.
+        child_segments = segments[:]
+        child_segments.append(child_name)
+        path = self.filesystem.getRealPathFromSegments(child_segments)
+        os.chmod(self.filesystem.getEncodedPath(path), stat.S_IREAD)
+
+        self.filesystem.deleteFolder(segments, recursive=True)
+
+        self.assertFalse(self.filesystem.exists(segments))
+
+    def test_deleteFile_read_only(self):
+        """
+        On Windows, it will delete the file even if it has the read only
+        attribute.
+        """
+        segments = mk.fs.createFileInTemp()
+        path = self.filesystem.getRealPathFromSegments(segments)
+        os.chmod(self.filesystem.getEncodedPath(path), stat.S_IREAD)
+        self.assertTrue(self.filesystem.exists(segments))
+
+        self.filesystem.deleteFile(segments)
+
+        self.assertFalse(self.filesystem.exists(segments))
+
+    def test_setAttributes_mode(self):
+        """
+        It will ignore the mode of the file as is not implemented in Windows.
+        """
+        _, segments = self.tempFile()
+        initial = self.filesystem.getAttributes(segments)
+
+        self.filesystem.setAttributes(segments, {'mode': 0o777})
+
+        after = self.filesystem.getAttributes(segments)
+
+        self.assertEqual(initial.mode, after.mode)
+
+    def test_isAbsolutePath(self):
+        """
+        Unit test for detecting which Windows path is absolute.
+        """
+        # Traditional DOS paths.
+        self.assertIsTrue(self.filesystem.isAbsolutePath('c'))
+        self.assertIsTrue(self.filesystem.isAbsolutePath('c:'))
+        self.assertIsTrue(self.filesystem.isAbsolutePath('c:/'))
+        self.assertIsTrue(self.filesystem.isAbsolutePath('c:\\'))
+        self.assertIsTrue(self.filesystem.isAbsolutePath('c:/some/path'))
+        self.assertIsTrue(self.filesystem.isAbsolutePath('c:\\some\\path'))
+
+        # UNC paths are always absolute.
+        self.assertIsTrue(self.filesystem.isAbsolutePath('\\\\system07\\C$\\'))
+        self.assertIsTrue(
+            self.filesystem.isAbsolutePath('\\\\.\\UNC\\Server\\Foo.txt'),
+        )
+        self.assertIsTrue(
+            self.filesystem.isAbsolutePath(
+                '\\\\?\\UNC\\Server\\Share\\Foo.txt',
+            ),
+        )
+        self.assertIsTrue(
+            self.filesystem.isAbsolutePath(
+                '\\\\.\\Volume{b75e2c83-0000-0000-0000-602f00000000}\\Foo.txt',
+            ),
+        )
+        self.assertIsTrue(
+            self.filesystem.isAbsolutePath(
+                '\\\\?\\Volume{b75e2c83-0000-0000-0000-602f00000000}\\Foo.txt',
+            ),
+        )
+        self.assertIsTrue(
+            self.filesystem.isAbsolutePath(r'\\.\C:\Test\Foo.txt'),
+        )
+        self.assertIsTrue(
+            self.filesystem.isAbsolutePath(r'\\?\C:\Test\Foo.txt'),
+        )
+
+        # Just the share root.
+        self.assertIsTrue(self.filesystem.isAbsolutePath('\\\\Server\\Share'))
 
-        file_content = mk.fs.getFileContent(self.test_segments)
-        self.assertEqual(new_content, file_content)
+        # Empty path is not absolute.
+        self.assertIsFalse(self.filesystem.isAbsolutePath(''))
 
-        if self.os_family == 'posix':
-            # It will not overwrite the permissions for existing files.
-            result = self.filesystem.getAttributes(self.test_segments)
-            self.assertEqual(0o666, result.mode & 0o666)
+        # Using forward slashes will handled it as relative path.
+        self.assertIsFalse(
+            self.filesystem.isAbsolutePath('//system07/share-name'),
+        )
 
-    def test_openFileForAppending(self):
+        # Normal relative path.
+        self.assertIsFalse(self.filesystem.isAbsolutePath('some/path'))
+        self.assertIsFalse(self.filesystem.isAbsolutePath(r'win\path'))
+        self.assertIsFalse(self.filesystem.isAbsolutePath(r'.\win\path'))
+        self.assertIsFalse(self.filesystem.isAbsolutePath(r'..\win\path'))
+
+        # Crazy Windows API
+        # A relative path from the current directory of the C: drive.
+        self.assertIsFalse(
+            self.filesystem.isAbsolutePath(
+                r'C:Projects\apilibrary\apilibrary.sln',
+            ),
+        )
+
+        # They look like absolute, but they are default drive,
+        # so we consider them relative.
+        # On WIndows API this is defined as
+        # An absolute path from the root of the current drive.
+        self.assertIsFalse(
+            self.filesystem.isAbsolutePath(r'\default-drive\path'),
+        )
+        self.assertIsFalse(
+            self.filesystem.isAbsolutePath('/default/drive/path'),
+        )
+
+
+class TestLocalFilesystemNTnonDevicePath(
+    DefaultFilesystemTestCase,
+    LocalFilesystemNTMixin,
+):
+    """
+    Test for default local filesystem with special behavior for Windows.
+
+    Running with current working directory which is not defined as a
+    device path.
+
+    os.getcwd() -> C:\\Some\\path
+    """
+
+    _prev_os_getcwd = ''
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.os_family != 'nt':
+            raise cls.skipTest('Only on Windows.')
+        cls._prev_os_getcwd = os.getcwd()
+        if cls._prev_os_getcwd.startswith('\\\\'):  # pragma: no cover
+            # We have a device path, so force using a non-device path
+            # Most of the time, tests are executed from a process
+            # that already has a DOS path and not a device path.
+            os.chdir(cls._prev_os_getcwd[4:])
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            os.chdir(cls._prev_os_getcwd)
+
+
+class TestLocalFilesystemNTDevicePath(
+    DefaultFilesystemTestCase,
+    LocalFilesystemNTMixin,
+):
+    """
+    Test for default local filesystem with special behavior for Windows.
+
+    Running with current working directory which is defined as a
+    device path.
+    os.getcwd() -> \\\\?\\C:\\Some\\path
+    """
+
+    _prev_os_getcwd = ''
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.os_family != 'nt':
+            raise cls.skipTest('Only on Windows.')
+
+        cls._prev_os_getcwd = os.getcwd()
+        if not cls._prev_os_getcwd.startswith('\\\\'):
+            # We have a device path, so force using a non-device path
+            os.chdir('\\\\?\\' + cls._prev_os_getcwd)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            os.chdir(cls._prev_os_getcwd)
+
+
+@conditionals.onOSFamily('posix')
+class TestLocalFilesystemUnix(DefaultFilesystemTestCase):
+    """
+    Test for default local filesystem with special behavior for Linux and Unix.
+    """
+
+    def test_checkChildPath_unix(self):
         """
-        System test for openFileForAppending.
+        Will raise an error if child is outside of root, or do nothing if
+        child is is root.
         """
-        content = mk.getUniqueString()
-        new_content = mk.getUniqueString()
-        self.test_segments = mk.fs.createFileInTemp(content=content)
+        self.filesystem._checkChildPath('/root/path', '/root/path')
+        self.filesystem._checkChildPath('/root/path/', '/root/path')
+        self.filesystem._checkChildPath('/root/path', '/root/path/')
+        self.filesystem._checkChildPath('/root/path', '/root/path/../path/')
 
-        if self.os_family == 'posix':
-            result = self.filesystem.setAttributes(
-                self.test_segments,
-                {'mode': 0o666},
+        with self.assertRaises(CompatError):
+            self.filesystem._checkChildPath('/root/path', '/')
+
+        with self.assertRaises(CompatError):
+            self.filesystem._checkChildPath('/root/path', '/root/path/..')
+
+        with self.assertRaises(CompatError):
+            self.filesystem._checkChildPath('/root/path', '/root/path-other')
+
+    def test_temp_segments_location_unix(self):
+        """
+        On unix the temporary folders are located inside the temp folder.
+        """
+        if self.os_name == 'osx':
+            expected = self.filesystem.getSegmentsFromRealPath(
+                tempfile.gettempdir(),
             )
+        else:
+            expected = ['tmp']
+        self.assertEqual(expected, self.filesystem.temp_segments)
 
-        a_file = None
-        try:
-            a_file = self.filesystem.openFileForAppending(self.test_segments)
+    def test_setAttributes_mode(self):
+        """
+        It will set the mode of the file.
+        """
+        _, segments = self.tempFile()
+        initial = self.filesystem.getAttributes(segments)
 
-            a_file.write(new_content.encode('utf-8'))
-            a_file.close()
+        self.filesystem.setAttributes(segments, {'mode': 0o777})
 
-            a_file = self.filesystem.openFileForReading(self.test_segments)
-            new_test_content = a_file.read().decode('utf-8')
-            self.assertEqual(new_test_content, content + new_content)
-        finally:
-            a_file.close()
+        after = self.filesystem.getAttributes(segments)
 
-        if self.os_family == 'posix':
-            # It will not overwrite the permissions for existing files.
-            result = self.filesystem.getAttributes(self.test_segments)
-            self.assertEqual(0o666, result.mode & 0o666)
+        self.assertNotEqual(initial.mode, after.mode)
 
-    def test_openFileForAppending_mode(self):
+    def test_openFile_no_status(self):
         """
-        You can specify the file permissions used to create a new file
-        if doesn't exists.
+        Opening a file does a single path resolution.
+        The file is not checked in advance for being a folder, as this is
+        detected from the result of the open call.
         """
-        _, segments = self.tempPathCleanup()
+        _, segments = self.tempFile(content='test')
+        no_path_status = AssertionError('Path status not allowed.')
+
+        with self.patchObject(os, 'stat', side_effect=no_path_status):
+            with self.patchObject(os, 'lstat', side_effect=no_path_status):
+                with self.patchObject(os, 'fstat', wraps=os.fstat) as fstat:
+                    os.close(self.filesystem.openFile(segments, os.O_RDONLY, 0))
+                    self.filesystem.openFileForReading(segments).close()
+                    self.filesystem.openFileForWriting(segments).close()
+                    self.filesystem.openFileForAppending(segments).close()
+
+        # Only opening for reading needs a status check,
+        # and it is done for the file descriptor.
+        self.assertEqual(2, fstat.call_count)
+
+    def test_isAbsolutePath(self):
+        """
+        Only paths starting with forward slash are absolute on Unix.
+        """
+        self.assertIsTrue(self.filesystem.isAbsolutePath('/some/path'))
+        self.assertIsFalse(self.filesystem.isAbsolutePath('some/path'))
+        self.assertIsFalse(self.filesystem.isAbsolutePath(r'c:\win\path'))
+        self.assertIsFalse(self.filesystem.isAbsolutePath(r'\\win-share\path'))
+
+
+@conditionals.onOSFamily('posix')
+class TestFolderHandle(DefaultFilesystemTestCase):
+    """
+    Tests for operations done via an opened folder.
+    """
+
+    def openFolder(self, segments):
+        """
+        Open the folder and close it at cleanup.
+        """
+        handle = self.filesystem.openFolder(segments)
+        self.addCleanup(handle.close)
+        return handle
+
+    def test_openFolder_not_found(self):
+        """
+        Raise OSError when the folder does not exist.
+        """
+        path, segments = self.tempPath()
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFolder(segments)
+
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+        self.assertEqual(path, context.exception.filename)
+
+    def test_openFolder_file(self):
+        """
+        Raise OSError when trying to open a file as a folder.
+        """
+        segments = self.fileInTemp()
+
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFolder(segments)
+
+        self.assertEqual(errno.ENOTDIR, context.exception.errno)
+
+    def test_openFolder_close(self):
+        """
+        The folder is kept open until the handle is closed.
+        Closing multiple times is not an error.
+        """
+        segments = self.folderInTemp()
+
+        sut = self.filesystem.openFolder(segments)
+
+        self.assertProvides(IFolderHandle, sut)
+        self.assertEqual(segments, sut.segments)
+        self.assertEqual(mk.fs.getRealPathFromSegments(segments), sut.path)
+        self.assertIsFalse(sut.closed)
+        self.assertIsInstance(int, sut.fileno())
 
-        sut = self.filesystem.openFileForAppending(segments, mode=0o642)
-        sut.write(b'some data')
+        sut.close()
         sut.close()
 
-        a_file = self.filesystem.openFileForReading(segments)
-        new_test_content = a_file.read()
-        self.assertEqual(b'some data', new_test_content)
+        self.assertIsTrue(sut.closed)
+        with self.assertRaises(OSError) as context:
+            sut.fileno()
+        self.assertEqual(errno.EBADF, context.exception.errno)
 
-        if self.os_family == 'posix':
-            result = self.filesystem.getAttributes(segments)
-            # The umask will overwrite the requested attributes.
-            self.assertEqual(0o640, result.mode & 0o640)
+    def test_openFolder_context_manager(self):
+        """
+        The handle is closed when exiting the context.
+        """
+        segments = self.folderInTemp()
+
+        with self.filesystem.openFolder(segments) as sut:
+            self.assertIsFalse(sut.closed)
+
+        self.assertIsTrue(sut.closed)
 
-    def test_openFileForReading_ascii(self):
+    def test_stat(self):
         """
-        Check opening file for reading in ascii mode.
+        It can get the status of a member.
         """
-        content = 'ceva nou'
-        content_str = b'ceva nou'
-        self.test_segments = mk.fs.createFileInTemp(content=content)
-        a_file = None
-        try:
-            a_file = self.filesystem.openFileForReading(self.test_segments)
+        segments = self.folderInTemp()
+        mk.fs.createFile(segments + ['file\N{SUN}'], content='123')
+        sut = self.openFolder(segments)
 
-            self.assertEqual(content_str, a_file.read())
-        finally:
-            a_file.close()
+        result = sut.stat('file\N{SUN}')
 
-    def test_setAttributes_owner_and_group(self):
+        self.assertEqual(3, result.st_size)
+        self.assertEqual(
+            self.filesystem.getStatus(segments + ['file\N{SUN}']),
+            result,
+        )
+
+    def test_stat_not_found(self):
         """
-        It will raise OSError when trying to set ownership as normal user.
+        Raise OSError with the full path when the member is not found.
         """
-        _, segments = self.tempFile()
+        segments = self.folderInTemp()
+        sut = self.openFolder(segments)
 
-        if self.os_name == 'hpux':
-            # On HP-UX you can change the ownership of a file which is owned
-            # by you.
-            # But you can't reset it later, as it no longer belongs to you.
-            self.filesystem.setAttributes(segments, {'uid': 2, 'gid': 4})
+        with self.assertRaises(OSError) as context:
+            sut.stat('no-such-member')
 
-        error = self.assertRaises(
-            OSError,
-            self.filesystem.setAttributes,
-            segments,
-            {'uid': 1, 'gid': 1},
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+        self.assertEqual(
+            os.path.join(sut.path, 'no-such-member'),
+            context.exception.filename,
         )
 
-        self.assertEqual(errno.EPERM, error.errno)
-
-    def test_setAttributes_time(self):
+    def test_stat_invalid_name(self):
         """
-        It will set the time of the file.
+        Only direct members can be accessed.
         """
-        _, segments = self.tempFile()
-        initial = self.filesystem.getAttributes(segments)
+        segments = self.folderInTemp()
+        sut = self.openFolder(segments)
 
-        self.filesystem.setAttributes(segments, {'atime': 1, 'mtime': 2})
+        for name in ['', '.', '..', 'some/child', '../parent']:
+            with self.assertRaises(OSError) as context:
+                sut.stat(name)
+            self.assertEqual(errno.EINVAL, context.exception.errno)
 
-        after = self.filesystem.getAttributes(segments)
+    def test_open_and_unlink(self):
+        """
+        It can create, open and delete files.
+        """
+        segments = self.folderInTemp()
+        sut = self.openFolder(segments)
 
-        self.assertNotEqual(initial.modified, after.modified)
-        self.assertEqual(2, after.modified)
+        fd = sut.open('new-file', os.O_WRONLY | os.O_CREAT, 0o600)
+        os.write(fd, b'some data')
+        os.close(fd)
 
+        self.assertEqual(
+            'some data',
+            mk.fs.getFileContent(segments + ['new-file']),
+        )
 
-class LocalFilesystemNTMixin:
-    """
-    Shared tests for Windows path handling in an unlocked filesystem.
-    """
+        sut.unlink('new-file')
 
-    def test_temp_segments(self):
+        self.assertFalse(mk.fs.exists(segments + ['new-file']))
+
+    def test_mkdir(self):
         """
-        The temporary segments are the default Windows OS segments
+        It can create child folders.
         """
-        result = self.filesystem.temp_segments
+        segments = self.folderInTemp()
+        sut = self.openFolder(segments)
 
-        # We assume that all tests run from drive C
-        # and were we check that the temp segments are for an absolute path.
-        self.assertEqual('C', result[0])
+        sut.mkdir('child\N{SUN}')
 
-    def test_rename_file_read_only(self):
+        self.assertTrue(mk.fs.isFolder(segments + ['child\N{SUN}']))
+
+    def test_rename(self):
         """
-        On Windows, it will rename the file even if it has the read only
-        attribute.
+        It can rename members inside the same folder or move them to
+        another opened folder.
         """
-        _, initial_segments = mk.fs.makePathInTemp()
-        _, self.test_segments = mk.fs.makePathInTemp()
-        self.assertFalse(self.filesystem.exists(initial_segments))
-        self.assertFalse(self.filesystem.exists(self.test_segments))
-        self.filesystem.touch(initial_segments)
-        path = self.filesystem.getRealPathFromSegments(initial_segments)
-        os.chmod(self.filesystem.getEncodedPath(path), stat.S_IREAD)
+        segments = self.folderInTemp()
+        other_segments = self.folderInTemp()
+        mk.fs.createFile(segments + ['initial'], content='test')
+        sut = self.openFolder(segments)
+        other = self.openFolder(other_segments)
 
-        self.filesystem.rename(initial_segments, self.test_segments)
+        sut.rename('initial', 'renamed')
 
-        self.assertFalse(self.filesystem.exists(initial_segments))
-        self.assertTrue(self.filesystem.exists(self.test_segments))
+        self.assertEqual(['renamed'], mk.fs.getFolderContent(segments))
 
-    def test_getStatus_already_opened(self):
+        sut.rename('renamed', 'moved', destination=other)
+
+        self.assertEqual([], mk.fs.getFolderContent(segments))
+        self.assertEqual(['moved'], mk.fs.getFolderContent(other_segments))
+
+    def test_scandir(self):
         """
-        It will get status for file even if it's opened for writing.
+        It returns the attributes of each member, with the full path.
         """
-        self.test_segments = mk.fs.createFileInTemp()
-        handle = self.filesystem.openFileForWriting(self.test_segments)
-        handle.write(mk.ascii().encode('ascii'))
-        handle.flush()
-        self.addCleanup(lambda: handle.close())
+        segments = self.folderInTemp()
+        mk.fs.createFile(segments + ['file'], content='123')
+        mk.fs.createFolder(segments + ['folder'])
+        sut = self.openFolder(segments)
 
-        status = self.filesystem.getStatus(self.test_segments)
+        result = sut.scandir()
 
-        self.assertTrue(stat.S_ISREG(status.st_mode))
-        self.assertFalse(stat.S_ISDIR(status.st_mode))
-        self.assertFalse(stat.S_ISLNK(status.st_mode))
-        self.assertNotEqual(0, status.st_ino)
+        self.assertIteratorItemsEqual(
+            list(self.filesystem.iterateFolderContent(segments)),
+            result,
+        )
+        # It can list the folder multiple times.
+        self.assertEqual(2, len(list(sut.scandir())))
 
-    def test_checkChildPath_nt(self):
+    def test_virtual_member(self):
         """
-        See: test_checkChildPath_unix
+        Virtual members can't be modified via the handle.
         """
-        self.filesystem._checkChildPath('c:\\root\\path', 'c:\\root\\path')
-        self.filesystem._checkChildPath('c:\\root\\path\\', 'c:\\root\\path')
-        self.filesystem._checkChildPath('c:\\root\\path', 'c:\\root\\path\\')
-        self.filesystem._checkChildPath(
-            'c:\\root\\path',
-            'c:\\root\\path\\..\\path',
+        avatar = FilesystemApplicationAvatar(
+            name=mk.string(),
+            home_folder_path=mk.fs.temp_path,
+            virtual_folders=[(['virtual\N{SUN}'], mk.fs.temp_path)],
         )
+        filesystem = LocalFilesystem(avatar=avatar)
+        sut = filesystem.openFolder([])
+        self.addCleanup(sut.close)
 
-        with self.assertRaises(CompatError):
-            self.filesystem._checkChildPath('c:\\root\\path', 'c:\\')
-
-        with self.assertRaises(CompatError):
-            self.filesystem._checkChildPath(
-                'c:\\root\\path',
-                'c:\\root\\path\\..',
-            )
+        with self.assertRaises(CompatError) as context:
+            sut.mkdir('virtual\N{SUN}')
 
-    def test_getFileData(self):
-        """
-        Return a dict with file data.
-        """
-        content = mk.string()
-        path, segments = self.tempFile(content=content.encode('utf-8'))
-        name = segments[-1]
+        self.assertEqual(1007, context.exception.event_id)
 
-        result = self.filesystem._getFileData(path)
 
-        self.assertEqual(len(content.encode('utf-8')), result['size'])
-        self.assertEqual(name, result['name'])
-        self.assertEqual(0, result['tag'])
+class TestFolderCursor(DefaultFilesystemTestCase):
+    """
+    Tests for listing a folder in batches.
+    """
 
-    @conditionals.onCapability('symbolic_link', True)
-    def test_makeLink_bad_root_target(self):
+    def openFolderCursor(self, segments, batch_size=2):
         """
-        For unlocked accounts, will not create a valid link to a target
-        which does not have a valid drive letter.
+        Open the cursor and close it at cleanup.
+        """
+        cursor = self.filesystem.openFolderCursor(segments, batch_size)
+        self.addCleanup(cursor.close)
+        return cursor
 
-        This is a API inconsistency in Windows where CreateSymbolicLink will
-        consider bad:\\path as a relative path named `bad:` and not 'bad:'
-        as drive letter.
+    def makeMembers(self, count=5):
         """
-        with self.assertRaises(OSError):
-            target_segments = ['bad', 'no-such', 'target']
-            _, test_segments = mk.fs.makePathInTemp()
-            self.filesystem.makeLink(
-                target_segments=target_segments,
-                link_segments=test_segments,
-            )
+        Create a folder with `count` files and return its segments.
+        """
+        segments = self.folderInTemp()
+        for index in range(count):
+            mk.fs.createFile(segments + [f'file-{index}'])
+        return segments
 
-    def test_deleteFolder_recursive_read_only_members(self):
+    def test_openFolderCursor_not_found(self):
         """
-        On Windows, it will also delete the folders, even if it contains
-        files with read only attributes.
+        Raise OSError when the folder does not exist.
         """
-        segments, child_name = self.createFolderWithChild()
-        # Create and make sure we have a read only child.
-        child_segments = segments[:]
-        child_segments.append(child_name)
-        path = self.filesystem.getRealPathFromSegments(child_segments)
-        os.chmod(self.filesystem.getEncodedPath(path), stat.S_IREAD)
+        path, segments = self.tempPath()
 
-        self.filesystem.deleteFolder(segments, recursive=True)
+        with self.assertRaises(OSError) as context:
+            self.filesystem.openFolderCursor(segments)
 
-        self.assertFalse(self.filesystem.exists(segments))
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+        self.assertEqual(path, context.exception.filename)
 
-    def test_deleteFile_read_only(self):
+    def test_openFolderCursor_invalid_batch_size(self):
         """
-        On Windows, it will delete the file even if it has the read only
-        attribute.
+        The batch size should be at least 1.
         """
-        segments = mk.fs.createFileInTemp()
-        path = self.filesystem.getRealPathFromSegments(segments)
-        os.chmod(self.filesystem.getEncodedPath(path), stat.S_IREAD)
-        self.assertTrue(self.filesystem.exists(segments))
-
-        self.filesystem.deleteFile(segments)
+        with self.assertRaises(AssertionError):
+            self.filesystem.openFolderCursor(
+                self.filesystem.temp_segments, batch_size=0
+            )
 
-        self.assertFalse(self.filesystem.exists(segments))
+    def test_read(self):
+        """
+        The members are returned in batches, with their attributes, and an
+        empty list is returned at the end.
+        """
+        segments = self.makeMembers()
+
+        sut = self.openFolderCursor(segments)
+
+        self.assertProvides(IFolderCursor, sut)
+        self.assertEqual(segments, sut.segments)
+        self.assertEqual(mk.fs.getRealPathFromSegments(segments), sut.path)
+        batches = [sut.read(), sut.read()]
+        self.assertEqual(4, sut.position)
+        self.assertIsFalse(sut.exhausted)
+        batches.append(sut.read())
+        self.assertEqual([2, 2, 1], [len(batch) for batch in batches])
+        self.assertIsTrue(sut.exhausted)
+        self.assertIsFalse(sut.suspended)
+        self.assertEqual([], sut.read())
+        self.assertEqual(5, sut.position)
+        self.assertItemsEqual(
+            list(self.filesystem.iterateFolderContent(segments)),
+            batches[0] + batches[1] + batches[2],
+        )
 
-    def test_setAttributes_mode(self):
+    def test_close(self):
         """
-        It will ignore the mode of the file as is not implemented in Windows.
+        A closed cursor can no longer be read.
+        Closing multiple times is not an error.
         """
-        _, segments = self.tempFile()
-        initial = self.filesystem.getAttributes(segments)
+        sut = self.filesystem.openFolderCursor(self.makeMembers())
+        sut.read()
 
-        self.filesystem.setAttributes(segments, {'mode': 0o777})
-
-        after = self.filesystem.getAttributes(segments)
+        sut.close()
+        sut.close()
 
-        self.assertEqual(initial.mode, after.mode)
+        self.assertIsTrue(sut.closed)
+        self.assertIsFalse(sut.suspended)
+        with self.assertRaises(OSError) as context:
+            sut.read()
+        self.assertEqual(errno.EBADF, context.exception.errno)
+
+    def test_reapIdleCursors(self):
+        """
+        Idle cursors are suspended and the next read resumes from the
+        last returned member.
+        """
+        segments = self.makeMembers()
+        sut = self.openFolderCursor(segments)
+        busy = self.openFolderCursor(segments)
+        sut.idle_timeout = 0
+        first = sut.read()
+
+        result = FolderCursor.reapIdleCursors()
+
+        self.assertEqual(1, result)
+        self.assertIsTrue(sut.suspended)
+        self.assertIsFalse(busy.suspended)
+        rest = sut.read() + sut.read()
+        self.assertIsTrue(sut.exhausted)
+        self.assertItemsEqual(
+            mk.fs.getFolderContent(segments),
+            [member.name for member in first + rest],
+        )
 
-    def test_isAbsolutePath(self):
+    def test_max_open(self):
         """
-        Unit test for detecting which Windows path is absolute.
+        When too many cursors are opened, the idle ones are suspended
+        first and then the least recently used ones.
         """
-        # Traditional DOS paths.
-        self.assertIsTrue(self.filesystem.isAbsolutePath('c'))
-        self.assertIsTrue(self.filesystem.isAbsolutePath('c:'))
-        self.assertIsTrue(self.filesystem.isAbsolutePath('c:/'))
-        self.assertIsTrue(self.filesystem.isAbsolutePath('c:\\'))
-        self.assertIsTrue(self.filesystem.isAbsolutePath('c:/some/path'))
-        self.assertIsTrue(self.filesystem.isAbsolutePath('c:\\some\\path'))
+        segments = self.makeMembers()
+        with self.patchObject(FolderCursor, 'max_open', 2):
+            idle = self.openFolderCursor(segments)
+            idle.idle_timeout = 0
+            older = self.openFolderCursor(segments)
+            newer = self.openFolderCursor(segments)
 
-        # UNC paths are always absolute.
-        self.assertIsTrue(self.filesystem.isAbsolutePath('\\\\system07\\C$\\'))
-        self.assertIsTrue(
-            self.filesystem.isAbsolutePath('\\\\.\\UNC\\Server\\Foo.txt'),
-        )
-        self.assertIsTrue(
-            self.filesystem.isAbsolutePath(
-                '\\\\?\\UNC\\Server\\Share\\Foo.txt',
-            ),
-        )
-        self.assertIsTrue(
-            self.filesystem.isAbsolutePath(
-                '\\\\.\\Volume{b75e2c83-0000-0000-0000-602f00000000}\\Foo.txt',
-            ),
-        )
-        self.assertIsTrue(
-            self.filesystem.isAbsolutePath(
-                '\\\\?\\Volume{b75e2c83-0000-0000-0000-602f00000000}\\Foo.txt',
-            ),
-        )
-        self.assertIsTrue(
-            self.filesystem.isAbsolutePath(r'\\.\C:\Test\Foo.txt'),
-        )
-        self.assertIsTrue(
-            self.filesystem.isAbsolutePath(r'\\?\C:\Test\Foo.txt'),
-        )
+            self.assertIsTrue(idle.suspended)
+            self.assertIsFalse(older.suspended)
 
-        # Just the share root.
-        self.assertIsTrue(self.filesystem.isAbsolutePath('\\\\Server\\Share'))
+            older.read()
+            idle.read()
 
-        # Empty path is not absolute.
-        self.assertIsFalse(self.filesystem.isAbsolutePath(''))
+            self.assertIsFalse(idle.suspended)
+            self.assertIsFalse(older.suspended)
+            self.assertIsTrue(newer.suspended)
+            names = [m.name for m in newer.read() + newer.read()]
+            names.extend(m.name for m in newer.read())
+            self.assertItemsEqual(mk.fs.getFolderContent(segments), names)
 
-        # Using forward slashes will handled it as relative path.
-        self.assertIsFalse(
-            self.filesystem.isAbsolutePath('//system07/share-name'),
-        )
+    def test_open_reaps_idle(self):
+        """
+        Opening a cursor suspends the idle cursors, even when the limit
+        is not reached.
+        """
+        segments = self.makeMembers()
+        sut = self.openFolderCursor(segments)
+        sut.idle_timeout = 0
+        sut.read()
 
-        # Normal relative path.
-        self.assertIsFalse(self.filesystem.isAbsolutePath('some/path'))
-        self.assertIsFalse(self.filesystem.isAbsolutePath(r'win\path'))
-        self.assertIsFalse(self.filesystem.isAbsolutePath(r'.\win\path'))
-        self.assertIsFalse(self.filesystem.isAbsolutePath(r'..\win\path'))
+        self.openFolderCursor(segments)
 
-        # Crazy Windows API
-        # A relative path from the current directory of the C: drive.
-        self.assertIsFalse(
-            self.filesystem.isAbsolutePath(
-                r'C:Projects\apilibrary\apilibrary.sln',
-            ),
-        )
+        self.assertIsTrue(sut.suspended)
 
-        # They look like absolute, but they are default drive,
-        # so we consider them relative.
-        # On WIndows API this is defined as
-        # An absolute path from the root of the current drive.
-        self.assertIsFalse(
-            self.filesystem.isAbsolutePath(r'\default-drive\path'),
-        )
-        self.assertIsFalse(
-            self.filesystem.isAbsolutePath('/default/drive/path'),
-        )
+    def test_max_open_reading(self):
+        """
+        Cursors which are being read count toward the limit and they
+        are not suspended, so opening waits for the read to finish.
+        """
+        segments = self.makeMembers()
+        opened = []
+        get_attributes = self.filesystem._getMemberAttributes
 
+        def open_other():
+            opened.append(self.openFolderCursor(segments))
 
-class TestLocalFilesystemNTnonDevicePath(
-    DefaultFilesystemTestCase,
-    LocalFilesystemNTMixin,
-):
-    """
-    Test for default local filesystem with special behavior for Windows.
+        def get_while_reading(member):
+            if not opened:
+                thread = threading.Thread(target=open_other)
+                thread.start()
+                thread.join(0.1)
+                self.assertIsTrue(thread.is_alive())
+                opened.append(thread)
+            return get_attributes(member)
 
-    Running with current working directory which is not defined as a
-    device path.
+        with self.patchObject(FolderCursor, 'max_open', 1):
+            sut = self.openFolderCursor(segments)
+            with self.patchObject(
+                self.filesystem,
+                '_getMemberAttributes',
+                side_effect=get_while_reading,
+            ):
+                result = sut.read()
+            thread = opened[0]
+            thread.join(5)
 
-    os.getcwd() -> C:\\Some\\path
+            self.assertIsFalse(thread.is_alive())
+            self.assertEqual(2, len(result))
+            self.assertIsTrue(sut.suspended)
+            self.assertIsFalse(opened[1].suspended)
+
+
+@conditionals.onOSName('linux')
+class TestFolderWatch(DefaultFilesystemTestCase):
+    """
+    Tests for watching the changes of a folder.
     """
 
-    _prev_os_getcwd = ''
+    def watchFolder(self, segments, recursive=False, callback=None):
+        """
+        Watch the folder and close the watch at cleanup.
+        """
+        watch = self.filesystem.watchFolder(segments, recursive, callback)
+        self.addCleanup(watch.close)
+        return watch
 
-    @classmethod
-    def setUpClass(cls):
-        if cls.os_family != 'nt':
-            raise cls.skipTest('Only on Windows.')
-        cls._prev_os_getcwd = os.getcwd()
-        if cls._prev_os_getcwd.startswith('\\\\'):  # pragma: no cover
-            # We have a device path, so force using a non-device path
-            # Most of the time, tests are executed from a process
-            # that already has a DOS path and not a device path.
-            os.chdir(cls._prev_os_getcwd[4:])
-        super().setUpClass()
+    def test_watchFolder_not_found(self):
+        """
+        An error is raised when the folder does not exist.
+        """
+        _, segments = self.tempPath()
 
-    @classmethod
-    def tearDownClass(cls):
-        try:
-            super().tearDownClass()
-        finally:
-            os.chdir(cls._prev_os_getcwd)
+        with self.assertRaises(OSError) as context:
+            self.filesystem.watchFolder(segments)
 
+        self.assertEqual(errno.ENOENT, context.exception.errno)
 
-class TestLocalFilesystemNTDevicePath(
-    DefaultFilesystemTestCase,
-    LocalFilesystemNTMixin,
-):
-    """
-    Test for default local filesystem with special behavior for Windows.
+    def test_watchFolder(self):
+        """
+        Changes of the members are reported, with the modifications done
+        while creating a file coalesced.
+        """
+        segments = self.folderInTemp()
+        sut = self.watchFolder(segments)
 
-    Running with current working directory which is defined as a
-    device path.
-    os.getcwd() -> \\\\?\\C:\\Some\\path
-    """
+        self.assertProvides(IFolderWatch, sut)
+        self.assertEqual([], sut.read(timeout=0))
 
-    _prev_os_getcwd = ''
+        with self.filesystem.openFileForWriting(segments + ['new']) as stream:
+            stream.write(b'1')
+            stream.flush()
+            stream.write(b'2')
+        mk.fs.createFolder(segments + ['folder'])
+        mk.fs.createFolder(segments + ['folder', 'not-reported'])
 
-    @classmethod
-    def setUpClass(cls):
-        if cls.os_family != 'nt':
-            raise cls.skipTest('Only on Windows.')
+        result = sut.read(timeout=1)
 
-        cls._prev_os_getcwd = os.getcwd()
-        if not cls._prev_os_getcwd.startswith('\\\\'):
-            # We have a device path, so force using a non-device path
-            os.chdir('\\\\?\\' + cls._prev_os_getcwd)
-        super().setUpClass()
+        self.assertProvides(IFolderEvent, result[0])
+        self.assertEqual(
+            [
+                FolderEvent('create', segments + ['new'], False),
+                FolderEvent('close_write', segments + ['new'], False),
+                FolderEvent('create', segments + ['folder'], True),
+            ],
+            result,
+        )
 
-    @classmethod
-    def tearDownClass(cls):
-        try:
-            super().tearDownClass()
-        finally:
-            os.chdir(cls._prev_os_getcwd)
+        sut.close()
 
+        self.assertTrue(sut.closed)
+        self.assertEqual([], sut.read())
 
-@conditionals.onOSFamily('posix')
-class TestLocalFilesystemUnix(DefaultFilesystemTestCase):
-    """
-    Test for default local filesystem with special behavior for Linux and Unix.
-    """
+    def test_watchFolder_move_and_delete(self):
+        """
+        Moves inside the folder are reported with the source, while moves
+        from or to other folders are reported as create and delete.
+        """
+        segments = self.folderInTemp()
+        other_segments = self.folderInTemp()
+        for name in ['a', 'b', 'c']:
+            mk.fs.createFile(segments + [name])
+        mk.fs.createFile(other_segments + ['d'])
+        sut = self.watchFolder(segments)
 
-    def test_checkChildPath_unix(self):
+        self.filesystem.rename(segments + ['a'], segments + ['a2'])
+        self.filesystem.deleteFile(segments + ['b'])
+        self.filesystem.rename(segments + ['c'], other_segments + ['c'])
+        self.filesystem.rename(other_segments + ['d'], segments + ['d'])
+
+        self.assertEqual(
+            [
+                FolderEvent('move', segments + ['a2'], False, segments + ['a']),
+                FolderEvent('delete', segments + ['b'], False),
+                FolderEvent('delete', segments + ['c'], False),
+                FolderEvent('create', segments + ['d'], False),
+            ],
+            sut.read(timeout=1),
+        )
+
+    def test_watchFolder_recursive(self):
         """
-        Will raise an error if child is outside of root, or do nothing if
-        child is is root.
+        Changes of all the descendants are reported, including for the
+        folders created or moved after the watch was started.
         """
-        self.filesystem._checkChildPath('/root/path', '/root/path')
-        self.filesystem._checkChildPath('/root/path/', '/root/path')
-        self.filesystem._checkChildPath('/root/path', '/root/path/')
-        self.filesystem._checkChildPath('/root/path', '/root/path/../path/')
+        segments = self.folderInTemp()
+        mk.fs.createFolder(segments + ['sub'])
+        sut = self.watchFolder(segments, recursive=True)
 
-        with self.assertRaises(CompatError):
-            self.filesystem._checkChildPath('/root/path', '/')
+        mk.fs.createFile(segments + ['sub', 'a'])
+        mk.fs.createFolder(segments + ['new'])
+        mk.fs.createFolder(segments + ['new', 'deep'])
+        mk.fs.createFile(segments + ['new', 'deep', 'b'])
 
-        with self.assertRaises(CompatError):
-            self.filesystem._checkChildPath('/root/path', '/root/path/..')
+        self.assertEqual(
+            [
+                FolderEvent('create', segments + ['sub', 'a'], False),
+                FolderEvent('close_write', segments + ['sub', 'a'], False),
+                FolderEvent('create', segments + ['new'], True),
+                FolderEvent('create', segments + ['new', 'deep'], True),
+                FolderEvent('create', segments + ['new', 'deep', 'b'], False),
+            ],
+            sut.read(timeout=1),
+        )
 
-    def test_temp_segments_location_unix(self):
+        self.filesystem.rename(segments + ['new'], segments + ['moved'])
+        mk.fs.createFolder(segments + ['moved', 'deep', 'c'])
+
+        self.assertEqual(
+            [
+                FolderEvent(
+                    'move', segments + ['moved'], True, segments + ['new']
+                ),
+                FolderEvent('create', segments + ['moved', 'deep', 'c'], True),
+            ],
+            sut.read(timeout=1),
+        )
+
+    def test_watchFolder_deleted(self):
         """
-        On unix the temporary folders are located inside the temp folder.
+        The watched folder is reported as deleted.
         """
-        if self.os_name == 'osx':
-            expected = self.filesystem.getSegmentsFromRealPath(
-                tempfile.gettempdir(),
-            )
-        else:
-            expected = ['tmp']
-        self.assertEqual(expected, self.filesystem.temp_segments)
+        _, segments = self.tempPath()
+        mk.fs.createFolder(segments)
+        sut = self.watchFolder(segments)
 
-    def test_setAttributes_mode(self):
+        mk.fs.deleteFolder(segments)
+
+        self.assertEqual(
+            [FolderEvent('delete', segments, True)], sut.read(timeout=1)
+        )
+
+    def test_watchFolder_callback(self):
         """
-        It will set the mode of the file.
+        The changes are delivered to the callback from a separate thread,
+        until closed.
         """
-        _, segments = self.tempFile()
-        initial = self.filesystem.getAttributes(segments)
+        segments = self.folderInTemp()
+        received = []
+        sut = self.watchFolder(segments, callback=received.extend)
 
-        self.filesystem.setAttributes(segments, {'mode': 0o777})
+        mk.fs.createFolder(segments + ['a'])
 
-        after = self.filesystem.getAttributes(segments)
+        deadline = time.time() + 5
+        while not received:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        sut.close()
+        self.assertEqual(
+            [FolderEvent('create', segments + ['a'], True)], received
+        )
 
-        self.assertNotEqual(initial.mode, after.mode)
+    def test_iterate(self):
+        """
+        The changes can be iterated until the watch is closed.
+        """
+        segments = self.folderInTemp()
+        sut = self.watchFolder(segments)
+        mk.fs.createFolder(segments + ['a'])
+        mk.fs.createFolder(segments + ['b'])
+        result = []
 
-    def test_isAbsolutePath(self):
+        for event in sut:
+            result.append(event.segments[-1])
+            if len(result) == 2:
+                sut.close()
+
+        self.assertEqual(['a', 'b'], result)
+
+    def test_coalesce(self):
         """
-        Only paths starting with forward slash are absolute on Unix.
+        The repeated changes of a path are removed, but a path created
+        again after being deleted is reported.
         """
-        self.assertIsTrue(self.filesystem.isAbsolutePath('/some/path'))
-        self.assertIsFalse(self.filesystem.isAbsolutePath('some/path'))
-        self.assertIsFalse(self.filesystem.isAbsolutePath(r'c:\win\path'))
-        self.assertIsFalse(self.filesystem.isAbsolutePath(r'\\win-share\path'))
+        events = [
+            FolderEvent('create', ['a'], False),
+            FolderEvent('modify', ['a'], False),
+            FolderEvent('close_write', ['a'], False),
+            FolderEvent('modify', ['a'], False),
+            FolderEvent('close_write', ['a'], False),
+            FolderEvent('modify', ['b'], False),
+            FolderEvent('modify', ['b'], False),
+            FolderEvent('delete', ['a'], False),
+            FolderEvent('create', ['a'], False),
+        ]
+
+        self.assertEqual(
+            [
+                FolderEvent('create', ['a'], False),
+                FolderEvent('close_write', ['a'], False),
+                FolderEvent('modify', ['b'], False),
+                FolderEvent('delete', ['a'], False),
+                FolderEvent('create', ['a'], False),
+            ],
+            FolderWatch._coalesce(events),
+        )
 
 
 class TestLocalFilesystemUnlocked(CompatTestCase, FilesystemTestMixin):
@@ -2525,6 +4829,36 @@ class TestLocalFilesystemUnlocked(CompatTestCase, FilesystemTestMixin):
         segments = self.unlocked_filesystem.getSegments('../../../../../../B')
         self.assertEqual(['B'], segments)
 
+    def test_home_segments_copy(self):
+        """
+        Changing the returned home segments will not change the cached
+        value.
+        """
+        segments = self.unlocked_filesystem.home_segments
+        expected = segments[:]
+        segments.append('other')
+
+        self.assertEqual(expected, self.unlocked_filesystem.home_segments)
+        self.assertEqual(expected, self.unlocked_filesystem.getSegments(''))
+
+    def test_home_segments_avatar_changed(self):
+        """
+        The home segments are parsed again when the home folder of the
+        avatar is changed.
+        """
+        avatar = DefaultAvatar()
+        avatar.home_folder_path = mk.fs.temp_path
+        sut = LocalFilesystem(avatar=avatar)
+        self.assertEqual(mk.fs.temp_segments, sut.home_segments)
+
+        avatar.home_folder_path = os.path.join(mk.fs.temp_path, 'child')
+
+        self.assertEqual(mk.fs.temp_segments + ['child'], sut.home_segments)
+        self.assertEqual(
+            mk.fs.temp_segments + ['child', 'other'],
+            sut.getSegments('other'),
+        )
+
     @conditionals.onOSFamily('posix')
     def test_getRealPathFromSegments_unix(self):
         """
@@ -3103,6 +5437,103 @@ class TestLocalFilesystemLocked(CompatTestCase, FilesystemTestMixin):
 
         self.assertTrue(self.locked_filesystem.exists(link_segments))
 
+    @conditionals.onOSName('linux')
+    def test_openFileForReading_link_outside_home(self):
+        """
+        The kernel prevents opening a file via a link which points outside
+        of the home folder.
+        """
+        outside_path = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, outside_path)
+        outside_file = os.path.join(outside_path, 'secret')
+        with open(outside_file, 'wb') as stream:
+            stream.write(b'secret')
+        self.addCleanup(os.remove, outside_file)
+        link_name = mk.makeFilename()
+        os.symlink(outside_file, os.path.join(mk.fs.temp_path, link_name))
+        self.addCleanup(mk.fs.deleteFile, mk.fs.temp_segments + [link_name])
+
+        with self.assertRaises(CompatError) as context:
+            self.locked_filesystem.openFileForReading([link_name])
+
+        self.assertEqual(1018, context.exception.event_id)
+
+        # Relative links are also resolved beneath the home folder.
+        relative_name = mk.makeFilename()
+        os.symlink(
+            os.path.join('..', '..', outside_file),
+            os.path.join(mk.fs.temp_path, relative_name),
+        )
+        self.addCleanup(
+            mk.fs.deleteFile,
+            mk.fs.temp_segments + [relative_name],
+        )
+
+        with self.assertRaises(CompatError) as context:
+            self.locked_filesystem.openFileForReading([relative_name])
+
+        self.assertEqual(1018, context.exception.event_id)
+
+    @conditionals.onOSName('linux')
+    def test_openFileForReading_link_inside_home(self):
+        """
+        A file can be opened via absolute or relative links which point
+        inside the home folder, including links to folders.
+        """
+        path, segments = self.tempFile(content='inside')
+        absolute_name = mk.makeFilename()
+        relative_name = mk.makeFilename()
+        os.symlink(path, os.path.join(mk.fs.temp_path, absolute_name))
+        os.symlink(segments[-1], os.path.join(mk.fs.temp_path, relative_name))
+        self.addCleanup(mk.fs.deleteFile, mk.fs.temp_segments + [absolute_name])
+        self.addCleanup(mk.fs.deleteFile, mk.fs.temp_segments + [relative_name])
+
+        folder_name = mk.makeFilename()
+        os.symlink(mk.fs.temp_path, os.path.join(mk.fs.temp_path, folder_name))
+        self.addCleanup(mk.fs.deleteFile, mk.fs.temp_segments + [folder_name])
+        no_path_open = AssertionError('Open by path not allowed.')
+
+        # The files are not opened by path, outside of openat2.
+        with self.patchObject(
+            PosixFilesystemBase, '_osOpen', side_effect=no_path_open
+        ):
+            for segments in [
+                [absolute_name],
+                [relative_name],
+                [folder_name, absolute_name],
+            ]:
+                with self.locked_filesystem.openFileForReading(
+                    segments
+                ) as stream:
+                    self.assertEqual(b'inside', stream.read())
+
+    @conditionals.onOSName('linux')
+    def test_openFileForWriting_no_openat2(self):
+        """
+        It falls back to the normal open when the kernel has no support for
+        openat2.
+        """
+        from chevah_compat import unix_filesystem
+
+        _, segments = self.tempPathCleanup()
+        error = OSError(errno.ENOSYS, 'Not implemented')
+        with self.patchObject(unix_filesystem, '_openat2', side_effect=error):
+            with self.patchObject(
+                unix_filesystem.UnixFilesystem,
+                '_openat2_available',
+                True,
+            ):
+                with self.locked_filesystem.openFileForWriting(
+                    segments[-1:],
+                ) as stream:
+                    stream.write(b'data')
+
+                self.assertIsFalse(
+                    unix_filesystem.UnixFilesystem._openat2_available,
+                )
+
+        self.assertEqual('data', mk.fs.getFileContent(segments))
+
     @conditionals.onCapability('symbolic_link', True)
     def test_readLink_inside_home(self):
         """
@@ -3268,29 +5699,146 @@ class TestLocalFilesystemVirtualFolder(CompatTestCase):
         path, segments = self.tempFolder(suffix='low')
         virtual_shadow = segments[-1][:-3] + segments[-1][-3:].upper()
 
-        if self.os_name in ['windows', 'osx']:
-            with self.assertRaises(CompatError) as context:
-                self.getFilesystem(
-                    virtual_folders=[
-                        (['virtual-\N{CLOUD}', 'base\N{SUN}'], mk.fs.temp_path),
-                        ([virtual_shadow], mk.fs.temp_path),
-                    ],
-                )
-            self.assertEqual(1005, context.exception.event_id)
+        if self.os_name in ['windows', 'osx']:
+            with self.assertRaises(CompatError) as context:
+                self.getFilesystem(
+                    virtual_folders=[
+                        (['virtual-\N{CLOUD}', 'base\N{SUN}'], mk.fs.temp_path),
+                        ([virtual_shadow], mk.fs.temp_path),
+                    ],
+                )
+            self.assertEqual(1005, context.exception.event_id)
+
+        else:
+            self.getFilesystem(
+                virtual_folders=[
+                    (['virtual-\N{CLOUD}', 'base\N{SUN}'], mk.fs.temp_path),
+                    ([virtual_shadow], mk.fs.temp_path),
+                ],
+            )
+            self.getFilesystem(
+                virtual_folders=[
+                    (['virtual-\N{CLOUD}', 'base\N{SUN}'], mk.fs.temp_path),
+                    ([virtual_shadow, 'deep'], mk.fs.temp_path),
+                ],
+            )
+
+    def test_init_virtual_cached(self):
+        """
+        The virtual folders are validated only for the first filesystem
+        of an avatar configuration, until the cache is invalidated.
+        """
+        self.addCleanup(LocalFilesystem.invalidateAvatarCache)
+        name = mk.makeFilename()
+        virtual_folders = [([name, 'deep'], mk.fs.temp_path)]
+        first = self.getFilesystem(virtual_folders=virtual_folders)
+        mk.fs.createFolder(mk.fs.temp_segments + [name])
+        self.addCleanup(mk.fs.deleteFolder, mk.fs.temp_segments + [name])
+
+        second = self.getFilesystem(virtual_folders=virtual_folders)
+
+        self.assertEqual(
+            first.getRealPathFromSegments([name, 'deep', 'file']),
+            second.getRealPathFromSegments([name, 'deep', 'file']),
+        )
+
+        first.invalidateAvatarCache(first.avatar)
+
+        with self.assertRaises(CompatError) as context:
+            self.getFilesystem(virtual_folders=virtual_folders)
+        self.assertEqual(1005, context.exception.event_id)
+
+    def test_virtual_folders_changed(self):
+        """
+        The virtual folders changed in place are used after the avatar
+        cache is invalidated, and they are validated.
+        """
+        self.addCleanup(LocalFilesystem.invalidateAvatarCache)
+        name = mk.makeFilename()
+        virtual_folders = [([name, 'a'], mk.fs.temp_path)]
+        sut = self.getFilesystem(virtual_folders=virtual_folders)
+
+        virtual_folders.append(([name, 'b'], mk.fs.home_path))
+        virtual_folders[0][0][1] = 'c'
+
+        # Not compared for each path.
+        self.assertEqual(
+            os.path.join(mk.fs.temp_path, 'file'),
+            sut.getRealPathFromSegments([name, 'a', 'file']),
+        )
+
+        LocalFilesystem.invalidateAvatarCache(sut.avatar)
+
+        self.assertEqual(
+            os.path.join(mk.fs.home_path, 'file'),
+            sut.getRealPathFromSegments([name, 'b', 'file']),
+        )
+        self.assertEqual(
+            os.path.join(mk.fs.temp_path, 'file'),
+            sut.getRealPathFromSegments([name, 'c', 'file']),
+        )
+        self.assertEqual(
+            os.path.join(mk.fs.temp_path, name, 'a', 'file'),
+            sut.getRealPathFromSegments([name, 'a', 'file']),
+        )
+
+        _, segments = self.tempFolder()
+        virtual_folders.append((segments[-1:], mk.fs.temp_path))
+        LocalFilesystem.invalidateAvatarCache(sut.avatar)
+
+        with self.assertRaises(CompatError) as context:
+            sut.getRealPathFromSegments([name, 'b', 'file'])
+        self.assertEqual(1005, context.exception.event_id)
+
+    def test_virtual_folders_replaced(self):
+        """
+        Other virtual folders of the avatar are used without invalidating
+        the avatar cache.
+        """
+        self.addCleanup(LocalFilesystem.invalidateAvatarCache)
+        name = mk.makeFilename()
+        sut = self.getFilesystem(
+            virtual_folders=[([name, 'a'], mk.fs.temp_path)]
+        )
+
+        sut.avatar._virtual_folders = [([name, 'b'], mk.fs.temp_path)]
+
+        self.assertEqual(
+            os.path.join(mk.fs.temp_path, 'file'),
+            sut.getRealPathFromSegments([name, 'b', 'file']),
+        )
+
+    def test_init_virtual_overlap_not_cached(self):
+        """
+        A configuration which fails the validation is not cached, and
+        it fails for each new filesystem.
+        """
+        self.addCleanup(LocalFilesystem.invalidateAvatarCache)
+        _, segments = self.tempFolder()
+        virtual_folders = [(segments[-1:], mk.fs.temp_path)]
+
+        with self.assertRaises(CompatError):
+            self.getFilesystem(virtual_folders=virtual_folders)
+
+        with self.assertRaises(CompatError) as context:
+            self.getFilesystem(virtual_folders=virtual_folders)
+        self.assertEqual(1005, context.exception.event_id)
+
+    def test_invalidateAvatarCache_all(self):
+        """
+        Without an avatar, the cache is invalidated for all the avatars.
+        """
+        name = mk.makeFilename()
+        virtual_folders = [([name], mk.fs.temp_path)]
+        self.getFilesystem(virtual_folders=virtual_folders)
+        mk.fs.createFolder(mk.fs.temp_segments + [name])
+        self.addCleanup(mk.fs.deleteFolder, mk.fs.temp_segments + [name])
+
+        LocalFilesystem.invalidateAvatarCache()
 
-        else:
-            self.getFilesystem(
-                virtual_folders=[
-                    (['virtual-\N{CLOUD}', 'base\N{SUN}'], mk.fs.temp_path),
-                    ([virtual_shadow], mk.fs.temp_path),
-                ],
-            )
-            self.getFilesystem(
-                virtual_folders=[
-                    (['virtual-\N{CLOUD}', 'base\N{SUN}'], mk.fs.temp_path),
-                    ([virtual_shadow, 'deep'], mk.fs.temp_path),
-                ],
-            )
+        with self.assertRaises(CompatError) as context:
+            self.getFilesystem(virtual_folders=virtual_folders)
+        self.assertEqual(1005, context.exception.event_id)
 
     def test_getRealPathFromSegments_no_match(self):
         """
@@ -3961,6 +6509,34 @@ class TestLocalFilesystemVirtualFolder(CompatTestCase):
             sut.getAttributes(['some\N{CLOUD}', 'lost\N{SUN}'])
         self.assertEqual(1004, context.exception.event_id)
 
+    def test_getAttributesMany_virtual(self):
+        """
+        The attributes of the virtual paths are placeholders, while the
+        members of the virtual folders are read.
+        """
+        virtual_path, virtual_segments = self.tempFolder('virtual')
+        mk.fs.createFile(virtual_segments + ['file'], content='123')
+        sut = self.getFilesystem(
+            virtual_folders=[(['some', 'base'], virtual_path)],
+        )
+        segments_list = [
+            ['some'],
+            ['some', 'base', 'file'],
+            ['some', 'lost'],
+            ['some', 'base', 'missing'],
+        ]
+
+        result = sut.getAttributesMany(segments_list)
+
+        self.assertEqual(sut.getAttributes(['some']), result[0])
+        self.assertEqual(3, result[1].size)
+        self.assertEqual('file', result[1].name)
+        self.assertEqual(1004, result[2].event_id)
+        self.assertEqual(errno.ENOENT, result[3].errno)
+        self.assertEqual(
+            [True, True, False, False], sut.existsMany(segments_list)
+        )
+
     def test_getAttributes_virtual_case(self):
         """
         On Windows is case insensitive, while on other system is case
@@ -4568,6 +7144,224 @@ class TestLocalFilesystemVirtualFolder(CompatTestCase):
             result,
         )
 
+    def test_getFolderListing_virtual(self):
+        """
+        Virtual members are listed with the real members, keeping the
+        path of the virtual folder.
+        """
+        virtual_path, _ = self.tempFolder('virtual\N{SUN}')
+        _, real_segments = self.tempFolder()
+        sut = self.getFilesystem(
+            virtual_folders=[(['virtual\N{CLOUD}'], virtual_path)],
+        )
+        mk.fs.createFile(real_segments + ['some-file'], content='12')
+
+        result = sut.getFolderListing(real_segments[-1:])
+
+        self.assertEqual(1, len(result))
+        self.assertEqual(2, result.getTotalSize())
+
+        result = sut.getFolderListing([])
+
+        virtual = result.filter(include=result.VIRTUAL)
+        self.assertEqual(1, len(virtual))
+        self.assertEqual(
+            sut._getPlaceholderAttributes(['virtual\N{CLOUD}']),
+            virtual[0],
+        )
+        self.assertEqual(virtual_path, virtual[0].path)
+        self.assertEqual(len(result) - 1, result.count(exclude=result.VIRTUAL))
+
+    def test_openFolderCursor_virtual(self):
+        """
+        Virtual members are returned first and they are not returned
+        again when the cursor is resumed.
+        """
+        sut = self.getFilesystem(
+            virtual_folders=[
+                (['virtual\N{SUN}'], mk.fs.temp_path),
+                (['other\N{SUN}'], mk.fs.temp_path),
+            ],
+        )
+        cursor = sut.openFolderCursor([], batch_size=1)
+        self.addCleanup(cursor.close)
+        cursor.idle_timeout = 0
+
+        result = []
+        for _index in range(3):
+            result.extend(cursor.read())
+            FolderCursor.reapIdleCursors()
+        while not cursor.exhausted:
+            result.extend(cursor.read())
+
+        self.assertItemsEqual(
+            ['virtual\N{SUN}', 'other\N{SUN}'], [m.name for m in result[:2]]
+        )
+        self.assertItemsEqual(list(sut.iterateFolderContent([])), result)
+
+    def test_iterateFolderContent_filter_virtual(self):
+        """
+        The filter is also applied to the virtual members.
+        """
+        _, real_segments = self.tempFolder('real\N{SUN}')
+        mk.fs.createFile(real_segments + ['some-file'])
+        sut = self.getFilesystem(
+            virtual_folders=[(['virtual\N{SUN}'], mk.fs.temp_path)],
+        )
+
+        result = sut.iterateFolderContent([], '*\N{SUN}')
+
+        self.assertItemsEqual(
+            [
+                sut._getPlaceholderAttributes(['virtual\N{SUN}']),
+                sut.getAttributes(['real\N{SUN}']),
+            ],
+            list(result),
+        )
+
+        result = sut.iterateFolderContent(
+            [], lambda name, is_folder: name.startswith('virtual')
+        )
+
+        self.assertEqual(['virtual\N{SUN}'], [m.name for m in result])
+
+        result = sut.iterateFolderTree([], 'real*/*')
+
+        self.assertEqual(
+            [real_segments[-1:] + ['some-file']],
+            [segments for segments, _ in result],
+        )
+
+    def test_getTreeUsage_virtual(self):
+        """
+        The usage includes the trees of the virtual folders.
+        """
+        virtual_path, virtual_segments = self.tempFolder()
+        mk.fs.createFile(virtual_segments + ['some-file'], content='12')
+        sut = self.getFilesystem(
+            virtual_folders=[(['base\N{SUN}', 'virtual'], virtual_path)],
+        )
+
+        result = sut.getTreeUsage(['base\N{SUN}'])
+
+        self.assertEqual(1, result.files)
+        self.assertEqual(1, result.folders)
+        self.assertEqual(2, result.size)
+
+    @conditionals.onOSName('linux')
+    def test_watchFolder_virtual(self):
+        """
+        Changes from virtual folders are reported with the virtual
+        segments.
+        """
+        virtual_path, virtual_segments = self.tempFolder()
+        sut = self.getFilesystem(
+            virtual_folders=[(['base\N{SUN}', 'virtual'], virtual_path)],
+        )
+        watch = sut.watchFolder(['base\N{SUN}'], recursive=True)
+        self.addCleanup(watch.close)
+
+        mk.fs.createFolder(virtual_segments + ['new'])
+
+        self.assertEqual(
+            [FolderEvent('create', ['base\N{SUN}', 'virtual', 'new'], True)],
+            watch.read(timeout=1),
+        )
+
+    def test_executeMany_virtual(self):
+        """
+        The operations for virtual paths are denied, while the members of
+        the virtual folders can be changed.
+        """
+        virtual_path, virtual_segments = self.tempFolder('virtual')
+        sut = self.getFilesystem(
+            virtual_folders=[(['some', 'base'], virtual_path)],
+        )
+
+        result = sut.executeMany(
+            [
+                ('createFolder', ['some', 'base']),
+                ('createFolder', ['some', 'base', 'child']),
+            ]
+        )
+
+        # Operation denied.
+        self.assertEqual(1007, result[0].event_id)
+        self.assertEqual(None, result[1])
+        self.assertTrue(mk.fs.isFolder(virtual_segments + ['child']))
+
+    @conditionals.onOSName('linux')
+    def test_extendedAttributes_virtual(self):
+        """
+        The virtual paths have no extended attributes and they can't be
+        changed, while the members of the virtual folders can.
+        """
+        virtual_path, virtual_segments = self.tempFolder('virtual')
+        mk.fs.createFile(virtual_segments + ['file'])
+        sut = self.getFilesystem(
+            virtual_folders=[(['some', 'base'], virtual_path)],
+        )
+
+        sut.setExtendedAttributes(
+            ['some', 'base', 'file'], {'user.origin': b'1'}
+        )
+
+        self.assertEqual(
+            {'user.origin': b'1'},
+            sut.getExtendedAttributes(['some', 'base', 'file']),
+        )
+        self.assertEqual({}, sut.getExtendedAttributes(['some']))
+        self.assertEqual([], sut.listExtendedAttributes(['some', 'base']))
+        with self.assertRaises(CompatError) as context:
+            sut.setExtendedAttributes(['some', 'base'], {'user.origin': b'1'})
+        # Operation denied.
+        self.assertEqual(1007, context.exception.event_id)
+
+    def test_metadata_cache_virtual(self):
+        """
+        The virtual paths and the content of the folders with virtual
+        members are not cached.
+        """
+        sut = self.getFilesystem(
+            virtual_folders=[(['base\N{SUN}', 'virtual'], mk.fs.temp_path)],
+        )
+        sut.metadata_cache = MetadataCache()
+        self.addCleanup(sut.metadata_cache.close)
+
+        for _ignored in range(2):
+            self.assertTrue(sut.exists(['base\N{SUN}']))
+            self.assertTrue(sut.isFolder(['base\N{SUN}', 'virtual']))
+            self.assertEqual(['virtual'], sut.getFolderContent(['base\N{SUN}']))
+
+        self.assertEqual(0, sut.metadata_cache.hits)
+        self.assertEqual(0, sut.metadata_cache.misses)
+
+    def test_listFolderPage_virtual(self):
+        """
+        Virtual members are sorted together with the real members and
+        they shadow the real members with the same name.
+        """
+        sut = self.getFilesystem(
+            virtual_folders=[
+                (['b-virtual\N{SUN}'], mk.fs.temp_path),
+                (['c-real\N{SUN}', 'deep'], mk.fs.temp_path),
+            ],
+        )
+        _, segments = self.tempFolder('c-real\N{SUN}')
+        self.tempFolder('a-real\N{SUN}')
+
+        total, page = sut.listFolderPage(
+            [],
+            filter=lambda name, is_folder: name.endswith('\N{SUN}'),
+        )
+
+        self.assertEqual(3, total)
+        self.assertEqual(
+            ['a-real\N{SUN}', 'b-virtual\N{SUN}', 'c-real\N{SUN}'],
+            [m.name for m in page],
+        )
+        self.assertEqual(mk.fs._getPlaceholderAttributes(segments), page[2])
+
     def test_getFolderContent_virtual_deep_member(self):
         """
         It will list a deep virtual folder as a normal folder.
@@ -4743,3 +7537,318 @@ class TestFileAttributes(CompatTestCase):
         self.assertNotEqual(sut1, None)
         self.assertNotEqual(object(), sut1)
         self.assertNotEqual(sut1, object())
+
+    def test_equality_changed(self):
+        """
+        The attributes can be changed and they are used for equality.
+        """
+        name = mk.string()
+        sut1 = FileAttributes(name=name, path='some-path', size=1)
+        sut2 = FileAttributes(name=name, path='some-path', size=1)
+
+        sut2.group = 'adm'
+
+        self.assertNotEqual(sut1, sut2)
+
+        sut1.group = 'adm'
+
+        self.assertEqual(sut1, sut2)
+
+    def test_slots(self):
+        """
+        The attributes are stored without an instance dictionary.
+        """
+        sut = FileAttributes(name=mk.string(), path='some-path')
+
+        self.assertFalse(hasattr(sut, '__dict__'))
+        with self.assertRaises(AttributeError):
+            sut.other = 'value'
+
+    def test_hash(self):
+        """
+        Objects with same attributes have the same hash, and the hash
+        follows the changes of the attributes.
+        """
+        sut1 = FileAttributes(name='name', path='some-path', size=2)
+        sut2 = FileAttributes(name='name', path='some-path', size=2)
+
+        self.assertEqual(hash(sut1), hash(sut2))
+        self.assertEqual(1, len({sut1, sut2}))
+
+        sut2.size = 3
+
+        self.assertEqual(2, len({sut1, sut2}))
+
+    def test_hash_cached(self):
+        """
+        With `cache_hash` the hash is computed only once, and is not
+        used for equality.
+        """
+        sut = FileAttributes(name='name', path='some-path', cache_hash=True)
+        other = FileAttributes(name='name', path='some-path')
+        initial = hash(sut)
+
+        sut.size = 3
+
+        self.assertEqual(initial, hash(sut))
+        self.assertNotEqual(other, sut)
+
+    def test_repr(self):
+        """
+        It contains the values of the attributes.
+        """
+        sut = FileAttributes(name='name', path='some-path', uid=1)
+
+        result = repr(sut)
+
+        self.assertStartsWith(f"{FileAttributes}:{id(sut)}:{{'name': ", result)
+        self.assertContains("'path': 'some-path'", result)
+        self.assertContains("'uid': 1, ", result)
+        self.assertNotContains('_hash', result)
+
+    def test_fromStatus_file(self):
+        """
+        It can be created from the result of `lstat`.
+        """
+        path, _ = self.tempFile(content='test')
+        stats = os.lstat(path)
+
+        sut = FileAttributes.fromStatus('some-name', path, stats)
+
+        self.assertEqual(
+            FileAttributes(
+                name='some-name',
+                path=path,
+                size=4,
+                is_file=True,
+                is_folder=False,
+                is_link=False,
+                modified=stats.st_mtime,
+                mode=stats.st_mode,
+                hardlinks=stats.st_nlink,
+                uid=stats.st_uid,
+                gid=stats.st_gid,
+                node_id=stats.st_ino,
+            ),
+            sut,
+        )
+
+    @conditionals.onOSFamily('posix')
+    def test_fromStatus_link(self):
+        """
+        The link is detected from the mode of `lstat` when not explicitly
+        requested.
+        """
+        path, _ = self.tempFolder()
+        link_path = path + '-link'
+        os.symlink(path, link_path)
+        self.addCleanup(os.remove, link_path)
+
+        sut = FileAttributes.fromStatus('link', link_path, os.lstat(link_path))
+
+        self.assertIsTrue(sut.is_link)
+        self.assertIsFalse(sut.is_folder)
+
+        sut = FileAttributes.fromStatus(
+            'link', link_path, os.stat(link_path), is_link=True
+        )
+
+        self.assertIsTrue(sut.is_link)
+        self.assertIsTrue(sut.is_folder)
+
+
+class TestFolderListing(CompatTestCase):
+    """
+    Unit tests for FolderListing.
+    """
+
+    def getListing(self, *members):
+        """
+        Return a listing with a file for each (name, size, modified).
+        """
+        result = FolderListing('/base')
+        for name, size, modified in members:
+            result.append(
+                FileAttributes(
+                    name=name,
+                    path='/base/' + name,
+                    size=size,
+                    is_file=True,
+                    modified=modified,
+                    node_id=size,
+                )
+            )
+        return result
+
+    def test_init(self):
+        """
+        It is initialized without members.
+        """
+        sut = FolderListing('/base')
+
+        self.assertProvides(IFolderListing, sut)
+        self.assertEqual('/base', sut.path)
+        self.assertEqual(0, len(sut))
+        self.assertEqual([], list(sut))
+        self.assertEqual(0, sut.getTotalSize())
+        self.assertEqual(0, sut.count())
+
+    def test_append(self):
+        """
+        The members are returned as FileAttributes, including the
+        attributes which are not known.
+        """
+        sut = FolderListing('/base')
+        first = FileAttributes(
+            name='first',
+            path='/base/first',
+            size=3,
+            is_file=True,
+            modified=1.5,
+            mode=0o100640,
+            hardlinks=2,
+            uid=1000,
+            gid=100,
+            node_id=123,
+        )
+        second = FileAttributes(name='second', path='/other/second')
+
+        sut.append(first)
+        sut.append(second, is_virtual=True)
+
+        self.assertEqual(2, len(sut))
+        self.assertEqual([first, second], list(sut))
+        self.assertEqual(second, sut[-1])
+        self.assertEqual('first', sut.getName(0))
+        self.assertEqual(sut.FILE, sut.flags[0])
+        self.assertEqual(sut.VIRTUAL, sut.flags[1] & sut.VIRTUAL)
+        self.assertEqual(-1, sut.uids[1])
+
+        with self.assertRaises(IndexError):
+            sut[2]
+
+    def test_appendStatus(self):
+        """
+        The member can be added from the `lstat` result.
+        """
+        path, _ = self.tempFile(content='test')
+        name = os.path.basename(path)
+        sut = FolderListing(os.path.dirname(path))
+
+        sut.appendStatus(name, os.lstat(path), is_link=False)
+
+        self.assertEqual(
+            FileAttributes.fromStatus(name, path, os.lstat(path)),
+            sut[0],
+        )
+
+    def test_getName_unicode(self):
+        """
+        Names are stored as UTF-8, including the surrogates used for
+        names which can't be decoded.
+        """
+        sut = self.getListing(
+            ('\N{SUN}-sun', 1, 0),
+            ('bad-\udcff', 2, 0),
+        )
+
+        self.assertEqual('\N{SUN}-sun', sut.getName(0))
+        self.assertEqual('bad-\udcff', sut.getName(1))
+
+    def test_sort(self):
+        """
+        It returns a new listing sorted by name, size or modified time.
+        """
+        sut = self.getListing(('b', 2, 30), ('c', 1, 10), ('a', 3, 20))
+
+        result = sut.sort()
+
+        self.assertEqual(['a', 'b', 'c'], [m.name for m in result])
+        self.assertEqual(['b', 'c', 'a'], [m.name for m in sut])
+
+        result = sut.sort(key='size', reverse=True)
+
+        self.assertEqual(['a', 'b', 'c'], [m.name for m in result])
+        self.assertEqual([3, 2, 1], list(result.sizes))
+
+        result = sut.sort(key='modified')
+
+        self.assertEqual(['c', 'a', 'b'], [m.name for m in result])
+        self.assertEqual(
+            sut[1],
+            result[0],
+        )
+
+    def test_sort_unknown(self):
+        """
+        It fails for unknown sort keys.
+        """
+        sut = self.getListing()
+
+        with self.assertRaises(AssertionError):
+            sut.sort(key='mode')
+
+    def test_filter(self):
+        """
+        Members can be selected based on their flags.
+        """
+        sut = self.getListing(('a', 2, 0), ('b', 3, 0))
+        sut.append(
+            FileAttributes(
+                name='folder',
+                path='/base/folder',
+                size=4096,
+                is_folder=True,
+            )
+        )
+
+        result = sut.filter(include=sut.FILE)
+
+        self.assertEqual(['a', 'b'], [m.name for m in result])
+        self.assertEqual(5, sut.getTotalSize(include=sut.FILE))
+        self.assertEqual(4101, sut.getTotalSize())
+        self.assertEqual(1, sut.count(exclude=sut.FILE))
+        self.assertEqual(0, sut.count(include=sut.FILE | sut.FOLDER))
+
+
+class TestTreeUsage(CompatTestCase):
+    """
+    Unit tests for TreeUsage.
+    """
+
+    def test_init(self):
+        """
+        It starts empty.
+        """
+        sut = TreeUsage()
+
+        self.assertProvides(ITreeUsage, sut)
+        self.assertEqual(
+            'TreeUsage(files=0, folders=0, links=0, size=0, '
+            'allocated=0, errors=0)',
+            repr(sut),
+        )
+        self.assertEqual({}, sut.extensions)
+
+    def test_update(self):
+        """
+        The usage is added, including the extensions.
+        """
+        sut = TreeUsage()
+        sut.addFile('a.txt', 10, 4096)
+        other = TreeUsage()
+        other.addFile('b.TXT', 5, 0)
+        other.addFile('.profile', 1, 4096)
+        other.folders = 2
+        other.links = 3
+        other.errors = 4
+
+        sut.update(other)
+
+        self.assertEqual(3, sut.files)
+        self.assertEqual(2, sut.folders)
+        self.assertEqual(3, sut.links)
+        self.assertEqual(4, sut.errors)
+        self.assertEqual(16, sut.size)
+        self.assertEqual(8192, sut.allocated)
+        self.assertEqual({'.txt': (2, 15), '': (1, 1)}, sut.extensions)
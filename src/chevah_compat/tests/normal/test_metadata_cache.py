@@ -0,0 +1,301 @@
+# Copyright (c) 2026 Adi Roiban.
+# See LICENSE for details.
+"""
+Tests for the metadata cache.
+"""
+
+import os
+
+from chevah_compat.interfaces import IMetadataCache
+from chevah_compat.metadata_cache import MetadataCache, _parse_mounts
+from chevah_compat.testing import CompatTestCase, conditionals, mk
+
+
+class Counter:
+    """
+    Returns the values from `result` and counts the calls.
+    """
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result(self.calls)
+
+
+class TestMetadataCache(CompatTestCase):
+    """
+    Tests for MetadataCache.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.path, self.segments = self.tempFolder()
+        self.sut = MetadataCache()
+        self.addCleanup(self.sut.close)
+
+    def makeUnwatched(self, ttl):
+        """
+        Configure the cache as for a filesystem on which the changes are
+        not observed.
+        """
+        self.sut.ttl = ttl
+        self.sut.mounts_interval = 3600
+        self.sut._mounts = [('/', 'nfs4')]
+
+    def test_init(self):
+        """
+        No value is cached by default.
+        """
+        self.assertProvides(IMetadataCache, self.sut)
+        self.assertEqual(0, self.sut.hits)
+        self.assertEqual(0, self.sut.misses)
+        self.assertEqual(0.0, self.sut.hit_rate)
+
+    def test_get(self):
+        """
+        The value is computed only once for the same kind, path and owner.
+        """
+        path = os.path.join(self.path, 'a')
+        compute = Counter(lambda calls: calls)
+
+        self.assertEqual(1, self.sut.get('exists', path, 'u', compute))
+        self.assertEqual(1, self.sut.get('exists', path, 'u', compute))
+        self.assertEqual(2, self.sut.get('exists', path, 'other', compute))
+        self.assertEqual(3, self.sut.get('attributes', path, 'u', compute))
+
+        self.assertEqual(1, self.sut.hits)
+        self.assertEqual(3, self.sut.misses)
+        self.assertEqual(0.25, self.sut.hit_rate)
+
+    def test_get_error(self):
+        """
+        Errors are not cached.
+        """
+        path = os.path.join(self.path, 'a')
+
+        def compute():
+            raise OSError('Fail.')
+
+        with self.assertRaises(OSError):
+            self.sut.get('exists', path, None, compute)
+
+        self.assertEqual(
+            'good',
+            self.sut.get('exists', path, None, lambda: 'good'),
+        )
+        self.assertEqual(0, self.sut.hits)
+
+    def test_get_not_cacheable(self):
+        """
+        The values for which `cacheable` returns False are not kept.
+        """
+        path = os.path.join(self.path, 'a')
+        compute = Counter(lambda calls: calls)
+
+        self.sut.get('exists', path, None, compute, cacheable=lambda _: 0)
+        self.sut.get('exists', path, None, compute, cacheable=bool)
+
+        self.assertEqual(2, self.sut.get('exists', path, None, compute))
+        self.assertEqual(2, compute.calls)
+
+    def test_get_observed_only(self):
+        """
+        The values for which `observed_only` returns True are not kept
+        when the changes are not observed.
+        """
+        compute = Counter(lambda calls: calls)
+        self.sut.get('exists', self.path, None, compute, observed_only=bool)
+        self.sut.get('exists', self.path, None, compute, observed_only=bool)
+        self.makeUnwatched(ttl=3600)
+        path = os.path.join(self.path, 'a')
+
+        self.sut.get('exists', path, None, compute, observed_only=bool)
+        self.sut.get('exists', path, None, compute, observed_only=bool)
+
+        self.assertEqual(3, compute.calls)
+
+    def test_get_max_entries(self):
+        """
+        The least recently used values are removed when over the limit.
+        """
+        self.sut.max_entries = 2
+        compute = Counter(lambda calls: calls)
+        paths = [os.path.join(self.path, name) for name in 'abc']
+
+        self.sut.get('exists', paths[0], None, compute)
+        self.sut.get('exists', paths[1], None, compute)
+        self.sut.get('exists', paths[0], None, compute)
+        self.sut.get('exists', paths[2], None, compute)
+
+        self.assertEqual(1, self.sut.get('exists', paths[0], None, compute))
+        self.assertEqual(4, self.sut.get('exists', paths[1], None, compute))
+
+    @conditionals.onOSName('linux')
+    def test_get_changed(self):
+        """
+        The values are removed when the path or its folder is changed.
+        """
+        mk.fs.createFile(self.segments + ['a'], content='1')
+        path = os.path.join(self.path, 'a')
+        attributes = Counter(lambda _: os.stat(path).st_size)
+        content = Counter(lambda _: sorted(os.listdir(self.path)))
+
+        self.assertEqual(1, self.sut.get('attributes', path, None, attributes))
+        self.assertEqual(
+            ['a'], self.sut.get('content', self.path, None, content)
+        )
+
+        with open(path, 'ab') as stream:
+            stream.write(b'23')
+        mk.fs.createFile(self.segments + ['b'])
+
+        self.assertEqual(3, self.sut.get('attributes', path, None, attributes))
+        self.assertEqual(
+            ['a', 'b'], self.sut.get('content', self.path, None, content)
+        )
+        self.sut.get('attributes', path, None, attributes)
+        self.sut.get('content', self.path, None, content)
+        self.assertEqual(2, attributes.calls)
+        self.assertEqual(2, content.calls)
+
+    @conditionals.onOSName('linux')
+    def test_get_parent_renamed(self):
+        """
+        The values of the descendants are removed when a parent folder
+        is renamed or deleted.
+        """
+        mk.fs.createFolder(self.segments + ['sub'])
+        mk.fs.createFolder(self.segments + ['sub', 'child'])
+        path = os.path.join(self.path, 'sub', 'child', 'file')
+        exists = Counter(lambda _: os.path.exists(path))
+
+        self.assertFalse(self.sut.get('exists', path, None, exists))
+
+        os.rename(
+            os.path.join(self.path, 'sub'), os.path.join(self.path, 'old')
+        )
+        mk.fs.createFolder(self.segments + ['sub'])
+        mk.fs.createFolder(self.segments + ['sub', 'child'])
+        mk.fs.createFile(self.segments + ['sub', 'child', 'file'])
+
+        self.assertTrue(self.sut.get('exists', path, None, exists))
+        self.assertTrue(self.sut.get('exists', path, None, exists))
+        self.assertEqual(2, exists.calls)
+
+    @conditionals.onOSName('linux')
+    def test_get_max_watches(self):
+        """
+        The least recently used folders are no longer watched when over
+        the limit, and their values are removed.
+        """
+        mk.fs.createFolder(self.segments + ['a'])
+        mk.fs.createFolder(self.segments + ['b'])
+        # All the parents are watched.
+        self.sut.max_watches = len(self.segments) + 2
+        compute = Counter(lambda calls: calls)
+        path_a = os.path.join(self.path, 'a')
+        path_b = os.path.join(self.path, 'b')
+
+        self.sut.get('content', path_a, None, compute)
+        self.sut.get('content', path_b, None, compute)
+
+        self.assertEqual(self.sut.max_watches, len(self.sut._watches))
+        self.assertEqual(2, self.sut.get('content', path_b, None, compute))
+        self.assertEqual(3, self.sut.get('content', path_a, None, compute))
+
+    @conditionals.onOSName('linux')
+    def test_get_link(self):
+        """
+        Values for a folder which is a link are not cached, as the changes
+        are not observed.
+        """
+        link_path = os.path.join(self.path, 'link')
+        os.symlink(self.path, link_path)
+        compute = Counter(lambda calls: calls)
+
+        self.sut.get('content', link_path, None, compute)
+
+        self.assertEqual(2, self.sut.get('content', link_path, None, compute))
+
+    def test_get_ttl(self):
+        """
+        The changes are not observed for some filesystems, and the values
+        are kept for `ttl` seconds.
+        """
+        self.makeUnwatched(ttl=3600)
+        compute = Counter(lambda calls: calls)
+
+        self.sut.get('content', self.path, None, compute)
+        mk.fs.createFile(self.segments + ['b'])
+
+        self.assertEqual(1, self.sut.get('content', self.path, None, compute))
+        self.assertEqual({}, dict(self.sut._watches))
+
+        self.sut.ttl = 0
+        self.sut.get('attributes', self.path, None, compute)
+
+        self.assertEqual(
+            3, self.sut.get('attributes', self.path, None, compute)
+        )
+
+    def test_invalidate(self):
+        """
+        The values of a path and of its descendants are removed, or all
+        the values.
+        """
+        self.makeUnwatched(ttl=3600)
+        compute = Counter(lambda calls: calls)
+        path = os.path.join(self.path, 'a')
+        child_path = os.path.join(self.path, 'a', 'b')
+        other_path = os.path.join(self.path, 'ab')
+        self.sut.get('exists', path, None, compute)
+        self.sut.get('exists', child_path, None, compute)
+        self.sut.get('exists', other_path, None, compute)
+
+        self.sut.invalidate(path)
+
+        self.assertEqual(4, self.sut.get('exists', path, None, compute))
+        self.assertEqual(5, self.sut.get('exists', child_path, None, compute))
+        self.assertEqual(3, self.sut.get('exists', other_path, None, compute))
+
+        self.sut.invalidate()
+
+        self.assertEqual(6, self.sut.get('exists', other_path, None, compute))
+
+    def test_invalidate_not_recursive(self):
+        """
+        Only the values of the path are removed when not recursive.
+        """
+        self.makeUnwatched(ttl=3600)
+        compute = Counter(lambda calls: calls)
+        child_path = os.path.join(self.path, 'a')
+        self.sut.get('content', self.path, None, compute)
+        self.sut.get('exists', child_path, None, compute)
+
+        self.sut.invalidate(self.path, recursive=False)
+
+        self.assertEqual(3, self.sut.get('content', self.path, None, compute))
+        self.assertEqual(2, self.sut.get('exists', child_path, None, compute))
+
+    def test_parse_mounts(self):
+        """
+        The mount points are decoded and sorted with the longest first.
+        """
+        content = (
+            '22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw\n'
+            '35 22 0:31 / /mnt/with\\040space rw - nfs4 host:/ rw\n'
+            '36 22 0:32 / /mnt/fuse rw shared:3 master:1 - fuse.sshfs a rw\n'
+            'bad line\n'
+        )
+
+        self.assertEqual(
+            [
+                ('/mnt/with space', 'nfs4'),
+                ('/mnt/fuse', 'fuse.sshfs'),
+                ('/', 'ext4'),
+            ],
+            _parse_mounts(content),
+        )
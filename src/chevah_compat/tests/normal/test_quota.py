@@ -0,0 +1,378 @@
+# Copyright (c) 2026 Adi Roiban.
+# See LICENSE for details.
+"""
+Tests for the quota usage accounting.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from chevah_compat import LocalFilesystem
+from chevah_compat.avatar import FilesystemApplicationAvatar
+from chevah_compat.exceptions import CompatError
+from chevah_compat.interfaces import IQuotaTracker
+from chevah_compat.posix_filesystem import TreeUsage
+from chevah_compat.quota import QuotaTracker
+from chevah_compat.testing import CompatTestCase, mk
+
+
+class TestQuotaTracker(CompatTestCase):
+    """
+    Tests for QuotaTracker.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.home_path, self.home_segments = self.tempFolder()
+        avatar = FilesystemApplicationAvatar(
+            name=mk.string(),
+            home_folder_path=self.home_path,
+        )
+        self.filesystem = LocalFilesystem(avatar=avatar)
+        store_folder, _ = self.tempFolder()
+        self.store_path = os.path.join(store_folder, 'quota.json')
+        self.sut = QuotaTracker(self.store_path)
+
+    def write(self, segments, content, append=False):
+        """
+        Write `content` to the file at `segments`, via the filesystem.
+        """
+        if append:
+            stream = self.filesystem.openFileForAppending(segments)
+        else:
+            stream = self.filesystem.openFileForWriting(segments)
+        with stream:
+            stream.write(content)
+
+    def test_track(self):
+        """
+        The usage is reconciled when the filesystem is tracked for the
+        first time.
+        """
+        mk.fs.createFile(self.home_segments + ['a'], content='1' * 10)
+        mk.fs.createFolder(self.home_segments + ['sub'])
+        mk.fs.createFile(self.home_segments + ['sub', 'b'], content='12')
+
+        self.sut.track(self.filesystem)
+
+        self.assertProvides(IQuotaTracker, self.sut)
+        self.assertIs(self.sut, self.filesystem.quota)
+        self.assertEqual((12, 2), self.sut.getUsage(self.filesystem))
+
+    def test_track_not_locked(self):
+        """
+        Filesystems of avatars which are not locked into the home folder
+        are not tracked.
+        """
+        avatar = FilesystemApplicationAvatar(
+            name=mk.string(),
+            home_folder_path=mk.fs.temp_path,
+            lock_in_home_folder=False,
+        )
+        filesystem = LocalFilesystem(avatar=avatar)
+
+        with self.assertRaises(AssertionError):
+            self.sut.track(filesystem)
+
+        self.assertIsNone(filesystem.quota)
+
+    def test_reconcile_errors(self):
+        """
+        The known usage is kept when the tree is scanned with errors.
+        """
+        self.sut.track(self.filesystem)
+        self.sut.update(self.filesystem, 100, 3)
+        usage = TreeUsage()
+        usage.size = 1
+        usage.files = 1
+        usage.errors = 1
+
+        with self.patchObject(self.filesystem, '_scanTree', return_value=usage):
+            self.sut.reconcile(self.filesystem)
+
+        self.assertEqual((100, 3), self.sut.getUsage(self.filesystem))
+
+    def test_reconcileAll_error(self):
+        """
+        Any error of a filesystem is logged and the usage is still saved.
+        """
+        self.sut.track(self.filesystem)
+        self.sut.update(self.filesystem, 100, 3)
+
+        with self.patchObject(
+            self.sut, 'reconcile', side_effect=RuntimeError('bad')
+        ):
+            with self.assertLogs('chevah_compat.quota') as logs:
+                self.sut.reconcileAll()
+
+        self.assertIn(logs.output[0], 'Failed to reconcile')
+        with open(self.store_path) as stream:
+            content = json.load(stream)
+        self.assertEqual(
+            100, content['usage'][self.sut._getKey(self.filesystem)]['size']
+        )
+
+    def test_write(self):
+        """
+        Files written via the filesystem update the usage when closed,
+        taking into account the previous content.
+        """
+        self.sut.track(self.filesystem)
+
+        self.write(['a'], b'12345')
+
+        self.assertEqual((5, 1), self.sut.getUsage(self.filesystem))
+
+        self.write(['a'], b'12')
+
+        self.assertEqual((2, 1), self.sut.getUsage(self.filesystem))
+
+        self.write(['a'], b'123', append=True)
+        self.write(['b'], b'1')
+
+        self.assertEqual((6, 2), self.sut.getUsage(self.filesystem))
+
+    def test_write_checksum(self):
+        """
+        Files replaced after a checksum match are updated in the usage,
+        while the files are not changed after a checksum mismatch.
+        """
+        self.sut.track(self.filesystem)
+        self.write(['a'], b'12345')
+
+        with self.assertRaises(CompatError):
+            with self.filesystem.openFileForWriting(
+                ['a'], expected={'md5': '0' * 32}
+            ) as stream:
+                stream.write(b'12')
+
+        self.assertEqual((5, 1), self.sut.getUsage(self.filesystem))
+
+        with self.filesystem.openFileForWriting(
+            ['a'], expected={'md5': hashlib.md5(b'12').hexdigest()}
+        ) as stream:
+            stream.write(b'12')
+
+        self.assertEqual((2, 1), self.sut.getUsage(self.filesystem))
+
+    def test_write_deleted(self):
+        """
+        Files deleted while opened for writing are removed from the usage,
+        without counting the content written after they were opened.
+        """
+        mk.fs.createFile(self.home_segments + ['a'], content='1' * 10)
+        self.sut.track(self.filesystem)
+
+        with self.filesystem.openFileForWriting(['a']) as stream:
+            stream.write(b'12345')
+            stream.flush()
+            self.filesystem.deleteFile(['a'])
+
+            self.assertEqual((0, 0), self.sut.getUsage(self.filesystem))
+
+        self.assertEqual((0, 0), self.sut.getUsage(self.filesystem))
+
+        with self.filesystem.openFileForWriting(['b']) as stream:
+            stream.write(b'12345')
+            stream.flush()
+            self.filesystem.rename(['b'], ['b'])
+            self.write(['c'], b'12')
+            self.filesystem.rename(['c'], ['b'])
+
+        self.assertEqual((2, 1), self.sut.getUsage(self.filesystem))
+
+    def test_write_deleted_externally(self):
+        """
+        Files deleted while opened for writing, without the filesystem,
+        are removed from the usage when closed.
+        """
+        mk.fs.createFile(self.home_segments + ['a'], content='1' * 10)
+        self.sut.track(self.filesystem)
+
+        with self.filesystem.openFileForWriting(['a']) as stream:
+            stream.write(b'12345')
+            mk.fs.deleteFile(self.home_segments + ['a'])
+
+        self.assertEqual((0, 0), self.sut.getUsage(self.filesystem))
+
+    def test_delete(self):
+        """
+        Deleted files and folders are removed from the usage.
+        """
+        mk.fs.createFile(self.home_segments + ['a'], content='1' * 10)
+        mk.fs.createFolder(self.home_segments + ['sub'])
+        mk.fs.createFile(self.home_segments + ['sub', 'b'], content='12')
+        mk.fs.createFile(self.home_segments + ['sub', 'c'], content='123')
+        self.sut.track(self.filesystem)
+
+        self.filesystem.deleteFile(['a'])
+
+        self.assertEqual((5, 2), self.sut.getUsage(self.filesystem))
+
+        self.filesystem.deleteFolder(['sub'], recursive=True)
+
+        self.assertEqual((0, 0), self.sut.getUsage(self.filesystem))
+
+    def test_delete_error(self):
+        """
+        The usage is not changed when the delete fails.
+        """
+        mk.fs.createFolder(self.home_segments + ['sub'])
+        mk.fs.createFile(self.home_segments + ['sub', 'b'], content='12')
+        self.sut.track(self.filesystem)
+
+        with self.assertRaises(OSError):
+            self.filesystem.deleteFile(['sub'])
+        with self.assertRaises(OSError):
+            self.filesystem.deleteFolder(['sub'], recursive=False)
+
+        self.assertEqual((2, 1), self.sut.getUsage(self.filesystem))
+
+    def test_rename(self):
+        """
+        Renaming over an existing file removes it from the usage.
+        Renaming a file to itself doesn't change the usage.
+        """
+        mk.fs.createFile(self.home_segments + ['a'], content='1' * 10)
+        mk.fs.createFile(self.home_segments + ['b'], content='12')
+        self.sut.track(self.filesystem)
+
+        self.filesystem.rename(['a'], ['a'])
+
+        self.assertEqual((12, 2), self.sut.getUsage(self.filesystem))
+
+        self.filesystem.rename(['a'], ['b'])
+
+        self.assertEqual((10, 1), self.sut.getUsage(self.filesystem))
+
+    def test_copyFile(self):
+        """
+        Copies are added to the usage, replacing the overwritten file.
+        """
+        mk.fs.createFile(self.home_segments + ['a'], content='1' * 10)
+        mk.fs.createFile(self.home_segments + ['b'], content='12')
+        self.sut.track(self.filesystem)
+
+        self.filesystem.copyFile(['a'], ['c'])
+
+        self.assertEqual((22, 3), self.sut.getUsage(self.filesystem))
+
+        self.filesystem.copyFile(['a'], ['b'], overwrite=True)
+
+        self.assertEqual((30, 3), self.sut.getUsage(self.filesystem))
+
+    def test_copyFolder(self):
+        """
+        Copied folders are added to the usage, replacing the overwritten
+        files.
+        """
+        mk.fs.createFolder(self.home_segments + ['a'])
+        mk.fs.createFile(self.home_segments + ['a', 'b'], content='1' * 10)
+        mk.fs.createFolder(self.home_segments + ['c'])
+        mk.fs.createFile(self.home_segments + ['c', 'b'], content='12')
+        self.sut.track(self.filesystem)
+
+        self.filesystem.copyFolder(['a'], ['d'])
+
+        self.assertEqual((22, 3), self.sut.getUsage(self.filesystem))
+
+        self.filesystem.copyFolder(['a'], ['c'], overwrite=True)
+
+        self.assertEqual((30, 3), self.sut.getUsage(self.filesystem))
+
+    def test_copyFolder_error(self):
+        """
+        The usage is not changed when the destination exists and is not
+        overwritten.
+        """
+        mk.fs.createFolder(self.home_segments + ['a'])
+        mk.fs.createFile(self.home_segments + ['a', 'b'], content='1' * 10)
+        mk.fs.createFolder(self.home_segments + ['c'])
+        mk.fs.createFile(self.home_segments + ['c', 'b'], content='12')
+        self.sut.track(self.filesystem)
+
+        with self.assertRaises(OSError):
+            self.filesystem.copyFolder(['a'], ['c'])
+        with self.assertRaises(OSError):
+            self.filesystem.copyFolder(['a'], ['c'])
+
+        self.assertEqual((12, 2), self.sut.getUsage(self.filesystem))
+
+    def test_check(self):
+        """
+        An error is raised when the new size is over the limit.
+        """
+        mk.fs.createFile(self.home_segments + ['a'], content='1' * 10)
+        self.sut.track(self.filesystem)
+
+        self.sut.check(self.filesystem, 5, 15)
+
+        with self.assertRaises(CompatError) as context:
+            self.sut.check(self.filesystem, 6, 15)
+
+        self.assertEqual(1019, context.exception.event_id)
+        self.assertContains(
+            '10 bytes used, 6 requested and the limit is 15.',
+            context.exception.message,
+        )
+
+    def test_flush(self):
+        """
+        The usage is saved and loaded by new trackers, which don't
+        reconcile the known usage.
+        """
+        self.sut.track(self.filesystem)
+        self.sut.update(self.filesystem, 100, 3)
+
+        self.sut.flush()
+
+        with open(self.store_path) as stream:
+            content = json.load(stream)
+        self.assertEqual(1, content['version'])
+        self.assertEqual(
+            [],
+            [
+                name
+                for name in os.listdir(os.path.dirname(self.store_path))
+                if name.endswith('.tmp')
+            ],
+        )
+        sut = QuotaTracker(self.store_path)
+        sut.track(self.filesystem)
+        self.assertEqual((100, 3), sut.getUsage(self.filesystem))
+
+    def test_load_error(self):
+        """
+        A store which can't be parsed is ignored and the usage is
+        reconciled.
+        """
+        mk.fs.createFile(self.home_segments + ['a'], content='1' * 10)
+        for content in ['{"version": 1, "usa', '{"version": 1}', '[]']:
+            with open(self.store_path, 'w') as stream:
+                stream.write(content)
+
+            sut = QuotaTracker(self.store_path)
+            sut.track(self.filesystem)
+
+            self.assertEqual((10, 1), sut.getUsage(self.filesystem))
+
+    def test_start(self):
+        """
+        The usage is reconciled from a separate thread until stopped.
+        """
+        self.sut.track(self.filesystem)
+        self.sut.update(self.filesystem, 100, 3)
+        self.addCleanup(self.sut.stop)
+
+        self.sut.start(0.01)
+
+        with self.assertRaises(AssertionError):
+            self.sut.start(0.01)
+        deadline = time.time() + 5
+        while self.sut.getUsage(self.filesystem) != (0, 0):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.sut.stop()
+        self.assertTrue(os.path.exists(self.store_path))
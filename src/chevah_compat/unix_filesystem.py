@@ -4,13 +4,18 @@
 Module for hosting the Unix specific filesystem access.
 """
 
+import ctypes
 import errno
+import fcntl
 import grp
 import os
+import platform
 import pwd
 
 # See: https://github.com/PyCQA/pylint/issues/1565
 import stat  # pylint: disable=bad-python3-import
+import sys
+import weakref
 
 from zope.interface import implementer
 
@@ -19,6 +24,134 @@ from chevah_compat.interfaces import ILocalFilesystem
 from chevah_compat.posix_filesystem import PosixFilesystemBase
 from chevah_compat.unix_users import UnixUsers
 
+#: Resolve flags for openat2.
+#: See https://man7.org/linux/man-pages/man2/openat2.2.html
+RESOLVE_NO_MAGICLINKS = 0x02
+RESOLVE_BENEATH = 0x08
+
+#: Maximum number of absolute links resolved for a single open, as for
+#: the MAXSYMLINKS limit of the kernel.
+_MAX_LINKS = 40
+
+#: System call number for openat2, available since Linux 5.6.
+#: All the architectures from this list use the generic syscall table.
+_SYS_OPENAT2 = 437
+_OPENAT2_MACHINES = (
+    'x86_64',
+    'i686',
+    'aarch64',
+    'armv7l',
+    'ppc64le',
+    's390x',
+    'riscv64',
+)
+
+
+class _OpenHow(ctypes.Structure):
+    """
+    The `struct open_how` argument for openat2.
+    """
+
+    _fields_ = [
+        ('flags', ctypes.c_uint64),
+        ('mode', ctypes.c_uint64),
+        ('resolve', ctypes.c_uint64),
+    ]
+
+
+def _get_syscall():
+    """
+    Return the libc `syscall` function when openat2 might be available.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+
+    if platform.machine() not in _OPENAT2_MACHINES:
+        return None
+
+    try:
+        syscall = ctypes.CDLL(None, use_errno=True).syscall
+    except (OSError, AttributeError):
+        return None
+
+    syscall.restype = ctypes.c_long
+    return syscall
+
+
+_syscall = _get_syscall()
+
+
+def _openat2(dir_fd, path, flags, mode, resolve):
+    """
+    Return a file descriptor for `path`, relative to the `dir_fd` folder.
+
+    Raise OSError with ENOSYS when openat2 is not available.
+    """
+    if _syscall is None:
+        raise OSError(errno.ENOSYS, 'openat2 not available', path)
+
+    # O_TMPFILE also contains the O_DIRECTORY bits.
+    o_tmpfile = getattr(os, 'O_TMPFILE', 0)
+    is_tmpfile = o_tmpfile and (flags & o_tmpfile) == o_tmpfile
+    if not (flags & os.O_CREAT or is_tmpfile):
+        # The kernel rejects a mode which can't be used.
+        mode = 0
+
+    how = _OpenHow(flags=flags | os.O_CLOEXEC, mode=mode, resolve=resolve)
+    encoded_path = os.fsencode(path)
+    while True:
+        fd = _syscall(
+            ctypes.c_long(_SYS_OPENAT2),
+            ctypes.c_int(dir_fd),
+            ctypes.c_char_p(encoded_path),
+            ctypes.byref(how),
+            ctypes.c_size_t(ctypes.sizeof(how)),
+        )
+        if fd >= 0:
+            return fd
+
+        code = ctypes.get_errno()
+        if code in (errno.EINTR, errno.EAGAIN):
+            # Interrupted or a concurrent rename was detected.
+            continue
+        raise OSError(code, os.strerror(code), path)
+
+
+#: Commands for the open file description locks, available since Linux 3.15.
+_F_OFD_GETLK = getattr(fcntl, 'F_OFD_GETLK', None)
+_F_OFD_SETLK = getattr(fcntl, 'F_OFD_SETLK', None)
+_F_OFD_SETLKW = getattr(fcntl, 'F_OFD_SETLKW', None)
+
+
+class _Flock(ctypes.Structure):
+    """
+    The Linux `struct flock` argument for the fcntl locks.
+    """
+
+    _fields_ = [
+        ('l_type', ctypes.c_short),
+        ('l_whence', ctypes.c_short),
+        ('l_start', ctypes.c_int64),
+        ('l_len', ctypes.c_int64),
+        ('l_pid', ctypes.c_int),
+    ]
+
+
+def _ofd_lock(fd, command, lock_type, offset, length):
+    """
+    Call fcntl with an open file description lock `command` and return
+    the resulting `_Flock`.
+    """
+    flock = _Flock(
+        l_type=lock_type,
+        l_whence=os.SEEK_SET,
+        l_start=offset,
+        l_len=length,
+        l_pid=0,
+    )
+    result = fcntl.fcntl(fd, command, bytes(flock))
+    return _Flock.from_buffer_copy(result)
+
 
 @implementer(ILocalFilesystem)
 class UnixFilesystem(PosixFilesystemBase):
@@ -33,6 +166,15 @@ class UnixFilesystem(PosixFilesystemBase):
 
     system_users = UnixUsers()
 
+    #: Resolve flags used to open the paths of locked avatars.
+    _LOCKED_RESOLVE = RESOLVE_BENEATH | RESOLVE_NO_MAGICLINKS
+    #: Set to False when the running kernel has no support for openat2.
+    _openat2_available = _syscall is not None
+    #: Set to False when the running kernel has no support for the open
+    #: file description locks.
+    _ofd_locks_available = _F_OFD_SETLK is not None
+    _root_fd = None
+
     def _getRootPath(self):
         if not self._avatar:
             return '/'
@@ -70,7 +212,7 @@ class UnixFilesystem(PosixFilesystemBase):
         head = True
         tail = self.getAbsoluteRealPath(path)
 
-        for virtual_segments, real_path in self._avatar.virtual_folders:
+        for virtual_segments, real_path in self._virtual_folders:
             virtual_root = self.getAbsoluteRealPath(real_path)
             if not tail.startswith(virtual_root):
                 # Not a virtual folder.
@@ -91,6 +233,119 @@ class UnixFilesystem(PosixFilesystemBase):
             tail = head
         return segments
 
+    def _getLockedRelativePath(self, path):
+        """
+        Return `path` relative to the locked root folder.
+
+        Return None when the avatar is not locked or `path` is not inside
+        the root folder, as for virtual folders.
+        """
+        if not self._avatar or not self._avatar.lock_in_home_folder:
+            return None
+
+        root = self._root_path.rstrip('/')
+        if path in (root, self._root_path):
+            return '.'
+
+        if not path.startswith(root + '/'):
+            return None
+
+        return path[len(root) + 1 :]
+
+    def _getRootDescriptor(self):
+        """
+        Return the file descriptor of the root folder.
+
+        It is opened on first use and closed together with the filesystem.
+        """
+        if self._root_fd is None:
+            fd = os.open(self._root_path, os.O_PATH | os.O_DIRECTORY)
+            weakref.finalize(self, os.close, fd)
+            self._root_fd = fd
+        return self._root_fd
+
+    def _osOpen(self, path, flags, mode=0o777):
+        """
+        See `PosixFilesystemBase`.
+
+        For avatars locked into the home folder, the path is resolved by
+        the kernel beneath the root folder, so that a symbolic link
+        can't be used to escape the home folder.
+        """
+        relative_path = self._getLockedRelativePath(path)
+        if relative_path is None or not UnixFilesystem._openat2_available:
+            return super()._osOpen(path, flags, mode)
+
+        try:
+            return _openat2(
+                self._getRootDescriptor(),
+                relative_path,
+                flags,
+                mode,
+                self._LOCKED_RESOLVE,
+            )
+        except OSError as error:
+            if error.errno == errno.ENOSYS:
+                # Old kernel. Don't try again.
+                UnixFilesystem._openat2_available = False
+                return super()._osOpen(path, flags, mode)
+
+            if error.errno != errno.EXDEV:
+                raise OSError(error.errno, error.strerror, path)
+
+        # The kernel has found a reference outside of the root folder.
+        # This is also the case for absolute links to a path inside the
+        # root folder, so these links are made relative to the root folder
+        # and the path is opened again by the kernel, beneath the root.
+        for _ignored in range(_MAX_LINKS):
+            relative_path = self._rebaseLockedLink(relative_path)
+            if relative_path is None:
+                break
+            try:
+                return _openat2(
+                    self._getRootDescriptor(),
+                    relative_path,
+                    flags,
+                    mode,
+                    self._LOCKED_RESOLVE,
+                )
+            except OSError as error:
+                if error.errno != errno.EXDEV:
+                    raise OSError(error.errno, error.strerror, path)
+
+        raise CompatError(
+            1018,
+            f'Path "{path}" is outside of locked folder "{self._root_path}"',
+        )
+
+    def _rebaseLockedLink(self, relative_path):
+        """
+        Return `relative_path` with its first absolute link which points
+        inside the root folder replaced by the target relative to the root.
+
+        Return None when there is no such link.
+        The links are only read here, as the result is opened by the kernel
+        beneath the root folder, so a link changed in the meantime can't
+        be used to escape the root folder.
+        """
+        root_fd = self._getRootDescriptor()
+        parts = relative_path.split('/')
+        for index in range(1, len(parts) + 1):
+            try:
+                target = os.readlink('/'.join(parts[:index]), dir_fd=root_fd)
+            except OSError:
+                # Not a link or not found.
+                continue
+
+            if not target.startswith('/'):
+                continue
+
+            rebased = self._getLockedRelativePath(target.rstrip('/') or '/')
+            if rebased is None:
+                return None
+            return '/'.join([rebased] + parts[index:])
+        return None
+
     def readLink(self, segments):
         """See `ILocalFilesystem`."""
         path = self.getRealPathFromSegments(segments, include_virtual=False)
@@ -112,7 +367,8 @@ class UnixFilesystem(PosixFilesystemBase):
         )
 
         with self._impersonateUser():
-            return os.symlink(target_path, link_path)
+            os.symlink(target_path, link_path)
+        self._invalidateCache(link_segments)
 
     def setOwner(self, segments, owner):
         """See `ILocalFilesystem`."""
@@ -124,9 +380,10 @@ class UnixFilesystem(PosixFilesystemBase):
 
         with self._impersonateUser():
             try:
-                return os.chown(path, uid, -1)
+                os.chown(path, uid, -1)
             except Exception as error:
                 self.raiseFailedToSetOwner(owner, path, str(error))
+        self._invalidateCache(segments)
 
     def getOwner(self, segments):
         """See `ILocalFilesystem`."""
@@ -211,12 +468,20 @@ class UnixFilesystem(PosixFilesystemBase):
 
         if self.isLink(segments):
             self.deleteFile(segments)
-            return None
+            return
 
-        with self._impersonateUser():
-            if recursive:
-                return self._rmtree(path_encoded)
-            return os.rmdir(path_encoded)
+        usage = self._getQuotaFolderUsage(segments, recursive)
+        try:
+            with self._impersonateUser():
+                if recursive:
+                    self._rmtree(path_encoded)
+                else:
+                    os.rmdir(path_encoded)
+        finally:
+            # Members might be deleted before an error.
+            self._invalidateCache(segments, recursive=True)
+        if usage is not None:
+            self._updateQuota(-usage.size, -usage.files)
 
     def getStatus(self, segments):
         """
@@ -230,3 +495,95 @@ class UnixFilesystem(PosixFilesystemBase):
         path_encoded = self.getEncodedPath(path)
         with self._impersonateUser():
             return os.stat(path_encoded)
+
+    def lockFile(
+        self, stream, exclusive=True, offset=0, length=0, blocking=False
+    ):
+        """
+        See `ILocalFilesystem`.
+
+        The open file description locks are used when available.
+        Otherwise, `lockf` locks are used, which are owned by the process.
+        These are not conflicting with the locks of the same process and
+        they are released when any descriptor of the file is closed.
+        """
+        fd = self._getFileDescriptor(stream)
+        lock_type = fcntl.F_WRLCK if exclusive else fcntl.F_RDLCK
+        command = _F_OFD_SETLKW if blocking else _F_OFD_SETLK
+        try:
+            result = self._ofdLock(fd, command, lock_type, offset, length)
+            if result is not None:
+                return
+
+            operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            if not blocking:
+                operation |= fcntl.LOCK_NB
+            fcntl.lockf(fd, operation, length, offset)
+        except OSError as error:
+            if error.errno not in (errno.EACCES, errno.EAGAIN):
+                raise
+            raise OSError(
+                errno.EAGAIN,
+                'File is locked',
+                getattr(stream, 'name', None),
+            )
+
+    def unlockFile(self, stream, offset=0, length=0):
+        """
+        See `ILocalFilesystem`.
+        """
+        fd = self._getFileDescriptor(stream)
+        result = self._ofdLock(fd, _F_OFD_SETLK, fcntl.F_UNLCK, offset, length)
+        if result is not None:
+            return
+        fcntl.lockf(fd, fcntl.LOCK_UN, length, offset)
+
+    def getFileLock(self, stream, exclusive=True, offset=0, length=0):
+        """
+        See `ILocalFilesystem`.
+
+        Only available for the open file description locks.
+        """
+        fd = self._getFileDescriptor(stream)
+        lock_type = fcntl.F_WRLCK if exclusive else fcntl.F_RDLCK
+        result = self._ofdLock(fd, _F_OFD_GETLK, lock_type, offset, length)
+        if result is None:
+            raise OSError(
+                errno.ENOTSUP,
+                'Operation not supported',
+                getattr(stream, 'name', None),
+            )
+
+        if result.l_type == fcntl.F_UNLCK:
+            return None
+        pid = result.l_pid if result.l_pid > 0 else None
+        return (
+            result.l_type == fcntl.F_WRLCK,
+            result.l_start,
+            result.l_len,
+            pid,
+        )
+
+    def _ofdLock(self, fd, command, lock_type, offset, length):
+        """
+        Return the `_Flock` result of the open file description lock
+        `command`, or None when these locks are not available.
+        """
+        if not UnixFilesystem._ofd_locks_available:
+            return None
+
+        try:
+            return _ofd_lock(fd, command, lock_type, offset, length)
+        except OSError as error:
+            if error.errno != errno.EINVAL:
+                raise
+            try:
+                # Check that the error is not caused by the arguments.
+                _ofd_lock(fd, _F_OFD_GETLK, fcntl.F_RDLCK, 0, 0)
+            except OSError as probe_error:
+                if probe_error.errno != errno.EINVAL:
+                    raise
+                # Old kernel. Don't try again.
+                UnixFilesystem._ofd_locks_available = False
+                return None
+            raise